@@ -22,7 +22,9 @@ from email.mime.text import MIMEText
 from email.parser import BytesParser
 from email.utils import format_datetime, formatdate, make_msgid
 from html import unescape
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.metrics import wbxml_timed
 
 # WBXML control
 SWITCH_PAGE = 0x00
@@ -35,7 +37,9 @@ CP_PING = 1  # Ping codepage for push notifications
 CP_EMAIL = 2
 CP_AIRSYNCBASE = 17
 CP_SETTINGS = 18  # Settings codepage for OOF, DeviceInformation, etc.
+CP_MOVE = 5
 CP_PROVISION = 14
+CP_ITEMOPERATIONS = 20
 
 # AirSync (CP 0)
 AS_Sync = 0x05
@@ -60,6 +64,7 @@ AS_ApplicationData = 0x1D
 AS_ItemOperations = 0x1E
 AS_Response = 0x1F
 AS_Properties = 0x20
+AS_Limit = 0x25
 
 # Email (CP 2)
 EM_DateReceived = 0x0F
@@ -79,6 +84,27 @@ ASB_Truncated = 0x0D
 ASB_ContentType = 0x0E
 ASB_Preview = 0x14
 ASB_NativeBodyType = 0x16
+ASB_FileReference = 0x11
+
+# ItemOperations (CP 20) - MS-ASWBXML § 2.1.2.1.21
+IO_ItemOperations = 0x05
+IO_Fetch = 0x06
+IO_Store = 0x07
+IO_Options = 0x08
+IO_Range = 0x09
+IO_Total = 0x0A
+IO_Properties = 0x0B
+IO_Data = 0x0C
+IO_Status = 0x0D
+IO_Response = 0x0E
+IO_Part = 0x11
+
+# Move (CP 5) - MS-ASWBXML § 2.1.2.1.6
+MV_MoveItems = 0x05
+MV_SrcMsgId = 0x07
+MV_Response = 0x0A
+MV_Status = 0x0B
+MV_DstMsgId = 0x0C
 
 # Settings (CP 18) - MS-ASCMD § 2.2.2.1
 SETTINGS_Settings = 0x05
@@ -1118,6 +1144,101 @@ def write_delete_responses(
     w.end()  # </Responses>
 
 
+def write_change_responses(
+    *,
+    w: WBXMLWriter,
+    responses: List[Dict[str, Any]],
+) -> None:
+    """Emit <Responses> with a <Change>/<Delete> per client change that failed."""
+    if not responses:
+        return
+    w.page(CP_AIRSYNC)
+    w.start(AS_Responses)
+    for item in responses:
+        w.start(AS_Delete if item.get("kind") == "delete" else AS_Change)
+        w.start(AS_ServerId)
+        w.write_str(str(item.get("server_id") or ""))
+        w.end()
+        w.start(AS_Status)
+        w.write_str(str(item.get("status") or "1"))
+        w.end()
+        w.end()
+    w.end()  # </Responses>
+
+
+def _read_mb_u_int(buf: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _sync_collections_span(payload: bytes) -> Optional[Tuple[int, int, int]]:
+    """
+    (start, end, codepage at end) of the children of <Sync><Collections> in
+    an encoded Sync response; None when it has no Collections.
+    """
+    if len(payload) < 4:
+        return None
+    pos = 1  # version
+    for _ in range(2):  # public id, charset
+        _, pos = _read_mb_u_int(payload, pos)
+    strtbl, pos = _read_mb_u_int(payload, pos)
+    pos += strtbl
+    page, depth, start = CP_AIRSYNC, 0, None
+    while pos < len(payload):
+        token = payload[pos]
+        pos += 1
+        if token == SWITCH_PAGE:
+            page = payload[pos]
+            pos += 1
+        elif token == END:
+            depth -= 1
+            if start is not None and depth == 1:
+                return start, pos - 1, page
+        elif token == STR_I:
+            pos = payload.index(b"\x00", pos) + 1
+        elif token == 0xC3:  # OPAQUE
+            length, pos = _read_mb_u_int(payload, pos)
+            pos += length
+        elif token & 0x80:
+            return None  # attributes are never written
+        elif token & 0x40:
+            depth += 1
+            if start is None and depth == 2 and page == CP_AIRSYNC and token & 0x3F == AS_Collections:
+                start = pos
+    return None
+
+
+def merge_sync_responses(payloads: List[bytes]) -> Optional[bytes]:
+    """
+    One Sync response carrying the <Collection> elements of several
+    encoded Sync responses (one per collection), in order. The first
+    response provides everything outside <Collections>; responses without
+    Collections are skipped. None when none has any.
+    """
+    spans = [(payload, span) for payload in payloads for span in [_sync_collections_span(payload)] if span]
+    if not spans:
+        return None
+    first, (_start, first_end, first_page) = spans[0]
+    out = bytearray(first[:first_end])
+    page = first_page
+    for payload, (start, end, end_page) in spans[1:]:
+        # Each <Collection> tag is on the AirSync page
+        if page != CP_AIRSYNC:
+            out.extend([SWITCH_PAGE, CP_AIRSYNC])
+        out.extend(payload[start:end])
+        page = end_page
+    if page != first_page:
+        out.extend([SWITCH_PAGE, first_page])
+    out.extend(first[first_end:])
+    return bytes(out)
+
+
+@wbxml_timed("encode")
 def build_sync_response(
     *,
     new_sync_key: str,
@@ -1128,6 +1249,7 @@ def build_sync_response(
     more_available: bool,
     body_type_preference: int = 2,
     truncation_size: Optional[int] = None,
+    responses: Optional[List[Dict[str, Any]]] = None,
 ) -> SyncBatch:
     """
     <Sync>
@@ -1149,6 +1271,7 @@ def build_sync_response(
             </Add>
             ...
           </Commands>
+          [<Responses>...</Responses>]  (client changes that failed)
         </Collection>
       </Collections>
     </Sync>
@@ -1350,6 +1473,7 @@ def build_sync_response(
 
     # CRITICAL FIX: Must switch back to AirSync codepage after email body processing
     w.page(CP_AIRSYNC)
+    write_change_responses(w=w, responses=responses or [])
 
     w.end()  # </Collection>
     w.end()  # </Collections>
@@ -1364,6 +1488,7 @@ def build_sync_response(
     )
 
 
+@wbxml_timed("encode")
 def build_foldersync_with_folders(
     sync_key: str,
     folders: List[Dict[str, str]],
@@ -1491,6 +1616,7 @@ def build_foldersync_with_folders(
     return w.bytes()
 
 
+@wbxml_timed("encode")
 def build_foldersync_no_changes(sync_key: str = "1", status: str = "1") -> bytes:
     """
     Minimal FolderSync 'no changes' WBXML using FolderHierarchy code page tokens
@@ -1523,6 +1649,7 @@ def build_foldersync_no_changes(sync_key: str = "1", status: str = "1") -> bytes
     return w.bytes()
 
 
+@wbxml_timed("encode")
 def build_provision_response(
     *,
     policy_key: str,
@@ -1690,6 +1817,7 @@ def extract_synckey_and_collection(wb: bytes) -> tuple[Optional[str], Optional[s
 
 
 # Legacy compatibility functions
+@wbxml_timed("encode")
 def create_sync_response_wbxml(
     *,
     sync_key: str,
@@ -1700,6 +1828,7 @@ def create_sync_response_wbxml(
     class_name: str = "Email",
     body_type_preference: int = 2,
     truncation_size: Optional[int] = None,
+    responses: Optional[List[Dict[str, Any]]] = None,
 ) -> SyncBatch:
     """
     Legacy compatibility wrapper with Z-Push body preference support.
@@ -1707,6 +1836,7 @@ def create_sync_response_wbxml(
     Args:
         body_type_preference: 1=PlainText, 2=HTML (default), 3=RTF, 4=MIME
         truncation_size: Max body size in bytes (None = no truncation)
+        responses: Statuses of failed client changes, see write_change_responses
     """
     return build_sync_response(
         new_sync_key=sync_key,
@@ -1717,9 +1847,11 @@ def create_sync_response_wbxml(
         more_available=more_available,
         body_type_preference=body_type_preference,
         truncation_size=truncation_size,
+        responses=responses,
     )
 
 
+@wbxml_timed("encode")
 def create_sync_response_wbxml_with_fetch(
     *,
     sync_key: str,
@@ -1731,6 +1863,7 @@ def create_sync_response_wbxml_with_fetch(
     class_name: str = "Email",
     body_type_preference: int = 2,
     truncation_size: Optional[int] = None,
+    responses: Optional[List[Dict[str, Any]]] = None,
 ) -> SyncBatch:
     """
     Build a Sync response containing <Collections>/<Collection> with optional <Commands>/<Add>
@@ -2006,6 +2139,7 @@ def create_sync_response_wbxml_with_fetch(
 
     # CRITICAL FIX: Must switch back to AirSync codepage after email body processing
     w.page(CP_AIRSYNC)
+    write_change_responses(w=w, responses=responses or [])
 
     w.end()
     w.end()  # </Collection></Collections>
@@ -2021,6 +2155,7 @@ def create_sync_response_wbxml_with_fetch(
     )
 
 
+@wbxml_timed("encode")
 def build_settings_oof_get_response(oof_settings: Dict[str, Any]) -> bytes:
     """
     Build WBXML Settings:Oof:Get response.
@@ -2135,6 +2270,7 @@ def build_settings_oof_get_response(oof_settings: Dict[str, Any]) -> bytes:
     return w.bytes()
 
 
+@wbxml_timed("encode")
 def build_settings_oof_set_response(status: int = 1) -> bytes:
     """
     Build WBXML Settings:Oof:Set response.
@@ -2171,6 +2307,40 @@ def build_settings_oof_set_response(status: int = 1) -> bytes:
     return w.bytes()
 
 
+@wbxml_timed("encode")
+def build_moveitems_response(results: List[Dict[str, Any]]) -> bytes:
+    """
+    Build WBXML MoveItems response, one <Response> per requested move.
+
+    Args:
+        results: dicts with src_msg_id, status (3=Success, 1=Invalid source,
+            2=Invalid destination, 4=Same folder) and dst_msg_id on success
+    """
+    w = WBXMLWriter()
+    w.header()
+
+    # <MoveItems>
+    w.page(CP_MOVE)
+    w.start(MV_MoveItems)
+    for result in results:
+        w.start(MV_Response)
+        w.start(MV_SrcMsgId)
+        w.write_str(str(result.get("src_msg_id") or ""))
+        w.end()
+        w.start(MV_Status)
+        w.write_str(str(result["status"]))
+        w.end()
+        if result.get("dst_msg_id"):
+            w.start(MV_DstMsgId)
+            w.write_str(str(result["dst_msg_id"]))
+            w.end()
+        w.end()  # </Response>
+    w.end()  # </MoveItems>
+
+    return w.bytes()
+
+
+@wbxml_timed("encode")
 def create_invalid_synckey_response_wbxml(
     *, collection_id: str = "1", class_name: str = "Email"
 ) -> SyncBatch:
@@ -2266,6 +2436,7 @@ PR_AllowInternetSharing = 0x36
 PR_AccountOnlyRemoteWipe = 0x3B
 
 
+@wbxml_timed("encode")
 def create_sync_response_wbxml_headers_only(
     *,
     sync_key: str,
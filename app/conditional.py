@@ -0,0 +1,235 @@
+"""
+Conditional Requests
+Validator-based 304 responses for polled read endpoints.
+
+Outlook, OWA and DAV clients poll the same resources over and over, and
+most polls find nothing changed. A handler declares a cheap version key
+(a mailbox aggregate, a DAV revision, an OAB sequence, a row's
+``updated_at``) and ``conditional_response`` turns it into a strong ETag
+(and Last-Modified when a timestamp is known). A matching ``If-None-Match``
+(or, without one, ``If-Modified-Since``) is answered with 304 before the
+body builder runs.
+
+POST endpoints such as EWS cannot answer 304, so ``memo_key`` keeps the
+last rendered body per key and reuses it while the validator is unchanged.
+
+Per-endpoint counters (polls, 304s, reused bodies, builder CPU time) are
+exposed through ``conditional_stats`` for /health and the benchmarks.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, Dict, Hashable, Optional, Tuple, Union
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from .database import Email
+
+# Rendered bodies kept for ``memo_key`` reuse
+MEMO_SIZE = 2048
+
+Body = Union[str, bytes, Response]
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from the parts of a version key."""
+    digest = hashlib.sha1(repr(parts).encode("utf-8"))
+    return f'"{digest.hexdigest()[:20]}"'
+
+
+def http_date(moment: datetime) -> str:
+    """RFC 7231 IMF-fixdate; naive datetimes are UTC, as everywhere in the schema."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return format_datetime(moment.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def _parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed is None:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """RFC 7232 section 6: If-None-Match wins; If-Modified-Since only without it."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        wanted = _opaque(etag)
+        return any(_opaque(tag) in (wanted, "*") for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        since = _parse_http_date(if_modified_since)
+        if since is None:
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+class ConditionalStats:
+    """Per-endpoint poll counters and builder CPU time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, Dict[str, float]] = {}
+
+    def _bucket(self, endpoint: str) -> Dict[str, float]:
+        bucket = self._endpoints.get(endpoint)
+        if bucket is None:
+            bucket = self._endpoints[endpoint] = {
+                "requests": 0,
+                "not_modified": 0,
+                "reused": 0,
+                "built": 0,
+                "build_cpu_ms": 0.0,
+            }
+        return bucket
+
+    def record(self, endpoint: str, outcome: str, build_cpu_ms: float = 0.0) -> None:
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            bucket["requests"] += 1
+            bucket[outcome] += 1
+            bucket["build_cpu_ms"] += build_cpu_ms
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Counters plus the 304 share and the builder CPU time skipped."""
+        with self._lock:
+            result = {}
+            for endpoint, bucket in sorted(self._endpoints.items()):
+                avoided = bucket["not_modified"] + bucket["reused"]
+                per_build = bucket["build_cpu_ms"] / bucket["built"] if bucket["built"] else 0.0
+                result[endpoint] = dict(
+                    bucket,
+                    build_cpu_ms=round(bucket["build_cpu_ms"], 2),
+                    not_modified_ratio=round(bucket["not_modified"] / bucket["requests"], 3),
+                    cpu_saved_ms=round(avoided * per_build, 2),
+                )
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints.clear()
+
+
+conditional_stats = ConditionalStats()
+
+_memo: "OrderedDict[Hashable, Tuple[str, Response]]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _memo_get(key: Hashable, etag: str) -> Optional[Response]:
+    with _memo_lock:
+        entry = _memo.get(key)
+        if entry is None or entry[0] != etag:
+            return None
+        _memo.move_to_end(key)
+        return entry[1]
+
+
+def _memo_put(key: Hashable, etag: str, response: Response) -> None:
+    with _memo_lock:
+        _memo[key] = (etag, response)
+        _memo.move_to_end(key)
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def _copy(response: Response) -> Response:
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    return Response(
+        content=response.body,
+        status_code=response.status_code,
+        headers=headers,
+        media_type=response.media_type,
+    )
+
+
+def conditional_response(
+    request: Request,
+    endpoint: str,
+    version,
+    build: Callable[[], Body],
+    *,
+    last_modified: Optional[datetime] = None,
+    media_type: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    memo_key: Optional[Hashable] = None,
+    etag: Optional[str] = None,
+) -> Response:
+    """Answer from the validator when possible, otherwise run ``build``.
+
+    ``version`` is any hashable, repr-stable key that changes whenever the
+    body would; ``etag`` overrides the derived tag when the resource
+    already has one (DAV items, OAB files). ``build`` returns the body or a
+    complete Response; the validator headers are added either way.
+    """
+    etag = etag or make_etag(endpoint, version)
+    validators = {"ETag": etag}
+    if last_modified is not None:
+        validators["Last-Modified"] = http_date(last_modified)
+    if headers:
+        validators.update(headers)
+
+    if request.method in ("GET", "HEAD") and is_not_modified(request, etag, last_modified):
+        conditional_stats.record(endpoint, "not_modified")
+        return Response(status_code=304, headers=validators)
+
+    if memo_key is not None:
+        cached = _memo_get(memo_key, etag)
+        if cached is not None:
+            conditional_stats.record(endpoint, "reused")
+            return _copy(cached)
+
+    started = time.thread_time()
+    body = build()
+    cpu_ms = (time.thread_time() - started) * 1000
+    if isinstance(body, Response):
+        response = body
+        if response.status_code != 200:
+            # Errors are neither validated nor reused
+            conditional_stats.record(endpoint, "built", cpu_ms)
+            return response
+        for name, value in validators.items():
+            response.headers[name] = value
+    else:
+        response = Response(content=body, media_type=media_type, headers=validators)
+    conditional_stats.record(endpoint, "built", cpu_ms)
+    if memo_key is not None:
+        _memo_put(memo_key, etag, response)
+    return response
+
+
+# --- Version keys ---------------------------------------------------------------
+
+
+def mailbox_version(db: Session, user_id: int) -> Tuple:
+    """Cheap change marker for everything a user sent or received.
+
+    One aggregate over the sender/recipient indexes: inserts move MAX(id),
+    deletes move COUNT, and flag changes (read, deleted) move
+    MAX(updated_at).
+    """
+    row = (
+        db.query(func.count(Email.id), func.max(Email.id), func.max(Email.updated_at))
+        .filter(or_(Email.recipient_id == user_id, Email.sender_id == user_id))
+        .one()
+    )
+    count, newest_id, newest_update = row
+    return user_id, count, newest_id, newest_update.isoformat() if newest_update else None
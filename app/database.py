@@ -1,6 +1,6 @@
 import os
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
 from sqlalchemy import (
@@ -8,19 +8,23 @@ from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     LargeBinary,
     String,
     Text,
     UniqueConstraint,
-    create_engine,
-    text,
+    event,
+    func,
+    inspect,
+    select,
 )
-from sqlalchemy import inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, relationship, sessionmaker
 
 from .config import settings
+from .db_engine import DATABASE_REPLICA_URL, RoutingSession, build_engine
 
 # Prefer environment/config-provided database URL; fallback to local file
 DATABASE_URL = os.getenv(
@@ -32,11 +36,18 @@ DATABASE_URL = os.getenv(
     ),
 )
 
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = build_engine(DATABASE_URL)
+# Optional read replica for listing/search/estimate queries (see db_engine.prefer_replica)
+replica_engine = (
+    build_engine(DATABASE_REPLICA_URL, read_only=True) if DATABASE_REPLICA_URL else None
+)
+SessionLocal = sessionmaker(
+    class_=RoutingSession,
+    autocommit=False,
+    autoflush=False,
+    bind=engine,
+    replica_bind=replica_engine,
+)
 Base = declarative_base()
 
 
@@ -155,16 +166,63 @@ class OofSettings(Base):
     user = relationship("User", back_populates="oof_settings")
 
 
-class Email(Base):
-    __tablename__ = "emails"
+class MessageContent(Base):
+    """Body and MIME source shared by every mailbox copy of one message."""
+
+    __tablename__ = "message_contents"
 
     id = Column(Integer, primary_key=True, index=True)
-    uuid = Column(String, unique=True, index=True, default=lambda: str(uuid4()))
-    subject = Column(String, nullable=False)
     body = Column(Text)
     body_html = Column(Text)
     mime_content = Column(Text)
     mime_content_type = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+def _content_field(name: str):
+    """Email attribute that reads the shared MessageContent when the row has none.
+
+    In queries it is ``coalesce(emails.<name>, <message_contents.<name>>)``,
+    so filters and column selects see the content of fan-out copies too.
+    """
+    column_attr = f"_{name}"
+
+    def get(self):
+        value = getattr(self, column_attr)
+        if value is None and self.content_id is not None:
+            return getattr(self.content, name)
+        return value
+
+    def set(self, value):
+        setattr(self, column_attr, value)
+
+    def expression(cls):
+        shared = (
+            select(getattr(MessageContent, name))
+            .where(MessageContent.id == cls.content_id)
+            .scalar_subquery()
+        )
+        return func.coalesce(getattr(cls, column_attr), shared)
+
+    return hybrid_property(get, set, expr=expression)
+
+
+class Email(Base):
+    __tablename__ = "emails"
+
+    id = Column(Integer, primary_key=True, index=True)
+    uuid = Column(String, unique=True, index=True, default=lambda: str(uuid4()))
+    subject = Column(String, nullable=False)
+    # Inline content; NULL on fan-out copies, which read it from ``content``
+    _body = Column("body", Text)
+    _body_html = Column("body_html", Text)
+    _mime_content = Column("mime_content", Text)
+    _mime_content_type = Column("mime_content_type", String)
+    body = _content_field("body")
+    body_html = _content_field("body_html")
+    mime_content = _content_field("mime_content")
+    mime_content_type = _content_field("mime_content_type")
+    content_id = Column(Integer, ForeignKey("message_contents.id"), nullable=True, index=True)
     sender_id = Column(
         Integer, ForeignKey("users.id"), nullable=True
     )  # Nullable for external senders
@@ -190,6 +248,8 @@ class Email(Base):
     recipient = relationship(
         "User", foreign_keys=[recipient_id], back_populates="received_emails"
     )
+    # selectin: one IN query per result set, not one per row
+    content = relationship(MessageContent, lazy="selectin")
 
     @property
     def sender_email(self) -> Optional[str]:
@@ -303,7 +363,8 @@ class ActiveSyncDevice(Base):
     device_type = Column(String, nullable=True)
     policy_key = Column(String, nullable=True)
     is_provisioned = Column(Integer, default=0)
-    last_seen = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Set by the ActiveSync dispatcher, throttled (not on every row update)
+    last_seen = Column(DateTime, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
     __table_args__ = (UniqueConstraint("user_id", "device_id", name="uq_user_device"),)
 
@@ -689,256 +750,241 @@ class MapiSyncState(Base):
         return f"<MapiSyncState user={self.user_id} folder={self.folder_id} cn={self.last_cn}>"
 
 
-def create_tables():
-    Base.metadata.create_all(bind=engine)
-    try:
-        from .email_queue import Base as QueueBase
+class DavChange(Base):
+    """Per-owner change log behind CalDAV/CardDAV CTags and sync tokens (RFC 6578)"""
 
-        QueueBase.metadata.create_all(bind=engine)
-    except Exception as exc:
-        print(f"⚠️ Failed to ensure queue tables: {exc}")
-    ensure_ntlm_hash_column()
-    ensure_email_mime_columns()
-    ensure_global_address_list()
+    __tablename__ = "dav_changes"
 
+    id = Column(Integer, primary_key=True)  # revision carried in sync tokens
+    owner_id = Column(Integer, nullable=False)
+    collection = Column(String(16), nullable=False)  # calendar | addressbook
+    resource_id = Column(Integer, nullable=False)
+    deleted = Column(Boolean, default=False, nullable=False)
+    changed_at = Column(DateTime, default=datetime.utcnow)
 
-def ensure_ntlm_hash_column():
-    """Ensure users table contains ntlm_hash column for NTLM authentication."""
-    try:
-        inspector = inspect(engine)
-        if "users" not in inspector.get_table_names():
-            return
-        columns = {col["name"] for col in inspector.get_columns("users")}
-        if "ntlm_hash" in columns:
-            return
-        with engine.begin() as conn:
-            if engine.dialect.name == "sqlite":
-                conn.execute(text("ALTER TABLE users ADD COLUMN ntlm_hash TEXT"))
-            else:
-                conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS ntlm_hash TEXT"))
-            print("✅ Added ntlm_hash column to users table")
-    except Exception as exc:
-        print(f"⚠️ Failed to ensure ntlm_hash column: {exc}")
+    __table_args__ = (Index("idx_dav_changes_owner_rev", "owner_id", "collection", "id"),)
 
 
-def _ensure_uuid_for_table(conn, table_name: str):
-    """Ensure a uuid column exists for SQLite tables; no-op for other dialects."""
-    try:
-        if engine.dialect.name != "sqlite":
-            return
-        result = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
-        columns = {row[1] for row in result}
-        if "uuid" not in columns:
-            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN uuid TEXT")
-    except Exception:
-        pass
+_DAV_COLLECTIONS = {CalendarEvent: "calendar", Contact: "addressbook"}
 
 
-def ensure_uuid_columns_and_backfill():
-    """Ensure uuid column exists for key tables and backfill missing values using raw SQL."""
-    if engine.dialect.name != "sqlite":
-        return
-    try:
-        with engine.connect() as conn:
-            # Drop and recreate calendar tables to ensure correct schema
-            try:
-                conn.execute(text("DROP TABLE IF EXISTS calendar_events"))
-                conn.execute(text("DROP TABLE IF EXISTS calendar_folders"))
-                conn.commit()
-                print("✅ Dropped existing calendar tables")
-            except Exception as e:
-                print(f"⚠️ Error dropping calendar tables: {e}")
-
-            # Ensure contact folders table exists
-            ContactFolder.__table__.create(bind=engine, checkfirst=True)
-
-            # Ensure calendar tables exist - force creation
-            try:
-                CalendarFolder.__table__.create(bind=engine, checkfirst=True)
-                print("✅ CalendarFolder table created/verified")
-            except Exception as e:
-                print(f"❌ Error creating CalendarFolder table: {e}")
-
-            try:
-                CalendarEvent.__table__.create(bind=engine, checkfirst=True)
-                print("✅ CalendarEvent table created/verified")
-            except Exception as e:
-                print(f"❌ Error creating CalendarEvent table: {e}")
-
-            # Ensure extended contact columns exist
-            extended_columns = {
-                "folder_id": "INTEGER",
-                "file_as": "TEXT",
-                "nick_name": "TEXT",
-                "initials": "TEXT",
-                "suffix": "TEXT",
-                "title": "TEXT",
-                "department": "TEXT",
-                "office_location": "TEXT",
-                "manager": "TEXT",
-                "assistant_name": "TEXT",
-                "assistant_phone": "TEXT",
-                "spouse_partner_name": "TEXT",
-                "children": "TEXT",
-                "email_address_1": "TEXT",
-                "email_address_2": "TEXT",
-                "email_address_3": "TEXT",
-                "im_address": "TEXT",
-                "web_page": "TEXT",
-                "business_phone_2": "TEXT",
-                "business_fax": "TEXT",
-                "home_phone": "TEXT",
-                "home_phone_2": "TEXT",
-                "home_fax": "TEXT",
-                "pager": "TEXT",
-                "other_phone": "TEXT",
-                "other_fax": "TEXT",
-                "callback": "TEXT",
-                "car_phone": "TEXT",
-                "radio_phone": "TEXT",
-                "tty_tdd_phone": "TEXT",
-                "telex": "TEXT",
-                "business_address_street": "TEXT",
-                "business_address_city": "TEXT",
-                "business_address_state": "TEXT",
-                "business_address_postal_code": "TEXT",
-                "business_address_country": "TEXT",
-                "home_address_street": "TEXT",
-                "home_address_city": "TEXT",
-                "home_address_state": "TEXT",
-                "home_address_postal_code": "TEXT",
-                "home_address_country": "TEXT",
-                "other_address_street": "TEXT",
-                "other_address_city": "TEXT",
-                "other_address_state": "TEXT",
-                "other_address_postal_code": "TEXT",
-                "other_address_country": "TEXT",
-                "anniversary": "DATETIME",
-                "categories": "TEXT",
-                "sensitivity": "TEXT",
-                "gender": "TEXT",
-            }
-            result = conn.execute(text("PRAGMA table_info(contacts)")).fetchall()
-            existing_cols = {row[1] for row in result}
-            for col_name, col_type in extended_columns.items():
-                if col_name not in existing_cols:
-                    conn.execute(
-                        text(f"ALTER TABLE contacts ADD COLUMN {col_name} {col_type}")
-                    )
-            conn.commit()
-
-            # Ensure helpful indexes
-            folder_indexes = conn.execute(
-                text("PRAGMA index_list(contact_folders)")
-            ).fetchall()
-            folder_index_names = {row[1] for row in folder_indexes}
-            if "idx_contact_folders_owner" not in folder_index_names:
-                conn.execute(
-                    text(
-                        "CREATE INDEX idx_contact_folders_owner ON contact_folders(owner_id)"
-                    )
-                )
-                conn.commit()
-            if "idx_contact_folders_parent" not in folder_index_names:
-                conn.execute(
-                    text(
-                        "CREATE INDEX idx_contact_folders_parent ON contact_folders(parent_id)"
-                    )
-                )
-                conn.commit()
-
-            contact_indexes = conn.execute(
-                text("PRAGMA index_list(contacts)")
-            ).fetchall()
-            contact_index_names = {row[1] for row in contact_indexes}
-            if "idx_contacts_folder_id" not in contact_index_names:
-                conn.execute(
-                    text("CREATE INDEX idx_contacts_folder_id ON contacts(folder_id)")
+def _log_dav_change(connection, target, deleted: bool, owner_id: Optional[int] = None) -> None:
+    connection.execute(
+        DavChange.__table__.insert().values(
+            owner_id=target.owner_id if owner_id is None else owner_id,
+            collection=_DAV_COLLECTIONS[type(target)],
+            resource_id=target.id,
+            deleted=deleted,
+            changed_at=datetime.utcnow(),
+        )
+    )
+
+
+def _log_dav_update(connection, target) -> None:
+    # Moved to another owner: gone from the previous owner's collection
+    for previous in inspect(target).attrs.owner_id.history.deleted or ():
+        if previous is not None and previous != target.owner_id:
+            _log_dav_change(connection, target, True, owner_id=previous)
+    _log_dav_change(connection, target, False)
+
+
+for _model in _DAV_COLLECTIONS:
+    event.listen(_model, "after_insert", lambda m, c, t: _log_dav_change(c, t, False))
+    event.listen(_model, "after_update", lambda m, c, t: _log_dav_update(c, t))
+    event.listen(_model, "after_delete", lambda m, c, t: _log_dav_change(c, t, True))
+
+
+class FolderCounter(Base):
+    """Materialized totals per (mailbox, mail folder); see services/folder_counts.py"""
+
+    __tablename__ = "folder_counters"
+
+    user_id = Column(Integer, primary_key=True)
+    folder = Column(String(16), primary_key=True)  # inbox | sent | deleted
+    total_count = Column(Integer, default=0, nullable=False)
+    unread_count = Column(Integer, default=0, nullable=False)
+    size_bytes = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+def email_folders(
+    recipient_id: Optional[int],
+    sender_id: Optional[int],
+    is_deleted: Optional[bool],
+    is_read: Optional[bool],
+) -> List[Tuple[int, str, int]]:
+    """(user_id, folder, unread) for every folder an Email row is listed in.
+
+    Mirrors the folder filters of the mail views: the recipient's inbox and
+    the sender's sent items, or Deleted Items for both once deleted. Unread
+    only counts for the recipient.
+    """
+    unread = 0 if is_read else 1
+    if is_deleted:
+        folders = []
+        if recipient_id is not None:
+            folders.append((recipient_id, "deleted", unread))
+        if sender_id is not None and sender_id != recipient_id:
+            folders.append((sender_id, "deleted", 0))
+        return folders
+    folders = []
+    if recipient_id is not None:
+        folders.append((recipient_id, "inbox", unread))
+    if sender_id is not None:
+        folders.append((sender_id, "sent", 0))
+    return folders
+
+
+def email_size(email: "Email") -> int:
+    """Size counted for an Email row: its MIME source, else its plain body."""
+    for value in (email.mime_content, email.body):
+        if value is not None:
+            return len(value)
+    return 0
+
+
+_COUNTED_ATTRS = ("recipient_id", "sender_id", "is_deleted", "is_read")
+
+for _attr in _COUNTED_ATTRS:
+    # Load the old value on set even when the row was expired by a commit,
+    # so the counter deltas can subtract it
+    event.listen(getattr(Email, _attr), "set", lambda *args: None, active_history=True)
+
+
+def _previous(state, attr: str):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attr)
+
+
+def apply_folder_deltas(connection, deltas: Dict[Tuple[int, str], List[int]]) -> None:
+    """Add (total, unread, size) deltas to the counters, creating missing rows."""
+    table = FolderCounter.__table__
+    now = datetime.utcnow()
+    for (user_id, folder), (total, unread, size) in deltas.items():
+        if not (total or unread or size):
+            continue
+        increments = {
+            "total_count": table.c.total_count + total,
+            "unread_count": table.c.unread_count + unread,
+            "size_bytes": table.c.size_bytes + size,
+            "updated_at": now,
+        }
+        if connection.dialect.name in ("sqlite", "postgresql"):
+            if connection.dialect.name == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            connection.execute(
+                insert(table)
+                .values(
+                    user_id=user_id,
+                    folder=folder,
+                    total_count=total,
+                    unread_count=unread,
+                    size_bytes=size,
+                    updated_at=now,
                 )
-                conn.commit()
-            if "idx_contacts_email1" not in contact_index_names:
-                conn.execute(
-                    text(
-                        "CREATE INDEX idx_contacts_email1 ON contacts(email_address_1)"
-                    )
+                .on_conflict_do_update(index_elements=["user_id", "folder"], set_=increments)
+            )
+            continue
+        updated = connection.execute(
+            table.update()
+            .where(table.c.user_id == user_id, table.c.folder == folder)
+            .values(**increments)
+        )
+        if not updated.rowcount:
+            connection.execute(
+                table.insert().values(
+                    user_id=user_id,
+                    folder=folder,
+                    total_count=total,
+                    unread_count=unread,
+                    size_bytes=size,
+                    updated_at=now,
                 )
-                conn.commit()
-            for tbl in [
-                "users",
-                "emails",
-                "email_attachments",
-                "calendar_events",
-                "activesync_devices",
-                "activesync_state",
-                "contacts",
-                "contact_folders",
-            ]:
-                # Check if column exists
-                result = conn.execute(f"PRAGMA table_info({tbl})").fetchall()
-                columns = {row[1] for row in result}
-                if "uuid" not in columns:
-                    conn.execute(f"ALTER TABLE {tbl} ADD COLUMN uuid TEXT")
-                    conn.commit()
-
-                # Add unique index if not exists
-                indexes = conn.execute(f"PRAGMA index_list({tbl})").fetchall()
-                index_names = {row[1] for row in indexes}
-                if f"idx_{tbl}_uuid" not in index_names:
-                    conn.execute(f"CREATE UNIQUE INDEX idx_{tbl}_uuid ON {tbl}(uuid)")
-                    conn.commit()
-
-                # Backfill missing UUIDs
-                rows = conn.execute(
-                    f"SELECT id FROM {tbl} WHERE uuid IS NULL OR uuid = ''"
-                ).fetchall()
-
-                for row in rows:
-                    row_id = row[0]
-                    new_uuid = str(uuid4())
-                    conn.execute(
-                        f"UPDATE {tbl} SET uuid = '{new_uuid}' WHERE id = {row_id}"
-                    )
-
-                conn.commit()
-    except Exception as e:
-        print(f"Error during UUID migration: {e}")
-
-
-def ensure_admin_column():
-    """Ensure the users.admin column exists (SQLite-safe)."""
-    if engine.dialect.name != "sqlite":
-        return
-    try:
-        # Check pragma table info for users
-        with engine.connect() as conn:
-            result = conn.execute("PRAGMA table_info(users)").fetchall()
-            columns = {row[1] for row in result}
-            if "admin" not in columns:
-                conn.execute("ALTER TABLE users ADD COLUMN admin BOOLEAN DEFAULT 0")
-    except Exception:
-        # Best-effort; ignore if fails (column may already exist or locked)
-        pass
+            )
+
+
+@event.listens_for(Session, "after_flush")
+def _count_folder_changes(session: Session, _flush_context) -> None:
+    # Runs inside the flush transaction, so counters commit or roll back
+    # together with the rows they count
+    deltas: Dict[Tuple[int, str], List[int]] = {}
+
+    def add(folders, sign: int, size: int) -> None:
+        for user_id, folder, unread in folders:
+            entry = deltas.setdefault((user_id, folder), [0, 0, 0])
+            entry[0] += sign
+            entry[1] += sign * unread
+            entry[2] += sign * size
+
+    for obj in session.new:
+        if isinstance(obj, Email):
+            add(email_folders(*(getattr(obj, a) for a in _COUNTED_ATTRS)), 1, email_size(obj))
+    for obj in session.deleted:
+        if isinstance(obj, Email):
+            add(email_folders(*(_previous(inspect(obj), a) for a in _COUNTED_ATTRS)), -1, email_size(obj))
+    for obj in session.dirty:
+        if not isinstance(obj, Email):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[a].history.has_changes() for a in _COUNTED_ATTRS):
+            continue
+        size = email_size(obj)
+        add(email_folders(*(_previous(state, a) for a in _COUNTED_ATTRS)), -1, size)
+        add(email_folders(*(getattr(obj, a) for a in _COUNTED_ATTRS)), 1, size)
+
+    if deltas:
+        apply_folder_deltas(session.connection(), deltas)
+
+
+# Email columns the search index is built from (services/mail_search.py)
+_INDEXED_ATTRS = (
+    "subject",
+    "_body",
+    "_body_html",
+    "content_id",
+    "sender_id",
+    "recipient_id",
+    "external_sender",
+    "external_recipient",
+)
+
 
+@event.listens_for(Email.__table__, "after_create")
+def _create_search_index(target, connection, **kw) -> None:
+    from .services.mail_search import create_index
 
-def ensure_email_mime_columns():
-    """Ensure extended body/mime columns exist on the emails table."""
-    if engine.dialect.name != "sqlite":
+    create_index(connection)
+
+
+@event.listens_for(Session, "after_flush")
+def _index_mail_changes(session: Session, _flush_context) -> None:
+    # Same transaction as the rows, like the folder counters
+    changed = [obj for obj in session.new if isinstance(obj, Email)]
+    changed.extend(
+        obj
+        for obj in session.dirty
+        if isinstance(obj, Email)
+        and any(inspect(obj).attrs[a].history.has_changes() for a in _INDEXED_ATTRS)
+    )
+    removed = [obj.id for obj in session.deleted if isinstance(obj, Email)]
+    if not (changed or removed):
         return
-    try:
-        with engine.connect() as conn:
-            rows = conn.execute(text("PRAGMA table_info(emails)")).fetchall()
-            columns = {row[1] for row in rows}
-            if "body_html" not in columns:
-                conn.execute(text("ALTER TABLE emails ADD COLUMN body_html TEXT"))
-            if "mime_content" not in columns:
-                conn.execute(text("ALTER TABLE emails ADD COLUMN mime_content TEXT"))
-            if "mime_content_type" not in columns:
-                conn.execute(
-                    text("ALTER TABLE emails ADD COLUMN mime_content_type TEXT")
-                )
-            conn.commit()
-    except Exception:
-        pass
+    from .services import mail_search
+
+    connection = session.connection()
+    mail_search.remove_emails(connection, removed)
+    mail_search.index_emails(connection, changed)
+
+
+def create_tables():
+    """Create/upgrade the schema via the versioned migrations (see app/migrations.py)."""
+    from .migrations import migrate_database
+
+    migrate_database(engine)
 
 
 def sync_gal_entry_for_user(db_session, user: User):
@@ -964,11 +1010,11 @@ def sync_gal_entry_for_user(db_session, user: User):
     return entry
 
 
-def ensure_global_address_list():
+def ensure_global_address_list(bind=None):
     """Synchronize the GAL table with current users."""
-    session = SessionLocal()
+    session = SessionLocal(bind=bind) if bind is not None else SessionLocal()
     try:
-        GlobalAddressEntry.__table__.create(bind=engine, checkfirst=True)
+        GlobalAddressEntry.__table__.create(bind=session.get_bind(), checkfirst=True)
         users = session.query(User).all()
         seen_ids: set[int] = set()
         for user in users:
@@ -1013,10 +1059,6 @@ def set_admin_user(email: str, username: str | None = None):
         db.close()
 
 
-# Ensure critical schema adjustments run on import
-ensure_ntlm_hash_column()
-
-
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,208 @@
+"""
+Database Engine Configuration
+Per-service connection pool profiles and read-replica routing.
+
+Every container (UI, EWS, ActiveSync, MAPI, data service) runs the same
+code, so the engine is shaped by SERVICE_ROLE:
+- pool size / overflow / timeout / recycle come from a role profile and can
+  be overridden with DB_POOL_* variables
+- Postgres connections get a server-side statement_timeout; SQLite files get
+  WAL, synchronous and mmap pragmas plus a busy timeout
+- RoutingSession sends SELECTs to DATABASE_REPLICA_URL while a session has
+  opted in with prefer_replica()/replica_reads(), unless the session has
+  written or the mailbox being read was written by this process within
+  DB_REPLICA_RYW_WINDOW seconds (read-your-writes)
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import CompoundSelect, Select
+
+SERVICE_ROLE = os.getenv("SERVICE_ROLE", "default")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+DB_REPLICA_RYW_WINDOW = float(os.getenv("DB_REPLICA_RYW_WINDOW", "5"))
+
+# pool_size, max_overflow, statement_timeout_ms per service role
+POOL_PROFILES: Dict[str, Dict[str, int]] = {
+    "default": {"pool_size": 5, "max_overflow": 10, "statement_timeout_ms": 30000},
+    # OWA pages share the process with SMTP ingest and the queue processor
+    "ui": {"pool_size": 10, "max_overflow": 20, "statement_timeout_ms": 15000},
+    "ews": {"pool_size": 10, "max_overflow": 10, "statement_timeout_ms": 30000},
+    # Sized to DB_EXECUTOR_WORKERS so every pool thread can hold a connection
+    "activesync": {"pool_size": 12, "max_overflow": 8, "statement_timeout_ms": 30000},
+    "mapi": {"pool_size": 12, "max_overflow": 8, "statement_timeout_ms": 30000},
+    "data": {"pool_size": 5, "max_overflow": 5, "statement_timeout_ms": 10000},
+}
+
+_SQLITE_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SQLITE_SYNCHRONOUS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+def pool_settings(role: str = SERVICE_ROLE) -> Dict[str, int]:
+    """Pool profile for ``role`` with DB_POOL_* environment overrides applied."""
+    profile = dict(POOL_PROFILES.get(role, POOL_PROFILES["default"]))
+    profile["pool_size"] = int(os.getenv("DB_POOL_SIZE", profile["pool_size"]))
+    profile["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", profile["max_overflow"]))
+    profile["pool_timeout"] = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    profile["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    profile["statement_timeout_ms"] = int(
+        os.getenv("DB_STATEMENT_TIMEOUT_MS", profile["statement_timeout_ms"])
+    )
+    return profile
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+
+def _install_sqlite_pragmas(engine: Engine) -> None:
+    journal_mode = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+    synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+    mmap_size = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    busy_timeout = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    if journal_mode not in _SQLITE_JOURNAL_MODES:
+        journal_mode = "WAL"
+    if synchronous not in _SQLITE_SYNCHRONOUS:
+        synchronous = "NORMAL"
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute(f"PRAGMA mmap_size={mmap_size}")
+            cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        finally:
+            cursor.close()
+
+
+def build_engine(url: str, role: str = SERVICE_ROLE, read_only: bool = False) -> Engine:
+    """Engine for ``url`` configured with the pool profile of ``role``."""
+    settings = pool_settings(role)
+    if url.startswith("sqlite"):
+        kwargs = {"connect_args": {"check_same_thread": False}}
+        if not _is_memory_sqlite(url):
+            # In-memory databases use a single shared connection; no pool to size
+            kwargs.update(
+                pool_size=settings["pool_size"],
+                max_overflow=settings["max_overflow"],
+                pool_timeout=settings["pool_timeout"],
+            )
+        engine = create_engine(url, **kwargs)
+        if not _is_memory_sqlite(url):
+            _install_sqlite_pragmas(engine)
+        return engine
+
+    connect_args = {}
+    if url.startswith("postgresql"):
+        options = [f"-c statement_timeout={settings['statement_timeout_ms']}"]
+        if read_only:
+            options.append("-c default_transaction_read_only=on")
+        connect_args["options"] = " ".join(options)
+    return create_engine(
+        url,
+        pool_size=settings["pool_size"],
+        max_overflow=settings["max_overflow"],
+        pool_timeout=settings["pool_timeout"],
+        pool_recycle=settings["pool_recycle"],
+        pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no"),
+        connect_args=connect_args,
+    )
+
+
+# --- Read-your-writes tracking -------------------------------------------
+
+_MAILBOX_ATTRS = ("user_id", "owner_id", "recipient_id", "sender_id")
+_recent_writes: Dict[int, float] = {}
+_recent_writes_lock = threading.Lock()
+
+
+def mark_mailbox_write(mailbox_id: Optional[int]) -> None:
+    """Pin reads for ``mailbox_id`` to the primary for the next RYW window."""
+    if mailbox_id is None:
+        return
+    now = time.monotonic()
+    with _recent_writes_lock:
+        _recent_writes[mailbox_id] = now
+        if len(_recent_writes) > 10000:
+            cutoff = now - DB_REPLICA_RYW_WINDOW
+            for key in [k for k, ts in _recent_writes.items() if ts < cutoff]:
+                del _recent_writes[key]
+
+
+def mailbox_recently_written(mailbox_id: Optional[int]) -> bool:
+    if mailbox_id is None:
+        return False
+    written_at = _recent_writes.get(mailbox_id)
+    return written_at is not None and time.monotonic() - written_at < DB_REPLICA_RYW_WINDOW
+
+
+class RoutingSession(Session):
+    """Session that can serve opted-in SELECTs from a read replica."""
+
+    def __init__(self, *args, replica_bind: Optional[Engine] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica_bind = replica_bind
+
+    def _replica_allowed(self) -> bool:
+        if self.replica_bind is None or not self.info.get("prefer_replica"):
+            return False
+        if self.info.get("wrote") or self._flushing:
+            return False
+        return not mailbox_recently_written(self.info.get("mailbox_id"))
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if isinstance(clause, (Select, CompoundSelect)) and self._replica_allowed():
+            return self.replica_bind
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _record_writes(session: Session, _flush_context) -> None:
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if not changed:
+        return
+    session.info["wrote"] = True
+    mailboxes = {session.info.get("mailbox_id")}
+    for obj in changed:
+        for attr in _MAILBOX_ATTRS:
+            value = getattr(obj, attr, None)
+            if isinstance(value, int):
+                mailboxes.add(value)
+    for mailbox_id in mailboxes:
+        mark_mailbox_write(mailbox_id)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _record_bulk_writes(orm_execute_state) -> None:
+    # query(...).update()/delete() bypass the flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        session = orm_execute_state.session
+        session.info["wrote"] = True
+        mark_mailbox_write(session.info.get("mailbox_id"))
+
+
+def prefer_replica(db: Session, mailbox_id: Optional[int] = None) -> Session:
+    """Let the rest of this session's reads use the replica (listing/search/estimate paths)."""
+    db.info["prefer_replica"] = True
+    if mailbox_id is not None:
+        db.info["mailbox_id"] = mailbox_id
+    return db
+
+
+@contextmanager
+def replica_reads(db: Session, mailbox_id: Optional[int] = None) -> Iterator[Session]:
+    """Scoped prefer_replica(); the session goes back to the primary on exit."""
+    previous = (db.info.get("prefer_replica"), db.info.get("mailbox_id"))
+    prefer_replica(db, mailbox_id)
+    try:
+        yield db
+    finally:
+        db.info["prefer_replica"], db.info["mailbox_id"] = previous
@@ -0,0 +1,131 @@
+"""
+Database Executor
+Runs blocking SQLAlchemy work for async protocol handlers off the event loop.
+
+The large protocol handlers (EAS, EWS, MAPI/HTTP, CalDAV/CardDAV) are
+``async def`` but issue synchronous queries and PBKDF2 checks. Running them
+inline blocks every parked Ping, streaming subscription and WebSocket in the
+worker. This module provides a dedicated, bounded thread pool sized to the
+connection pool and:
+
+- run_in_db_thread(): run a sync callable on the pool
+- offload_to_db_pool: decorator that buffers the request body on the event
+  loop, then runs the whole handler coroutine on a pool thread with its own
+  private event loop (the handler's only awaits are on the buffered body)
+- db_session_scope(): session lifetime for code running on the pool
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from fastapi import Request
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "12"))
+
+_thread_state = threading.local()
+
+
+def _initializer() -> None:
+    _thread_state.is_db_worker = True
+
+
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS,
+    thread_name_prefix="db-worker",
+    initializer=_initializer,
+)
+
+
+def on_db_worker() -> bool:
+    return getattr(_thread_state, "is_db_worker", False)
+
+
+@contextmanager
+def db_session_scope() -> Iterator[Session]:
+    """Session for a unit of work on the DB pool; rolled back on error, always closed."""
+    db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_in_db_thread(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run ``func`` on the DB pool; runs inline when already on a pool thread."""
+    if on_db_worker():
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(db_executor, call)
+
+
+def _run_coroutine_on_worker(coro_fn, args, kwargs):
+    loop: Optional[asyncio.AbstractEventLoop] = getattr(_thread_state, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _thread_state.loop = loop
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro_fn(*args, **kwargs))
+    finally:
+        # Don't leave stragglers to run during some later request
+        pending = asyncio.all_tasks(loop)
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+
+async def run_coroutine_in_db_thread(coro_fn, *args, **kwargs) -> Any:
+    """Run ``coro_fn(*args, **kwargs)`` to completion on a DB pool thread."""
+    if on_db_worker():
+        return await coro_fn(*args, **kwargs)
+    return await run_in_db_thread(_run_coroutine_on_worker, coro_fn, args, kwargs)
+
+
+def _find_request(args, kwargs) -> Optional[Request]:
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, Request):
+            return value
+    return None
+
+
+def offload_to_db_pool(handler=None, *, inline_when: Optional[Callable[[Request, bytes], bool]] = None):
+    """Decorator for async route handlers that do blocking DB work.
+
+    ``inline_when(request, body)`` keeps specific requests on the event loop:
+    long-polls (a parked request must not hold a pool thread) and handlers
+    that await loop-bound queues. Offloaded handlers run on a
+    private loop: shared state they signal (push_manager, the WebSocket
+    manager) must be thread-safe and wake waiters on their own loop.
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            request = _find_request(args, kwargs)
+            if request is not None:
+                # Buffer on the loop; later `await request.body()` calls return the cached bytes
+                body = await request.body()
+                if inline_when is not None and inline_when(request, body):
+                    return await fn(*args, **kwargs)
+            return await run_coroutine_in_db_thread(fn, *args, **kwargs)
+
+        return wrapper
+
+    if handler is not None:
+        return decorate(handler)
+    return decorate
@@ -1,17 +1,27 @@
 """
 Email Delivery Service
 Orchestrates email delivery to external recipients
+
+External rows of a claimed batch are grouped by destination MX, sender and
+RFC Message-ID: MX records are looked up once per domain and each group is
+sent in one SMTP session with a RCPT TO per recipient, so a message to ten
+people at one domain costs one connection and one DATA transfer. Every
+queue row still gets its own outcome from the per-recipient replies.
 """
 
 import asyncio
 import logging
+import os
 import uuid
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 
 from sqlalchemy.orm import Session
 
-from .database import User, get_db
+from sqlalchemy import func
+
+from .database import SessionLocal, User, get_db
 from .email_parser import html_to_text
 from .email_queue import EmailQueueStatus, QueuedEmail, email_queue
 from .ews_push import trigger_ews_push
@@ -28,7 +38,10 @@ class EmailDeliveryService:
     def __init__(self):
         self.email_queue = email_queue
         self.processing = False
-        self.batch_size = 10
+        # Larger batches give the MX grouping more recipients to combine
+        self.batch_size = int(os.getenv("QUEUE_BATCH_SIZE", "50"))
+        # Bounds one cycle when another producer keeps the queue busy
+        self.max_batches_per_cycle = 100
         self.retry_delays = [1, 5, 15, 60]  # Minutes between retries
 
     async def process_queue(self, db: Session = None):
@@ -46,11 +59,8 @@ class EmailDeliveryService:
         try:
             logger.info("Starting email queue processing")
 
-            # Process pending emails
-            await self._process_pending_emails(db)
-
-            # Process retry emails
-            await self._process_retry_emails(db)
+            # Claim and deliver due emails (new, retries and expired leases)
+            await self._process_due_emails(db)
 
             logger.info("Email queue processing completed")
 
@@ -59,29 +69,33 @@ class EmailDeliveryService:
         finally:
             self.processing = False
 
-    async def _process_pending_emails(self, db: Session = None):
-        """Process pending emails from queue"""
-        try:
-            pending_emails = email_queue.get_pending_emails(self.batch_size)
-            logger.info(f"Processing {len(pending_emails)} pending emails")
-
-            for email in pending_emails:
-                await self._process_single_email(email, db)
+    async def _process_due_emails(self, db: Session = None):
+        """Deliver leased batches until nothing is due.
 
-        except Exception as e:
-            logger.error(f"Error processing pending emails: {e}")
-
-    async def _process_retry_emails(self, db: Session = None):
-        """Process emails ready for retry"""
+        Each batch is leased to this worker, so any number of workers can
+        drain the same queue without sending a message twice.
+        """
         try:
-            retry_emails = email_queue.get_retry_emails(self.batch_size)
-            logger.info(f"Processing {len(retry_emails)} retry emails")
-
-            for email in retry_emails:
-                await self._process_single_email(email, db)
+            for _ in range(self.max_batches_per_cycle):
+                emails = email_queue.claim_due(self.batch_size)
+                if not emails:
+                    break
+                logger.info(f"Processing {len(emails)} claimed emails")
+
+                internal = self._internal_addresses(
+                    [email.recipient_email for email in emails], db
+                )
+                external = []
+                for email in emails:
+                    if (email.recipient_email or "").lower() in internal:
+                        await self._process_single_email(email, db)
+                    else:
+                        external.append(email)
+                if external:
+                    await self._deliver_external_batch(external)
 
         except Exception as e:
-            logger.error(f"Error processing retry emails: {e}")
+            logger.error(f"Error processing due emails: {e}")
 
     async def _process_single_email(
         self, queued_email: QueuedEmail, db: Session = None
@@ -98,7 +112,7 @@ class EmailDeliveryService:
                 f"Processing email {queued_email.message_id} to {queued_email.recipient_email}"
             )
 
-            # Mark as processing
+            # Refresh the lease taken by claim_due()
             email_queue.mark_as_processing(queued_email.message_id)
 
             # Check if recipient is internal or external
@@ -111,6 +125,24 @@ class EmailDeliveryService:
             logger.error(f"Error processing email {queued_email.message_id}: {e}")
             email_queue.mark_as_failed(queued_email.message_id, str(e))
 
+    def _internal_addresses(self, addresses: List[str], db: Session = None) -> Set[str]:
+        """Lowercased addresses among ``addresses`` that belong to local users."""
+        wanted = {address.lower() for address in addresses if address}
+        if not wanted:
+            return set()
+        try:
+            if db:
+                rows = db.query(User.email).filter(func.lower(User.email).in_(wanted)).all()
+            else:
+                with SessionLocal() as session:
+                    rows = session.query(User.email).filter(
+                        func.lower(User.email).in_(wanted)
+                    ).all()
+            return {email.lower() for (email,) in rows}
+        except Exception as e:
+            logger.error(f"Error checking internal recipients: {e}")
+            return set()
+
     def _is_internal_recipient(self, email: str, db: Session = None) -> bool:
         """
         Check if recipient is internal user
@@ -245,59 +277,78 @@ class EmailDeliveryService:
         Args:
             queued_email: QueuedEmail object
         """
-        try:
-            logger.info(f"Delivering external email to {queued_email.recipient_email}")
+        await self._deliver_external_batch([queued_email])
 
-            # Get delivery information (MX records, etc.)
-            delivery_info = mx_lookup.get_delivery_info(queued_email.recipient_email)
+    async def _deliver_external_batch(self, queued_emails: List[QueuedEmail]):
+        """
+        Deliver claimed external emails, one SMTP session per MX group
 
-            if not delivery_info:
-                error_msg = (
-                    f"Could not get delivery info for {queued_email.recipient_email}"
+        Args:
+            queued_emails: Claimed QueuedEmail objects for external recipients
+        """
+        routes: Dict[str, Optional[Dict]] = {}
+        groups = defaultdict(list)
+        for queued_email in queued_emails:
+            try:
+                domain = queued_email.recipient_email.rsplit("@", 1)[-1].lower()
+                if domain not in routes:
+                    routes[domain] = mx_lookup.get_delivery_info(queued_email.recipient_email)
+                delivery_info = routes[domain]
+                if not delivery_info:
+                    error_msg = f"Could not get delivery info for {queued_email.recipient_email}"
+                    logger.error(error_msg)
+                    email_queue.mark_as_failed(queued_email.message_id, error_msg)
+                    continue
+                delivery_info = dict(delivery_info, email=queued_email.recipient_email)
+                # Refresh the lease and record where the message is going
+                email_queue.update_status(
+                    queued_email.message_id,
+                    EmailQueueStatus.PROCESSING,
+                    delivery_info=delivery_info,
                 )
-                logger.error(error_msg)
-                email_queue.mark_as_failed(queued_email.message_id, error_msg)
-                return
-
-            # Update queue with delivery info
-            email_queue.update_status(
-                queued_email.message_id,
-                EmailQueueStatus.PROCESSING,
-                delivery_info=delivery_info,
-            )
-
-            # Attempt delivery
-            result = smtp_client.deliver_email(
-                sender=queued_email.sender_email,
-                recipient=queued_email.recipient_email,
-                subject=queued_email.subject,
-                body=queued_email.body,
-                headers=queued_email.headers or {},
-                mx_server=delivery_info["best_mx_server"],
-                mx_port=delivery_info["port"],
-            )
-
-            if result.success:
-                logger.info(
-                    f"Successfully delivered email {queued_email.message_id} to {queued_email.recipient_email}"
+                headers = queued_email.headers or {}
+                key = (
+                    delivery_info["best_mx_server"],
+                    delivery_info["port"],
+                    queued_email.sender_email,
+                    headers.get("Message-ID") or queued_email.message_id,
                 )
-                email_queue.mark_as_sent(queued_email.message_id)
-            else:
+                groups[key].append(queued_email)
+            except Exception as e:
+                logger.error(f"Error routing email {queued_email.message_id}: {e}")
+                email_queue.mark_as_failed(queued_email.message_id, str(e))
+
+        for (mx_server, mx_port, sender, _), members in groups.items():
+            first = members[0]
+            recipients = list(dict.fromkeys(email.recipient_email for email in members))
+            logger.info(f"Delivering external email to {recipients} via {mx_server}")
+            results = smtp_client.deliver_message(
+                sender=sender,
+                recipients=recipients,
+                subject=first.subject,
+                body=first.body,
+                headers=first.headers or {},
+                mx_server=mx_server,
+                mx_port=mx_port,
+            )
+            for queued_email in members:
+                result = results[queued_email.recipient_email]
+                if result.success:
+                    logger.info(
+                        f"Successfully delivered email {queued_email.message_id} to {queued_email.recipient_email}"
+                    )
+                    email_queue.mark_as_sent(queued_email.message_id)
+                    continue
                 error_msg = f"Delivery failed: {result.error_message}"
                 logger.error(
                     f"Failed to deliver email {queued_email.message_id}: {error_msg}"
                 )
-
                 # Check if we should retry
                 if queued_email.retry_count < queued_email.max_retries:
                     email_queue.mark_for_retry(queued_email.message_id, error_msg)
                 else:
                     email_queue.mark_as_failed(queued_email.message_id, error_msg)
 
-        except Exception as e:
-            logger.error(f"Error delivering external email: {e}")
-            email_queue.mark_as_failed(queued_email.message_id, str(e))
-
     def _is_html_content(self, queued_email: QueuedEmail) -> bool:
         """Heuristically determine if the queued email body is HTML."""
         try:
@@ -379,6 +430,55 @@ class EmailDeliveryService:
             logger.error(f"Error queuing email: {e}")
             raise
 
+    def queue_message(
+        self,
+        sender_email: str,
+        recipient_emails: List[str],
+        subject: str,
+        body: str,
+        headers: Dict = None,
+        priority: int = 5,
+    ) -> str:
+        """
+        Queue one message for several recipients
+
+        Every recipient gets its own queue row; they share the RFC
+        Message-ID, so recipients behind the same MX are delivered together.
+
+        Args:
+            sender_email: Sender email address
+            recipient_emails: Recipient email addresses
+            subject: Email subject
+            body: Email body
+            headers: Additional headers; "To" is the visible recipient list
+            priority: Queue priority (1-10)
+
+        Returns:
+            RFC Message-ID of the message
+        """
+        try:
+            headers = dict(headers) if headers else {}
+            message_id = headers.setdefault(
+                "Message-ID", f"<{uuid.uuid4()}@365-email.local>"
+            )
+            headers.setdefault("To", ", ".join(recipient_emails))
+
+            rows = email_queue.add_message(
+                sender_email=sender_email,
+                recipient_emails=recipient_emails,
+                subject=subject,
+                body=body,
+                headers=headers,
+                priority=priority,
+            )
+
+            logger.info(f"Queued email {message_id} for delivery to {len(rows)} recipient(s)")
+            return message_id
+
+        except Exception as e:
+            logger.error(f"Error queuing email: {e}")
+            raise
+
     def get_delivery_stats(self) -> Dict:
         """
         Get delivery statistics
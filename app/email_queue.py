@@ -1,20 +1,48 @@
 """
 Email Queue System
 Handles queuing and processing of outbound emails
+
+Delivery workers claim due messages with a lease instead of reading them:
+- claim_due() moves up to N due rows to ``processing`` in one transaction,
+  stamping ``lease_owner`` and pushing ``next_retry_at`` out to the lease
+  expiry. On Postgres the candidate rows are selected FOR UPDATE SKIP
+  LOCKED so concurrent workers take disjoint batches; on SQLite the UPDATE
+  re-checks the due predicate, so only one writer wins each row
+- a ``processing`` row whose lease expired is due again, so messages held
+  by a worker that died go back to the queue
+- a daemon thread heartbeats the leases this process holds, and status
+  updates are a conditional UPDATE on the lease owner, so a worker that
+  lost its lease cannot change the message any more
+
+``next_retry_at`` is the due time for every status (pending rows are due
+when queued), so claims are served by the (status, next_retry_at, priority)
+index. Each call uses a short-lived session rather than one per process.
+
+A message for several external recipients is queued by add_message() as
+one row per recipient (each row carries its own delivery state) sharing
+an RFC Message-ID header and one stored body in ``message_contents``;
+claim_due() loads the shared bodies for a batch in one query.
 """
-import asyncio
 import logging
-import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set
 from enum import Enum
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, func
+from uuid import uuid4
+from sqlalchemy import Column, Index, Integer, String, Text, DateTime, JSON, and_, case, func, or_
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session
-from .database import SessionLocal
+from sqlalchemy.orm.attributes import set_committed_value
+from .database import MessageContent, SessionLocal
 
 logger = logging.getLogger(__name__)
 
+# Seconds a claimed message stays with its worker without a heartbeat
+QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", "120"))
+
 # Email queue database model
 Base = declarative_base()
 
@@ -45,13 +73,50 @@ class QueuedEmail(Base):
     sent_at = Column(DateTime)
     error_message = Column(Text)
     delivery_info = Column(JSON)  # Store MX/delivery information
+    lease_owner = Column(String)  # Worker holding the message while processing
+    content_id = Column(Integer)  # message_contents row when body is shared
+
+    __table_args__ = (
+        Index("idx_queued_emails_due", "status", "next_retry_at", "priority"),
+    )
+
+# Statuses a worker may claim once next_retry_at has passed
+_CLAIMABLE = (
+    EmailQueueStatus.PENDING.value,
+    EmailQueueStatus.RETRY.value,
+    EmailQueueStatus.PROCESSING.value,  # lease expired
+)
+
+def _due(now: datetime):
+    return and_(
+        QueuedEmail.status.in_(_CLAIMABLE),
+        QueuedEmail.next_retry_at <= now,
+        or_(
+            QueuedEmail.status != EmailQueueStatus.RETRY.value,
+            QueuedEmail.retry_count < QueuedEmail.max_retries,
+        ),
+    )
 
 class EmailQueue:
     """Email queue management system"""
     
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
         self.processing = False
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.lease_seconds = QUEUE_LEASE_SECONDS
+        self._held: Set[int] = set()
+        self._held_lock = threading.Lock()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+    
+    @contextmanager
+    def _session(self):
+        # Returned rows are used after commit by the delivery code
+        db = self.session_factory(expire_on_commit=False)
+        try:
+            yield db
+        finally:
+            db.close()
     
     def add_email(self, 
                   message_id: str,
@@ -76,95 +141,315 @@ class EmailQueue:
         Returns:
             QueuedEmail object
         """
-        try:
-            # Check if email already exists
-            existing = self.db.query(QueuedEmail).filter(
-                QueuedEmail.message_id == message_id
-            ).first()
-            
-            if existing:
-                logger.warning(f"Email {message_id} already in queue")
-                return existing
+        with self._session() as db:
+            try:
+                # Check if email already exists
+                existing = db.query(QueuedEmail).filter(
+                    QueuedEmail.message_id == message_id
+                ).first()
+                
+                if existing:
+                    logger.warning(f"Email {message_id} already in queue")
+                    return existing
+                
+                # Create new queued email, due immediately
+                now = datetime.utcnow()
+                queued_email = QueuedEmail(
+                    message_id=message_id,
+                    sender_email=sender_email,
+                    recipient_email=recipient_email,
+                    subject=subject,
+                    body=body,
+                    headers=headers or {},
+                    priority=priority,
+                    status=EmailQueueStatus.PENDING.value,
+                    next_retry_at=now,
+                    created_at=now,
+                    updated_at=now
+                )
+                
+                db.add(queued_email)
+                db.commit()
+                
+                logger.info(f"Added email {message_id} to queue (priority: {priority})")
+                return queued_email
+                
+            except Exception as e:
+                logger.error(f"Error adding email to queue: {e}")
+                db.rollback()
+                raise
+    
+    def add_message(self,
+                    sender_email: str,
+                    recipient_emails: List[str],
+                    subject: str,
+                    body: str,
+                    headers: Dict = None,
+                    priority: int = 5) -> List[QueuedEmail]:
+        """
+        Queue one message for several recipients in one transaction
+        
+        Each recipient gets its own row (and queue message ID) so it can be
+        sent, retried or failed on its own; the body is stored once.
+        
+        Args:
+            sender_email: Sender email address
+            recipient_emails: Recipient email addresses
+            subject: Email subject
+            body: Email body
+            headers: Email headers shared by every copy (Message-ID, To)
+            priority: Queue priority (1-10, lower = higher priority)
             
-            # Create new queued email
-            now = datetime.utcnow()
-            queued_email = QueuedEmail(
-                message_id=message_id,
-                sender_email=sender_email,
-                recipient_email=recipient_email,
-                subject=subject,
-                body=body,
-                headers=headers or {},
-                priority=priority,
-                status=EmailQueueStatus.PENDING.value,
-                created_at=now,
-                updated_at=now
+        Returns:
+            List of QueuedEmail objects, one per recipient
+        """
+        recipient_emails = list(dict.fromkeys(recipient_emails))
+        if not recipient_emails:
+            return []
+        with self._session() as db:
+            try:
+                content_id = None
+                row_body = body
+                if len(recipient_emails) > 1:
+                    content = MessageContent(body=body)
+                    db.add(content)
+                    db.flush()
+                    content_id, row_body = content.id, None
+                
+                now = datetime.utcnow()
+                rows = [
+                    QueuedEmail(
+                        message_id=f"<{uuid4()}@365-email.local>",
+                        sender_email=sender_email,
+                        recipient_email=recipient_email,
+                        subject=subject,
+                        body=row_body,
+                        content_id=content_id,
+                        headers=headers or {},
+                        priority=priority,
+                        status=EmailQueueStatus.PENDING.value,
+                        next_retry_at=now,
+                        created_at=now,
+                        updated_at=now
+                    )
+                    for recipient_email in recipient_emails
+                ]
+                db.add_all(rows)
+                db.commit()
+                for row in rows:
+                    set_committed_value(row, "body", body)
+                
+                logger.info(
+                    f"Added message for {len(rows)} recipient(s) to queue (priority: {priority})"
+                )
+                return rows
+                
+            except Exception as e:
+                logger.error(f"Error adding message to queue: {e}")
+                db.rollback()
+                raise
+    
+    def _load_shared_bodies(self, db, emails: List[QueuedEmail]) -> None:
+        content_ids = {email.content_id for email in emails if email.content_id and email.body is None}
+        if not content_ids:
+            return
+        bodies = dict(
+            db.query(MessageContent.id, MessageContent.body).filter(
+                MessageContent.id.in_(content_ids)
             )
+        )
+        for email in emails:
+            if email.content_id in bodies and email.body is None:
+                # Not a change to the row: never flushed back
+                set_committed_value(email, "body", bodies[email.content_id])
+    
+    def claim_due(self, limit: int = 10) -> List[QueuedEmail]:
+        """
+        Lease due emails to this worker, ordered by priority and due time
+        
+        Claimed rows are in ``processing`` and owned by this worker until
+        they reach a final status or the lease expires without a heartbeat.
+        
+        Args:
+            limit: Maximum number of emails to claim
             
-            self.db.add(queued_email)
-            self.db.commit()
-            self.db.refresh(queued_email)
-            
-            logger.info(f"Added email {message_id} to queue (priority: {priority})")
-            return queued_email
-            
-        except Exception as e:
-            logger.error(f"Error adding email to queue: {e}")
-            self.db.rollback()
-            raise
+        Returns:
+            List of claimed QueuedEmail objects
+        """
+        with self._session() as db:
+            try:
+                now = datetime.utcnow()
+                expires = now + timedelta(seconds=self.lease_seconds)
+                # SKIP LOCKED hands concurrent Postgres workers disjoint rows;
+                # SQLite renders no lock clause and relies on the UPDATE below
+                candidates = [
+                    row_id
+                    for (row_id,) in db.query(QueuedEmail.id)
+                    .filter(_due(now))
+                    .order_by(QueuedEmail.priority.asc(), QueuedEmail.next_retry_at.asc())
+                    .limit(limit)
+                    .with_for_update(skip_locked=True)
+                ]
+                if not candidates:
+                    db.rollback()
+                    return []
+                db.query(QueuedEmail).filter(
+                    QueuedEmail.id.in_(candidates), _due(now)
+                ).update(
+                    {
+                        QueuedEmail.status: EmailQueueStatus.PROCESSING.value,
+                        QueuedEmail.lease_owner: self.worker_id,
+                        QueuedEmail.next_retry_at: expires,
+                        QueuedEmail.updated_at: now,
+                    },
+                    synchronize_session=False,
+                )
+                db.commit()
+                emails = db.query(QueuedEmail).filter(
+                    QueuedEmail.id.in_(candidates),
+                    QueuedEmail.lease_owner == self.worker_id,
+                    QueuedEmail.next_retry_at == expires,
+                ).order_by(
+                    QueuedEmail.priority.asc(),
+                    QueuedEmail.id.asc()
+                ).all()
+                self._load_shared_bodies(db, emails)
+                db.commit()
+            except Exception as e:
+                logger.error(f"Error claiming due emails: {e}")
+                db.rollback()
+                return []
+        
+        if emails:
+            with self._held_lock:
+                self._held.update(email.id for email in emails)
+            self._ensure_heartbeat()
+        logger.info(f"Claimed {len(emails)} due emails (worker {self.worker_id})")
+        return emails
+    
+    def heartbeat(self) -> int:
+        """
+        Extend the leases this worker holds
+        
+        Returns:
+            Number of leases extended; rows taken over by another worker
+            after an expiry are dropped from the held set
+        """
+        with self._held_lock:
+            held = list(self._held)
+        if not held:
+            return 0
+        with self._session() as db:
+            try:
+                expires = datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+                owned = self._owned(db, held)
+                extended = owned.update(
+                    {QueuedEmail.next_retry_at: expires},
+                    synchronize_session=False,
+                )
+                still_held = {
+                    row_id for (row_id,) in self._owned(db, held).with_entities(QueuedEmail.id)
+                }
+                db.commit()
+            except Exception as e:
+                logger.error(f"Error extending queue leases: {e}")
+                db.rollback()
+                return 0
+        lost = set(held) - still_held
+        if lost:
+            logger.warning(f"Lost queue leases for {sorted(lost)}")
+            self._release(lost)
+        return extended
+    
+    def _owned(self, db, ids):
+        return db.query(QueuedEmail).filter(
+            QueuedEmail.id.in_(ids),
+            QueuedEmail.status == EmailQueueStatus.PROCESSING.value,
+            QueuedEmail.lease_owner == self.worker_id,
+        )
+    
+    def _release(self, ids) -> None:
+        with self._held_lock:
+            self._held.difference_update(ids)
+    
+    def _ensure_heartbeat(self) -> None:
+        thread = self._heartbeat_thread
+        if thread and thread.is_alive():
+            return
+        self._heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop, name="queue-lease-heartbeat", daemon=True
+        )
+        self._heartbeat_thread.start()
+    
+    def _heartbeat_loop(self) -> None:
+        # A thread, not a task: SMTP delivery blocks the event loop
+        interval = max(1.0, self.lease_seconds / 3)
+        while True:
+            time.sleep(interval)
+            with self._held_lock:
+                if not self._held:
+                    self._heartbeat_thread = None
+                    return
+            self.heartbeat()
     
     def get_pending_emails(self, limit: int = 10) -> List[QueuedEmail]:
         """
         Get pending emails from queue, ordered by priority and creation time
         
+        Read-only listing; delivery workers use claim_due().
+        
         Args:
             limit: Maximum number of emails to return
             
         Returns:
             List of QueuedEmail objects
         """
-        try:
-            emails = self.db.query(QueuedEmail).filter(
-                QueuedEmail.status == EmailQueueStatus.PENDING.value
-            ).order_by(
-                QueuedEmail.priority.asc(),
-                QueuedEmail.created_at.asc()
-            ).limit(limit).all()
-            
-            logger.info(f"Retrieved {len(emails)} pending emails from queue")
-            return emails
-            
-        except Exception as e:
-            logger.error(f"Error retrieving pending emails: {e}")
-            return []
+        with self._session() as db:
+            try:
+                emails = db.query(QueuedEmail).filter(
+                    QueuedEmail.status == EmailQueueStatus.PENDING.value
+                ).order_by(
+                    QueuedEmail.priority.asc(),
+                    QueuedEmail.created_at.asc()
+                ).limit(limit).all()
+                
+                logger.info(f"Retrieved {len(emails)} pending emails from queue")
+                return emails
+                
+            except Exception as e:
+                logger.error(f"Error retrieving pending emails: {e}")
+                return []
     
     def get_retry_emails(self, limit: int = 10) -> List[QueuedEmail]:
         """
         Get emails ready for retry
         
+        Read-only listing; delivery workers use claim_due().
+        
         Args:
             limit: Maximum number of emails to return
             
         Returns:
             List of QueuedEmail objects ready for retry
         """
-        try:
-            now = datetime.utcnow()
-            emails = self.db.query(QueuedEmail).filter(
-                QueuedEmail.status == EmailQueueStatus.RETRY.value,
-                QueuedEmail.next_retry_at <= now,
-                QueuedEmail.retry_count < QueuedEmail.max_retries
-            ).order_by(
-                QueuedEmail.priority.asc(),
-                QueuedEmail.next_retry_at.asc()
-            ).limit(limit).all()
-            
-            logger.info(f"Retrieved {len(emails)} emails ready for retry")
-            return emails
-            
-        except Exception as e:
-            logger.error(f"Error retrieving retry emails: {e}")
-            return []
+        with self._session() as db:
+            try:
+                now = datetime.utcnow()
+                emails = db.query(QueuedEmail).filter(
+                    QueuedEmail.status == EmailQueueStatus.RETRY.value,
+                    QueuedEmail.next_retry_at <= now,
+                    QueuedEmail.retry_count < QueuedEmail.max_retries
+                ).order_by(
+                    QueuedEmail.priority.asc(),
+                    QueuedEmail.next_retry_at.asc()
+                ).limit(limit).all()
+                
+                logger.info(f"Retrieved {len(emails)} emails ready for retry")
+                return emails
+                
+            except Exception as e:
+                logger.error(f"Error retrieving retry emails: {e}")
+                return []
     
     def update_status(self, 
                      message_id: str, 
@@ -174,6 +459,12 @@ class EmailQueue:
         """
         Update email status in queue
         
+        Only the worker holding the lease may change a message: the update
+        is one conditional UPDATE on ``lease_owner`` and ``status``, so a
+        worker whose lease expired can neither overwrite the outcome of the
+        one that took over nor re-queue a message already sent. An unleased
+        pending/retry message can still be taken with PROCESSING.
+        
         Args:
             message_id: Email message ID
             status: New status
@@ -183,43 +474,74 @@ class EmailQueue:
         Returns:
             True if updated successfully
         """
-        try:
-            email = self.db.query(QueuedEmail).filter(
-                QueuedEmail.message_id == message_id
-            ).first()
-            
-            if not email:
-                logger.error(f"Email {message_id} not found in queue")
+        with self._session() as db:
+            try:
+                email = db.query(QueuedEmail).filter(
+                    QueuedEmail.message_id == message_id
+                ).first()
+                
+                if not email:
+                    logger.error(f"Email {message_id} not found in queue")
+                    return False
+                
+                now = datetime.utcnow()
+                values = {QueuedEmail.status: status.value, QueuedEmail.updated_at: now}
+                if error_message:
+                    values[QueuedEmail.error_message] = error_message
+                if delivery_info:
+                    values[QueuedEmail.delivery_info] = delivery_info
+                
+                leased = and_(
+                    QueuedEmail.status == EmailQueueStatus.PROCESSING.value,
+                    QueuedEmail.lease_owner == self.worker_id,
+                )
+                if status == EmailQueueStatus.PROCESSING:
+                    # Taking or refreshing the lease
+                    values[QueuedEmail.lease_owner] = self.worker_id
+                    values[QueuedEmail.next_retry_at] = now + timedelta(seconds=self.lease_seconds)
+                    leased = or_(
+                        leased,
+                        and_(
+                            QueuedEmail.lease_owner.is_(None),
+                            QueuedEmail.status.in_(
+                                (EmailQueueStatus.PENDING.value, EmailQueueStatus.RETRY.value)
+                            ),
+                        ),
+                    )
+                else:
+                    values[QueuedEmail.lease_owner] = None
+                if status == EmailQueueStatus.SENT:
+                    values[QueuedEmail.sent_at] = now
+                elif status == EmailQueueStatus.RETRY:
+                    retry_count = (email.retry_count or 0) + 1
+                    values[QueuedEmail.retry_count] = retry_count
+                    # Exponential backoff: 2^retry_count minutes
+                    values[QueuedEmail.next_retry_at] = now + timedelta(minutes=2 ** retry_count)
+                    # The backoff is computed from the count read above
+                    leased = and_(leased, QueuedEmail.retry_count == email.retry_count)
+                
+                updated = db.query(QueuedEmail).filter(
+                    QueuedEmail.id == email.id, leased
+                ).update(values, synchronize_session=False)
+                db.commit()
+                if not updated:
+                    logger.warning(
+                        f"Email {message_id} is not leased to this worker; not updating"
+                    )
+                    self._release([email.id])
+                    return False
+                if status != EmailQueueStatus.PROCESSING:
+                    self._release([email.id])
+                logger.info(f"Updated email {message_id} status to {status.value}")
+                return True
+                
+            except Exception as e:
+                logger.error(f"Error updating email status: {e}")
+                db.rollback()
                 return False
-            
-            email.status = status.value
-            email.updated_at = datetime.utcnow()
-            
-            if error_message:
-                email.error_message = error_message
-            
-            if delivery_info:
-                email.delivery_info = delivery_info
-            
-            if status == EmailQueueStatus.SENT:
-                email.sent_at = datetime.utcnow()
-            elif status == EmailQueueStatus.RETRY:
-                email.retry_count += 1
-                # Exponential backoff: 2^retry_count minutes
-                retry_delay = 2 ** email.retry_count
-                email.next_retry_at = datetime.utcnow() + timedelta(minutes=retry_delay)
-            
-            self.db.commit()
-            logger.info(f"Updated email {message_id} status to {status.value}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error updating email status: {e}")
-            self.db.rollback()
-            return False
     
     def mark_as_processing(self, message_id: str) -> bool:
-        """Mark email as being processed"""
+        """Mark email as being processed (takes or refreshes the lease)"""
         return self.update_status(message_id, EmailQueueStatus.PROCESSING)
     
     def mark_as_sent(self, message_id: str) -> bool:
@@ -238,30 +560,42 @@ class EmailQueue:
         """
         Get queue statistics
         
+        One grouped query: a count per status plus retries that are due.
+        
         Returns:
             Dictionary with queue statistics
         """
-        try:
-            stats = {}
-            for status in EmailQueueStatus:
-                count = self.db.query(QueuedEmail).filter(
-                    QueuedEmail.status == status.value
-                ).count()
-                stats[status.value] = count
-            
-            # Add retry information
-            retry_ready = self.db.query(QueuedEmail).filter(
-                QueuedEmail.status == EmailQueueStatus.RETRY.value,
-                QueuedEmail.next_retry_at <= datetime.utcnow()
-            ).count()
-            stats['retry_ready'] = retry_ready
-            
-            logger.info(f"Queue stats: {stats}")
-            return stats
-            
-        except Exception as e:
-            logger.error(f"Error getting queue stats: {e}")
-            return {}
+        with self._session() as db:
+            try:
+                retry_due = case(
+                    (
+                        and_(
+                            QueuedEmail.status == EmailQueueStatus.RETRY.value,
+                            QueuedEmail.next_retry_at <= datetime.utcnow(),
+                        ),
+                        1,
+                    ),
+                    else_=0,
+                )
+                rows = db.query(
+                    QueuedEmail.status,
+                    func.count(QueuedEmail.id),
+                    func.sum(retry_due),
+                ).group_by(QueuedEmail.status).all()
+                
+                stats = {status.value: 0 for status in EmailQueueStatus}
+                stats['retry_ready'] = 0
+                for status, count, ready in rows:
+                    if status in stats:
+                        stats[status] = count
+                    stats['retry_ready'] += int(ready or 0)
+                
+                logger.info(f"Queue stats: {stats}")
+                return stats
+                
+            except Exception as e:
+                logger.error(f"Error getting queue stats: {e}")
+                return {}
     
     def cleanup_old_emails(self, days: int = 30) -> int:
         """
@@ -273,31 +607,32 @@ class EmailQueue:
         Returns:
             Number of emails cleaned up
         """
-        try:
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            
-            # Delete old sent emails
-            sent_count = self.db.query(QueuedEmail).filter(
-                QueuedEmail.status == EmailQueueStatus.SENT.value,
-                QueuedEmail.sent_at < cutoff_date
-            ).delete()
-            
-            # Delete old failed emails
-            failed_count = self.db.query(QueuedEmail).filter(
-                QueuedEmail.status == EmailQueueStatus.FAILED.value,
-                QueuedEmail.updated_at < cutoff_date
-            ).delete()
-            
-            self.db.commit()
-            total_cleaned = sent_count + failed_count
-            
-            logger.info(f"Cleaned up {total_cleaned} old emails (sent: {sent_count}, failed: {failed_count})")
-            return total_cleaned
-            
-        except Exception as e:
-            logger.error(f"Error cleaning up old emails: {e}")
-            self.db.rollback()
-            return 0
+        with self._session() as db:
+            try:
+                cutoff_date = datetime.utcnow() - timedelta(days=days)
+                
+                # Delete old sent emails
+                sent_count = db.query(QueuedEmail).filter(
+                    QueuedEmail.status == EmailQueueStatus.SENT.value,
+                    QueuedEmail.sent_at < cutoff_date
+                ).delete()
+                
+                # Delete old failed emails
+                failed_count = db.query(QueuedEmail).filter(
+                    QueuedEmail.status == EmailQueueStatus.FAILED.value,
+                    QueuedEmail.updated_at < cutoff_date
+                ).delete()
+                
+                db.commit()
+                total_cleaned = sent_count + failed_count
+                
+                logger.info(f"Cleaned up {total_cleaned} old emails (sent: {sent_count}, failed: {failed_count})")
+                return total_cleaned
+                
+            except Exception as e:
+                logger.error(f"Error cleaning up old emails: {e}")
+                db.rollback()
+                return 0
 
 # Global queue instance
 email_queue = EmailQueue()
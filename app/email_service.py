@@ -6,12 +6,13 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from typing import List, Optional
 
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from .database import Email, User
 from .email_delivery import email_delivery
-from .email_parser import get_email_preview, html_to_text
-from .ews_push import trigger_ews_push
+from .email_parser import html_to_text
+from .message_store import deliver_to_mailboxes, notify_new_mail
 from .mime_utils import build_mime_message, plain_to_html
 from .models import EmailCreate
 from .websocket_manager import manager
@@ -24,96 +25,88 @@ class EmailService:
         self.db = db
 
     def send_email(self, email_data: EmailCreate, sender_id: int) -> Email:
-        """Send an email and store it in the database"""
+        """Send an email and store it in the database
+
+        Internal recipients get their mailbox rows in one transaction, sharing
+        one stored body when there are several; external recipients are
+        queued together so delivery can batch them per destination MX.
+        Returns the first recipient's mailbox row, or the sent-item
+        placeholder when every recipient is external.
+        """
         try:
             # Get sender user
             sender_user = self.db.query(User).filter(User.id == sender_id).first()
             if not sender_user:
                 raise ValueError(f"Sender user {sender_id} not found")
 
-            # Check if recipient is internal
-            recipient = (
-                self.db.query(User)
-                .filter(User.email == email_data.recipient_email)
-                .first()
-            )
-
-            if recipient:
-                # Internal recipient - create email record directly
-                body_html = email_data.body_html or ""
-                body_plain = email_data.body or ""
-                if body_html and not body_plain:
-                    body_plain = html_to_text(body_html)
-                if body_plain and not body_html:
-                    body_html = plain_to_html(body_plain)
-                mime_content, mime_type = build_mime_message(
-                    email_data.subject,
-                    sender_user.email,
-                    recipient.email,
-                    body_plain,
-                    body_html if body_html else None,
+            addresses = list(
+                dict.fromkeys(
+                    address.lower()
+                    for address in [
+                        email_data.recipient_email,
+                        *email_data.additional_recipients,
+                    ]
                 )
-                mime_content_b64 = base64.b64encode(
-                    mime_content.encode("utf-8", errors="ignore")
-                ).decode("ascii")
-                email_record = Email(
+            )
+            # Check which recipients are internal, in one query
+            internal = {
+                user.email.lower(): user
+                for user in self.db.query(User)
+                .filter(func.lower(User.email).in_(addresses))
+                .all()
+            }
+            external = [address for address in addresses if address not in internal]
+
+            body_html = email_data.body_html or ""
+            body_plain = email_data.body or ""
+            if body_html and not body_plain:
+                body_plain = html_to_text(body_html)
+            if body_plain and not body_html:
+                body_html = plain_to_html(body_plain)
+            mime_content, mime_type = build_mime_message(
+                email_data.subject,
+                sender_user.email,
+                ", ".join(addresses),
+                body_plain,
+                body_html if body_html else None,
+            )
+            mime_content_b64 = base64.b64encode(
+                mime_content.encode("utf-8", errors="ignore")
+            ).decode("ascii")
+
+            records: List[Email] = []
+            if internal:
+                # Internal recipients - create mailbox rows directly
+                records = deliver_to_mailboxes(
+                    self.db,
+                    [internal[address].id for address in addresses if address in internal],
                     subject=email_data.subject,
                     body=body_plain,
                     body_html=body_html,
                     mime_content=mime_content_b64,
                     mime_content_type=mime_type,
                     sender_id=sender_id,
-                    recipient_id=recipient.id,
-                )
-
-                self.db.add(email_record)
-                self.db.commit()
-                self.db.refresh(email_record)
-
-                # Send WebSocket notification to recipient
-                self._send_email_notification(recipient.id, email_record)
-                # Publish EWS streaming event (Inbox)
-                trigger_ews_push(
-                    user_id=recipient.id,
-                    folder_id="DF_inbox",
-                    item_id=email_record.id,
                 )
-
+                # WebSocket and EWS streaming (Inbox), once per mailbox
+                notify_new_mail(records, sender=sender_user.email)
                 logger.info(
-                    f"Email sent internally from user {sender_id} to {email_data.recipient_email}"
+                    f"Email sent internally from user {sender_id} to {len(records)} mailbox(es)"
                 )
-                return email_record
-            else:
-                # External recipient - queue for delivery
-                logger.info(f"Queuing external email to {email_data.recipient_email}")
 
-                # Queue the email for external delivery
-                message_id = email_delivery.queue_email(
+            if external:
+                # External recipients - queue for delivery as one message
+                logger.info(f"Queuing external email to {external}")
+
+                message_id = email_delivery.queue_message(
                     sender_email=sender_user.email,
-                    recipient_email=email_data.recipient_email,
+                    recipient_emails=external,
                     subject=email_data.subject,
                     body=email_data.body,
-                    headers={"X-Sender-ID": str(sender_id)},
+                    headers={"X-Sender-ID": str(sender_id), "To": ", ".join(addresses)},
                     priority=5,
                 )
 
                 # Create a placeholder email record for tracking
-                body_html = email_data.body_html or ""
-                body_plain = email_data.body or ""
-                if body_html and not body_plain:
-                    body_plain = html_to_text(body_html)
-                if body_plain and not body_html:
-                    body_html = plain_to_html(body_plain)
-                mime_content, mime_type = build_mime_message(
-                    email_data.subject,
-                    sender_user.email,
-                    email_data.recipient_email,
-                    body_plain,
-                    body_html if body_html else None,
-                )
-                mime_content_b64 = base64.b64encode(
-                    mime_content.encode("utf-8", errors="ignore")
-                ).decode("ascii")
                 email_record = Email(
                     subject=email_data.subject,
                     body=body_plain,
@@ -128,9 +121,11 @@ class EmailService:
                 self.db.add(email_record)
                 self.db.commit()
                 self.db.refresh(email_record)
+                records.append(email_record)
 
                 logger.info(f"External email queued with message ID {message_id}")
-                return email_record
+
+            return records[0]
 
         except Exception as e:
             self.db.rollback()
@@ -268,44 +263,10 @@ class EmailService:
             .all()
         )
 
-    def _send_email_notification(self, user_id: int, email: Email):
-        """Send WebSocket notification for new email"""
-        try:
-            # Get sender information
-            sender_email = "Unknown"
-            if email.sender:
-                sender_email = email.sender.email
-            elif email.external_sender:
-                sender_email = email.external_sender
-
-            # Create email data for notification
-            preview_source = email.body_html or email.body
-            email_data = {
-                "id": email.id,
-                "subject": email.subject,
-                "sender": sender_email,
-                "preview": get_email_preview(preview_source or "", 100),
-                "is_read": email.is_read,
-                "created_at": email.created_at.isoformat(),
-            }
-
-            # Send notification asynchronously
-            import asyncio
-
-            asyncio.create_task(manager.send_email_notification(user_id, email_data))
-            logger.info(
-                f"📧 WebSocket notification queued for user {user_id}: {email.subject}"
-            )
-
-        except Exception as e:
-            logger.error(f"Error sending email notification: {e}")
-
     def _send_email_update_notification(self, user_id: int, update_data: dict):
         """Send WebSocket notification for email update"""
         try:
-            import asyncio
-
-            asyncio.create_task(manager.send_email_update(user_id, update_data))
+            manager.notify_email_update(user_id, update_data)
             logger.info(f"📧 Email update notification sent to user {user_id}")
         except Exception as e:
             logger.error(f"Error sending email update notification: {e}")
@@ -63,6 +63,14 @@ class EwsPushHub:
         async with self._lock:
             return self._subs.get(subscription_id)
 
+    def get_stats(self) -> Dict[str, int]:
+        """Subscription count and undelivered events, for /metrics."""
+        subs = list(self._subs.values())
+        return {
+            "subscriptions": len(subs),
+            "queued_events": sum(sub.queue.qsize() for sub in subs),
+        }
+
     async def publish_new_mail(
         self, user_id: int, folder_id: str, item_id: int
     ) -> None:
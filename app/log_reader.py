@@ -0,0 +1,236 @@
+"""
+Log File Reader
+Tail, time-range and search helpers for the admin log viewers.
+
+Log files can grow to several GB, so nothing here reads a file front to
+back per request:
+- tail_lines() seeks backward from EOF in fixed-size blocks
+- LogOffsetIndex samples (timestamp, byte offset) every N lines and is
+  extended incrementally as the file grows, so time-range reads seek
+  straight to the right region
+- search_lines() scans backward block by block, skipping blocks without a
+  match, and yields results as they are found so callers can stream them
+"""
+import bisect
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+BLOCK_SIZE = int(os.getenv("LOG_READER_BLOCK_SIZE", str(64 * 1024)))
+LOG_INDEX_STRIDE = int(os.getenv("LOG_INDEX_STRIDE", "1000"))
+
+# "2025-10-18 12:00:00,123 - ..." (logging) or {"ts": "2025-10-18T12:00:00Z", ...} (JSON lines)
+_TIMESTAMP_RE = re.compile(rb"(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})")
+_TIMESTAMP_WINDOW = 96
+
+
+def parse_line_timestamp(line: bytes) -> Optional[datetime]:
+    """Timestamp near the start of a log line, if any."""
+    match = _TIMESTAMP_RE.search(line, 0, _TIMESTAMP_WINDOW)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(
+            (match.group(1) + b" " + match.group(2)).decode("ascii"), "%Y-%m-%d %H:%M:%S"
+        )
+    except ValueError:
+        return None
+
+
+def parse_time_param(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO-8601 query parameter into a naive datetime (logs carry no zone)."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None, microsecond=0)
+
+
+def _decode(line: bytes) -> str:
+    return line.rstrip(b"\r").decode("utf-8", errors="ignore")
+
+
+def _iter_reverse_chunks(
+    path: str, start: int = 0, end: Optional[int] = None, block_size: int = BLOCK_SIZE
+) -> Iterator[bytes]:
+    """Yield runs of complete lines (newline separated) from ``end`` back to ``start``."""
+    with open(path, "rb") as handle:
+        if end is None:
+            handle.seek(0, os.SEEK_END)
+            end = handle.tell()
+        if end > start:
+            handle.seek(end - 1)
+            if handle.read(1) == b"\n":
+                end -= 1
+        pos = end
+        remainder = b""
+        while pos > start:
+            size = min(block_size, pos - start)
+            pos -= size
+            handle.seek(pos)
+            chunk = handle.read(size) + remainder
+            cut = chunk.find(b"\n")
+            if cut == -1:
+                remainder = chunk
+                continue
+            remainder = chunk[:cut]
+            yield chunk[cut + 1 :]
+        if remainder or end > start:
+            yield remainder
+
+
+def iter_lines_reverse(
+    path: str, start: int = 0, end: Optional[int] = None, block_size: int = BLOCK_SIZE
+) -> Iterator[bytes]:
+    """Lines between byte offsets ``start`` and ``end``, newest first."""
+    for chunk in _iter_reverse_chunks(path, start, end, block_size):
+        yield from reversed(chunk.split(b"\n"))
+
+
+def tail_lines(path: str, limit: int, block_size: int = BLOCK_SIZE) -> List[str]:
+    """Last ``limit`` lines of ``path`` in file order."""
+    if limit <= 0:
+        return []
+    lines: List[bytes] = []
+    for line in iter_lines_reverse(path, block_size=block_size):
+        lines.append(line)
+        if len(lines) >= limit:
+            break
+    lines.reverse()
+    return [_decode(line) for line in lines]
+
+
+class LogOffsetIndex:
+    """Sparse (timestamp, offset) samples taken every ``stride`` lines."""
+
+    def __init__(self, path: str, stride: int = LOG_INDEX_STRIDE):
+        self.path = path
+        self.stride = max(1, stride)
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, inode, head: bytes = b"") -> None:
+        self._inode = inode
+        self._head = head
+        self._times: List[datetime] = []
+        self._offsets: List[int] = []
+        self.indexed_to = 0
+        self.line_count = 0
+
+    def refresh(self) -> None:
+        """Index any bytes appended since the last call; restart after truncation/rotation."""
+        with self._lock:
+            stat = os.stat(self.path)
+            with open(self.path, "rb") as handle:
+                # A truncated-and-regrown file keeps its inode but not its first bytes
+                head = handle.read(64)
+                if stat.st_ino != self._inode or stat.st_size < self.indexed_to or head[: len(self._head)] != self._head:
+                    self._reset(stat.st_ino, head)
+                elif len(self._head) < len(head):
+                    self._head = head
+                if stat.st_size == self.indexed_to:
+                    return
+                handle.seek(self.indexed_to)
+                offset = self.indexed_to
+                for line in handle:
+                    if not line.endswith(b"\n"):
+                        break  # partial line still being written
+                    if self.line_count % self.stride == 0:
+                        stamp = parse_line_timestamp(line)
+                        if stamp is not None and (not self._times or stamp >= self._times[-1]):
+                            self._times.append(stamp)
+                            self._offsets.append(offset)
+                    offset += len(line)
+                    self.line_count += 1
+                self.indexed_to = offset
+
+    def window(self, since: Optional[datetime], until: Optional[datetime]) -> Tuple[int, Optional[int]]:
+        """Byte range that contains every line between ``since`` and ``until``."""
+        self.refresh()
+        start, end = 0, None
+        if since is not None:
+            idx = bisect.bisect_left(self._times, since) - 1
+            if idx >= 0:
+                start = self._offsets[idx]
+        if until is not None:
+            idx = bisect.bisect_right(self._times, until)
+            if idx < len(self._offsets):
+                end = self._offsets[idx]
+        return start, end
+
+
+_indexes: Dict[str, LogOffsetIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_offset_index(path: str) -> LogOffsetIndex:
+    full_path = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(full_path)
+        if index is None:
+            index = _indexes[full_path] = LogOffsetIndex(full_path)
+        return index
+
+
+def _in_window(line: bytes, since: Optional[datetime], until: Optional[datetime]) -> bool:
+    if since is None and until is None:
+        return True
+    stamp = parse_line_timestamp(line)
+    if stamp is None:
+        return True  # continuation lines (tracebacks) stay with their record
+    return (since is None or stamp >= since) and (until is None or stamp <= until)
+
+
+def read_lines(
+    path: str,
+    limit: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List[str]:
+    """Newest ``limit`` lines, optionally restricted to a time range, in file order."""
+    if since is None and until is None:
+        return tail_lines(path, limit)
+    start, end = get_offset_index(path).window(since, until)
+    lines: List[bytes] = []
+    for line in iter_lines_reverse(path, start, end):
+        if not _in_window(line, since, until):
+            continue
+        lines.append(line)
+        if len(lines) >= limit:
+            break
+    lines.reverse()
+    return [_decode(line) for line in lines]
+
+
+def search_lines(
+    path: str,
+    query: str,
+    limit: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Iterator[str]:
+    """Yield up to ``limit`` lines containing ``query`` (case-insensitive), newest first.
+
+    Case folding is applied per block rather than per line, and blocks with
+    no occurrence of the needle are skipped without splitting them.
+    """
+    needle = query.lower().encode("utf-8")
+    if not needle or limit <= 0:
+        return
+    start, end = (0, None)
+    if since is not None or until is not None:
+        start, end = get_offset_index(path).window(since, until)
+    found = 0
+    for chunk in _iter_reverse_chunks(path, start, end):
+        if needle not in chunk.lower():
+            continue
+        for line in reversed(chunk.split(b"\n")):
+            if needle in line.lower() and _in_window(line, since, until):
+                yield _decode(line)
+                found += 1
+                if found >= limit:
+                    return
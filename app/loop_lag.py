@@ -0,0 +1,84 @@
+"""
+Event Loop Lag Monitor
+Measures how late the event loop wakes up from a fixed-interval sleep.
+
+Any blocking call on the loop (a synchronous query, a password hash) shows
+up directly as lag. The monitor keeps a rolling window of samples and logs
+a warning for stalls above LOOP_LAG_WARN_MS.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "250"))
+_WINDOW = 600
+
+
+class LoopLagMonitor:
+    """Background task sampling event loop responsiveness"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, warn_ms: float = LOOP_LAG_WARN_MS):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+        self.samples: deque = deque(maxlen=_WINDOW)
+        self.max_lag_ms = 0.0
+        self.stalls = 0
+
+    async def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._sample_loop())
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def record(self, lag_ms: float) -> None:
+        self.samples.append(lag_ms)
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        if lag_ms >= self.warn_ms:
+            self.stalls += 1
+            logger.warning(f"Event loop stalled for {lag_ms:.0f} ms")
+
+    async def _sample_loop(self):
+        while self.running:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, (time.perf_counter() - expected) * 1000))
+
+    def get_stats(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def _pct(pct: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))], 2)
+
+        return {
+            "samples": len(ordered),
+            "lag_ms_p50": _pct(0.50),
+            "lag_ms_p99": _pct(0.99),
+            "lag_ms_max_window": round(ordered[-1], 2) if ordered else None,
+            "lag_ms_max": round(self.max_lag_ms, 2),
+            "stalls": self.stalls,
+        }
+
+
+# Global loop lag monitor instance
+loop_lag_monitor = LoopLagMonitor()
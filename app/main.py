@@ -14,10 +14,16 @@ from app.routers.activesync import eas_dispatch as eas_dispatch_handler
 from app.routers.activesync import eas_options as eas_options_handler
 
 from .config import settings
-from .database import create_tables, engine, ensure_uuid_columns_and_backfill
-from .email_queue import Base as QueueBase
 from .logging_config import setup_logging
+from .migrations import migrate_database
+from .loop_lag import loop_lag_monitor
+from .metrics import MetricsMiddleware
+from .conditional import conditional_stats
+from .ews_push import ews_push_hub
+from .push_notifications import push_manager
 from .queue_processor import queue_processor
+from .services.folder_counts import folder_count_reconciler
+from .services.oab_builder import oab_generator
 from .routers import (
     auth,
     calendar,
@@ -28,6 +34,7 @@ from .routers import (
     emails,
     ews,
     mapihttp,
+    metrics,
     modern_auth,
     oab,
     owa,
@@ -47,16 +54,24 @@ async def lifespan(app: FastAPI):
     # Setup comprehensive logging
     setup_logging()
 
-    create_tables()
-    ensure_uuid_columns_and_backfill()
-    # Create queue tables
-    QueueBase.metadata.create_all(bind=engine)
+    # Apply pending schema migrations (backfills continue in the background)
+    migrate_database()
+    # SMTP delivery publishes EWS notifications from worker threads
+    ews_push_hub.set_loop(asyncio.get_running_loop())
+    # Offloaded handlers and worker threads wake parked Ping/Sync requests
+    push_manager.set_loop(asyncio.get_running_loop())
     logger.info("Starting SMTP server and queue processor")
     await start_smtp_server()
     await queue_processor.start()
+    await oab_generator.start()
+    await folder_count_reconciler.start()
+    await loop_lag_monitor.start()
     yield
     # Shutdown
     logger.info("Shutting down SMTP server and queue processor")
+    await loop_lag_monitor.stop()
+    await folder_count_reconciler.stop()
+    await oab_generator.stop()
     await queue_processor.stop()
     await stop_smtp_server()
 
@@ -67,6 +82,7 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan,
 )
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(auth.router)
@@ -87,6 +103,7 @@ app.include_router(oab.router)
 app.include_router(rpc_proxy.router)
 app.include_router(deep_debug.router)
 app.include_router(shares.router, prefix="/shares")
+app.include_router(metrics.router)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -146,7 +163,11 @@ async def root():
 
 @app.get("/health", status_code=status.HTTP_200_OK, tags=["Health"])
 async def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "event_loop": loop_lag_monitor.get_stats(),
+        "conditional": conditional_stats.snapshot(),
+    }
 
 
 if __name__ == "__main__":
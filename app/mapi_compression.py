@@ -0,0 +1,288 @@
+"""
+MAPI RPC Buffer Compression and Obfuscation
+
+Implements the RPC_HEADER_EXT framing used for ROP output buffers in
+EcDoRpcExt2 / MAPI/HTTP Execute responses (and decoding of the framed
+request buffers clients send), including:
+- LZ77 compression (the "Plain LZ77" variant referenced by MS-OXCRPC)
+- XorMagic (0xA5) obfuscation
+
+References:
+- [MS-OXCRPC] 2.2.2.1 RPC_HEADER_EXT, 3.1.7.2 Compression Algorithm
+- [MS-XCA] 2.3 / 2.4 Plain LZ77 Compression and Decompression
+- [MS-OXCMAPIHTTP] 2.2.4.2 Execute request Flags
+"""
+
+import struct
+from typing import Dict, Tuple
+
+# RPC_HEADER_EXT flags
+RHEF_COMPRESSED = 0x0001
+RHEF_XOR_MAGIC = 0x0002
+RHEF_LAST = 0x0004
+
+# Execute request flags (client opt-outs)
+EXECUTE_FLAG_NO_COMPRESSION = 0x00000001
+EXECUTE_FLAG_NO_XOR_MAGIC = 0x00000002
+
+RPC_HEADER_EXT_SIZE = 8
+# Largest uncompressed ROP output buffer per RPC_HEADER_EXT ([MS-OXCRPC] 3.1.4.2.1.1.1)
+MAX_ROP_OUTPUT_SIZE = 0x8000
+XOR_MAGIC = 0xA5
+
+# Payloads smaller than this rarely compress below their own size
+MIN_COMPRESSIBLE_SIZE = 64
+
+_MAX_OFFSET = 8192  # 13-bit offset field
+_MIN_MATCH = 3
+_HASH_CHAIN_DEPTH = 4
+
+
+def _match_length(data: bytes, earlier: int, current: int, max_len: int) -> int:
+    """Length of the common run at ``earlier``/``current`` (both share a 3-byte key).
+
+    Compares slices with a growing/shrinking stride so long runs are
+    measured in a handful of C-level comparisons instead of per byte.
+    """
+    length = _MIN_MATCH
+    step = 8
+    while length < max_len:
+        step = min(step, max_len - length)
+        if data[earlier + length : earlier + length + step] == data[current + length : current + length + step]:
+            length += step
+            step <<= 1
+        elif step == 1:
+            break
+        else:
+            step >>= 1
+    return length
+
+
+def lz77_compress(data: bytes) -> bytes:
+    """Compress ``data`` with Plain LZ77 ([MS-XCA] 2.3)."""
+    out = bytearray(4)  # placeholder for the first flag word
+    flag_pos = 0
+    flags = 0
+    flag_count = 0
+    last_length_half_byte = 0
+    length = len(data)
+    pos = 0
+    heads: Dict[bytes, list] = {}
+
+    while pos < length:
+        best_len = 0
+        best_off = 0
+        if pos + _MIN_MATCH <= length:
+            key = data[pos : pos + _MIN_MATCH]
+            candidates = heads.get(key)
+            if candidates:
+                max_len = length - pos
+                for cand in reversed(candidates):
+                    off = pos - cand
+                    if off > _MAX_OFFSET:
+                        break
+                    # Cheap reject: a longer match must also differ nowhere at best_len
+                    if best_len and data[cand + best_len] != data[pos + best_len]:
+                        continue
+                    match_len = _match_length(data, cand, pos, max_len)
+                    if match_len > best_len:
+                        best_len = match_len
+                        best_off = off
+                        if match_len == max_len:
+                            break
+                candidates.append(pos)
+                if len(candidates) > _HASH_CHAIN_DEPTH:
+                    del candidates[0]
+            else:
+                heads[key] = [pos]
+
+        if best_len >= _MIN_MATCH:
+            match_len = best_len - 3
+            metadata = (best_off - 1) << 3
+            if match_len < 7:
+                out += struct.pack("<H", metadata | match_len)
+            else:
+                out += struct.pack("<H", metadata | 7)
+                match_len -= 7
+                nibble = min(match_len, 15)
+                if last_length_half_byte == 0:
+                    last_length_half_byte = len(out)
+                    out.append(nibble)
+                else:
+                    out[last_length_half_byte] |= nibble << 4
+                    last_length_half_byte = 0
+                if match_len >= 15:
+                    match_len -= 15
+                    if match_len < 255:
+                        out.append(match_len)
+                    else:
+                        out.append(255)
+                        match_len += 7 + 15
+                        if match_len < (1 << 16):
+                            out += struct.pack("<H", match_len)
+                        else:
+                            out += struct.pack("<HI", 0, match_len)
+            flags = (flags << 1) | 1
+            # Index the positions covered by the match so later data can refer to them
+            end = pos + best_len
+            for skipped in range(pos + 1, min(end, length - _MIN_MATCH + 1)):
+                key = data[skipped : skipped + _MIN_MATCH]
+                chain = heads.get(key)
+                if chain is None:
+                    heads[key] = [skipped]
+                else:
+                    chain.append(skipped)
+                    if len(chain) > _HASH_CHAIN_DEPTH:
+                        del chain[0]
+            pos = end
+        else:
+            out.append(data[pos])
+            flags <<= 1
+            pos += 1
+
+        flag_count += 1
+        if flag_count == 32:
+            struct.pack_into("<I", out, flag_pos, flags & 0xFFFFFFFF)
+            flag_pos = len(out)
+            out += b"\x00\x00\x00\x00"
+            flags = 0
+            flag_count = 0
+
+    # Terminate: pad remaining flag bits with 1s (an end-of-stream "match")
+    flags = (flags << (32 - flag_count)) | ((1 << (32 - flag_count)) - 1)
+    struct.pack_into("<I", out, flag_pos, flags & 0xFFFFFFFF)
+    return bytes(out)
+
+
+def lz77_decompress(data: bytes) -> bytes:
+    """Decompress a Plain LZ77 stream ([MS-XCA] 2.4)."""
+    out = bytearray()
+    flags = 0
+    flag_count = 0
+    pos = 0
+    last_length_half_byte = 0
+    length = len(data)
+
+    while True:
+        if flag_count == 0:
+            if pos + 4 > length:
+                raise ValueError("Truncated LZ77 flag word")
+            flags = struct.unpack_from("<I", data, pos)[0]
+            pos += 4
+            flag_count = 32
+        flag_count -= 1
+        if not flags & (1 << flag_count):
+            if pos >= length:
+                raise ValueError("Truncated LZ77 literal")
+            out.append(data[pos])
+            pos += 1
+            continue
+
+        if pos == length:
+            return bytes(out)
+        if pos + 2 > length:
+            raise ValueError("Truncated LZ77 match")
+        metadata = struct.unpack_from("<H", data, pos)[0]
+        pos += 2
+        match_len = metadata & 7
+        match_off = (metadata >> 3) + 1
+        if match_len == 7:
+            if last_length_half_byte == 0:
+                match_len = data[pos] & 0x0F
+                last_length_half_byte = pos
+                pos += 1
+            else:
+                match_len = data[last_length_half_byte] >> 4
+                last_length_half_byte = 0
+            if match_len == 15:
+                match_len = data[pos]
+                pos += 1
+                if match_len == 255:
+                    match_len = struct.unpack_from("<H", data, pos)[0]
+                    pos += 2
+                    if match_len == 0:
+                        match_len = struct.unpack_from("<I", data, pos)[0]
+                        pos += 4
+                    if match_len < 15 + 7:
+                        raise ValueError("Invalid LZ77 extended match length")
+                    match_len -= 15 + 7
+                match_len += 15
+            match_len += 7
+        match_len += 3
+        if match_off > len(out):
+            raise ValueError("LZ77 match offset outside of output")
+        start = len(out) - match_off
+        if match_off >= match_len:
+            out += out[start : start + match_len]
+        else:
+            for i in range(match_len):
+                out.append(out[start + i])
+
+
+def xor_magic(data: bytes) -> bytes:
+    """Apply (or remove) XorMagic obfuscation."""
+    if not data:
+        return b""
+    size = len(data)
+    mask = int.from_bytes(bytes([XOR_MAGIC]) * size, "little")
+    return (int.from_bytes(data, "little") ^ mask).to_bytes(size, "little")
+
+
+def encode_rpc_buffer(
+    payload: bytes,
+    *,
+    compress: bool = True,
+    obfuscate: bool = False,
+    last: bool = True,
+) -> bytes:
+    """Frame ``payload`` with an RPC_HEADER_EXT, compressing/obfuscating as allowed.
+
+    Compression is only kept when it actually shrinks the payload.
+    """
+    flags = RHEF_LAST if last else 0
+    body = payload
+    if compress and len(payload) >= MIN_COMPRESSIBLE_SIZE:
+        compressed = lz77_compress(payload)
+        if len(compressed) < len(payload):
+            body = compressed
+            flags |= RHEF_COMPRESSED
+    if obfuscate:
+        body = xor_magic(body)
+        flags |= RHEF_XOR_MAGIC
+    header = struct.pack("<HHHH", 0, flags, len(body), len(payload))
+    return header + body
+
+
+def decode_rpc_request(buffer: bytes) -> bytes:
+    """ROP request payload of an rgbIn buffer: one or more RPC_HEADER_EXT chunks up to RHEF_LAST."""
+    payload = bytearray()
+    offset = 0
+    while True:
+        if len(buffer) - offset < RPC_HEADER_EXT_SIZE:
+            raise ValueError("Buffer shorter than RPC_HEADER_EXT")
+        version, flags, size, _size_actual = struct.unpack_from("<HHHH", buffer, offset)
+        if version != 0:
+            raise ValueError(f"Unsupported RPC_HEADER_EXT version {version}")
+        end = offset + RPC_HEADER_EXT_SIZE + size
+        if end > len(buffer):
+            raise ValueError("RPC_HEADER_EXT Size exceeds the buffer")
+        chunk, flags = decode_rpc_buffer(buffer[offset:end])
+        payload += chunk
+        offset = end
+        if flags & RHEF_LAST:
+            return bytes(payload)
+
+
+def decode_rpc_buffer(buffer: bytes) -> Tuple[bytes, int]:
+    """Undo :func:`encode_rpc_buffer`; returns ``(payload, flags)``."""
+    if len(buffer) < RPC_HEADER_EXT_SIZE:
+        raise ValueError("Buffer shorter than RPC_HEADER_EXT")
+    _version, flags, size, size_actual = struct.unpack_from("<HHHH", buffer, 0)
+    body = buffer[RPC_HEADER_EXT_SIZE : RPC_HEADER_EXT_SIZE + size]
+    if flags & RHEF_XOR_MAGIC:
+        body = xor_magic(body)
+    if flags & RHEF_COMPRESSED:
+        body = lz77_decompress(body)
+    if len(body) != size_actual:
+        raise ValueError("RPC_HEADER_EXT SizeActual mismatch")
+    return body, flags
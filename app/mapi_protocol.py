@@ -17,6 +17,7 @@ References:
 - [MS-OXCDATA]: Data Structures
 """
 
+import os
 import struct
 import uuid
 import logging
@@ -26,6 +27,15 @@ from enum import IntEnum
 import json
 from datetime import datetime
 
+from .mapi_compression import (
+    EXECUTE_FLAG_NO_COMPRESSION,
+    EXECUTE_FLAG_NO_XOR_MAGIC,
+    MAX_ROP_OUTPUT_SIZE,
+    RPC_HEADER_EXT_SIZE,
+    decode_rpc_request,
+    encode_rpc_buffer,
+)
+
 logger = logging.getLogger(__name__)
 
 class MapiHttpRequestType(IntEnum):
@@ -419,6 +429,8 @@ class MapiRpcProcessor:
         self.db = db_session
         self.sessions: Dict[str, MapiContext] = {}
         self.rop_processors: Dict[str, Any] = {}  # Will be imported dynamically to avoid circular imports
+        # XorMagic obfuscation is optional for servers; off unless explicitly enabled
+        self.obfuscate = os.getenv("MAPI_RPC_XOR_MAGIC", "").lower() in ("1", "true", "yes")
     
     def process_rpc(
         self,
@@ -500,29 +512,27 @@ class MapiRpcProcessor:
             if len(data) < 4:
                 return self._build_rpc_error(0x80040111)
             
-            # Skip RPC-specific headers and get to ROP buffer
-            rop_buffer_offset = 0
-            
-            # Find ROP buffer in RPC data (simplified parsing)
-            for offset in range(0, min(len(data) - 8, 100), 4):
+            # rgbIn is RPC_HEADER_EXT framed (Version 0), possibly compressed or
+            # obfuscated; a bare ROP buffer starts with its non-zero size instead
+            if struct.unpack_from('<H', data, 0)[0] == 0:
                 try:
-                    # Look for ROP buffer header pattern
-                    potential_size = struct.unpack('<H', data[offset:offset+2])[0]
-                    potential_count = struct.unpack('<H', data[offset+2:offset+4])[0]
-                    
-                    # Reasonable ROP buffer size and count
-                    if 8 <= potential_size <= len(data) - offset and 1 <= potential_count <= 50:
-                        rop_buffer_offset = offset
-                        break
-                except:
-                    continue
-            
-            rop_buffer = data[rop_buffer_offset:]
+                    rop_buffer = decode_rpc_request(data)
+                except (ValueError, IndexError, struct.error) as exc:
+                    logger.warning(f"Invalid RPC_HEADER_EXT in EcDoRpc request: {exc}")
+                    return self._build_rpc_error(0x80040111)
+            else:
+                rop_buffer = data
             
-            # Process ROP buffer
-            rop_response = rop_processor.process_rop_buffer(rop_buffer)
-            if max_response_size and len(rop_response) > max_response_size:
-                rop_response = rop_response[:max_response_size]
+            # Process ROP buffer within the size the client is willing to accept
+            budget = MAX_ROP_OUTPUT_SIZE
+            if max_response_size:
+                budget = min(budget, max_response_size - RPC_HEADER_EXT_SIZE)
+            rop_payload = rop_processor.process_rop_buffer(rop_buffer, max_size=budget)
+            rop_response = encode_rpc_buffer(
+                rop_payload,
+                compress=not request_flags & EXECUTE_FLAG_NO_COMPRESSION,
+                obfuscate=self.obfuscate and not request_flags & EXECUTE_FLAG_NO_XOR_MAGIC,
+            )
             
             # Build RPC response
             response = bytearray()
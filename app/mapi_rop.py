@@ -22,17 +22,23 @@ References:
 
 import struct
 import logging
+import time
 from typing import Dict, List, Optional, Tuple, Any, Union
 from dataclasses import dataclass
 from enum import IntEnum
 import uuid
 
+from .mapi_compression import MAX_ROP_OUTPUT_SIZE
 from .mapi_protocol import MapiProperty, MapiPropertyTags, MapiPropertyType
 from .mapi_store import message_store, MapiFolder, MapiMessage, MapiPropertyConverter
 from .database import SessionLocal, Email, User
+from .metrics import observe_command
 
 logger = logging.getLogger(__name__)
 
+ROP_BUFFER_HEADER_SIZE = 8    # size + count + reserved
+ROP_RESPONSE_HEADER_SIZE = 6  # RopId + OutputHandleIndex + ReturnValue
+
 class RopId(IntEnum):
     """ROP operation IDs"""
     RopLogon = 0xFE
@@ -58,6 +64,13 @@ class RopId(IntEnum):
     RopDeleteAttach = 0x24
     RopSaveChangesAttachment = 0x25
     RopRelease = 0x01
+    RopBufferTooSmall = 0xFF
+
+class QueryRowsOrigin(IntEnum):
+    """RopQueryRows cursor origin (bookmark) values"""
+    BOOKMARK_BEGINNING = 0x00
+    BOOKMARK_CURRENT = 0x01
+    BOOKMARK_END = 0x02
 
 class LogonFlags(IntEnum):
     """RopLogon flags"""
@@ -81,6 +94,13 @@ class RopRequest:
     output_handle_index: int
     data: bytes
 
+class RopBufferTooSmallError(Exception):
+    """Raised by a ROP handler when its response cannot fit the output budget"""
+
+    def __init__(self, size_needed: int):
+        super().__init__(f"ROP response needs {size_needed} bytes")
+        self.size_needed = size_needed
+
 @dataclass
 class RopResponse:
     """ROP response structure"""
@@ -117,6 +137,25 @@ class HandleManager:
         """Release handle"""
         if handle_id in self.handles:
             del self.handles[handle_id]
+    
+    def snapshot(self) -> Tuple[Dict[int, Dict[str, Any]], int]:
+        """Copy of the handle table, including per-handle state such as table cursors"""
+        handles = {}
+        for handle_id, handle in self.handles.items():
+            data = handle['data']
+            handles[handle_id] = dict(handle, data=dict(data) if isinstance(data, dict) else data)
+        return handles, self.next_handle
+    
+    def restore(self, snapshot: Tuple[Dict[int, Dict[str, Any]], int]):
+        """Undo every handle change made since ``snapshot``"""
+        self.handles, self.next_handle = snapshot
+
+def _rop_name(rop_id: int) -> str:
+    try:
+        return RopId(rop_id).name
+    except ValueError:
+        return f"0x{rop_id:02x}"
+
 
 class RopProcessor:
     """Processes MAPI ROP operations"""
@@ -125,9 +164,17 @@ class RopProcessor:
         self.user_email = user_email
         self.handle_manager = HandleManager()
         self.logon_handle = None
+        # Bytes still available for the ROP currently being processed
+        self._response_budget = MAX_ROP_OUTPUT_SIZE
         
-    def process_rop_buffer(self, rop_buffer: bytes) -> bytes:
-        """Process ROP buffer containing multiple ROP requests"""
+    def process_rop_buffer(self, rop_buffer: bytes, max_size: int = MAX_ROP_OUTPUT_SIZE) -> bytes:
+        """Process ROP buffer containing multiple ROP requests
+
+        Responses are accumulated until ``max_size`` bytes would be exceeded.
+        The ROP that does not fit and every ROP after it are handed back to the
+        client in a RopBufferTooSmall response so it can resend them; the
+        handle table and cursors are rolled back to before that ROP ran.
+        """
         try:
             if len(rop_buffer) < 8:
                 return self._build_error_response(0x80040111)
@@ -140,6 +187,7 @@ class RopProcessor:
             
             offset = 8  # Skip header
             responses = []
+            remaining = max(max_size, 0) - ROP_BUFFER_HEADER_SIZE
             
             # Process each ROP
             for i in range(rop_count):
@@ -150,10 +198,32 @@ class RopProcessor:
                 if rop_request is None:
                     break
                 
-                offset += consumed
+                # Process individual ROP within what is left of the output budget.
+                # A ROP whose response is dropped is resent by the client, so
+                # its handle allocations and cursor moves must not stick
+                self._response_budget = remaining - ROP_RESPONSE_HEADER_SIZE
+                saved_state = (self.handle_manager.snapshot(), self.logon_handle)
+                started = time.perf_counter()
+                try:
+                    rop_response = self._process_single_rop(rop_request)
+                    size_needed = ROP_RESPONSE_HEADER_SIZE + len(rop_response.data)
+                except RopBufferTooSmallError as exc:
+                    rop_response = None
+                    size_needed = ROP_RESPONSE_HEADER_SIZE + exc.size_needed
+                observe_command("rop", _rop_name(rop_request.rop_id), time.perf_counter() - started)
+                
+                if rop_response is None or size_needed > remaining:
+                    snapshot, self.logon_handle = saved_state
+                    self.handle_manager.restore(snapshot)
+                    logger.info(
+                        f"ROP 0x{rop_request.rop_id:02x} needs {size_needed} bytes, "
+                        f"{remaining} left; returning RopBufferTooSmall"
+                    )
+                    responses.append(self._build_buffer_too_small(size_needed, rop_buffer[offset:]))
+                    break
                 
-                # Process individual ROP
-                rop_response = self._process_single_rop(rop_request)
+                offset += consumed
+                remaining -= size_needed
                 responses.append(rop_response)
             
             # Build response buffer
@@ -249,6 +319,8 @@ class RopProcessor:
                     data=b''
                 )
                 
+        except RopBufferTooSmallError:
+            raise
         except Exception as e:
             logger.error(f"Error processing ROP {request.rop_id}: {e}")
             return RopResponse(
@@ -303,7 +375,7 @@ class RopProcessor:
                 folder_name = 'inbox'
             
             # Get folder from message store
-            folder = message_store.get_folder_by_id(folder_name)
+            folder = message_store.get_folder_by_id(folder_name, self.user_email)
             if not folder:
                 return RopResponse(
                     rop_id=request.rop_id,
@@ -452,23 +524,33 @@ class RopProcessor:
             else:
                 row_count = 10
             
-            # Limit row count
-            row_count = min(row_count, 50)
-            
-            # Get requested rows
+            # Return as many rows as fit in the output budget; the client asks
+            # again from the current cursor while Origin is not BOOKMARK_END
             end_row = min(current_row + row_count, len(messages))
-            requested_messages = messages[current_row:end_row]
+            budget = self._response_budget - 3  # Origin + RowCount
+            rows = []
+            used = 0
+            for message in messages[current_row:end_row]:
+                row_data = self._serialize_message_row(message, columns)
+                row_size = 2 + len(row_data)
+                if used + row_size > budget:
+                    if not rows:
+                        raise RopBufferTooSmallError(3 + row_size)
+                    break
+                rows.append(struct.pack('<H', len(row_data)))
+                rows.append(row_data)
+                used += row_size
+            
+            row_total = len(rows) // 2
+            end_row = current_row + row_total
+            origin = (
+                QueryRowsOrigin.BOOKMARK_END
+                if end_row >= len(messages)
+                else QueryRowsOrigin.BOOKMARK_CURRENT
+            )
             
             # Build response
-            response_data = b''
-            response_data += struct.pack('<B', 0x00)  # Origin: Beginning
-            response_data += struct.pack('<H', len(requested_messages))  # Row count
-            
-            # Serialize each row
-            for message in requested_messages:
-                row_data = self._serialize_message_row(message, columns)
-                response_data += struct.pack('<H', len(row_data))
-                response_data += row_data
+            response_data = struct.pack('<BH', origin, row_total) + b''.join(rows)
             
             # Update current row
             table_data['current_row'] = end_row
@@ -480,6 +562,8 @@ class RopProcessor:
                 data=response_data
             )
             
+        except RopBufferTooSmallError:
+            raise
         except Exception as e:
             logger.error(f"Error in RopQueryRows: {e}")
             return RopResponse(
@@ -521,7 +605,7 @@ class RopProcessor:
             
             # Get folder hierarchy from message store
             from .mapi_store import message_store
-            folders = message_store.get_folder_hierarchy()
+            folders = message_store.get_folder_hierarchy(self.user_email)
             
             # Store folder data in handle
             self.handle_manager.set_handle_data(table_handle, {
@@ -649,27 +733,30 @@ class RopProcessor:
         
         return row_data
     
+    def _build_buffer_too_small(self, size_needed: int, request_buffers: bytes) -> RopResponse:
+        """Build RopBufferTooSmall carrying the ROP requests that were not executed"""
+        return RopResponse(
+            rop_id=RopId.RopBufferTooSmall,
+            output_handle_index=0,
+            return_value=0,
+            data=struct.pack('<H', min(size_needed, 0xFFFF)) + request_buffers
+        )
+    
     def _build_rop_response_buffer(self, responses: List[RopResponse]) -> bytes:
         """Build ROP response buffer"""
-        # Calculate total size
-        total_size = 8  # Header
+        parts = []
         for response in responses:
-            total_size += 4 + len(response.data)  # ROP header + data
-        
-        # Build buffer
-        buffer = b''
-        buffer += struct.pack('<H', total_size)  # ROP buffer size
-        buffer += struct.pack('<H', len(responses))  # ROP count
-        buffer += struct.pack('<I', 0)  # Reserved
-        
-        # Add responses
-        for response in responses:
-            buffer += struct.pack('<B', response.rop_id)
-            buffer += struct.pack('<B', response.output_handle_index)
-            buffer += struct.pack('<I', response.return_value)
-            buffer += response.data
+            if response.rop_id == RopId.RopBufferTooSmall:
+                # RopId, SizeNeeded, RequestBuffers - no handle index/return value
+                parts.append(struct.pack('<B', response.rop_id))
+            else:
+                parts.append(struct.pack('<BBI', response.rop_id, response.output_handle_index, response.return_value))
+            parts.append(response.data)
+        body = b''.join(parts)
         
-        return buffer
+        # Header: ROP buffer size, ROP count, reserved
+        header = struct.pack('<HHI', min(ROP_BUFFER_HEADER_SIZE + len(body), 0xFFFF), len(responses), 0)
+        return header + body
     
     def _build_error_response(self, error_code: int) -> bytes:
         """Build error response"""
@@ -13,17 +13,21 @@ This bridges our existing email database with MAPI protocol expectations.
 import struct
 import logging
 from typing import Dict, List, Optional, Tuple, Any, Union
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from enum import IntEnum
 from datetime import datetime
 import uuid
 
 from .mapi_protocol import MapiProperty, MapiPropertyTags, MapiPropertyType
 from .database import SessionLocal, Email, User
+from .services.folder_counts import get_counts
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
 
+# Store folders backed by a materialized folder counter (services/folder_counts.py)
+MAPI_COUNTED_FOLDERS = {"inbox": "inbox", "sent_items": "sent", "deleted_items": "deleted"}
+
 class MapiFolderType(IntEnum):
     """MAPI folder types"""
     FOLDER_GENERIC = 1
@@ -235,13 +239,46 @@ class MapiMessageStore:
         
         return folders
     
-    def get_folder_hierarchy(self) -> List[MapiFolder]:
-        """Get folder hierarchy"""
-        return list(self.folders.values())
+    def _with_counts(self, folders: List[MapiFolder], user_email: Optional[str]) -> List[MapiFolder]:
+        """Per-user copies of ``folders`` carrying the mailbox's folder counters"""
+        if not user_email:
+            return folders
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.email == user_email).first()
+            counts = get_counts(db, user.id) if user else {}
+        except Exception as e:
+            logger.error(f"Error reading folder counters: {e}")
+            counts = {}
+        finally:
+            db.close()
+        
+        result = []
+        for folder in folders:
+            folder_counts = counts.get(MAPI_COUNTED_FOLDERS.get(folder.folder_id))
+            if folder_counts:
+                properties = dict(folder.properties)
+                properties[MapiPropertyTags.PR_CONTENT_COUNT] = folder_counts["total"]
+                properties[MapiPropertyTags.PR_CONTENT_UNREAD] = folder_counts["unread"]
+                folder = replace(
+                    folder,
+                    content_count=folder_counts["total"],
+                    unread_count=folder_counts["unread"],
+                    properties=properties,
+                )
+            result.append(folder)
+        return result
+    
+    def get_folder_hierarchy(self, user_email: Optional[str] = None) -> List[MapiFolder]:
+        """Get folder hierarchy, with the user's counts when ``user_email`` is given"""
+        return self._with_counts(list(self.folders.values()), user_email)
     
-    def get_folder_by_id(self, folder_id: str) -> Optional[MapiFolder]:
-        """Get folder by ID"""
-        return self.folders.get(folder_id)
+    def get_folder_by_id(self, folder_id: str, user_email: Optional[str] = None) -> Optional[MapiFolder]:
+        """Get folder by ID, with the user's counts when ``user_email`` is given"""
+        folder = self.folders.get(folder_id)
+        if folder is None:
+            return None
+        return self._with_counts([folder], user_email)[0]
     
     def get_folder_contents(self, folder_id: str, user_email: str) -> List[MapiMessage]:
         """Get folder contents (messages)"""
@@ -286,16 +323,6 @@ class MapiMessageStore:
                 )
                 messages.append(message)
             
-            # Update folder counts
-            if folder_id in self.folders:
-                self.folders[folder_id].content_count = len(messages)
-                unread_count = sum(1 for msg in messages if not (msg.message_flags & MapiMessageFlags.MSGFLAG_READ))
-                self.folders[folder_id].unread_count = unread_count
-                
-                # Update properties
-                self.folders[folder_id].properties[MapiPropertyTags.PR_CONTENT_COUNT] = len(messages)
-                self.folders[folder_id].properties[MapiPropertyTags.PR_CONTENT_UNREAD] = unread_count
-            
             return messages
             
         except Exception as e:
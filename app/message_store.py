@@ -0,0 +1,142 @@
+"""
+Message Store
+One stored body per message, one mailbox row per recipient.
+
+A message addressed to many internal mailboxes used to be copied in full
+(body, HTML and base64 MIME) into one Email row per recipient, each in its
+own transaction with its own notifications. Now:
+- the content is stored once in ``message_contents`` and every mailbox row
+  points at it through ``Email.content_id`` (Email.body, body_html,
+  mime_content and mime_content_type fall back to it); single-recipient
+  messages keep their content inline
+- all mailbox rows are inserted in one transaction
+- notifications are coalesced: one EWS event, one ActiveSync Ping wake-up
+  and one WebSocket message per mailbox, however many rows it received
+"""
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .database import Email, MessageContent
+from .email_parser import get_email_preview
+from .ews_push import trigger_ews_push
+from .push_notifications import schedule_notify_new_email
+from .websocket_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# Below this many mailboxes the content stays inline on the Email row
+SHARED_CONTENT_MIN_RECIPIENTS = 2
+
+
+def store_content(
+    db: Session,
+    body: Optional[str],
+    body_html: Optional[str],
+    mime_content: Optional[str],
+    mime_content_type: Optional[str],
+) -> MessageContent:
+    """Add the shared content row and flush it to get its id."""
+    content = MessageContent(
+        body=body,
+        body_html=body_html,
+        mime_content=mime_content,
+        mime_content_type=mime_content_type,
+    )
+    db.add(content)
+    db.flush()
+    return content
+
+
+def deliver_to_mailboxes(
+    db: Session,
+    recipient_ids: Iterable[int],
+    subject: str,
+    body: Optional[str],
+    body_html: Optional[str],
+    mime_content: Optional[str],
+    mime_content_type: Optional[str],
+    sender_id: Optional[int] = None,
+    external_sender: Optional[str] = None,
+    is_external: bool = False,
+) -> List[Email]:
+    """Insert one mailbox row per distinct recipient and commit once."""
+    recipient_ids = list(dict.fromkeys(recipient_ids))
+    if not recipient_ids:
+        return []
+
+    fields = {
+        "body": body,
+        "body_html": body_html,
+        "mime_content": mime_content,
+        "mime_content_type": mime_content_type,
+    }
+    if len(recipient_ids) >= SHARED_CONTENT_MIN_RECIPIENTS:
+        content = store_content(db, **fields)
+        fields = {"content": content}
+
+    emails = [
+        Email(
+            subject=subject,
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            is_external=is_external,
+            external_sender=external_sender,
+            is_read=False,
+            **fields,
+        )
+        for recipient_id in recipient_ids
+    ]
+    db.add_all(emails)
+    db.commit()
+    logger.info(
+        "Stored message %r for %d mailbox(es)%s",
+        subject,
+        len(emails),
+        " (shared content)" if "content" in fields else "",
+    )
+    return emails
+
+
+def notify_new_mail(emails: Iterable[Email], sender: Optional[str] = None) -> None:
+    """Tell each affected mailbox about its new mail, once per mailbox."""
+    newest: Dict[int, Email] = {}
+    for email in emails:
+        if email.recipient_id is None:
+            continue
+        current = newest.get(email.recipient_id)
+        if current is None or email.id > current.id:
+            newest[email.recipient_id] = email
+    if not newest:
+        return
+
+    previews: Dict[object, str] = {}
+    for user_id, email in newest.items():
+        try:
+            trigger_ews_push(user_id=user_id, folder_id="DF_inbox", item_id=email.id)
+        except Exception as exc:
+            logger.debug("EWS push trigger failed for %s: %s", email.id, exc)
+
+        try:
+            # Wake any ActiveSync Ping parked for this mailbox; delivered on
+            # the main loop whichever thread or loop we are on
+            schedule_notify_new_email(user_id, folder_id="1")
+        except Exception as exc:
+            logger.warning(f"Failed to trigger ActiveSync notification: {exc}")
+
+        # Fan-out copies share content, so the preview is built once
+        key = email.content_id or ("inline", email.id)
+        if key not in previews:
+            previews[key] = get_email_preview(email.body_html or email.body or "", 100)
+        manager.notify_new_email(
+            user_id,
+            {
+                "id": email.id,
+                "subject": email.subject,
+                "sender": sender or email.external_sender,
+                "preview": previews[key],
+                "is_read": email.is_read,
+                "created_at": email.created_at.isoformat() if email.created_at else None,
+            },
+        )
@@ -0,0 +1,419 @@
+"""
+Metrics
+Prometheus-style counters and histograms for the protocol hot paths.
+
+One registry per process, rendered in the text exposition format by the
+/metrics router. Recording is a lock plus a bisect per observation, with no
+per-request allocation beyond a small context object, so it stays on in
+production (METRICS_ENABLED=0 turns the middleware and the SQL/WBXML hooks
+off).
+
+- ``MetricsMiddleware`` labels every HTTP request with a protocol and a
+  command (EAS ``Cmd``, MAPI ``X-RequestType``, EWS operation via
+  ``set_command``) and records latency plus SQL statements and SQL time.
+- SQLAlchemy engine events count statements per request through a context
+  variable; ``run_in_db_thread`` copies the context, so statements issued
+  from the DB pool are attributed to the request that scheduled them.
+- ``observe_command`` times non-HTTP commands (SMTP verbs, MAPI ROPs).
+- ``wbxml_timed`` wraps WBXML parsers and builders (bytes and time).
+
+Series per metric are capped (METRICS_MAX_SERIES) so client-controlled
+labels cannot grow memory without bound; overflow lands in ``other``.
+"""
+import contextvars
+import functools
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "500"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_OTHER = "other"
+_LABEL_VALUE = re.compile(r"^[A-Za-z0-9_.:-]{1,64}$")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(round(value, 6))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, values: Tuple[str, ...]) -> Tuple[str, ...]:
+        # Caller holds the lock
+        if values in self._series or len(self._series) < METRICS_MAX_SERIES:
+            return values
+        return tuple(_OTHER for _ in values)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._series.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = self.header()
+        for labels, value in series:
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # per-bucket counts (the last slot is +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, *labels: str) -> Optional[Tuple[List[int], float, int]]:
+        with self._lock:
+            series = self._series.get(labels)
+            return (list(series[0]), series[1], series[2]) if series else None
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        lines = self.header()
+        bounds = self.buckets + (float("inf"),)
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labels, labels, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{plain} {_number(total)}")
+            lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Sampled at render time; the callback returns a number or {label tuple: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        try:
+            sample = self.callback()
+        except Exception:  # noqa: BLE001 - a broken gauge must not break the scrape
+            return []
+        if sample is None:
+            return []
+        lines = self.header()
+        if isinstance(sample, dict):
+            for labels, value in sorted(sample.items()):
+                if value is not None:
+                    lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_number(value)}")
+        else:
+            lines.append(f"{self.name} {_number(sample)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics in registration order."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(
+        self, name: str, documentation: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable, labels: Iterable[str] = ()) -> Gauge:
+        """Register (or replace) a sampled gauge."""
+        gauge = Gauge(name, documentation, callback, labels)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+command_duration = metrics.histogram(
+    "command_duration_seconds",
+    "Latency per protocol command (EAS Cmd, EWS operation, MAPI request type, ROP, SMTP verb)",
+    ("protocol", "command"),
+)
+request_sql_statements = metrics.histogram(
+    "request_sql_statements",
+    "SQL statements issued per HTTP request",
+    ("protocol", "command"),
+    COUNT_BUCKETS,
+)
+request_sql_seconds = metrics.counter(
+    "request_sql_seconds_total", "SQL execution time spent by HTTP requests", ("protocol", "command")
+)
+responses_total = metrics.counter("http_responses_total", "HTTP responses by status class", ("protocol", "status"))
+sql_statement_duration = metrics.histogram(
+    "sql_statement_duration_seconds", "Duration of each SQL statement", (), SQL_BUCKETS
+)
+wbxml_duration = metrics.histogram(
+    "wbxml_duration_seconds", "WBXML encode/decode time per call", ("direction", "function"), SQL_BUCKETS
+)
+wbxml_bytes = metrics.histogram(
+    "wbxml_bytes", "WBXML payload size per call", ("direction", "function"), BYTES_BUCKETS
+)
+
+
+# --- Per-request context --------------------------------------------------------
+
+
+class RequestStats:
+    __slots__ = ("protocol", "command", "sql_statements", "sql_seconds")
+
+    def __init__(self, protocol: str, command: str):
+        self.protocol = protocol
+        self.command = command
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("metrics_request", default=None)
+
+
+def current_request() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def _label(value: Optional[str], default: str = "unknown") -> str:
+    if not value:
+        return default
+    return value if _LABEL_VALUE.match(value) else _OTHER
+
+
+def set_command(command: str) -> None:
+    """Name the command of the current request once the handler knows it (EWS)."""
+    stats = _current.get()
+    if stats is not None:
+        stats.command = _label(command)
+
+
+def observe_command(protocol: str, command: str, seconds: float) -> None:
+    if METRICS_ENABLED:
+        command_duration.observe(seconds, protocol, _label(command))
+
+
+@contextmanager
+def command_timer(protocol: str, command: str):
+    """``with command_timer("smtp", "RCPT"):`` records the block's latency."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_command(protocol, command, time.perf_counter() - started)
+
+
+def _classify(scope) -> Tuple[str, str]:
+    path = scope.get("path", "")
+    lowered = path.lower()
+    if lowered.startswith(("/microsoft-server-activesync", "/activesync")):
+        query = scope.get("query_string", b"").decode("latin-1")
+        match = re.search(r"(?:^|&)Cmd=([^&]*)", query, re.IGNORECASE)
+        return "eas", _label(match.group(1) if match else None, "none")
+    if lowered.startswith("/ews"):
+        return "ews", "unknown"
+    if lowered.startswith("/mapi"):
+        for name, value in scope.get("headers", ()):
+            if name == b"x-requesttype":
+                return "mapi", _label(value.decode("latin-1"))
+        return "mapi", "none"
+    if lowered.startswith(("/caldav", "/carddav", "/.well-known/cal", "/.well-known/card")):
+        return "dav", scope.get("method", "GET")
+    if lowered.startswith("/autodiscover"):
+        return "autodiscover", scope.get("method", "GET")
+    if lowered.startswith("/oab"):
+        return "oab", scope.get("method", "GET")
+    if lowered == "/metrics":
+        return "metrics", "GET"
+    return "http", scope.get("method", "GET")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL work per protocol command."""
+
+    def __init__(self, app):
+        self.app = app
+        if METRICS_ENABLED:
+            install_sql_metrics()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(*_classify(scope))
+        token = _current.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            labels = (stats.protocol, stats.command)
+            command_duration.observe(time.perf_counter() - started, *labels)
+            request_sql_statements.observe(stats.sql_statements, *labels)
+            if stats.sql_seconds:
+                request_sql_seconds.inc(stats.sql_seconds, *labels)
+            responses_total.inc(1, stats.protocol, f"{status_code // 100}xx")
+
+
+# --- SQL ------------------------------------------------------------------------
+
+_sql_installed = False
+_sql_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    sql_statement_duration.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.sql_seconds += elapsed
+
+
+def install_sql_metrics() -> None:
+    """Listen on every Engine (primary and replicas) once per process."""
+    global _sql_installed
+    with _sql_lock:
+        if _sql_installed:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _sql_installed = True
+
+
+# --- WBXML ----------------------------------------------------------------------
+
+_wbxml_depth = threading.local()
+
+
+def wbxml_timed(direction: str):
+    """Record time and bytes of a WBXML parser ("decode") or builder ("encode").
+
+    Only the outermost call is recorded, so builders that delegate to other
+    builders are not double counted. Decoders measure their first argument,
+    encoders their return value (or its ``payload`` for a SyncBatch).
+    """
+
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            depth = getattr(_wbxml_depth, "value", 0)
+            if depth:
+                return func(*args, **kwargs)
+            _wbxml_depth.value = 1
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _wbxml_depth.value = 0
+            wbxml_duration.observe(time.perf_counter() - started, direction, name)
+            payload = args[0] if direction == "decode" and args else getattr(result, "payload", result)
+            if isinstance(payload, (bytes, bytearray)):
+                wbxml_bytes.observe(len(payload), direction, name)
+            return result
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,415 @@
+"""
+Schema Migrations
+Versioned schema changes recorded in the ``schema_migrations`` table.
+
+Service startup used to re-probe the whole schema on every boot
+(create_all, PRAGMA table_info for each contact column, recreating the
+calendar tables, row-by-row UUID backfills), so cold start grew with the
+size of the data. Now every change is a numbered step that runs once:
+- migrate_database() reads the applied versions (a single query when the
+  schema is current) and runs pending DDL steps in order
+- steps marked ``background`` are data backfills; they run in batches on a
+  daemon thread and are recorded when they finish, so health checks are
+  not held up by them
+- every step is idempotent, so services racing on first start (or a
+  partially migrated legacy database) converge on the same schema
+
+To change the schema, append a step with the next version number.
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from uuid import uuid4
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .database import (
+    Base,
+    CalendarEvent,
+    CalendarFolder,
+    Contact,
+    DavChange,
+    engine as default_engine,
+    ensure_global_address_list,
+    FolderCounter,
+    MessageContent,
+    User,
+)
+from .email_queue import Base as QueueBase
+from .services.folder_counts import reconcile as reconcile_folder_counts
+from .services.mail_search import backfill as backfill_search_index
+from .services.mail_search import create_index as create_search_index
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BACKFILL_BATCH = int(os.getenv("MIGRATION_BACKFILL_BATCH", "5000"))
+# Arbitrary constant identifying the migration advisory lock on Postgres
+_PG_LOCK_KEY = 365_000_001
+
+_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(200) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+)
+"""
+
+_UUID_TABLES = (
+    "users",
+    "emails",
+    "email_attachments",
+    "calendar_events",
+    "activesync_devices",
+    "activesync_state",
+    "contacts",
+    "contact_folders",
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable
+    # Background steps take the Engine (they commit per batch); DDL steps take a Connection
+    background: bool = False
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str, background: bool = False):
+    def register(func):
+        MIGRATIONS.append(Migration(version, name, func, background))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+
+    return register
+
+
+# --- Helpers ----------------------------------------------------------------
+
+
+def _columns(conn: Connection, table: str) -> Set[str]:
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def _has_table(conn: Connection, table: str) -> bool:
+    return inspect(conn).has_table(table)
+
+
+def _add_columns(conn: Connection, table: str, columns: Dict[str, str]) -> None:
+    """ALTER TABLE ADD COLUMN for each ``name: ddl`` not already present."""
+    if not _has_table(conn, table):
+        return
+    existing = _columns(conn, table)
+    for name, ddl in columns.items():
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+            logger.info("Added column %s.%s", table, name)
+
+
+def _add_missing_model_columns(conn: Connection, table) -> None:
+    """Add (as nullable) any column the model declares but the table lacks."""
+    if not _has_table(conn, table.name):
+        return
+    existing = _columns(conn, table.name)
+    missing = {
+        column.name: column.type.compile(dialect=conn.dialect)
+        for column in table.columns
+        if column.name not in existing
+    }
+    _add_columns(conn, table.name, missing)
+
+
+# --- Steps ------------------------------------------------------------------
+
+
+@migration(1, "baseline_tables")
+def _baseline(conn: Connection) -> None:
+    Base.metadata.create_all(bind=conn)
+    QueueBase.metadata.create_all(bind=conn)
+
+
+@migration(2, "user_auth_columns")
+def _user_auth_columns(conn: Connection) -> None:
+    _add_columns(conn, "users", {"ntlm_hash": "TEXT", "admin": "BOOLEAN DEFAULT FALSE"})
+    # Modern-auth columns (TOTP, WebAuthn, OAuth2, SAML) were never migrated on old databases
+    _add_missing_model_columns(conn, User.__table__)
+
+
+@migration(3, "email_body_mime_columns")
+def _email_body_columns(conn: Connection) -> None:
+    _add_columns(
+        conn,
+        "emails",
+        {"body_html": "TEXT", "mime_content": "TEXT", "mime_content_type": "TEXT"},
+    )
+
+
+@migration(4, "calendar_schema")
+def _calendar_schema(conn: Connection) -> None:
+    # Previously the calendar tables were dropped and recreated on every start;
+    # bring old tables up to the model instead and keep their rows.
+    _add_missing_model_columns(conn, CalendarFolder.__table__)
+    _add_missing_model_columns(conn, CalendarEvent.__table__)
+
+
+@migration(5, "contact_extended_columns")
+def _contact_columns(conn: Connection) -> None:
+    _add_missing_model_columns(conn, Contact.__table__)
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_contact_folders_owner ON contact_folders(owner_id)",
+        "CREATE INDEX IF NOT EXISTS idx_contact_folders_parent ON contact_folders(parent_id)",
+        "CREATE INDEX IF NOT EXISTS idx_contacts_folder_id ON contacts(folder_id)",
+        "CREATE INDEX IF NOT EXISTS idx_contacts_email1 ON contacts(email_address_1)",
+    ):
+        conn.execute(text(statement))
+
+
+@migration(6, "uuid_columns")
+def _uuid_columns(conn: Connection) -> None:
+    for table in _UUID_TABLES:
+        if not _has_table(conn, table):
+            continue
+        _add_columns(conn, table, {"uuid": "VARCHAR"})
+        # Empty strings would collide in the unique index; the backfill fills NULLs
+        conn.execute(text(f"UPDATE {table} SET uuid = NULL WHERE uuid = ''"))
+        indexes = inspect(conn).get_indexes(table)
+        if not any(ix["unique"] and ix["column_names"] == ["uuid"] for ix in indexes):
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_uuid ON {table}(uuid)"))
+
+
+@migration(7, "uuid_backfill", background=True)
+def _uuid_backfill(engine: Engine) -> None:
+    for table in _UUID_TABLES:
+        total = 0
+        last_id = 0
+        while True:
+            with engine.begin() as conn:
+                if not _has_table(conn, table):
+                    break
+                # Keyset over the primary key so each batch starts where the last ended
+                ids = conn.execute(
+                    text(
+                        f"SELECT id FROM {table} WHERE id > :last AND uuid IS NULL "
+                        "ORDER BY id LIMIT :limit"
+                    ),
+                    {"last": last_id, "limit": MIGRATION_BACKFILL_BATCH},
+                ).scalars().all()
+                if not ids:
+                    break
+                conn.execute(
+                    text(f"UPDATE {table} SET uuid = :uuid WHERE id = :id"),
+                    [{"uuid": str(uuid4()), "id": row_id} for row_id in ids],
+                )
+            total += len(ids)
+            last_id = ids[-1]
+        if total:
+            logger.info("Backfilled %d uuid values in %s", total, table)
+
+
+@migration(8, "gal_backfill", background=True)
+def _gal_backfill(engine: Engine) -> None:
+    # New and updated users keep their GAL entry in sync; this seeds existing ones
+    ensure_global_address_list(bind=engine)
+
+
+@migration(9, "dav_change_log")
+def _dav_change_log(conn: Connection) -> None:
+    DavChange.__table__.create(bind=conn, checkfirst=True)
+    # calendar-query time ranges filter on owner first
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS idx_calendar_events_owner_start "
+            "ON calendar_events(owner_id, start_time)"
+        )
+    )
+
+
+@migration(10, "owa_list_indexes")
+def _owa_list_indexes(conn: Connection) -> None:
+    # OWA message list: keyset pages per folder and updated_at deltas
+    for name, columns in (
+        ("idx_emails_recipient_list", "recipient_id, is_deleted, created_at, id"),
+        ("idx_emails_sender_list", "sender_id, is_deleted, created_at, id"),
+        ("idx_emails_recipient_updated", "recipient_id, updated_at"),
+        ("idx_emails_sender_updated", "sender_id, updated_at"),
+    ):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON emails({columns})"))
+
+
+@migration(11, "queue_leases")
+def _queue_leases(conn: Connection) -> None:
+    if not _has_table(conn, "queued_emails"):
+        return
+    _add_columns(conn, "queued_emails", {"lease_owner": "VARCHAR"})
+    # next_retry_at is now the due time for every status; rows left in
+    # processing by the old code become claimable again
+    conn.execute(
+        text(
+            "UPDATE queued_emails SET next_retry_at = COALESCE(created_at, CURRENT_TIMESTAMP) "
+            "WHERE next_retry_at IS NULL AND status IN ('pending', 'processing')"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS idx_queued_emails_due "
+            "ON queued_emails(status, next_retry_at, priority)"
+        )
+    )
+
+
+
+@migration(12, "message_contents")
+def _message_contents(conn: Connection) -> None:
+    # Fan-out copies of a message share one body row
+    MessageContent.__table__.create(bind=conn, checkfirst=True)
+    if _has_table(conn, "emails"):
+        _add_columns(conn, "emails", {"content_id": "INTEGER"})
+        conn.execute(
+            text("CREATE INDEX IF NOT EXISTS ix_emails_content_id ON emails(content_id)")
+        )
+    if _has_table(conn, "queued_emails"):
+        _add_columns(conn, "queued_emails", {"content_id": "INTEGER"})
+
+
+@migration(13, "folder_counters")
+def _folder_counters(conn: Connection) -> None:
+    FolderCounter.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(14, "folder_counter_backfill", background=True)
+def _folder_counter_backfill(engine: Engine) -> None:
+    # Live writes already adjust the counters; this adds everything before them
+    with Session(bind=engine) as db:
+        reconcile_folder_counts(db)
+
+
+@migration(15, "mail_search_index")
+def _mail_search_index(conn: Connection) -> None:
+    if _has_table(conn, "emails"):
+        create_search_index(conn)
+
+
+@migration(16, "mail_search_backfill", background=True)
+def _mail_search_backfill(engine: Engine) -> None:
+    # New mail is indexed as it is stored; this indexes everything before it
+    backfill_search_index(engine)
+
+
+# --- Runner -----------------------------------------------------------------
+
+
+def applied_versions(engine: Engine = default_engine) -> Set[int]:
+    with engine.begin() as conn:
+        conn.execute(text(_VERSION_TABLE))
+        return set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+
+def current_version(engine: Engine = default_engine) -> int:
+    return max(applied_versions(engine), default=0)
+
+
+def _record(conn: Connection, step: Migration) -> None:
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+        {"v": step.version, "n": step.name, "t": datetime.utcnow()},
+    )
+
+
+def _record_standalone(engine: Engine, step: Migration) -> None:
+    try:
+        with engine.begin() as conn:
+            _record(conn, step)
+    except IntegrityError:
+        pass  # another service recorded it first
+
+
+def _run_ddl_steps(engine: Engine, steps: Iterable[Migration]) -> List[int]:
+    ran = []
+    with engine.connect() as lock_conn:
+        if engine.dialect.name == "postgresql":
+            lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _PG_LOCK_KEY})
+        try:
+            for step in steps:
+                if step.version in applied_versions(engine):
+                    continue  # applied by another service while we waited
+                started = time.perf_counter()
+                try:
+                    with engine.begin() as conn:
+                        step.upgrade(conn)
+                        _record(conn, step)
+                except IntegrityError:
+                    continue
+                ran.append(step.version)
+                logger.info(
+                    "Applied migration %d %s in %.2fs",
+                    step.version,
+                    step.name,
+                    time.perf_counter() - started,
+                )
+        finally:
+            if engine.dialect.name == "postgresql":
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _PG_LOCK_KEY})
+                lock_conn.commit()
+    return ran
+
+
+_background_lock = threading.Lock()
+_background_thread: Optional[threading.Thread] = None
+
+
+def run_background_steps(engine: Engine, steps: Iterable[Migration]) -> None:
+    for step in steps:
+        started = time.perf_counter()
+        try:
+            step.upgrade(engine)
+        except Exception as exc:
+            # Retried on the next start; the step is not recorded
+            logger.error("Background migration %d %s failed: %s", step.version, step.name, exc)
+            return
+        _record_standalone(engine, step)
+        logger.info(
+            "Applied background migration %d %s in %.2fs",
+            step.version,
+            step.name,
+            time.perf_counter() - started,
+        )
+
+
+def migrate_database(engine: Engine = default_engine, background: bool = True) -> List[int]:
+    """Bring the schema to the latest version; returns the DDL versions applied now.
+
+    Pending backfills run on a daemon thread when ``background`` is true and
+    inline otherwise (scripts, tests).
+    """
+    global _background_thread
+    applied = applied_versions(engine)
+    pending = [step for step in MIGRATIONS if step.version not in applied]
+    if not pending:
+        return []
+
+    ran = _run_ddl_steps(engine, [step for step in pending if not step.background])
+    backfills = [step for step in pending if step.background]
+    if backfills:
+        if not background:
+            run_background_steps(engine, backfills)
+        else:
+            with _background_lock:
+                if _background_thread is None or not _background_thread.is_alive():
+                    _background_thread = threading.Thread(
+                        target=run_background_steps,
+                        args=(engine, backfills),
+                        name="schema-backfill",
+                        daemon=True,
+                    )
+                    _background_thread.start()
+    return ran
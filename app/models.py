@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 from pydantic import BaseModel, EmailStr
 
@@ -38,6 +38,8 @@ class EmailBase(BaseModel):
 
 class EmailCreate(EmailBase):
     recipient_email: EmailStr
+    # Further recipients of the same message (stored and queued once)
+    additional_recipients: List[EmailStr] = []
 
 
 class EmailResponse(EmailBase):
@@ -276,7 +278,10 @@ class CalendarEventBase(BaseModel):
 
 
 class CalendarEventCreate(CalendarEventBase):
-    pass
+    # RRULE-style JSON object or RFC 5545 rule string (see services/recurrence.py)
+    recurrence_pattern: Optional[Union[Dict[str, Any], str]] = None
+    recurrence_end: Optional[datetime] = None
+    recurrence_count: Optional[int] = None
 
 
 class CalendarEventResponse(CalendarEventBase):
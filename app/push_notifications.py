@@ -6,10 +6,16 @@ Push notification manager for ActiveSync Ping command.
 This module provides an event-driven system for notifying connected devices
 about new content, similar to Z-Push's approach. When new emails arrive,
 all active Ping connections are immediately notified.
+
+Waiters park on the main event loop, while notifications also come from
+DB pool threads running handlers on private loops. State is guarded by a
+thread lock and each waiter is woken on its own loop, so notify from any
+thread or loop is safe.
 """
 
 import asyncio
-from typing import Dict, Set
+import threading
+from typing import Dict, Optional, Set
 from datetime import datetime
 import logging
 
@@ -28,9 +34,14 @@ class PushNotificationManager:
     def __init__(self):
         # Map of user_id -> set of asyncio.Event objects
         self._subscribers: Dict[int, Set[asyncio.Event]] = {}
-        # Map of event -> (user_id, folders) for cleanup
+        # Map of event -> (user_id, folders, loop) for cleanup and wake-ups
         self._event_info: Dict[asyncio.Event, tuple] = {}
-        self._lock = asyncio.Lock()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def set_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Register the main event loop; schedule_notify() delivers there."""
+        self._loop = loop
     
     async def subscribe(self, user_id: int, folders: list) -> asyncio.Event:
         """
@@ -44,13 +55,14 @@ class PushNotificationManager:
             An asyncio.Event that will be set when new content arrives
         """
         event = asyncio.Event()
+        loop = asyncio.get_running_loop()
         
-        async with self._lock:
+        with self._lock:
             if user_id not in self._subscribers:
                 self._subscribers[user_id] = set()
             
             self._subscribers[user_id].add(event)
-            self._event_info[event] = (user_id, folders)
+            self._event_info[event] = (user_id, folders, loop)
         
         logger.debug(f"Ping subscribed for user {user_id}, folders {folders}")
         return event
@@ -62,9 +74,9 @@ class PushNotificationManager:
         Args:
             event: The event object returned by subscribe()
         """
-        async with self._lock:
+        with self._lock:
             if event in self._event_info:
-                user_id, _ = self._event_info[event]
+                user_id = self._event_info[event][0]
                 if user_id in self._subscribers:
                     self._subscribers[user_id].discard(event)
                     if not self._subscribers[user_id]:
@@ -83,14 +95,42 @@ class PushNotificationManager:
             user_id: The user ID with new content
             folder_id: The folder/collection ID with new content (default: "1" for inbox)
         """
-        async with self._lock:
-            if user_id in self._subscribers:
-                # Notify all subscribers for this user
-                for event in self._subscribers[user_id]:
-                    event.set()
-                
-                count = len(self._subscribers[user_id])
-                logger.info(f"Notified {count} Ping connection(s) for user {user_id}, folder {folder_id}")
+        self.wake(user_id, folder_id)
+
+    def wake(self, user_id: int, folder_id: str = "1") -> int:
+        """
+        Set the events of the user's subscribers, each on the loop it was
+        created on. Safe from any thread; returns the number woken.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        with self._lock:
+            waiters = [(event, self._event_info[event][2]) for event in self._subscribers.get(user_id, ())]
+        for event, loop in waiters:
+            if loop is running:
+                event.set()
+                continue
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # the waiter's loop has closed
+        if waiters:
+            logger.info(f"Notified {len(waiters)} Ping connection(s) for user {user_id}, folder {folder_id}")
+        return len(waiters)
+
+    def schedule_notify(self, user_id: int, folder_id: str = "1") -> None:
+        """
+        Thread-safe: run notify_new_content() on the main loop (see
+        set_loop). Without a running main loop (scripts, tests) the
+        subscribers are woken directly.
+        """
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            self.wake(user_id, folder_id)
+            return
+        asyncio.run_coroutine_threadsafe(self.notify_new_content(user_id, folder_id), loop)
     
     def get_active_connections_count(self) -> int:
         """Get the total number of active Ping connections."""
@@ -116,6 +156,14 @@ async def notify_new_email(user_id: int, folder_id: str = "1"):
     await push_manager.notify_new_content(user_id, folder_id)
 
 
+def schedule_notify_new_email(user_id: int, folder_id: str = "1") -> None:
+    """
+    Notify about new content from any thread or event loop (DB pool
+    handlers, after_commit hooks); delivered on the main loop.
+    """
+    push_manager.schedule_notify(user_id, folder_id)
+
+
 
 
 
@@ -4,6 +4,7 @@ import json
 import logging
 import random
 import re
+import struct
 import time
 import traceback
 import uuid
@@ -23,7 +24,19 @@ import os
 # ActiveSync WBXML builders (root-level module)
 import sys
 
+from ..attachment_stream import (
+    FileSegment,
+    RangeNotSatisfiable,
+    Segment,
+    load_attachments,
+    parse_byte_range,
+    ranged_file_response,
+    segments_length,
+    streaming_segments_response,
+)
 from ..auth import get_current_user_from_basic_auth
+from ..db_engine import replica_reads
+from ..db_executor import run_coroutine_in_db_thread
 from ..database import (
     ActiveSyncDevice,
     ActiveSyncState,
@@ -34,6 +47,11 @@ from ..database import (
 )
 from ..diagnostic_logger import _write_json_line
 from ..email_service import EmailService
+from ..metrics import wbxml_timed
+from ..services.folder_counts import get_folder_count
+from ..services.gal_service import GalService
+from ..services import client_changes, hanging_sync, mail_search
+from ..services.sync_replay import sync_replay_cache
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 from activesync.adapter import sync_prepare_batch
@@ -52,17 +70,22 @@ from activesync.wbxml_builder import (
     _safe_aslog,
     build_foldersync_no_changes,
     build_foldersync_with_folders,
+    build_moveitems_response,
     build_provision_response,
     create_invalid_synckey_response_wbxml,
     create_sync_response_wbxml,
     create_sync_response_wbxml_with_fetch,
+    merge_sync_responses,
     write_fetch_responses,
 )
 
 from ..synckey_utils import bump_synckey, generate_synckey, has_synckey, parse_synckey
 from ..wbxml_parser import (
     parse_wbxml_foldersync_request,
+    parse_wbxml_moveitems_request,
     parse_wbxml_provision_request,
+    parse_wbxml_sync_collections,
+    parse_wbxml_sync_commands,
     parse_wbxml_sync_fetch_and_delete,
     parse_wbxml_sync_request,
 )
@@ -70,6 +93,11 @@ from ..wbxml_parser import (
 # Rate limiting for sync requests
 _sync_rate_limits = {}
 
+# ActiveSyncDevice.last_seen is written at most this often per device
+LAST_SEEN_INTERVAL = timedelta(
+    minutes=float(os.getenv("ACTIVESYNC_LAST_SEEN_MINUTES", "5"))
+)
+
 router = APIRouter(prefix="/activesync", tags=["activesync"])
 root_router = APIRouter(tags=["activesync-root"])
 
@@ -78,9 +106,6 @@ root_router = APIRouter(tags=["activesync-root"])
 # This was causing the AttributeError: 'APIRouter' object has no attribute 'middleware'
 
 
-# Simple in-memory pending cache: (user, device, collection, client_key) -> wbxml bytes
-_pending_batches_cache = {}
-
 # Loop detection cache: (user, device, collection) -> loop state
 _loop_detection_cache = {}
 
@@ -95,6 +120,10 @@ _HTML_PATTERN = re.compile(
 
 WBXML_MEDIA_TYPE = "application/vnd.ms-sync.wbxml"
 
+# Mail collections by ActiveSync ServerId -> mailbox folder
+_COLLECTION_FOLDERS = {"1": "inbox", "3": "deleted", "4": "sent"}
+_FOLDER_COLLECTIONS = {folder: server_id for server_id, folder in _COLLECTION_FOLDERS.items()}
+
 DEFAULT_SYSTEM_FOLDERS = [
     # NOTE: No Root folder - ActiveSync clients (especially Outlook) don't need/want it
     # parent_id="0" means "top level" for all folders
@@ -472,6 +501,7 @@ def _parse_itemops_fetches(
     return fetches
 
 
+@wbxml_timed("encode")
 def _build_itemops_wbxml_response(response_items: List[Dict]) -> bytes:
     """
     Build WBXML ItemOperations response with MIME support.
@@ -674,6 +704,203 @@ def _build_itemops_wbxml_response(response_items: List[Dict]) -> bytes:
     return w.bytes()
 
 
+def _parse_itemops_file_fetches(request_body_bytes: bytes) -> List[Dict[str, Optional[str]]]:
+    """
+    Extract attachment fetches (ItemOperations Fetch with an AirSyncBase
+    FileReference, optional Options/Range) from an ItemOperations request.
+
+    Returns:
+        List of {"file_reference", "range"} dicts in request order
+    """
+    from activesync.wbxml_builder import (
+        ASB_FileReference,
+        CP_AIRSYNCBASE,
+        CP_ITEMOPERATIONS,
+        IO_Fetch,
+        IO_Range,
+    )
+
+    data = request_body_bytes or b""
+    fetches: List[Dict[str, Optional[str]]] = []
+    stack: List[Optional[str]] = []
+    current: Optional[Dict[str, Optional[str]]] = None
+    cp = 0
+    # Skip the WBXML header: version, public id, charset, string table length
+    i = 4 if len(data) >= 4 else len(data)
+    while i < len(data):
+        b = data[i]
+        i += 1
+        if b == 0x00:  # SWITCH_PAGE
+            if i < len(data):
+                cp = data[i]
+                i += 1
+            continue
+        if b == 0x01:  # END
+            tag = stack.pop() if stack else None
+            if tag == "Fetch" and current is not None:
+                if current.get("file_reference"):
+                    fetches.append(current)
+                current = None
+            continue
+        if b == 0x03:  # STR_I belonging to the innermost element
+            end = data.find(b"\x00", i)
+            end = len(data) if end < 0 else end
+            text = data[i:end].decode("utf-8", errors="ignore").strip()
+            i = end + 1
+            tag = stack[-1] if stack else None
+            if current is not None and tag in ("FileReference", "Range"):
+                current["file_reference" if tag == "FileReference" else "range"] = text
+            continue
+        if b == 0xC3:  # OPAQUE: mb_u_int32 length + bytes
+            length = 0
+            while i < len(data):
+                octet = data[i]
+                i += 1
+                length = (length << 7) | (octet & 0x7F)
+                if not octet & 0x80:
+                    break
+            i += length
+            continue
+
+        token = b & 0x3F
+        if not b & 0x40:
+            continue  # Empty element, nothing to track
+        tag = None
+        if cp == CP_ITEMOPERATIONS and token == IO_Fetch:
+            tag = "Fetch"
+            current = {"file_reference": None, "range": None}
+        elif cp == CP_AIRSYNCBASE and token == ASB_FileReference:
+            tag = "FileReference"
+        elif cp == CP_ITEMOPERATIONS and token == IO_Range:
+            tag = "Range"
+        stack.append(tag)
+    return fetches
+
+
+def _itemops_attachment_response(
+    db: Session,
+    user_id: int,
+    fetches: List[Dict[str, Optional[str]]],
+    headers: dict,
+    multipart: bool,
+) -> Response:
+    """
+    ItemOperations response for attachment fetches, streamed from disk.
+
+    Inline responses carry each attachment base64-encoded in <Data>;
+    multipart responses (MS-ASAcceptMultiPart: T) carry a <Part> index
+    instead and append the raw bytes as separate parts after the WBXML.
+    Either way attachment bytes are read block by block while the client
+    downloads, never held in memory.
+    """
+    from activesync.wbxml_builder import (
+        ASB_FileReference,
+        CP_AIRSYNCBASE,
+        CP_ITEMOPERATIONS,
+        IO_Data,
+        IO_Fetch,
+        IO_ItemOperations,
+        IO_Part,
+        IO_Properties,
+        IO_Range,
+        IO_Response,
+        IO_Status,
+        IO_Total,
+        STR_I,
+    )
+
+    attachments = load_attachments(db, user_id, [f["file_reference"] for f in fetches])
+    w = WBXMLWriter()
+    w.header()
+    segments: List[Segment] = []
+    parts: List[FileSegment] = []
+
+    def flush() -> None:
+        segments.append(bytes(w.buf))
+        w.buf = bytearray()
+
+    def element(cp: int, token: int, value: str) -> None:
+        w.page(cp)
+        w.start(token)
+        w.write_str(value)
+        w.end()
+
+    w.page(CP_ITEMOPERATIONS)
+    w.start(IO_ItemOperations)
+    element(CP_ITEMOPERATIONS, IO_Status, "1")
+    w.start(IO_Response)
+    for fetch in fetches:
+        file_ref = fetch["file_reference"]
+        att = attachments.get(file_ref)
+        path = att.file_path if att is not None else None
+        status, segment, byte_range = "15", None, None
+        if path and os.path.exists(path):
+            size = os.path.getsize(path)
+            try:
+                byte_range = (
+                    parse_byte_range(f"bytes={fetch['range']}", size)
+                    if fetch.get("range")
+                    else None
+                )
+                start, end = byte_range or (0, size - 1)
+                segment = FileSegment(path, start, end, encode_base64=not multipart)
+                status = "1"
+            except RangeNotSatisfiable:
+                status = "8"
+
+        w.page(CP_ITEMOPERATIONS)
+        w.start(IO_Fetch)
+        element(CP_ITEMOPERATIONS, IO_Status, status)
+        element(CP_AIRSYNCBASE, ASB_FileReference, file_ref)
+        if segment is not None:
+            w.page(CP_ITEMOPERATIONS)
+            w.start(IO_Properties)
+            if fetch.get("range"):
+                element(CP_ITEMOPERATIONS, IO_Range, f"{segment.start}-{segment.end}")
+                element(CP_ITEMOPERATIONS, IO_Total, str(size))
+            if multipart:
+                parts.append(segment)
+                element(CP_ITEMOPERATIONS, IO_Part, str(len(parts)))
+            else:
+                w.start(IO_Data)
+                w.write_byte(STR_I)
+                flush()
+                segments.append(segment)
+                w.write_byte(0x00)
+                w.end()  # </Data>
+            w.end()  # </Properties>
+        w.end()  # </Fetch>
+    w.end()  # </Response>
+    w.end()  # </ItemOperations>
+    flush()
+
+    hdrs = dict(headers or {})
+    media_type = WBXML_MEDIA_TYPE
+    if multipart:
+        # PartsCount, then (offset, length) per part, then the parts: the
+        # WBXML response is part 0, attachment i is part i
+        bodies: List[Segment] = [b"".join(segments)] + parts
+        offset = 4 + 8 * len(bodies)
+        table = [struct.pack("<i", len(bodies))]
+        for body in bodies:
+            table.append(struct.pack("<ii", offset, len(body)))
+            offset += len(body)
+        segments = [b"".join(table)] + bodies
+        media_type = "application/vnd.ms-sync.multipart"
+    hdrs["Content-Type"] = media_type
+    _write_json_line(
+        "activesync/activesync.log",
+        {
+            "event": "itemoperations_attachments",
+            "fetch_count": len(fetches),
+            "found": sum(1 for f in fetches if f["file_reference"] in attachments),
+            "multipart": multipart,
+            "content_length": segments_length(segments),
+        },
+    )
+    return streaming_segments_response(segments, media_type, hdrs)
+
+
 def _wbxml_response(
     payload: bytes,
     headers: dict,
@@ -1119,26 +1346,40 @@ root_router.add_api_route(
 def _get_or_create_device(
     db: Session, user_id: int, device_id: str, device_type: str | None = None
 ) -> ActiveSyncDevice:
+    """Load the device row locked for this request, creating it if needed.
+
+    FOR UPDATE serializes concurrent requests from one device on Postgres
+    (SQLite serializes writers anyway). Nothing is committed here; the
+    dispatcher commits once per request.
+    """
     device = (
         db.query(ActiveSyncDevice)
         .filter(
             ActiveSyncDevice.user_id == user_id, ActiveSyncDevice.device_id == device_id
         )
+        .with_for_update()
         .first()
     )
+    now = datetime.utcnow()
     if not device:
         device = ActiveSyncDevice(
-            user_id=user_id, device_id=device_id, device_type=device_type or "generic"
+            user_id=user_id,
+            device_id=device_id,
+            device_type=device_type or "generic",
+            last_seen=now,
         )
         db.add(device)
-        db.commit()
-        db.refresh(device)
+        db.flush()
+    elif device.last_seen is None or now - device.last_seen >= LAST_SEEN_INTERVAL:
+        # Throttled: a poll every few seconds must not rewrite the row each time
+        device.last_seen = now
     return device
 
 
 def _get_or_init_state(
     db: Session, user_id: int, device_id: str, collection_id: str = "1"
 ) -> ActiveSyncState:
+    """Load the collection state locked for this request, creating it if needed."""
     state = (
         db.query(ActiveSyncState)
         .filter(
@@ -1146,6 +1387,7 @@ def _get_or_init_state(
             ActiveSyncState.device_id == device_id,
             ActiveSyncState.collection_id == collection_id,
         )
+        .with_for_update()
         .first()
     )
     if not state:
@@ -1156,8 +1398,7 @@ def _get_or_init_state(
             sync_key="0",
         )
         db.add(state)
-        db.commit()
-        db.refresh(state)
+        db.flush()
 
     # MS-ASCMD compliant: No artificial loop breaking - follow standard sync key progression
 
@@ -1226,13 +1467,217 @@ def _allocate_sync_key(
     return next_key, next_counter
 
 
+def _stage_sync_replay(
+    db: Session,
+    user_id: int,
+    device_id: str,
+    collection_id: str,
+    state: ActiveSyncState,
+    response_sync_key: str,
+    variant: tuple,
+    payload: bytes,
+) -> None:
+    """Keep a response that staged a pending batch, to replay it on a retry."""
+    if state.pending_sync_key and state.pending_sync_key == response_sync_key:
+        sync_replay_cache.stage(
+            db,
+            (user_id, device_id, collection_id, response_sync_key),
+            (state.pending_item_ids, variant),
+            payload,
+        )
+
+
+def _sync_status_wbxml(status: str, limit: Optional[str] = None) -> bytes:
+    """Request-level Sync error, e.g. 13 (resend the full request) or 14 (bad Wait/HeartbeatInterval)."""
+    from activesync.wbxml_builder import CP_AIRSYNC, AS_Limit, AS_Status, AS_Sync
+
+    w = WBXMLWriter()
+    w.header()
+    w.page(CP_AIRSYNC)
+    w.start(AS_Sync)
+    w.start(AS_Status)
+    w.write_str(status)
+    w.end()
+    if limit is not None:
+        w.start(AS_Limit)
+        w.write_str(limit)
+        w.end()
+    w.end()
+    return w.bytes()
+
+
+def _search_element(body: str, tag: str) -> Optional[str]:
+    match = re.search(rf"<(?:\w+:)?{tag}>([^<]*)</(?:\w+:)?{tag}>", body)
+    return html_module.unescape(match.group(1)).strip() if match else None
+
+
+def _search_date(body: str, comparison: str) -> Optional[datetime]:
+    match = re.search(
+        rf"<{comparison}>[\s\S]*?<Value>([^<]+)</Value>[\s\S]*?</{comparison}>", body
+    )
+    if not match:
+        return None
+    try:
+        value = datetime.fromisoformat(match.group(1).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return value.replace(tzinfo=None)
+
+
+def _mailbox_search_xml(db: Session, user_id: int, body: str) -> str:
+    """MS-ASCMD Search of the Mailbox store, served from the full-text index."""
+    collection_id = _search_element(body, "CollectionId")
+    start, end = 0, 99
+    range_text = _search_element(body, "Range")
+    if range_text and re.fullmatch(r"\d+-\d+", range_text):
+        start, end = (int(part) for part in range_text.split("-"))
+    found = mail_search.search(
+        db,
+        user_id,
+        _search_element(body, "FreeText"),
+        folder=_COLLECTION_FOLDERS.get(collection_id) if collection_id else None,
+        # DateReceived comparisons: GreaterThan is the lower bound
+        since=_search_date(body, "GreaterThan"),
+        until=_search_date(body, "LessThan"),
+        offset=start,
+        limit=max(1, end - start + 1),
+    )
+    emails = mail_search.load_emails(db, found["ids"])
+
+    root = ET.Element("Search")
+    root.set("xmlns", "Search")
+    ET.SubElement(root, "Status").text = "1"
+    store = ET.SubElement(ET.SubElement(root, "Response"), "Store")
+    ET.SubElement(store, "Status").text = "1"
+    for email in emails:
+        if email.is_deleted:
+            server_collection = _FOLDER_COLLECTIONS["deleted"]
+        elif email.recipient_id == user_id:
+            server_collection = _FOLDER_COLLECTIONS["inbox"]
+        else:
+            server_collection = _FOLDER_COLLECTIONS["sent"]
+        result = ET.SubElement(store, "Result")
+        ET.SubElement(result, "Class").text = "Email"
+        ET.SubElement(result, "LongId").text = f"{server_collection}:{email.id}"
+        ET.SubElement(result, "CollectionId").text = server_collection
+        props = ET.SubElement(result, "Properties")
+        ET.SubElement(props, "Subject").text = email.subject or ""
+        ET.SubElement(props, "From").text = email.sender_email or ""
+        ET.SubElement(props, "To").text = email.recipient_email or ""
+        if email.created_at:
+            ET.SubElement(props, "DateReceived").text = email.created_at.strftime(
+                "%Y-%m-%dT%H:%M:%S.000Z"
+            )
+        ET.SubElement(props, "Read").text = "1" if email.is_read else "0"
+    if emails:
+        ET.SubElement(store, "Range").text = f"{start}-{start + len(emails) - 1}"
+    ET.SubElement(store, "Total").text = str(found["total"])
+    return ET.tostring(root, encoding="unicode")
+
+
+async def _sync_collections_response(
+    request: Request,
+    current_user: User,
+    db: Session,
+    collections: List[dict],
+    headers: dict,
+) -> Response:
+    """
+    Answer several Sync collections in one round trip: each is built by the
+    single-collection handler (state, pending batch, replay) and their
+    <Collection> elements are merged into one response.
+    """
+    payloads = []
+    for collection in collections:
+        response = await _eas_command(request, current_user, db, sync_selection=collection)
+        if response.status_code == 200 and response.body.startswith(b"\x03\x01"):
+            payloads.append(response.body)
+    merged = merge_sync_responses(payloads)
+    _write_json_line(
+        "activesync/activesync.log",
+        {
+            "event": "sync_multi_collection",
+            "collections": [c["collection_id"] for c in collections],
+            "answered": len(payloads),
+        },
+    )
+    if merged is None:
+        return Response(status_code=200, headers=headers)
+    return _wbxml_response(merged, headers, cmd="sync")
+
+
 @router.post("/Microsoft-Server-ActiveSync")
 async def eas_dispatch(
     request: Request,
     current_user: User = Depends(get_current_user_from_basic_auth),
     db: Session = Depends(get_db),
 ):
-    """Dispatcher for Microsoft-Server-ActiveSync commands."""
+    """Dispatcher for Microsoft-Server-ActiveSync commands.
+
+    Each request is one unit of work: the device and collection state are
+    loaded once under FOR UPDATE, changed in memory, and committed here
+    once the response is built (one fsync per poll instead of one per
+    state change). An exception rolls the whole request back.
+
+    The handler runs on the DB pool. A hanging Sync with nothing to report
+    yet comes back as a ParkedSync and waits here, on the event loop, so a
+    parked device holds no pool thread; once something changes the handler
+    runs again to answer the changed collections.
+    """
+    # Buffer on the loop; later `await request.body()` calls return the cached bytes
+    await request.body()
+    response = await run_coroutine_in_db_thread(_eas_unit_of_work, request, current_user, db)
+    if isinstance(response, hanging_sync.ParkedSync):
+        changed, waited = await hanging_sync.hang(
+            db,
+            current_user.id,
+            response.device_id,
+            response.collections,
+            _COLLECTION_FOLDERS,
+            response.timeout,
+        )
+        _write_json_line(
+            "activesync/activesync.log",
+            {
+                "event": "sync_hanging",
+                "device_id": response.device_id,
+                "heartbeat": response.timeout,
+                "waited": waited,
+                "changed": changed,
+            },
+        )
+        if not changed:
+            # Heartbeat expired without changes: empty response (MS-ASCMD)
+            return Response(status_code=200, headers=response.headers)
+        response = await run_coroutine_in_db_thread(
+            _eas_unit_of_work, request, current_user, db, changed_collections=changed
+        )
+    return response
+
+
+async def _eas_unit_of_work(
+    request: Request,
+    current_user: User,
+    db: Session,
+    changed_collections: Optional[List[str]] = None,
+):
+    response = await _eas_command(request, current_user, db, changed_collections=changed_collections)
+    db.commit()
+    return response
+
+
+async def _eas_command(
+    request: Request,
+    current_user: User,
+    db: Session,
+    changed_collections: Optional[List[str]] = None,
+    sync_selection: Optional[dict] = None,
+):
+    """
+    Handle one EAS command. ``changed_collections`` resumes a parked
+    hanging Sync; ``sync_selection`` answers one collection of a
+    multi-collection Sync (see _sync_collections_response).
+    """
     # Log that we successfully reached the POST handler with authentication
     _write_json_line(
         "activesync/activesync.log",
@@ -1334,30 +1779,20 @@ async def eas_dispatch(
             else "1234567890"
         )
         device.is_provisioned = 1
-        try:
-            db.commit()
-        except Exception:
-            db.rollback()
-        else:
-            db.refresh(device)
-            try:
-                (
-                    db.query(ActiveSyncState)
-                    .filter(
-                        ActiveSyncState.user_id == current_user.id,
-                        ActiveSyncState.device_id == device_id,
-                    )
-                    .update(
-                        {
-                            ActiveSyncState.synckey_uuid: None,
-                            ActiveSyncState.synckey_counter: 0,
-                            ActiveSyncState.sync_key: "0",
-                        }
-                    )
-                )
-                db.commit()
-            except Exception:
-                db.rollback()
+        (
+            db.query(ActiveSyncState)
+            .filter(
+                ActiveSyncState.user_id == current_user.id,
+                ActiveSyncState.device_id == device_id,
+            )
+            .update(
+                {
+                    ActiveSyncState.synckey_uuid: None,
+                    ActiveSyncState.synckey_counter: 0,
+                    ActiveSyncState.sync_key: "0",
+                }
+            )
+        )
         _write_json_line(
             "activesync/activesync.log",
             {
@@ -1469,16 +1904,10 @@ async def eas_dispatch(
             hdrs_449 = dict(headers)
             effective_pk = device.policy_key
             if not effective_pk or effective_pk == "0":
-                import random
-
                 effective_pk = (
                     "".join(random.choices("0123456789", k=10)).lstrip("0") or "1"
                 )
-                try:
-                    device.policy_key = effective_pk
-                    db.commit()
-                except Exception:
-                    db.rollback()
+                device.policy_key = effective_pk
             hdrs_449["X-MS-PolicyKey"] = effective_pk
             hdrs_449["Retry-After"] = "1"
             hdrs_449["MS-ASProtocolError"] = "1"
@@ -1709,8 +2138,6 @@ async def eas_dispatch(
         # Ensure we echo a non-zero numeric PolicyKey to guide the client ACK
         pk = headers_449.get("X-MS-PolicyKey") or device.policy_key
         if not pk or pk == "0":
-            import random
-
             pk = "".join(random.choices("0123456789", k=10)).lstrip("0") or "1"
             try:
                 device.policy_key = pk
@@ -1859,13 +2286,6 @@ async def eas_dispatch(
             state.sync_key = new_sync_key
             state.synckey_uuid = None
             state.synckey_counter = 1
-            try:
-                db.commit()
-            except Exception:
-                db.rollback()
-                raise
-            else:
-                db.refresh(state)
             _write_json_line(
                 "activesync/activesync.log",
                 {
@@ -1988,7 +2408,6 @@ async def eas_dispatch(
             state.sync_key = "0"
             state.synckey_counter = 0
             state.synckey_uuid = None
-            db.commit()
 
             if is_wbxml_request:
                 wbxml_content = build_foldersync_no_changes(sync_key="0", status="9")
@@ -2032,15 +2451,84 @@ async def eas_dispatch(
 
     elif cmd == "sync":
         # Microsoft ActiveSync Sync implementation according to MS-ASCMD specification
+        # Empty/partial requests are expanded from the device's previous one,
+        # and Wait/HeartbeatInterval park the request until something changes
+        sync_request = {"collections": [], "expanded": False, "has_commands": False}
+        if not request_body_bytes or request_body_bytes.startswith(b"\x03\x01"):
+            sync_request = hanging_sync.resolve_request(
+                current_user.id, device_id, parse_wbxml_sync_collections(request_body_bytes)
+            )
+            if sync_request is None:
+                # Nothing cached to expand from (restart, other worker): Status 13
+                # makes the client resend the full request
+                return _wbxml_response(_sync_status_wbxml("13"), headers, cmd="sync")
+            if not request_body_bytes:
+                # Answer in WBXML like the request being repeated: an empty <Sync/>
+                request_body_bytes = b"\x03\x01\x6a\x00\x45\x01"
+        heartbeat, heartbeat_limit = hanging_sync.heartbeat_seconds(sync_request)
+        if heartbeat_limit is not None:
+            return _wbxml_response(
+                _sync_status_wbxml("14", heartbeat_limit), headers, cmd="sync"
+            )
+
+        # Collections answered when the handler does not take the one in the
+        # body: expanded and multi-collection requests, and the collections
+        # that changed for a hanging request. Several are built one by one
+        # and merged into one response.
+        selected_collection = sync_selection
+        selected_collections: List[dict] = []
+        if sync_selection is not None:
+            pass
+        elif heartbeat and sync_request["collections"] and not sync_request["has_commands"]:
+            changed = changed_collections
+            if changed is None:
+                changed = hanging_sync.changed_collections(
+                    db, current_user.id, device_id, sync_request["collections"], _COLLECTION_FOLDERS
+                )
+                if not changed:
+                    # Park on the event loop (eas_dispatch), not on this pool thread
+                    return hanging_sync.ParkedSync(device_id, sync_request["collections"], heartbeat, headers)
+            selected_collections = [
+                c for c in sync_request["collections"] if c["collection_id"] in changed
+            ]
+        elif sync_request["expanded"] or len(sync_request["collections"]) > 1:
+            selected_collections = sync_request["collections"]
+        if len(selected_collections) > 1:
+            return await _sync_collections_response(
+                request, current_user, db, selected_collections, headers
+            )
+        if selected_collections:
+            selected_collection = selected_collections[0]
+
         # Use state for the specific collection being synced
         collection_id = request.query_params.get("CollectionId", "1")
+        if selected_collection is not None:
+            collection_id = selected_collection["collection_id"]
         state = _get_or_init_state(db, current_user.id, device_id, collection_id)
 
         # Parse WBXML request body to extract actual SyncKey and CollectionId
         wbxml_params = parse_wbxml_sync_request(request_body_bytes)
+        if selected_collection is not None:
+            wbxml_params["collection_id"] = collection_id
+            wbxml_params["sync_key"] = (
+                # A cached collection's key is stale: the client holds the last one we sent
+                (state.pending_sync_key or state.sync_key or "0")
+                if selected_collection.get("cached")
+                else (selected_collection["sync_key"] or "0")
+            )
+            window = selected_collection["window_size"] or sync_request["window_size"]
+            if window:
+                wbxml_params["window_size"] = window
+            if selected_collection["body_preferences"]:
+                wbxml_params["body_preferences"] = selected_collection["body_preferences"]
         extra_ops = parse_wbxml_sync_fetch_and_delete(request_body_bytes)
         fetch_ids = extra_ops.get("fetch_ids", [])
         delete_ids = extra_ops.get("delete_ids", [])
+        if sync_selection is not None:
+            # The body may carry operations for the other collections too
+            prefix = f"{collection_id}:"
+            fetch_ids = [sid for sid in fetch_ids if sid.startswith(prefix)]
+            delete_ids = [sid for sid in delete_ids if sid.startswith(prefix)]
         _write_json_line(
             "activesync/activesync.log",
             {
@@ -2117,6 +2605,8 @@ async def eas_dispatch(
         if not is_ios:
             if effective_truncation is None or effective_truncation > 5120:
                 effective_truncation = 5120
+        # Request options a replayed batch must have been built with
+        replay_variant = (window_size, body_type_preference, effective_truncation)
 
         _write_json_line(
             "activesync/activesync.log",
@@ -2189,7 +2679,6 @@ async def eas_dispatch(
                 state.pending_sync_key = None
                 state.pending_max_email_id = None
                 state.pending_item_ids = None
-                db.commit()
 
         # CRITICAL FIX: Handle SyncKey=0 BEFORE any email queries!
         # When client sends SyncKey=0, it means "I have nothing, start fresh"
@@ -2218,8 +2707,8 @@ async def eas_dispatch(
             state.pending_sync_key = None
             state.pending_max_email_id = None
             state.pending_item_ids = None
-            db.commit()
-            
+            sync_replay_cache.stage_invalidate(db, current_user.id, device_id, collection_id)
+
             synced_ids_snapshot = set()
 
             if previous_server_key != "0":
@@ -2275,7 +2764,6 @@ async def eas_dispatch(
             state.pending_item_ids = None
             state.synced_email_ids = None
             state.last_synced_email_id = 0
-            db.commit()
 
             is_wbxml_request = len(
                 request_body_bytes
@@ -2313,6 +2801,28 @@ async def eas_dispatch(
                 content=xml_response, media_type="application/xml", headers=headers
             )
 
+        # Client changes (Delete, read-state Change) sent for this collection,
+        # applied as one batch; failed items go back in <Responses>
+        client_change_responses: List[dict] = []
+        client_commands = parse_wbxml_sync_commands(request_body_bytes).get(collection_id)
+        if client_commands and client_sync_key != "0":
+            change_results = client_changes.apply_sync_commands(
+                db, current_user.id, collection_id, client_commands, _COLLECTION_FOLDERS
+            )
+            client_change_responses = [
+                r for r in change_results if r["status"] != client_changes.STATUS_SUCCESS
+            ]
+            _write_json_line(
+                "activesync/activesync.log",
+                {
+                    "event": "sync_client_changes",
+                    "collection_id": collection_id,
+                    "deletes": len(client_commands["deletes"]),
+                    "changes": len(client_commands["changes"]),
+                    "failed": len(client_change_responses),
+                },
+            )
+
         # CRITICAL FIX #26: Two-phase commit - check for pending batch first!
         # Expert: "Only commit when the client echoes back the SyncKey you issued"
 
@@ -2343,7 +2853,6 @@ async def eas_dispatch(
                 state.pending_sync_key = None
                 state.pending_max_email_id = None
                 state.pending_item_ids = None
-                db.commit()
 
         # CRITICAL FIX: Handle client exactly 1 ahead of server (post-FolderSync recovery)
         # Example: Client sends sync_key=1, server has sync_key=0, no pending batch
@@ -2365,7 +2874,6 @@ async def eas_dispatch(
             )
             state.sync_key = "1"
             state.synckey_counter = 1
-            db.commit()
             # Fall through to send emails with response_sync_key=2
 
         # 1) Client confirms last batch? → Clear pending, advance to next batch
@@ -2437,7 +2945,7 @@ async def eas_dispatch(
             state.pending_sync_key = None
             state.pending_max_email_id = None
             state.pending_item_ids = None
-            db.commit()
+            sync_replay_cache.stage_invalidate(db, current_user.id, device_id, collection_id)
 
             _write_json_line(
                 "activesync/activesync.log",
@@ -2488,6 +2996,25 @@ async def eas_dispatch(
                         "message": "Client retry - resending pending batch IDEMPOTENTLY with SAME key",
                     },
                 )
+                replayed = sync_replay_cache.get(
+                    (current_user.id, device_id, collection_id, state.pending_sync_key),
+                    (state.pending_item_ids, replay_variant),
+                )
+                if replayed is not None:
+                    # Byte-identical to the response the client did not receive
+                    return _wbxml_response(
+                        replayed,
+                        headers,
+                        cmd="sync",
+                        log_meta={
+                            "device_id": device_id,
+                            "collection_id": collection_id,
+                            "response_sync_key": state.pending_sync_key,
+                            "resend_pending": True,
+                            "replayed": True,
+                            "wbxml_length": len(replayed),
+                        },
+                    )
 
                 # Fetch the specific emails from pending
                 if state.pending_item_ids:
@@ -2543,8 +3070,13 @@ async def eas_dispatch(
                         class_name="Email",
                         body_type_preference=body_type_preference,
                         truncation_size=effective_truncation,
+                        responses=client_change_responses,
                     )
 
+                    _stage_sync_replay(
+                        db, current_user.id, device_id, collection_id, state,
+                        state.pending_sync_key, replay_variant, wbxml_batch.payload,
+                    )
                     _write_json_line(
                         "activesync/activesync.log",
                         {
@@ -2719,7 +3251,6 @@ async def eas_dispatch(
                 )
                 # Z-Push approach: Reset to 0 to force full resync
                 state.last_synced_email_id = 0
-                db.commit()
                 # Re-query emails after reset
                 emails = [e for e in all_emails if e.id > 0]
                 _write_json_line(
@@ -2889,6 +3420,7 @@ async def eas_dispatch(
                         class_name="Email",
                         body_type_preference=body_type_preference,
                         truncation_size=effective_truncation,
+                        responses=client_change_responses,
                     )
                 wbxml = wbxml_batch.payload
 
@@ -2936,8 +3468,12 @@ async def eas_dispatch(
                     state.pending_max_email_id = None
                     state.pending_item_ids = None
 
-                # Commit the staged state (pending or autocommitted)
-                db.commit()
+                # The staged state (pending or autocommitted) is committed
+                # with the rest of the request by eas_dispatch
+                _stage_sync_replay(
+                    db, current_user.id, device_id, collection_id, state,
+                    response_sync_key, replay_variant, wbxml,
+                )
 
                 _write_json_line(
                     "activesync/activesync.log",
@@ -3025,7 +3561,6 @@ async def eas_dispatch(
             state.sync_key = "0"
             state.synckey_counter = 0
             state.synckey_uuid = None
-            db.commit()
             # Send Status=3 (Invalid sync key) to tell client to restart
             is_wbxml_request = len(
                 request_body_bytes
@@ -3181,7 +3716,8 @@ async def eas_dispatch(
                 if is_outlook:
                     # Align with grommunio/z-push: honour WindowSize without artificial 50KB cap
                     emails_to_send = emails[:window_size] if window_size else emails
-                    has_more = len(emails) > len(emails_to_send)
+                    # ``emails`` is already trimmed to WindowSize; keep the earlier verdict
+                    has_more = has_more or len(emails) > len(emails_to_send)
 
                     # Retain loop detection safeguard for pathological clients
                     is_loop, suggested_window = _detect_sync_loop(
@@ -3224,7 +3760,7 @@ async def eas_dispatch(
                 else:
                     # iOS/Android: Send full WindowSize (they can handle larger batches)
                     emails_to_send = emails[:window_size] if window_size else emails
-                    has_more = len(emails) > window_size if window_size else False
+                    has_more = has_more or len(emails) > len(emails_to_send)
 
                 _write_json_line(
                     "activesync/activesync.log",
@@ -3287,6 +3823,7 @@ async def eas_dispatch(
                         class_name="Email",
                         body_type_preference=body_type_preference,
                         truncation_size=effective_truncation,
+                        responses=client_change_responses,
                     )
                     wbxml = wbxml_batch.payload
                     _write_json_line(
@@ -3319,6 +3856,7 @@ async def eas_dispatch(
                         class_name="Email",
                         body_type_preference=body_type_preference,
                         truncation_size=effective_truncation,
+                        responses=client_change_responses,
                     )
                     wbxml = wbxml_batch.payload
                 # If there were FETCH requests, append <Responses><Fetch> with bodies
@@ -3363,9 +3901,13 @@ async def eas_dispatch(
                             },
                         )
 
-                # Commit: NEW SyncKey + PENDING batch (NOT last_synced_email_id yet!)
+                # Staged for the request's commit: NEW SyncKey + PENDING batch
+                # (NOT last_synced_email_id yet!)
                 # state.sync_key and state.synckey_counter were set above
-                db.commit()
+                _stage_sync_replay(
+                    db, current_user.id, device_id, collection_id, state,
+                    response_sync_key, replay_variant, wbxml,
+                )
 
                 email_id_list = [getattr(email, "id", None) for email in emails_to_send]
                 mime_types_sent: List[Optional[str]] = []
@@ -3483,10 +4025,13 @@ async def eas_dispatch(
                         class_name="Email",
                         body_type_preference=body_type_preference,
                         truncation_size=effective_truncation,
+                        responses=client_change_responses,
                     )
                     wbxml = wbxml_batch.payload
-                    if not has_more:
-                        db.commit()
+                    _stage_sync_replay(
+                        db, current_user.id, device_id, collection_id, state,
+                        response_sync_key, replay_variant, wbxml,
+                    )
                     _write_json_line(
                         "activesync/activesync.log",
                         {
@@ -3530,6 +4075,7 @@ async def eas_dispatch(
                         class_name="Email",
                         body_type_preference=body_type_preference,
                         truncation_size=effective_truncation,
+                        responses=client_change_responses,
                     )
                     wbxml = wbxml_batch.payload
                     _write_json_line(
@@ -3596,7 +4142,6 @@ async def eas_dispatch(
                     synced_ids = _load_synced_ids(state)
                     synced_ids.update(e.id for e in emails)
                     _store_synced_ids(state, synced_ids)
-            db.commit()
 
             is_wbxml_request = len(
                 request_body_bytes
@@ -3613,6 +4158,7 @@ async def eas_dispatch(
                         class_name="Email",
                         body_type_preference=body_type_preference,
                         truncation_size=effective_truncation,
+                        responses=client_change_responses,
                     )
                 except Exception as e:
                     # Log the error
@@ -3630,6 +4176,10 @@ async def eas_dispatch(
                     )
                 else:
                     wbxml = wbxml_batch.payload
+                    _stage_sync_replay(
+                        db, current_user.id, device_id, collection_id, state,
+                        new_sync_key, replay_variant, wbxml,
+                    )
                     # Log the successful WBXML creation
                     _write_json_line(
                         "activesync/activesync.log",
@@ -3898,21 +4448,11 @@ async def eas_dispatch(
     elif cmd == "getitemestimate":
         # MS-ASCMD GetItemEstimate implementation
         collection_id = request.query_params.get("CollectionId", "1")
-        folder_type = "inbox" if collection_id == "1" else "inbox"
+        folder_type = _COLLECTION_FOLDERS.get(collection_id, "inbox")
 
-        email_service = EmailService(db)
-        # Respect WindowSize for GetItemEstimate-like flows; default to 5 if absent
-        estimate_limit = max(
-            (
-                int(wbxml_params.get("window_size", 5))
-                if "wbxml_params" in locals()
-                else 5
-            ),
-            1,
-        )
-        emails = email_service.get_user_emails(
-            current_user.id, folder_type, limit=estimate_limit
-        )
+        # O(1) from the materialized folder counter instead of counting rows
+        with replica_reads(db, current_user.id):
+            estimate = get_folder_count(db, current_user.id, folder_type)["total"]
 
         xml = f"""<?xml version="1.0" encoding="utf-8"?>
 <GetItemEstimate xmlns="GetItemEstimate">
@@ -3920,7 +4460,7 @@ async def eas_dispatch(
     <Response>
         <Collection>
             <CollectionId>{collection_id}</CollectionId>
-            <Estimate>{len(emails)}</Estimate>
+            <Estimate>{estimate}</Estimate>
         </Collection>
     </Response>
 </GetItemEstimate>"""
@@ -3930,10 +4470,11 @@ async def eas_dispatch(
             {
                 "event": "getitemestimate",
                 "collection_id": collection_id,
-                "estimate": len(emails),
+                "estimate": estimate,
                 "user_id": current_user.id,
             },
         )
+        return Response(content=xml, media_type="application/xml", headers=headers)
     if cmd == "options":
         options_xml = """<?xml version="1.0" encoding="utf-8"?>
 <Options xmlns="Options">
@@ -4150,13 +4691,25 @@ async def eas_dispatch(
         )
         return Response(content=xml, media_type="application/xml", headers=headers)
     if cmd == "search":
-        # MS-ASCMD Search implementation for GAL (Global Address List)
+        # MS-ASCMD Search: the GAL, or the user's mailbox via the full-text index
         query = request.query_params.get("Query", "").strip()
-        # Simple fallback: try to parse tiny XML bodies that include <Query>text</Query>
+        txt = ""
         try:
             body = await request.body()
-            if not query and body:
-                txt = body.decode("utf-8", errors="ignore")
+            txt = body.decode("utf-8", errors="ignore") if body else ""
+        except Exception:
+            pass
+        if (_search_element(txt, "Name") or "").lower() == "mailbox":
+            with replica_reads(db, current_user.id):
+                xml = _mailbox_search_xml(db, current_user.id, txt)
+            _write_json_line(
+                "activesync/activesync.log",
+                {"event": "search_mailbox", "bytes": len(xml)},
+            )
+            return Response(content=xml, media_type="application/xml", headers=headers)
+        # Simple fallback: try to parse tiny XML bodies that include <Query>text</Query>
+        try:
+            if not query and txt:
                 if "<Query>" in txt:
                     qstart = txt.find("<Query>") + 7
                     qend = txt.find("</Query>")
@@ -4164,18 +4717,7 @@ async def eas_dispatch(
                         query = txt[qstart:qend].strip()
         except Exception:
             pass
-        q = f"%{query.lower()}%" if query else "%"
-        users = (
-            db.query(User)
-            .filter(
-                (User.email.ilike(q))
-                | (User.username.ilike(q))
-                | (User.full_name.ilike(q))
-            )
-            .order_by(User.full_name.asc())
-            .limit(50)
-            .all()
-        )
+        entries = GalService(db).search(query or None, limit=50)
         # Build MS-ASCMD compliant Search response for GAL
         root = ET.Element("Search")
         root.set("xmlns", "Search")
@@ -4183,22 +4725,19 @@ async def eas_dispatch(
         resp = ET.SubElement(root, "Response")
         store = ET.SubElement(resp, "Store")
         ET.SubElement(store, "Name").text = "GAL"
-        for u in users:
+        for entry in entries:
             result = ET.SubElement(store, "Result")
             props = ET.SubElement(result, "Properties")
-            ET.SubElement(props, "DisplayName").text = u.full_name or u.username
-            ET.SubElement(props, "EmailAddress").text = u.email
-            ET.SubElement(props, "FirstName").text = (u.full_name or u.username).split(
-                " "
-            )[0]
-            last = (u.full_name or u.username).split(" ")[-1]
-            ET.SubElement(props, "LastName").text = (
-                last if last else (u.full_name or u.username)
-            )
+            ET.SubElement(props, "DisplayName").text = entry.display_name
+            ET.SubElement(props, "EmailAddress").text = entry.email
+            ET.SubElement(props, "FirstName").text = entry.given_name or entry.display_name
+            ET.SubElement(props, "LastName").text = entry.surname or entry.display_name
+            if entry.company:
+                ET.SubElement(props, "Company").text = entry.company
         xml = ET.tostring(root, encoding="unicode")
         _write_json_line(
             "activesync/activesync.log",
-            {"event": "search", "query": query, "results": len(users)},
+            {"event": "search", "query": query, "results": len(entries)},
         )
         return Response(content=xml, media_type="application/xml", headers=headers)
 
@@ -4208,6 +4747,17 @@ async def eas_dispatch(
         request_body_bytes = await request.body()
 
         try:
+            # Attachment fetches (FileReference) are streamed from disk
+            file_fetches = _parse_itemops_file_fetches(request_body_bytes)
+            if file_fetches:
+                return _itemops_attachment_response(
+                    db,
+                    current_user.id,
+                    file_fetches,
+                    headers,
+                    multipart=request.headers.get("MS-ASAcceptMultiPart", "").upper() == "T",
+                )
+
             # Parse WBXML to extract fetch requests
             fetches = _parse_itemops_fetches(request_body_bytes)
 
@@ -4324,9 +4874,23 @@ async def eas_dispatch(
     # MS-ASCMD MoveItems command implementation
     if cmd == "moveitems":
         # MS-ASCMD MoveItems for moving emails between folders
-        _write_json_line("activesync/activesync.log", {"event": "moveitems"})
-        xml = f'<MoveItems xmlns="MoveItems"><Status>1</Status></MoveItems>'
-        return Response(content=xml, media_type="application/xml", headers=headers)
+        if not request_body_bytes.startswith(b"\x03\x01"):
+            _write_json_line("activesync/activesync.log", {"event": "moveitems"})
+            xml = f'<MoveItems xmlns="MoveItems"><Status>1</Status></MoveItems>'
+            return Response(content=xml, media_type="application/xml", headers=headers)
+        # All moves of the request in one batch, one Response per move
+        moves = parse_wbxml_moveitems_request(request_body_bytes)
+        results = client_changes.move_items(db, current_user.id, moves, _COLLECTION_FOLDERS)
+        _write_json_line(
+            "activesync/activesync.log",
+            {
+                "event": "moveitems",
+                "device_id": device_id,
+                "requested": len(moves),
+                "moved": sum(r["status"] == client_changes.MOVE_SUCCESS for r in results),
+            },
+        )
+        return _wbxml_response(build_moveitems_response(results), headers, cmd="moveitems")
 
     # MS-ASCMD MeetingResponse command implementation
     if cmd == "meetingresponse":
@@ -4350,16 +4914,7 @@ async def eas_dispatch(
             xml = f'<GetAttachment xmlns="GetAttachment"><Status>2</Status></GetAttachment>'
             return Response(content=xml, media_type="application/xml", headers=headers)
         try:
-            from ..database import EmailAttachment
-
-            att = (
-                db.query(EmailAttachment)
-                .filter(
-                    (EmailAttachment.uuid == file_ref)
-                    | (EmailAttachment.id == file_ref)
-                )
-                .first()
-            )
+            att = load_attachments(db, current_user.id, [file_ref]).get(file_ref)
             if not att or not att.file_path or not os.path.exists(att.file_path):
                 xml = f'<GetAttachment xmlns="GetAttachment"><Status>6</Status></GetAttachment>'
                 return Response(
@@ -4368,12 +4923,14 @@ async def eas_dispatch(
                     headers=headers,
                     status_code=404,
                 )
-            # Stream file
-            content_type = att.content_type or "application/octet-stream"
-            with open(att.file_path, "rb") as f:
-                data = f.read()
-            # Return as raw attachment body; EAS often uses direct HTTP response
-            return Response(content=data, media_type=content_type, headers=headers)
+            # Raw attachment body streamed from disk; honours HTTP Range so
+            # interrupted downloads resume instead of restarting
+            return ranged_file_response(
+                att.file_path,
+                att.content_type or "application/octet-stream",
+                request.headers.get("Range"),
+                headers,
+            )
         except Exception as e:
             _write_json_line(
                 "activesync/activesync.log",
@@ -1,12 +1,17 @@
 import html
+import json
 import logging
+import os
+import re
 import uuid
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
 
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import RedirectResponse, Response
 
 from ..config import settings
-from ..database import SessionLocal, User
+from ..db_executor import db_session_scope, run_in_db_thread
 from ..diagnostic_logger import (
     log_autodiscover,
     log_autodiscover_request,
@@ -14,169 +19,92 @@ from ..diagnostic_logger import (
     log_outlook_health,
     outlook_diagnostics,
 )
+from ..services.autodiscover_cache import (
+    MailboxProfile,
+    autodiscover_cache,
+    load_profile,
+    normalize_email,
+)
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+# Outlook health/phase records and full response dumps cost several log
+# writes per request; they are only written when this is enabled
+AUTODISCOVER_VERBOSE_LOG = os.getenv("AUTODISCOVER_VERBOSE_LOG", "0").lower() in ("1", "true", "yes")
 
-@router.get("/Autodiscover/Autodiscover.xml")
-@router.post("/Autodiscover/Autodiscover.xml")
-async def autodiscover(request: Request):
-    """ActiveSync-compatible autodiscover response (Outlook/Exchange style)."""
-    logger = logging.getLogger(__name__)
-    host = settings.HOSTNAME or request.headers.get("Host", "")
+OUTLOOK_SCHEMA = "http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006"
+OUTLOOK_SCHEMA_2006A = OUTLOOK_SCHEMA + "a"
+MOBILESYNC_SCHEMA = "http://schemas.microsoft.com/exchange/autodiscover/mobilesync/responseschema/2006"
+FAKE_ORG = "/o=SkyShift Dev/ou=Exchange Administrative Group (FYDIBOHF23SPDLT)"
+DEFAULT_DISPLAY_NAME = "365 Email User"
+DEFAULT_DEPLOYMENT_ID = "eeeeeeee-eeee-eeee-eeee-eeeeeeeeeeee"
 
-    # Enhanced diagnostic logging
-    request_id = str(uuid.uuid4())
-    user_agent = request.headers.get("User-Agent", "")
+_EMAIL_RE = re.compile(r"<EMailAddress>([^<]+)</EMailAddress>", re.I)
+_SCHEMA_RE = re.compile(r"<AcceptableResponseSchema>([^<]+)</AcceptableResponseSchema>", re.I)
 
-    # Try to extract email/UPN from request body if present
-    body = await request.body()
-    try:
-        logger.info(
-            "Autodiscover POST from %s UA=%s",
-            request.client.host if request.client else "?",
-            user_agent,
-        )
-        logger.debug(
-            "Autodiscover body: %s", body.decode("utf-8", errors="ignore")[:2000]
-        )
-
-        # Log this as an Outlook phase with health monitoring
-        client_ip = request.client.host if request.client else "unknown"
+# Per-mailbox fields of the POX response. Templates are rendered once per
+# (host, schema) with NUL-delimited markers in their place (html.escape
+# leaves them alone), split, and filled per mailbox.
+_POX_FIELDS = ("display", "email", "local_part", "mailbox_identity", "deployment")
+_MARK = "\x00"
 
-        # Enhanced health monitoring
-        log_outlook_health(
-            "autodiscover_request",
-            client_ip,
-            user_agent,
-            {
-                "host": host,
-                "content_length": len(body),
-                "is_outlook": "outlook" in user_agent.lower(),
-                "request_id": request_id,
-            },
-        )
 
-        outlook_diagnostics.log_outlook_phase(
-            "autodiscover_xml_request",
-            {
-                "request_id": request_id,
-                "host": host,
-                "user_agent": user_agent,
-                "client_ip": client_ip,
-                "content_length": len(body),
-            },
-        )
-        log_autodiscover(
-            "request",
-            {
-                "ip": (request.client.host if request.client else None),
-                "ua": request.headers.get("User-Agent"),
-                "host": request.headers.get("Host"),
-                "content_type": request.headers.get("Content-Type"),
-                "content_length": request.headers.get("Content-Length"),
-                "preview": body.decode("utf-8", errors="ignore")[:1000],
-            },
-        )
-    except Exception:
-        pass
-    response_schema = (
-        "http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006"
-    )
+def _parse_request(text: str) -> Tuple[Optional[str], str]:
+    """(requested address, response schema) from a POX request body."""
     requested_email = None
-    is_mobilesync_request = False
-    try:
-        text = body.decode("utf-8", errors="ignore")
-        # Very simple extraction: <EMailAddress>user@domain</EMailAddress>
-        import re
-
-        m = re.search(r"<EMailAddress>([^<]+)</EMailAddress>", text, re.I)
-        if m:
-            requested_email = m.group(1).strip()
-
-        # Preferred response schema if supplied
-        schema_match = re.search(
-            r"<AcceptableResponseSchema>([^<]+)</AcceptableResponseSchema>", text, re.I
-        )
-        if schema_match:
-            schema_value = schema_match.group(1).strip()
-            if "mobilesync" in schema_value.lower():
-                # ActiveSync/MobileSync request
-                response_schema = "http://schemas.microsoft.com/exchange/autodiscover/mobilesync/responseschema/2006"
-                is_mobilesync_request = True
-                logger.info("Received MobileSync/ActiveSync schema request")
-            elif schema_value.endswith("/2006a"):
-                response_schema = "http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a"
-        if "2006a" in text and not schema_match:
-            response_schema = "http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a"
-            logger.info("Received 2006a schema request from Outlook")
-    except Exception:
-        pass
-
-    display_name = "365 Email User"
-    user_uuid = None
-    if requested_email:
-        try:
-            db = SessionLocal()
-            user = db.query(User).filter(User.email == requested_email).first()
-            if user:
-                display_name = user.full_name or user.username or requested_email
-                user_uuid = getattr(user, "uuid", None)
-        except Exception:
-            pass
-        finally:
-            try:
-                db.close()
-            except Exception:
-                pass
-
-    # Build protocol URLs
+    response_schema = OUTLOOK_SCHEMA
+    m = _EMAIL_RE.search(text)
+    if m:
+        requested_email = m.group(1).strip()
+    schema_match = _SCHEMA_RE.search(text)
+    if schema_match:
+        schema_value = schema_match.group(1).strip()
+        if "mobilesync" in schema_value.lower():
+            response_schema = MOBILESYNC_SCHEMA
+        elif schema_value.endswith("/2006a"):
+            response_schema = OUTLOOK_SCHEMA_2006A
+    elif "2006a" in text:
+        response_schema = OUTLOOK_SCHEMA_2006A
+    return requested_email, response_schema
+
+
+def _pox_xml(
+    host: str,
+    response_ns: str,
+    display: str,
+    email: str,
+    local_part: str,
+    mailbox_identity: str,
+    deployment: str,
+) -> str:
+    """Autodiscover POX response; values are escaped here."""
     owa_url = f"https://{host}/owa/"
     ews_url = f"https://{host}/EWS/Exchange.asmx"
     activesync_url = f"https://{host}/Microsoft-Server-ActiveSync"
     mapi_emsmdb_base = f"https://{host}/mapi/emsmdb/"
     mapi_nspi_base = f"https://{host}/mapi/nspi/"
     oab_url = f"https://{host}/oab/default.oab"
+    mapi_url_full = f"{mapi_emsmdb_base}?MailboxId={mailbox_identity}"
 
-    effective_email = requested_email or f"user@{host}"
-    local_part = effective_email.split("@")[0]
-    domain = effective_email.split("@", 1)[1] if "@" in effective_email else host
-    mailbox_id = user_uuid or local_part
-    mailbox_smtp_identity = f"{mailbox_id}@{domain}" if domain else mailbox_id
-    fake_org = "/o=SkyShift Dev/ou=Exchange Administrative Group (FYDIBOHF23SPDLT)"
-    server_dn_raw = f"{fake_org}/cn=Configuration/cn=Servers/cn={host}"
-    mailbox_dn_raw = f"{fake_org}/cn=Recipients/cn={local_part}"
-
-    legacy_dn_raw = mailbox_dn_raw
-    deployment_id = user_uuid or "eeeeeeee-eeee-eeee-eeee-eeeeeeeeeeee"
-    escaped_display = html.escape(display_name)
-    escaped_email = html.escape(effective_email)
+    escaped_display = html.escape(display)
+    escaped_email = html.escape(email)
     escaped_host = html.escape(host)
     escaped_owa = html.escape(owa_url)
     escaped_ews = html.escape(ews_url)
     escaped_as = html.escape(activesync_url)
-    mapi_url_full = f"{mapi_emsmdb_base}?MailboxId={mailbox_smtp_identity}"
     escaped_mapi_emsmdb_base = html.escape(mapi_emsmdb_base)
     escaped_mapi_nspi_base = html.escape(mapi_nspi_base)
     escaped_oab = html.escape(oab_url)
     escaped_smtp_port = html.escape(str(settings.SMTP_PORT))
-    server_dn = html.escape(server_dn_raw)
-    mailbox_dn = html.escape(mailbox_dn_raw)
-    legacy_dn = html.escape(legacy_dn_raw)
-    deployment = html.escape(deployment_id)
-    escaped_mailbox_identity = html.escape(mailbox_smtp_identity)
-
-    response_ns = response_schema
-    if not requested_email:
-        requested_email = (
-            request.query_params.get("email")
-            or request.query_params.get("EmailAddress")
-            or request.query_params.get("Email")
-        )
-
-    # Generate ActiveSync/MobileSync format if requested
-    if is_mobilesync_request:
-        xml = f"""<?xml version="1.0" encoding="utf-8" standalone="yes"?>
+    server_dn = html.escape(f"{FAKE_ORG}/cn=Configuration/cn=Servers/cn={host}")
+    mailbox_dn = html.escape(f"{FAKE_ORG}/cn=Recipients/cn={local_part}")
+    legacy_dn = mailbox_dn
+    deployment = html.escape(deployment)
+    escaped_mailbox_identity = html.escape(mailbox_identity)
+
+    if response_ns == MOBILESYNC_SCHEMA:
+        return f"""<?xml version="1.0" encoding="utf-8" standalone="yes"?>
 <Autodiscover xmlns="http://schemas.microsoft.com/exchange/autodiscover/responseschema/2006">
   <Response xmlns="{response_ns}">
     <Culture>en:us</Culture>
@@ -196,9 +124,9 @@ async def autodiscover(request: Request):
   </Response>
 </Autodiscover>
 """
-    else:
-        # Generate Outlook/EXCH format (default)
-        xml = f"""<?xml version="1.0" encoding="utf-8" standalone="yes"?>
+
+    # Outlook/EXCH format (default)
+    return f"""<?xml version="1.0" encoding="utf-8" standalone="yes"?>
 <Autodiscover xmlns="http://schemas.microsoft.com/exchange/autodiscover/responseschema/2006" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
   <Response xmlns="{response_ns}">
     <ErrorCode>NoError</ErrorCode>
@@ -324,34 +252,144 @@ async def autodiscover(request: Request):
   </Response>
 </Autodiscover>
 """.strip()
+
+
+@lru_cache(maxsize=64)
+def _pox_template(host: str, response_ns: str) -> Tuple[str, ...]:
+    """Per-host/schema response split around the per-mailbox fields (odd indexes)."""
+    markers = [f"{_MARK}{name}{_MARK}" for name in _POX_FIELDS]
+    return tuple(_pox_xml(host, response_ns, *markers).split(_MARK))
+
+
+def _fill(template: Tuple[str, ...], values: Dict[str, str]) -> str:
+    parts = list(template)
+    for i in range(1, len(parts), 2):
+        parts[i] = html.escape(values[parts[i]])
+    return "".join(parts)
+
+
+def _mailbox_fields(host: str, requested_email: Optional[str], profile: Optional[MailboxProfile]) -> Dict[str, str]:
+    if profile is not None:
+        effective_email = profile.email
+    elif requested_email:
+        effective_email = normalize_email(requested_email)
+    else:
+        effective_email = f"user@{host}"
+    local_part = effective_email.split("@")[0]
+    domain = effective_email.split("@", 1)[1] if "@" in effective_email else host
+    user_uuid = profile.user_uuid if profile else None
+    mailbox_id = user_uuid or local_part
+    return {
+        "display": profile.display_name if profile else DEFAULT_DISPLAY_NAME,
+        "email": effective_email,
+        "local_part": local_part,
+        "mailbox_identity": f"{mailbox_id}@{domain}" if domain else mailbox_id,
+        "deployment": user_uuid or DEFAULT_DEPLOYMENT_ID,
+    }
+
+
+def _lookup_profile(address: str) -> Optional[MailboxProfile]:
+    with db_session_scope() as db:
+        return load_profile(db, address)
+
+
+async def _mailbox_profile(address: Optional[str]) -> Optional[MailboxProfile]:
+    """Cached mailbox profile; the database is only asked on a cache miss."""
+    if not address:
+        return None
+    found, profile = autodiscover_cache.cached_profile(address)
+    if found:
+        return profile
     try:
-        logger.debug("Autodiscover response XML: %s", xml)
-        log_autodiscover("response", {"xml_preview": xml[:1000]})
+        profile = await run_in_db_thread(_lookup_profile, address)
+    except Exception as exc:
+        logger.warning("Autodiscover user lookup failed for %s: %s", address, exc)
+        return None  # not cached: retried on the next request
+    autodiscover_cache.store_profile(address, profile)
+    return profile
+
+
+def _log_verbose_request(request: Request, host: str, body: bytes, request_id: str) -> None:
+    user_agent = request.headers.get("User-Agent", "")
+    client_ip = request.client.host if request.client else "unknown"
+    logger.debug("Autodiscover body: %s", body.decode("utf-8", errors="ignore")[:2000])
+    log_outlook_health(
+        "autodiscover_request",
+        client_ip,
+        user_agent,
+        {
+            "host": host,
+            "content_length": len(body),
+            "is_outlook": "outlook" in user_agent.lower(),
+            "request_id": request_id,
+        },
+    )
+    outlook_diagnostics.log_outlook_phase(
+        "autodiscover_xml_request",
+        {
+            "request_id": request_id,
+            "host": host,
+            "user_agent": user_agent,
+            "client_ip": client_ip,
+            "content_length": len(body),
+        },
+    )
+
+
+@router.get("/Autodiscover/Autodiscover.xml")
+@router.post("/Autodiscover/Autodiscover.xml")
+async def autodiscover(request: Request):
+    """ActiveSync-compatible autodiscover response (Outlook/Exchange style).
 
-        # ENHANCED DEBUG LOGGING: Log full autodiscover response
+    Responses come from autodiscover_cache; a miss renders the precomputed
+    per-host template and looks the mailbox up at most once per TTL.
+    """
+    host = settings.HOSTNAME or request.headers.get("Host", "")
+    request_id = str(uuid.uuid4())
+    body = await request.body()
+    text = body.decode("utf-8", errors="ignore")
+    requested_email, response_ns = _parse_request(text)
+
+    try:
+        if AUTODISCOVER_VERBOSE_LOG:
+            _log_verbose_request(request, host, body, request_id)
         log_autodiscover(
-            "response_full",
+            "request",
             {
-                "request_id": request_id,
+                "ip": (request.client.host if request.client else None),
+                "ua": request.headers.get("User-Agent"),
+                "host": request.headers.get("Host"),
+                "content_type": request.headers.get("Content-Type"),
+                "content_length": request.headers.get("Content-Length"),
                 "email": requested_email,
-                "user_agent": user_agent,
-                "mapi_url": mapi_url_full,
-                "auth_package": "Basic",  # Changed from Negotiate
-                "full_xml_length": len(xml),
-                "mapi_http_enabled": True,
-                "protocols_offered": [
-                    "EXCH",
-                    "EXHTTP",
-                    "EXPR",
-                    "mapiHttp",
-                    "WEB",
-                    "MobileSync",
-                    "SMTP",
-                ],
+                "schema": response_ns,
             },
         )
     except Exception:
         pass
+
+    key = (normalize_email(requested_email), response_ns, host, "pox")
+    xml = autodiscover_cache.get_response(key)
+    if xml is None:
+        profile = await _mailbox_profile(requested_email)
+        xml = _fill(_pox_template(host, response_ns), _mailbox_fields(host, requested_email, profile))
+        autodiscover_cache.store_response(key, xml)
+
+    if AUTODISCOVER_VERBOSE_LOG:
+        try:
+            log_autodiscover("response", {"xml_preview": xml[:1000]})
+            log_autodiscover(
+                "response_full",
+                {
+                    "request_id": request_id,
+                    "email": requested_email,
+                    "user_agent": request.headers.get("User-Agent", ""),
+                    "full_xml_length": len(xml),
+                    "mapi_http_enabled": True,
+                },
+            )
+        except Exception:
+            pass
     return Response(content=xml, media_type="application/xml")
 
 
@@ -369,14 +407,108 @@ async def autodiscover_get_lower(request: Request):
     return await autodiscover(request)
 
 
+def _json_settings(host: str, email_address: str, display_name: str) -> dict:
+    activesync_url = f"https://{host}/Microsoft-Server-ActiveSync"
+    ews_url = f"https://{host}/EWS/Exchange.asmx"
+    mapi_url = f"https://{host}/mapi/emsmdb"
+
+    # Generate ServerDN and MdbDN for MAPI
+    local_part = email_address.split("@")[0]
+    server_dn_raw = f"{FAKE_ORG}/cn=Configuration/cn=Servers/cn={host}"
+    mailbox_dn_raw = f"{FAKE_ORG}/cn=Recipients/cn={local_part}"
+
+    return {
+        "User": {"DisplayName": display_name, "EmailAddress": email_address},
+        "Account": {
+            "AccountType": "email",
+            "Action": "settings",
+            "UserName": email_address,
+        },
+        "Protocol": [
+            {
+                "Type": "EXCH",
+                "Server": host,
+                "Port": 443,
+                "SSL": "On",
+                "SPA": "Off",
+                "AuthRequired": "On",
+                "DomainRequired": "Off",
+                "AuthPackage": "Basic",
+                "ASUrl": activesync_url,
+                "EwsUrl": ews_url,
+                "OOFUrl": ews_url,
+                "OABUrl": f"https://{host}/oab/default.oab",
+                "LoginName": email_address,
+                "MapiHttpEnabled": True,
+                "MapiHttpServerUrl": mapi_url,
+                "MapiHttpVersion": "2",
+                "ServerExclusiveConnect": True,
+                "PublicFolderServer": host,
+                "ActiveDirectoryServer": host,
+                "ServerDN": server_dn_raw,
+                "MdbDN": mailbox_dn_raw,
+                "CertPrincipalName": f"msstd:{host}",
+            },
+            {
+                "Type": "EXPR",
+                "Server": host,
+                "Port": 443,
+                "SSL": "On",
+                "SPA": "Off",
+                "AuthRequired": "On",
+                "DomainRequired": "Off",
+                "AuthPackage": "Basic",
+                "ASUrl": activesync_url,
+                "EwsUrl": ews_url,
+                "OOFUrl": ews_url,
+                "OABUrl": f"https://{host}/oab/default.oab",
+                "LoginName": email_address,
+                "ServerExclusiveConnect": True,
+                "External": {
+                    "Server": host,
+                    "Url": mapi_url,
+                    "ASUrl": activesync_url,
+                    "EwsUrl": ews_url,
+                    "OOFUrl": ews_url,
+                    "CertPrincipalName": f"msstd:{host}",
+                },
+                "CertPrincipalName": f"msstd:{host}",
+            },
+            {
+                "Type": "MobileSync",
+                "Server": host,
+                "Url": activesync_url,
+                "SSL": "On",
+                "AuthPackage": "Basic",
+                "LoginName": email_address,
+            },
+            {
+                "Type": "WEB",
+                "OWAUrl": f"https://{host}/owa/",
+                "OOFUrl": f"https://{host}/owa/?path=/options/automaticreply",
+            },
+            {
+                "Type": "SMTP",
+                "Server": host,
+                "Port": settings.SMTP_PORT,
+                "SSL": "On",
+                "Encryption": "TLS",
+                "SPA": "Off",
+                "AuthPackage": "Basic",
+                "LoginName": email_address,
+            },
+        ],
+    }
+
+
 # JSON Autodiscover endpoint for modern Outlook clients
 @router.get("/autodiscover/autodiscover.json/v1.0/{email_address}")
 async def autodiscover_json(email_address: str, request: Request):
     """JSON-based Autodiscover for modern Outlook clients"""
     try:
         host = settings.HOSTNAME or request.headers.get("Host", "")
+        protocol = request.query_params.get("Protocol", "")
 
-        # Log the JSON autodiscover request
         log_autodiscover(
             "json_request",
             {
@@ -388,127 +520,17 @@ async def autodiscover_json(email_address: str, request: Request):
             },
         )
 
-        # Get user info
-        display_name = "365 Email User"
-        try:
-            db = SessionLocal()
-            user = db.query(User).filter(User.email == email_address).first()
-            if user:
-                display_name = user.full_name or user.username or email_address
-        except Exception:
-            pass
-        finally:
-            try:
-                db.close()
-            except:
-                pass
-
-        activesync_url = f"https://{host}/Microsoft-Server-ActiveSync"
-        ews_url = f"https://{host}/EWS/Exchange.asmx"
-        mapi_url = f"https://{host}/mapi/emsmdb"
-
-        # Generate ServerDN and MdbDN for MAPI
-        local_part = email_address.split("@")[0]
-        fake_org = "/o=SkyShift Dev/ou=Exchange Administrative Group (FYDIBOHF23SPDLT)"
-        server_dn_raw = f"{fake_org}/cn=Configuration/cn=Servers/cn={host}"
-        mailbox_dn_raw = f"{fake_org}/cn=Recipients/cn={local_part}"
-
-        log_autodiscover(
-            "json_response",
-            {
-                "email": email_address,
-                "reason": "Providing JSON autodiscover response for Outlook compatibility",
-                "ua": request.headers.get("User-Agent", ""),
-            },
-        )
-
-        json_response = {
-            "User": {"DisplayName": display_name, "EmailAddress": email_address},
-            "Account": {
-                "AccountType": "email",
-                "Action": "settings",
-                "UserName": email_address,
-            },
-            "Protocol": [
-                {
-                    "Type": "EXCH",
-                    "Server": host,
-                    "Port": 443,
-                    "SSL": "On",
-                    "SPA": "Off",
-                    "AuthRequired": "On",
-                    "DomainRequired": "Off",
-                    "AuthPackage": "Basic",
-                    "ASUrl": activesync_url,
-                    "EwsUrl": ews_url,
-                    "OOFUrl": ews_url,
-                    "OABUrl": f"https://{host}/oab/default.oab",
-                    "LoginName": email_address,
-                    "MapiHttpEnabled": True,
-                    "MapiHttpServerUrl": mapi_url,
-                    "MapiHttpVersion": "2",
-                    "ServerExclusiveConnect": True,
-                    "PublicFolderServer": host,
-                    "ActiveDirectoryServer": host,
-                    "ServerDN": server_dn_raw,
-                    "MdbDN": mailbox_dn_raw,
-                    "CertPrincipalName": f"msstd:{host}",
-                },
-                {
-                    "Type": "EXPR",
-                    "Server": host,
-                    "Port": 443,
-                    "SSL": "On",
-                    "SPA": "Off",
-                    "AuthRequired": "On",
-                    "DomainRequired": "Off",
-                    "AuthPackage": "Basic",
-                    "ASUrl": activesync_url,
-                    "EwsUrl": ews_url,
-                    "OOFUrl": ews_url,
-                    "OABUrl": f"https://{host}/oab/default.oab",
-                    "LoginName": email_address,
-                    "ServerExclusiveConnect": True,
-                    "External": {
-                        "Server": host,
-                        "Url": mapi_url,
-                        "ASUrl": activesync_url,
-                        "EwsUrl": ews_url,
-                        "OOFUrl": ews_url,
-                        "CertPrincipalName": f"msstd:{host}",
-                    },
-                    "CertPrincipalName": f"msstd:{host}",
-                },
-                {
-                    "Type": "MobileSync",
-                    "Server": host,
-                    "Url": activesync_url,
-                    "SSL": "On",
-                    "AuthPackage": "Basic",
-                    "LoginName": email_address,
-                },
-                {
-                    "Type": "WEB",
-                    "OWAUrl": f"https://{host}/owa/",
-                    "OOFUrl": f"https://{host}/owa/?path=/options/automaticreply",
-                },
-                {
-                    "Type": "SMTP",
-                    "Server": host,
-                    "Port": settings.SMTP_PORT,
-                    "SSL": "On",
-                    "Encryption": "TLS",
-                    "SPA": "Off",
-                    "AuthPackage": "Basic",
-                    "LoginName": email_address,
-                },
-            ],
-        }
-
-        return json_response
+        key = (normalize_email(email_address), "json", host, protocol)
+        payload = autodiscover_cache.get_response(key)
+        if payload is None:
+            profile = await _mailbox_profile(email_address)
+            display_name = profile.display_name if profile else DEFAULT_DISPLAY_NAME
+            address = profile.email if profile else normalize_email(email_address)
+            payload = json.dumps(_json_settings(host, address, display_name))
+            autodiscover_cache.store_response(key, payload)
+        return Response(content=payload, media_type="application/json")
 
     except Exception as e:
-        logger = logging.getLogger(__name__)
         logger.error(f"Error in JSON autodiscover: {e}")
         # Return error response
         return {"error": "AutodiscoverFailed", "message": "Unable to retrieve settings"}
@@ -1,18 +1,40 @@
+import re
+import xml.etree.ElementTree as ET
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+from xml.sax.saxutils import escape
 
 from fastapi import APIRouter, Request, Response, status
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 
 from ..auth import authenticate_user
-from ..database import CalendarEvent, Contact, get_db
+from ..conditional import conditional_response
+from ..database import CalendarEvent, Contact, User
+from ..db_engine import prefer_replica
+from ..db_executor import offload_to_db_pool, db_session_scope
 from ..diagnostic_logger import log_ews
+from ..services.dav_sync import (
+    changes_since,
+    current_revision,
+    load_resources,
+    make_ctag,
+    make_sync_token,
+    parse_sync_token,
+    resource_etag,
+)
+from ..services.recurrence import series_for
 
 router = APIRouter(prefix="", tags=["caldav-carddav"])  # mounted directly
 
+DAV_NS = "DAV:"
+CALDAV_NS = "urn:ietf:params:xml:ns:caldav"
+CARDDAV_NS = "urn:ietf:params:xml:ns:carddav"
+CS_NS = "http://calendarserver.org/ns/"
 
-async def _basic_auth(request: Request, db: Session) -> str | None:
-    """Return authenticated user's email, or None if not authenticated."""
+
+def _basic_auth_user(request: Request, db: Session) -> User | None:
+    """Return the authenticated user, or None if not authenticated."""
     try:
         auth = request.headers.get("Authorization", "")
         if not auth.startswith("Basic "):
@@ -21,12 +43,17 @@ async def _basic_auth(request: Request, db: Session) -> str | None:
 
         decoded = base64.b64decode(auth.split(" ", 1)[1]).decode("utf-8")
         username, password = decoded.split(":", 1)
-        user = authenticate_user(db, username, password)
-        return user.email if user else None
+        return authenticate_user(db, username, password) or None
     except Exception:
         return None
 
 
+async def _basic_auth(request: Request, db: Session) -> str | None:
+    """Return authenticated user's email, or None if not authenticated."""
+    user = _basic_auth_user(request, db)
+    return user.email if user else None
+
+
 def _iso(dt: datetime | None) -> str:
     return dt.strftime("%Y%m%dT%H%M%SZ") if dt else ""
 
@@ -43,11 +70,37 @@ def _event_to_ical(ev: CalendarEvent) -> str:
         f"DTSTART:{_iso(ev.start_time)}\r\n"
         f"DTEND:{_iso(ev.end_time)}\r\n"
         f"SUMMARY:{subject_clean}\r\n"
-        "END:VEVENT\r\n"
+        f"{_recurrence_lines(ev, subject_clean)}"
         "END:VCALENDAR\r\n"
     )
 
 
+def _recurrence_lines(ev: CalendarEvent, subject: str) -> str:
+    """RRULE/EXDATE for a master (closing its VEVENT) plus one override per moved occurrence."""
+    series = series_for(ev)
+    if series is None:
+        return "END:VEVENT\r\n"
+    lines = f"RRULE:{series.to_rrule()}\r\n"
+    cancelled = sorted(series.exdates | {k for k, v in series.exceptions.items() if v is None})
+    if cancelled:
+        lines += f"EXDATE:{','.join(_iso(dt) for dt in cancelled)}\r\n"
+    lines += "END:VEVENT\r\n"
+    for original, occ in sorted(series.exceptions.items()):
+        if occ is None:
+            continue
+        lines += (
+            "BEGIN:VEVENT\r\n"
+            f"UID:CAL_{ev.id}@local\r\n"
+            f"RECURRENCE-ID:{_iso(original)}\r\n"
+            f"DTSTAMP:{_iso(ev.created_at)}\r\n"
+            f"DTSTART:{_iso(occ.start)}\r\n"
+            f"DTEND:{_iso(occ.end)}\r\n"
+            f"SUMMARY:{subject}\r\n"
+            "END:VEVENT\r\n"
+        )
+    return lines
+
+
 def _contact_to_vcard(c: Contact) -> str:
     fn = c.display_name or ""
     email = c.email_address_1 or ""
@@ -61,13 +114,309 @@ def _contact_to_vcard(c: Contact) -> str:
     )
 
 
+# --- Collection helpers -------------------------------------------------------
+
+# collection -> (resource prefix, suffix, data element, data namespace, renderer, media type)
+_COLLECTIONS = {
+    "calendar": ("CAL_", ".ics", "calendar-data", CALDAV_NS, _event_to_ical, "text/calendar"),
+    "addressbook": ("CONTACT_", ".vcf", "address-data", CARDDAV_NS, _contact_to_vcard, "text/vcard"),
+}
+_MULTIGET = {f"{{{CALDAV_NS}}}calendar-multiget", f"{{{CARDDAV_NS}}}addressbook-multiget"}
+
+
+def _challenge(realm: str) -> Response:
+    return Response(status_code=401, headers={"WWW-Authenticate": f'Basic realm="{realm}"'})
+
+
+def _realm(collection: str) -> str:
+    return "CalDAV" if collection == "calendar" else "CardDAV"
+
+
+def _resource_id(collection: str, value: str) -> Optional[int]:
+    prefix, suffix = _COLLECTIONS[collection][:2]
+    match = re.search(rf"{prefix}(\d+)(?:@[^/]*)?(?:{re.escape(suffix)})?$", value or "")
+    return int(match.group(1)) if match else None
+
+
+def _multistatus(collection: str, responses: List[str], sync_token: Optional[str] = None) -> Response:
+    data_ns = _COLLECTIONS[collection][3]
+    prefix = "cal" if collection == "calendar" else "card"
+    body = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        f'<d:multistatus xmlns:d="DAV:" xmlns:{prefix}="{data_ns}">'
+        + "".join(responses)
+        + (f"<d:sync-token>{escape(sync_token)}</d:sync-token>" if sync_token else "")
+        + "</d:multistatus>"
+    )
+    return Response(content=body, media_type="application/xml", status_code=207)
+
+
+def _item_response(collection: str, base_href: str, resource, with_data: bool) -> str:
+    prefix, suffix, data_tag, _ns, render, _media = _COLLECTIONS[collection]
+    ns_prefix = "cal" if collection == "calendar" else "card"
+    data = f"<{ns_prefix}:{data_tag}>{escape(render(resource))}</{ns_prefix}:{data_tag}>" if with_data else ""
+    return (
+        f"<d:response><d:href>{base_href}{prefix}{resource.id}{suffix}</d:href>"
+        f"<d:propstat><d:prop>"
+        f"<d:getetag>{escape(resource_etag(resource))}</d:getetag>"
+        f"{data}"
+        f"</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+    )
+
+
+def _missing_response(href: str) -> str:
+    return f"<d:response><d:href>{escape(href)}</d:href><d:status>HTTP/1.1 404 Not Found</d:status></d:response>"
+
+
+def _parse_time_range(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.strip(), "%Y%m%dT%H%M%SZ")
+    except ValueError:
+        return None
+
+
+def _time_range(root: ET.Element) -> tuple[Optional[datetime], Optional[datetime]]:
+    time_range = root.find(f".//{{{CALDAV_NS}}}time-range")
+    if time_range is None:
+        return None, None
+    return _parse_time_range(time_range.get("start")), _parse_time_range(time_range.get("end"))
+
+
+def _time_range_criteria(start: Optional[datetime], end: Optional[datetime]) -> list:
+    """calendar-query time-range pushed down to the indexed start/end columns."""
+    criteria = []
+    single = []
+    if end is not None:
+        single.append(CalendarEvent.start_time < end)
+    if start is not None:
+        single.append(CalendarEvent.end_time > start)
+    if not single:
+        return []
+    # Recurring masters can start before the range and still have occurrences in it
+    recurring = [CalendarEvent.is_recurring.is_(True)]
+    if end is not None:
+        recurring.append(CalendarEvent.start_time < end)
+    if start is not None:
+        recurring.append(
+            or_(CalendarEvent.recurrence_end.is_(None), CalendarEvent.recurrence_end >= start)
+        )
+    criteria.append(or_(and_(*single), and_(*recurring)))
+    return criteria
+
+
+def _drop_series_outside(
+    db: Session, owner_id: int, resources: list, start: Optional[datetime], end: Optional[datetime]
+) -> list:
+    """Remove recurring masters that matched the SQL prefilter but have no occurrence in range."""
+    if start is None and end is None:
+        return resources
+    masters = (
+        db.query(
+            CalendarEvent.id,
+            CalendarEvent.start_time,
+            CalendarEvent.end_time,
+            CalendarEvent.is_recurring,
+            CalendarEvent.recurrence_pattern,
+            CalendarEvent.recurrence_end,
+            CalendarEvent.recurrence_count,
+            CalendarEvent.meeting_status,
+            CalendarEvent.updated_at,
+        )
+        .filter(
+            CalendarEvent.owner_id == owner_id,
+            CalendarEvent.is_recurring.is_(True),
+            CalendarEvent.id.in_([r.id for r in resources]),
+        )
+        .all()
+        if resources
+        else []
+    )
+    outside = set()
+    for master in masters:
+        series = series_for(master)
+        if series is not None and not series.has_occurrence(start or series.dtstart, end):
+            outside.add(master.id)
+    return [r for r in resources if r.id not in outside]
+
+
+def _owner_matches(user: User, user_email: Optional[str]) -> bool:
+    return user_email is None or user_email.lower() == (user.email or "").lower()
+
+
+def _dav_report(request: Request, body: bytes, collection: str, base_href: str, user_email: Optional[str]) -> Response:
+    with db_session_scope() as db:
+        user = _basic_auth_user(request, db)
+        if user is None:
+            return _challenge(_realm(collection))
+        if not _owner_matches(user, user_email):
+            return Response(status_code=status.HTTP_403_FORBIDDEN)
+        prefer_replica(db, user.id)
+
+        try:
+            root = ET.fromstring(body) if body.strip() else None
+        except ET.ParseError:
+            return Response(status_code=status.HTTP_400_BAD_REQUEST)
+        data_tag = _COLLECTIONS[collection][2]
+        data_ns = _COLLECTIONS[collection][3]
+        with_data = root is None or root.find(f".//{{{DAV_NS}}}prop/{{{data_ns}}}{data_tag}") is not None
+        tag = root.tag if root is not None else None
+
+        if tag == f"{{{DAV_NS}}}sync-collection":
+            token_el = root.find(f"{{{DAV_NS}}}sync-token")
+            revision = parse_sync_token(token_el.text if token_el is not None else None)
+            if revision is None:
+                return Response(
+                    content='<?xml version="1.0" encoding="utf-8"?>'
+                    '<d:error xmlns:d="DAV:"><d:valid-sync-token/></d:error>',
+                    media_type="application/xml",
+                    status_code=status.HTTP_403_FORBIDDEN,
+                )
+            if revision == 0:
+                # Read the revision first: anything changed meanwhile is re-sent next poll
+                newest = current_revision(db, user.id, collection)
+                resources = load_resources(db, collection, user.id, with_data=with_data)
+                deleted: set = set()
+            else:
+                changed, deleted, newest = changes_since(db, user.id, collection, revision)
+                resources = load_resources(db, collection, user.id, ids=changed, with_data=with_data)
+                deleted |= changed - {r.id for r in resources}  # moved away or gone since
+            prefix, suffix = _COLLECTIONS[collection][:2]
+            responses = [_item_response(collection, base_href, r, with_data) for r in resources]
+            responses += [_missing_response(f"{base_href}{prefix}{rid}{suffix}") for rid in sorted(deleted)]
+            return _multistatus(collection, responses, sync_token=make_sync_token(newest))
+
+        if tag in _MULTIGET:
+            hrefs = [el.text or "" for el in root.findall(f"{{{DAV_NS}}}href")]
+            wanted = {href: _resource_id(collection, href) for href in hrefs}
+            resources = load_resources(
+                db, collection, user.id, ids={rid for rid in wanted.values() if rid is not None}, with_data=with_data
+            )
+            found = {r.id for r in resources}
+            responses = [_item_response(collection, base_href, r, with_data) for r in resources]
+            responses += [_missing_response(href) for href, rid in wanted.items() if rid not in found]
+            return _multistatus(collection, responses)
+
+        if tag == f"{{{CALDAV_NS}}}calendar-query":
+            start, end = _time_range(root)
+            criteria = _time_range_criteria(start, end)
+            resources = load_resources(db, collection, user.id, with_data=with_data, criteria=criteria)
+            resources = _drop_series_outside(db, user.id, resources, start, end)
+        else:
+            resources = load_resources(db, collection, user.id, with_data=with_data)
+        return _multistatus(collection, [_item_response(collection, base_href, r, with_data) for r in resources])
+
+
+def _collection_propfind(request: Request, collection: str, href: str, user_email: Optional[str]) -> Response:
+    with db_session_scope() as db:
+        user = _basic_auth_user(request, db)
+        if user is None:
+            return _challenge(_realm(collection))
+        if not _owner_matches(user, user_email):
+            return Response(status_code=status.HTTP_403_FORBIDDEN)
+        prefer_replica(db, user.id)
+        revision = current_revision(db, user.id, collection)
+    if collection == "calendar":
+        kind = "<cal:calendar/>"
+        name = "Calendar"
+        reports = ("cal:calendar-query", "cal:calendar-multiget", "d:sync-collection")
+        ns = f'xmlns:cal="{CALDAV_NS}"'
+    else:
+        kind = "<card:addressbook/>"
+        name = "Address Book"
+        reports = ("card:addressbook-query", "card:addressbook-multiget", "d:sync-collection")
+        ns = f'xmlns:card="{CARDDAV_NS}"'
+    supported = "".join(
+        f"<d:supported-report><d:report><{report}/></d:report></d:supported-report>" for report in reports
+    )
+    xml = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        f'<d:multistatus xmlns:d="DAV:" xmlns:cs="{CS_NS}" {ns}>'
+        f"<d:response><d:href>{escape(href)}</d:href><d:propstat><d:prop>"
+        f"<d:resourcetype><d:collection/>{kind}</d:resourcetype>"
+        f"<d:displayname>{name}</d:displayname>"
+        f"<d:current-user-principal><d:href>/principals/users/{escape(user.email)}/</d:href></d:current-user-principal>"
+        f"<cs:getctag>{make_ctag(revision)}</cs:getctag>"
+        f"<d:sync-token>{make_sync_token(revision)}</d:sync-token>"
+        f"<d:supported-report-set>{supported}</d:supported-report-set>"
+        "</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+        "</d:multistatus>"
+    )
+    return Response(content=xml, media_type="application/xml", status_code=207)
+
+
+def _collection_get(request: Request, collection: str) -> Response:
+    with db_session_scope() as db:
+        user = _basic_auth_user(request, db)
+        if user is None:
+            return _challenge(_realm(collection))
+        prefer_replica(db, user.id)
+        render, media_type = _COLLECTIONS[collection][4], _COLLECTIONS[collection][5]
+        # The collection body changes exactly when its sync revision does
+        revision = current_revision(db, user.id, collection)
+        return conditional_response(
+            request,
+            f"dav.{collection}",
+            (user.id, revision),
+            lambda: "".join(render(r) for r in load_resources(db, collection, user.id)),
+            media_type=media_type,
+        )
+
+
+def _item_get(request: Request, collection: str, uid: str, user_email: Optional[str]) -> Response:
+    resource_id = _resource_id(collection, uid)
+    if resource_id is None:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    with db_session_scope() as db:
+        user = _basic_auth_user(request, db)
+        if user is None:
+            return _challenge(_realm(collection))
+        if not _owner_matches(user, user_email):
+            return Response(status_code=status.HTTP_403_FORBIDDEN)
+        # Validate on the id/updated_at columns; the full row is only read for a 200
+        stamps = load_resources(db, collection, user.id, ids=[resource_id], with_data=False)
+        if not stamps:
+            return Response(status_code=status.HTTP_404_NOT_FOUND)
+        stamp = stamps[0]
+        render, media_type = _COLLECTIONS[collection][4], _COLLECTIONS[collection][5]
+
+        def build():
+            resources = load_resources(db, collection, user.id, ids=[resource_id])
+            if not resources:
+                return Response(status_code=status.HTTP_404_NOT_FOUND)
+            return render(resources[0])
+
+        return conditional_response(
+            request,
+            f"dav.{collection}.item",
+            None,
+            build,
+            etag=resource_etag(stamp),
+            last_modified=stamp.updated_at or stamp.created_at,
+            media_type=media_type,
+        )
+
+
+def _log_dav(event: str, path: str, request: Request) -> None:
+    try:
+        log_ews(
+            event,
+            {
+                "path": path,
+                "ua": request.headers.get("User-Agent"),
+                "auth": bool(request.headers.get("Authorization")),
+            },
+        )
+    except Exception:
+        pass
+
+
 # CardDAV collection (address book)
 @router.get("/carddav/addressbook/", name="carddav-collection")
+@offload_to_db_pool
 async def carddav_collection(request: Request):
-    db: Session = next(get_db())
-    contacts: List[Contact] = db.query(Contact).limit(50).all()
-    body = "".join(_contact_to_vcard(c) for c in contacts)
-    return Response(content=body, media_type="text/vcard")
+    return _collection_get(request, "addressbook")
 
 
 # CardDAV WebDAV discovery for Thunderbird
@@ -83,88 +432,18 @@ async def carddav_options():
 
 
 @router.api_route("/carddav/addressbook/", methods=["PROPFIND"])
+@offload_to_db_pool
 async def carddav_propfind(request: Request):
-    # Minimal multistatus describing the addressbook collection
-    # Challenge for Basic if missing
-    try:
-        log_ews(
-            "dav_propfind",
-            {
-                "path": "/carddav/addressbook/",
-                "ua": request.headers.get("User-Agent"),
-                "auth": bool(request.headers.get("Authorization")),
-            },
-        )
-    except Exception:
-        pass
-    auth = request.headers.get("Authorization", "")
-    if not auth.startswith("Basic "):
-        return Response(
-            status_code=401, headers={"WWW-Authenticate": 'Basic realm="CardDAV"'}
-        )
-    xml = (
-        """
-<?xml version="1.0" encoding="utf-8"?>
-<d:multistatus xmlns:d="DAV:" xmlns:cs="http://calendarserver.org/ns/" xmlns:card="urn:ietf:params:xml:ns:carddav">
-  <d:response>
-    <d:href>/carddav/addressbook/</d:href>
-    <d:propstat>
-      <d:prop>
-        <d:resourcetype>
-          <d:collection/>
-          <card:addressbook/>
-        </d:resourcetype>
-        <d:displayname>Address Book</d:displayname>
-        <d:current-user-principal><d:href>/principals/users/default/</d:href></d:current-user-principal>
-        <d:supported-report-set>
-          <d:supported-report><d:report><card:addressbook-query/></d:report></d:supported-report>
-          <d:supported-report><d:report><card:addressbook-multiget/></d:report></d:supported-report>
-        </d:supported-report-set>
-      </d:prop>
-      <d:status>HTTP/1.1 200 OK</d:status>
-    </d:propstat>
-  </d:response>
- </d:multistatus>
-"""
-    ).strip()
-    return Response(content=xml, media_type="application/xml", status_code=207)
+    _log_dav("dav_propfind", "/carddav/addressbook/", request)
+    return _collection_propfind(request, "addressbook", "/carddav/addressbook/", None)
 
 
 @router.api_route("/carddav/addressbook/", methods=["REPORT"])
+@offload_to_db_pool
 async def carddav_report(request: Request):
-    try:
-        log_ews(
-            "dav_report",
-            {
-                "path": "/carddav/addressbook/",
-                "ua": request.headers.get("User-Agent"),
-            },
-        )
-    except Exception:
-        pass
-    db: Session = next(get_db())
-    # Return all contacts inline as address-data in a multistatus
-    contacts = db.query(Contact).limit(50).all()
-    responses = []
-    for c in contacts:
-        uid = f"CONTACT_{c.id}.vcf"
-        vcard = _contact_to_vcard(c)
-        # Simple, weak ETag based on id
-        etag = f'"{c.id}"'
-        responses.append(
-            f"<d:response><d:href>/carddav/addressbook/{uid}</d:href>"
-            f"<d:propstat><d:prop>"
-            f"<d:getetag>{etag}</d:getetag>"
-            f'<card:address-data xmlns:card="urn:ietf:params:xml:ns:carddav">{vcard}</card:address-data>'
-            f"</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
-        )
-    body = (
-        '<?xml version="1.0" encoding="utf-8"?>'
-        '<d:multistatus xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">'
-        + "".join(responses)
-        + "</d:multistatus>"
-    )
-    return Response(content=body, media_type="application/xml", status_code=207)
+    _log_dav("dav_report", "/carddav/addressbook/", request)
+    body = await request.body()
+    return _dav_report(request, body, "addressbook", "/carddav/addressbook/", None)
 
 
 # Well-known discovery endpoints so clients can find the collections
@@ -188,40 +467,25 @@ async def well_known_caldav():
 
 # CardDAV single resource
 @router.get("/carddav/addressbook/{uid}.vcf")
-async def carddav_item(uid: str, request: Request):
-    db: Session = next(get_db())
-    if uid.startswith("CONTACT_"):
-        cid = uid.split("_", 1)[1].split("@", 1)[0]
-        contact = db.get(Contact, int(cid))
-        if contact:
-            return Response(content=_contact_to_vcard(contact), media_type="text/vcard")
-    return Response(status_code=status.HTTP_404_NOT_FOUND)
+@router.get("/carddav/{user_email}/addressbook/{uid}.vcf")
+@offload_to_db_pool
+async def carddav_item(uid: str, request: Request, user_email: Optional[str] = None):
+    return _item_get(request, "addressbook", uid, user_email)
 
 
 # CalDAV calendar collection
 @router.get("/caldav/calendar/")
+@offload_to_db_pool
 async def caldav_collection(request: Request):
-    db: Session = next(get_db())
-    events: List[CalendarEvent] = (
-        db.query(CalendarEvent)
-        .order_by(CalendarEvent.start_time.desc())
-        .limit(50)
-        .all()
-    )
-    body = "".join(_event_to_ical(e) for e in events)
-    return Response(content=body, media_type="text/calendar")
+    return _collection_get(request, "calendar")
 
 
 # CalDAV single resource
 @router.get("/caldav/calendar/{uid}.ics")
-async def caldav_item(uid: str, request: Request):
-    db: Session = next(get_db())
-    if uid.startswith("CAL_"):
-        eid = uid.split("_", 1)[1].split("@", 1)[0]
-        ev = db.get(CalendarEvent, int(eid))
-        if ev:
-            return Response(content=_event_to_ical(ev), media_type="text/calendar")
-    return Response(status_code=status.HTTP_404_NOT_FOUND)
+@router.get("/caldav/{user_email}/calendar/{uid}.ics")
+@offload_to_db_pool
+async def caldav_item(uid: str, request: Request, user_email: Optional[str] = None):
+    return _item_get(request, "calendar", uid, user_email)
 
 
 # CalDAV WebDAV discovery
@@ -237,29 +501,20 @@ async def caldav_options():
 
 
 @router.api_route("/caldav/", methods=["PROPFIND"])
+@offload_to_db_pool
 async def caldav_home_propfind(request: Request):
-    db: Session = next(get_db())
-    # Advertise the calendar-home-set and current-user-principal
-    try:
-        log_ews(
-            "dav_propfind",
-            {
-                "path": "/caldav/",
-                "ua": request.headers.get("User-Agent"),
-                "auth": bool(request.headers.get("Authorization")),
-            },
+    with db_session_scope() as db:
+        # Advertise the calendar-home-set and current-user-principal
+        _log_dav("dav_propfind", "/caldav/", request)
+        user_email = await _basic_auth(request, db)
+        home = "/caldav/calendar/" if not user_email else f"/caldav/{user_email}/calendar/"
+        principal = (
+            "/principals/users/default/"
+            if not user_email
+            else f"/principals/users/{user_email}/"
         )
-    except Exception:
-        pass
-    user_email = await _basic_auth(request, db)
-    home = "/caldav/calendar/" if not user_email else f"/caldav/{user_email}/calendar/"
-    principal = (
-        "/principals/users/default/"
-        if not user_email
-        else f"/principals/users/{user_email}/"
-    )
-    xml = (
-        """
+        xml = (
+            """
 <?xml version="1.0" encoding="utf-8"?>
 <d:multistatus xmlns:d="DAV:" xmlns:cal="urn:ietf:params:xml:ns:caldav">
   <d:response>
@@ -284,33 +539,24 @@ async def caldav_home_propfind(request: Request):
 
 
 @router.api_route("/carddav/", methods=["PROPFIND"])
+@offload_to_db_pool
 async def carddav_home_propfind(request: Request):
-    db: Session = next(get_db())
-    # Advertise the addressbook-home-set and current-user-principal
-    try:
-        log_ews(
-            "dav_propfind",
-            {
-                "path": "/carddav/",
-                "ua": request.headers.get("User-Agent"),
-                "auth": bool(request.headers.get("Authorization")),
-            },
+    with db_session_scope() as db:
+        # Advertise the addressbook-home-set and current-user-principal
+        _log_dav("dav_propfind", "/carddav/", request)
+        user_email = await _basic_auth(request, db)
+        home = (
+            "/carddav/addressbook/"
+            if not user_email
+            else f"/carddav/{user_email}/addressbook/"
         )
-    except Exception:
-        pass
-    user_email = await _basic_auth(request, db)
-    home = (
-        "/carddav/addressbook/"
-        if not user_email
-        else f"/carddav/{user_email}/addressbook/"
-    )
-    principal = (
-        "/principals/users/default/"
-        if not user_email
-        else f"/principals/users/{user_email}/"
-    )
-    xml = (
-        """
+        principal = (
+            "/principals/users/default/"
+            if not user_email
+            else f"/principals/users/{user_email}/"
+        )
+        xml = (
+            """
 <?xml version="1.0" encoding="utf-8"?>
 <d:multistatus xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">
   <d:response>
@@ -373,129 +619,48 @@ async def dav_principal(user_email: str):
 
 
 @router.api_route("/carddav/{user_email}/addressbook/", methods=["PROPFIND"])
-async def carddav_user_addressbook_propfind(user_email: str):
-    xml = (
-        f"""
-<?xml version="1.0" encoding="utf-8"?>
-<d:multistatus xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">
-  <d:response>
-    <d:href>/carddav/{user_email}/addressbook/</d:href>
-    <d:propstat>
-      <d:prop>
-        <d:resourcetype><d:collection/><card:addressbook/></d:resourcetype>
-        <d:displayname>Address Book</d:displayname>
-      </d:prop>
-      <d:status>HTTP/1.1 200 OK</d:status>
-    </d:propstat>
-  </d:response>
-</d:multistatus>
-"""
-    ).strip()
-    return Response(content=xml, media_type="application/xml", status_code=207)
+@offload_to_db_pool
+async def carddav_user_addressbook_propfind(user_email: str, request: Request):
+    href = f"/carddav/{user_email}/addressbook/"
+    return _collection_propfind(request, "addressbook", href, user_email)
+
+
+@router.api_route("/carddav/{user_email}/addressbook/", methods=["REPORT"])
+@offload_to_db_pool
+async def carddav_user_addressbook_report(user_email: str, request: Request):
+    href = f"/carddav/{user_email}/addressbook/"
+    _log_dav("dav_report", href, request)
+    body = await request.body()
+    return _dav_report(request, body, "addressbook", href, user_email)
 
 
 @router.api_route("/caldav/{user_email}/calendar/", methods=["PROPFIND"])
-async def caldav_user_calendar_propfind(user_email: str):
-    xml = (
-        f"""
-<?xml version="1.0" encoding="utf-8"?>
-<d:multistatus xmlns:d="DAV:" xmlns:cal="urn:ietf:params:xml:ns:caldav">
-  <d:response>
-    <d:href>/caldav/{user_email}/calendar/</d:href>
-    <d:propstat>
-      <d:prop>
-        <d:resourcetype><d:collection/><cal:calendar/></d:resourcetype>
-        <d:displayname>Calendar</d:displayname>
-      </d:prop>
-      <d:status>HTTP/1.1 200 OK</d:status>
-    </d:propstat>
-  </d:response>
-</d:multistatus>
-"""
-    ).strip()
-    return Response(content=xml, media_type="application/xml", status_code=207)
+@offload_to_db_pool
+async def caldav_user_calendar_propfind(user_email: str, request: Request):
+    href = f"/caldav/{user_email}/calendar/"
+    return _collection_propfind(request, "calendar", href, user_email)
+
+
+@router.api_route("/caldav/{user_email}/calendar/", methods=["REPORT"])
+@offload_to_db_pool
+async def caldav_user_calendar_report(user_email: str, request: Request):
+    href = f"/caldav/{user_email}/calendar/"
+    _log_dav("dav_report", href, request)
+    body = await request.body()
+    return _dav_report(request, body, "calendar", href, user_email)
 
 
 @router.api_route("/caldav/calendar/", methods=["PROPFIND"])
+@offload_to_db_pool
 async def caldav_propfind(request: Request):
     # Describe the calendar collection
-    try:
-        log_ews(
-            "dav_propfind",
-            {
-                "path": "/caldav/calendar/",
-                "ua": request.headers.get("User-Agent"),
-                "auth": bool(request.headers.get("Authorization")),
-            },
-        )
-    except Exception:
-        pass
-    auth = request.headers.get("Authorization", "")
-    if not auth.startswith("Basic "):
-        return Response(
-            status_code=401, headers={"WWW-Authenticate": 'Basic realm="CalDAV"'}
-        )
-    xml = (
-        """
-<?xml version="1.0" encoding="utf-8"?>
-<d:multistatus xmlns:d="DAV:" xmlns:cal="urn:ietf:params:xml:ns:caldav">
-  <d:response>
-    <d:href>/caldav/calendar/</d:href>
-    <d:propstat>
-      <d:prop>
-        <d:resourcetype><d:collection/><cal:calendar/></d:resourcetype>
-        <d:displayname>Calendar</d:displayname>
-        <d:current-user-principal><d:href>/principals/users/default/</d:href></d:current-user-principal>
-        <d:supported-report-set>
-          <d:supported-report><d:report><cal:calendar-query/></d:report></d:supported-report>
-          <d:supported-report><d:report><cal:calendar-multiget/></d:report></d:supported-report>
-        </d:supported-report-set>
-      </d:prop>
-      <d:status>HTTP/1.1 200 OK</d:status>
-    </d:propstat>
-  </d:response>
-</d:multistatus>
-"""
-    ).strip()
-    return Response(content=xml, media_type="application/xml", status_code=207)
+    _log_dav("dav_propfind", "/caldav/calendar/", request)
+    return _collection_propfind(request, "calendar", "/caldav/calendar/", None)
 
 
 @router.api_route("/caldav/calendar/", methods=["REPORT"])
+@offload_to_db_pool
 async def caldav_report(request: Request):
-    try:
-        log_ews(
-            "dav_report",
-            {
-                "path": "/caldav/calendar/",
-                "ua": request.headers.get("User-Agent"),
-            },
-        )
-    except Exception:
-        pass
-    db: Session = next(get_db())
-    # Return all events as calendar-data in a multistatus
-    events: List[CalendarEvent] = (
-        db.query(CalendarEvent)
-        .order_by(CalendarEvent.start_time.desc())
-        .limit(50)
-        .all()
-    )
-    responses = []
-    for e in events:
-        uid = f"CAL_{e.id}.ics"
-        ical = _event_to_ical(e)
-        etag = f'"{e.id}"'
-        responses.append(
-            f"<d:response><d:href>/caldav/calendar/{uid}</d:href>"
-            f"<d:propstat><d:prop>"
-            f"<d:getetag>{etag}</d:getetag>"
-            f'<cal:calendar-data xmlns:cal="urn:ietf:params:xml:ns:caldav">{ical}</cal:calendar-data>'
-            f"</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
-        )
-    body = (
-        '<?xml version="1.0" encoding="utf-8"?>'
-        '<d:multistatus xmlns:d="DAV:" xmlns:cal="urn:ietf:params:xml:ns:caldav">'
-        + "".join(responses)
-        + "</d:multistatus>"
-    )
-    return Response(content=body, media_type="application/xml", status_code=207)
+    _log_dav("dav_report", "/caldav/calendar/", request)
+    body = await request.body()
+    return _dav_report(request, body, "calendar", "/caldav/calendar/", None)
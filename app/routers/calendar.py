@@ -5,7 +5,7 @@ Calendar router for Exchange-compatible calendar operations
 from datetime import datetime, timedelta
 from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from sqlalchemy.orm import Session
 
@@ -19,6 +19,7 @@ from ..models import (
     CalendarFolderTree,
 )
 from ..services.calendar_service import CalendarService
+from ..services.freebusy import freebusy_index, merged_free_busy, resolve_mailboxes
 
 router = APIRouter(prefix="/calendar", tags=["calendar"])
 
@@ -208,6 +209,48 @@ def get_upcoming_events(
     return [CalendarEventResponse.from_orm(event) for event in events]
 
 
+@router.get("/freebusy")
+def get_free_busy(
+    emails: str = Query(..., description="Comma-separated mailbox addresses"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: int = Query(30, ge=5, le=1440),
+    current_user: Union[User, RedirectResponse] = Depends(get_current_user_from_cookie),
+    db: Session = Depends(get_db),
+):
+    """Merged busy intervals for several mailboxes (defaults to the next 7 days)"""
+    if isinstance(current_user, RedirectResponse):
+        return current_user
+
+    start = start or datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    end = end or start + timedelta(days=7)
+    if end <= start or end - start > timedelta(days=62):
+        raise HTTPException(status_code=400, detail="Invalid free/busy window")
+
+    addresses = [address.strip() for address in emails.split(",") if address.strip()]
+    mailboxes = resolve_mailboxes(db, addresses)
+    busy = freebusy_index.busy_intervals(db, set(mailboxes.values()), start, end)
+
+    schedules = []
+    for address in addresses:
+        user_id = mailboxes.get(address.lower())
+        if user_id is None:
+            schedules.append({"email": address, "error": "not_found"})
+            continue
+        intervals = busy[user_id]
+        schedules.append(
+            {
+                "email": address,
+                "busy": [
+                    {"start": occ.start, "end": occ.end, "status": occ.status}
+                    for occ in intervals
+                ],
+                "merged": merged_free_busy(intervals, start, end, interval),
+            }
+        )
+    return {"start": start, "end": end, "interval_minutes": interval, "schedules": schedules}
+
+
 # OWA Calendar UI Endpoints
 @router.get("/", response_class=HTMLResponse)
 def calendar_home(
@@ -1,3 +1,4 @@
+import json
 from typing import List, Optional, Union
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
@@ -5,9 +6,12 @@ from fastapi.responses import RedirectResponse, Response
 from sqlalchemy.orm import Session
 
 from ..auth import get_current_user, get_current_user_from_cookie
+from ..conditional import conditional_response, mailbox_version
 from ..database import Email, EmailAttachment, User, get_db
+from ..db_engine import prefer_replica
 from ..email_service import EmailService
 from ..models import EmailCreate, EmailResponse, EmailSummary
+from ..services.folder_counts import get_counts
 
 router = APIRouter(prefix="/emails", tags=["emails"])
 
@@ -42,9 +46,22 @@ def get_emails(
     if isinstance(current_user, RedirectResponse):
         return current_user
 
+    db = prefer_replica(db, current_user.id)
     email_service = EmailService(db)
-    emails = email_service.get_user_emails(current_user.id, folder, limit, offset)
-    return [EmailSummary.from_email(email) for email in emails]
+
+    def build() -> str:
+        emails = email_service.get_user_emails(current_user.id, folder, limit, offset)
+        return json.dumps(
+            [EmailSummary.from_email(email).model_dump(mode="json") for email in emails]
+        )
+
+    return conditional_response(
+        request,
+        "owa.emails",
+        (folder, limit, offset, mailbox_version(db, current_user.id)),
+        build,
+        media_type="application/json",
+    )
 
 
 @router.get("/{email_id}", response_model=EmailResponse)
@@ -130,6 +147,7 @@ def delete_email(
 
 @router.get("/stats/summary")
 def get_email_stats(
+    request: Request,
     current_user: Union[User, RedirectResponse] = Depends(get_current_user_from_cookie),
     db: Session = Depends(get_db),
 ):
@@ -137,13 +155,22 @@ def get_email_stats(
     if isinstance(current_user, RedirectResponse):
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    email_service = EmailService(db)
-    inbox_emails = email_service.get_user_emails(current_user.id, "inbox")
-    sent_emails = email_service.get_user_emails(current_user.id, "sent")
-    unread_count = sum(1 for email in inbox_emails if not email.is_read)
-
-    return {
-        "inbox_count": len(inbox_emails),
-        "sent_count": len(sent_emails),
-        "unread_count": unread_count,
-    }
+    # Materialized counters: one primary-key read, exact beyond any page size
+    counts = get_counts(db, current_user.id)
+
+    def build() -> str:
+        return json.dumps(
+            {
+                "inbox_count": counts["inbox"]["total"],
+                "sent_count": counts["sent"]["total"],
+                "unread_count": counts["inbox"]["unread"],
+            }
+        )
+
+    return conditional_response(
+        request,
+        "owa.stats",
+        (current_user.id, counts["inbox"]["total"], counts["sent"]["total"], counts["inbox"]["unread"]),
+        build,
+        media_type="application/json",
+    )
@@ -1,19 +1,34 @@
 import base64
+import html
 import time
 import re
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import xml.etree.ElementTree as ET
 
 from fastapi import APIRouter, Request, status
 from fastapi.responses import Response
 from sqlalchemy.orm import Session
 
+from ..attachment_stream import FileSegment, load_attachments, streaming_segments_response
 from ..auth import authenticate_user
+from ..conditional import conditional_response
+from ..db_engine import prefer_replica
+from ..db_executor import offload_to_db_pool, run_in_db_thread
 from ..database import Email, EmailAttachment, SessionLocal
 from ..diagnostic_logger import log_ews
 from ..email_delivery import email_delivery
 from ..ews_push import ews_push_hub
+from ..metrics import set_command
+from ..services.freebusy import (
+    LEGACY_NAMES,
+    freebusy_index,
+    merged_free_busy,
+    resolve_mailboxes,
+    status_level,
+)
+from ..services.folder_counts import get_counts
 from ..services.gal_service import GalService
+from ..services import mail_search
 
 router = APIRouter(prefix="/EWS", tags=["ews"])
 
@@ -47,8 +62,120 @@ def ews_error(message: str) -> str:
     )
 
 
+def _is_streaming_request(request: Request, body: bytes) -> bool:
+    """Streaming subscribe/poll/unsubscribe await the push hub's loop-bound queues."""
+    return b"Subscribe" in body or b"GetStreamingEvents" in body
+
+
+# Distinguished folder ids of the mail folders (folder counters, mail search)
+_MAIL_FOLDERS = {"inbox": "inbox", "sentitems": "sent", "deleteditems": "deleted"}
+
+# Views we can serve: detail (subjects, locations) is not exposed, so the
+# Detailed* requests are answered with the matching FreeBusy* view
+_AVAILABILITY_VIEWS = {
+    "MergedOnly": "MergedOnly",
+    "FreeBusy": "FreeBusy",
+    "FreeBusyMerged": "FreeBusyMerged",
+    "Detailed": "FreeBusy",
+    "DetailedMerged": "FreeBusyMerged",
+}
+
+
+def _parse_availability_time(value: str | None) -> datetime | None:
+    if not value or not value.strip():
+        return None
+    raw = value.strip()
+    if raw.endswith("Z"):
+        raw = raw[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(raw)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def get_user_availability(db: Session, text: str) -> str:
+    """GetUserAvailability body: free/busy views from the free/busy index.
+
+    Times in the request and response are in the request's TimeZone (its
+    Bias; daylight rules are not applied), as Exchange does.
+    """
+    ns = {"m": EWS_NS_MESSAGES, "t": EWS_NS_TYPES}
+    root = ET.fromstring(text)
+    addresses = [
+        (node.text or "").strip() for node in root.findall(".//t:MailboxData/t:Email/t:Address", ns)
+    ]
+    bias = timedelta(minutes=int((root.findtext(".//t:TimeZone/t:Bias", "0", ns) or "0").strip() or 0))
+    window = root.find(".//t:FreeBusyViewOptions/t:TimeWindow", ns)
+    start = _parse_availability_time(window.findtext("t:StartTime", None, ns) if window is not None else None)
+    end = _parse_availability_time(window.findtext("t:EndTime", None, ns) if window is not None else None)
+    slot = int(root.findtext(".//t:MergedFreeBusyIntervalInMinutes", "30", ns) or 30)
+    requested = (root.findtext(".//t:FreeBusyViewOptions/t:RequestedView", "", ns) or "").strip()
+    view = _AVAILABILITY_VIEWS.get(requested, "FreeBusyMerged")
+    if start is None or end is None or end <= start:
+        start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=7)
+        bias = timedelta(0)
+
+    # Local -> UTC: UTC = local + Bias
+    utc_start, utc_end = start + bias, end + bias
+    mailboxes = resolve_mailboxes(db, addresses)
+    busy = freebusy_index.busy_intervals(db, set(mailboxes.values()), utc_start, utc_end)
+
+    def local(dt: datetime) -> str:
+        return (dt - bias).strftime("%Y-%m-%dT%H:%M:%S")
+
+    responses = []
+    for address in addresses:
+        user_id = mailboxes.get(address.lower())
+        if user_id is None:
+            responses.append(
+                "<m:FreeBusyResponse>"
+                '<m:ResponseMessage ResponseClass="Error">'
+                "<m:MessageText>No mailbox with such guid.</m:MessageText>"
+                "<m:ResponseCode>ErrorMailRecipientNotFound</m:ResponseCode>"
+                "</m:ResponseMessage>"
+                "<m:FreeBusyView><t:FreeBusyViewType>None</t:FreeBusyViewType></m:FreeBusyView>"
+                "</m:FreeBusyResponse>"
+            )
+            continue
+        intervals = busy[user_id]
+        parts = [f"<t:FreeBusyViewType>{view}</t:FreeBusyViewType>"]
+        if view.endswith("Merged") or view == "MergedOnly":
+            parts.append(
+                f"<t:MergedFreeBusy>{merged_free_busy(intervals, utc_start, utc_end, slot)}</t:MergedFreeBusy>"
+            )
+        if view != "MergedOnly":
+            parts.append(
+                "<t:CalendarEventArray>"
+                + "".join(
+                    "<t:CalendarEvent>"
+                    f"<t:StartTime>{local(occ.start)}</t:StartTime>"
+                    f"<t:EndTime>{local(occ.end)}</t:EndTime>"
+                    f"<t:BusyType>{LEGACY_NAMES[status_level(occ.status)]}</t:BusyType>"
+                    "</t:CalendarEvent>"
+                    for occ in intervals
+                )
+                + "</t:CalendarEventArray>"
+            )
+        responses.append(
+            "<m:FreeBusyResponse>"
+            '<m:ResponseMessage ResponseClass="Success"><m:ResponseCode>NoError</m:ResponseCode></m:ResponseMessage>'
+            f"<m:FreeBusyView>{''.join(parts)}</m:FreeBusyView>"
+            "</m:FreeBusyResponse>"
+        )
+    return (
+        f'<m:GetUserAvailabilityResponse xmlns:m="{EWS_NS_MESSAGES}" xmlns:t="{EWS_NS_TYPES}">'
+        f"<m:FreeBusyResponseArray>{''.join(responses)}</m:FreeBusyResponseArray>"
+        f"</m:GetUserAvailabilityResponse>"
+    )
+
+
 @router.get("/Exchange.asmx")
 @router.post("/Exchange.asmx")
+@offload_to_db_pool(inline_when=_is_streaming_request)
 async def ews_aspx(request: Request):
     """Very minimal EWS endpoint to make Outlook probe pass. Supports FindItem on Inbox with a tiny response.
     This is not a full EWS; it only returns a small item list mapped from DB.
@@ -82,7 +209,8 @@ async def ews_aspx(request: Request):
                 },
             )
 
-        user = authenticate_user(db, username, password)
+        # PBKDF2 verification is CPU-bound; keep it off the event loop
+        user = await run_in_db_thread(authenticate_user, db, username, password)
         if not user:
             log_ews("auth_invalid", {"username": username})
             return Response(
@@ -119,6 +247,7 @@ async def ews_aspx(request: Request):
         except Exception:
             operation_name = "Unknown"
         log_ews("operation_detected", {"operation": operation_name})
+        set_command(operation_name)
 
         # Naive routing based on method names in SOAP
         def _xml(s: str | None) -> str:
@@ -217,20 +346,47 @@ async def ews_aspx(request: Request):
             log_ews("findfolder_response", {"bytes": len(resp)})
             return Response(content=resp, media_type="text/xml")
         if "FindItem" in text:
-            # Return last 10 emails owned by the authenticated user; if client requests IdOnly return ItemId only
-            emails = (
-                db.query(Email)
-                .filter(Email.recipient_id == user.id)
-                .order_by(Email.created_at.desc())
-                .limit(10)
-                .all()
-            )
+            # Listing only: serve from the read replica when one is configured
+            prefer_replica(db, user.id)
             wants_id_only = "<t:BaseShape>IdOnly</t:BaseShape>" in text
             # Determine target folder
             import re
 
             mfolder = re.search(r'<t:DistinguishedFolderId\s+Id="([^"]+)"', text)
             target = mfolder.group(1).lower() if mfolder else "inbox"
+            includes_last = True
+            mquery = re.search(
+                r"<(?:\w+:)?QueryString[^>]*>([\s\S]*?)</(?:\w+:)?QueryString>", text
+            )
+            if not mquery or target in ("contacts", "calendar"):
+                # Return last 10 emails owned by the authenticated user; if client requests IdOnly return ItemId only
+                emails = (
+                    db.query(Email)
+                    .filter(Email.recipient_id == user.id)
+                    .order_by(Email.created_at.desc())
+                    .limit(10)
+                    .all()
+                )
+                total_items = len(emails)
+            else:
+                # Full-text search; folders other than the mail folders search all mail
+                mpage = re.search(r"<m:IndexedPageItemView\b([^>]*)>", text)
+                page_attrs = dict(re.findall(r'(\w+)="([^"]*)"', mpage.group(1))) if mpage else {}
+                offset = page_attrs.get("Offset", "0")
+                offset = int(offset) if offset.isdigit() else 0
+                max_entries = page_attrs.get("MaxEntriesReturned", "50")
+                found = mail_search.search(
+                    db,
+                    user.id,
+                    html.unescape(mquery.group(1)),
+                    folder=_MAIL_FOLDERS.get(target),
+                    offset=offset,
+                    limit=int(max_entries) if max_entries.isdigit() else 50,
+                )
+                emails = mail_search.load_emails(db, found["ids"])
+                total_items = found["total"]
+                includes_last = offset + len(emails) >= total_items
+                log_ews("finditem_search", {"total": total_items, "returned": len(emails)})
             if target == "contacts":
                 from ..database import Contact
 
@@ -327,7 +483,7 @@ async def ews_aspx(request: Request):
                 f"<m:ResponseMessages>"
                 f'<m:FindItemResponseMessage ResponseClass="Success">'
                 f"<m:ResponseCode>NoError</m:ResponseCode>"
-                f'<m:RootFolder TotalItemsInView="{len(emails)}" IncludesLastItemInRange="true">'
+                f'<m:RootFolder TotalItemsInView="{total_items}" IncludesLastItemInRange="{str(includes_last).lower()}">'
                 f"<t:Items>{items_xml}</t:Items>"
                 f"</m:RootFolder>"
                 f"</m:FindItemResponseMessage>"
@@ -803,24 +959,10 @@ async def ews_aspx(request: Request):
                 if fid == "msgfolderroot":
                     # Advertise accurate child count so clients show full tree
                     return f'<t:Folder><t:FolderId Id="DF_root" ChangeKey="0"/><t:DisplayName>{name}</t:DisplayName><t:ChildFolderCount>9</t:ChildFolderCount></t:Folder>'
-                # add basic counts; compute inbox total from DB
-                total = 0
-                if fid == "inbox":
-                    try:
-                        total = (
-                            db.query(Email)
-                            .filter(Email.recipient_id == user.id)
-                            .count()
-                        )
-                    except Exception:
-                        total = 0
-                elif fid == "sentitems":
-                    try:
-                        total = (
-                            db.query(Email).filter(Email.sender_id == user.id).count()
-                        )
-                    except Exception:
-                        total = 0
+                # Materialized per-folder counters (services/folder_counts.py)
+                folder_counts = counts.get(_MAIL_FOLDERS.get(fid)) if counts else None
+                total = folder_counts["total"] if folder_counts else 0
+                unread = folder_counts["unread"] if folder_counts else 0
                 return (
                     f"<t:Folder>"
                     f'<t:FolderId Id="DF_{fid}" ChangeKey="0"/>'
@@ -829,32 +971,54 @@ async def ews_aspx(request: Request):
                     f"<t:DisplayName>{name}</t:DisplayName>"
                     f"<t:TotalCount>{total}</t:TotalCount>"
                     f"<t:ChildFolderCount>0</t:ChildFolderCount>"
-                    f"<t:UnreadCount>0</t:UnreadCount>"
+                    f"<t:UnreadCount>{unread}</t:UnreadCount>"
                     f"</t:Folder>"
                 )
 
-            # Per EWS, return one ResponseMessage per requested folder
-            response_messages = "".join(
-                [
-                    (
-                        f'<m:GetFolderResponseMessage ResponseClass="Success">'
-                        f"<m:ResponseCode>NoError</m:ResponseCode>"
-                        f"<m:Folders>{folder_xml(fid)}</m:Folders>"
-                        f"</m:GetFolderResponseMessage>"
-                    )
-                    for fid in all_ids
-                ]
+            def build_getfolder() -> str:
+                # Per EWS, return one ResponseMessage per requested folder
+                response_messages = "".join(
+                    [
+                        (
+                            f'<m:GetFolderResponseMessage ResponseClass="Success">'
+                            f"<m:ResponseCode>NoError</m:ResponseCode>"
+                            f"<m:Folders>{folder_xml(fid)}</m:Folders>"
+                            f"</m:GetFolderResponseMessage>"
+                        )
+                        for fid in all_ids
+                    ]
+                )
+                body = (
+                    f'<m:GetFolderResponse xmlns:m="{EWS_NS_MESSAGES}" xmlns:t="{EWS_NS_TYPES}">'
+                    f"<m:ResponseMessages>"
+                    f"{response_messages}"
+                    f"</m:ResponseMessages>"
+                    f"</m:GetFolderResponse>"
+                )
+                resp = soap_envelope(body)
+                log_ews("getfolder_response", {"bytes": len(resp)})
+                return resp
+
+            # Only the mail folder counters depend on the mailbox, and they
+            # double as the validator
+            counts = (
+                get_counts(db, user.id)
+                if set(_MAIL_FOLDERS).intersection(all_ids)
+                else None
             )
-            body = (
-                f'<m:GetFolderResponse xmlns:m="{EWS_NS_MESSAGES}" xmlns:t="{EWS_NS_TYPES}">'
-                f"<m:ResponseMessages>"
-                f"{response_messages}"
-                f"</m:ResponseMessages>"
-                f"</m:GetFolderResponse>"
+            version = (
+                tuple(sorted((name, tuple(c.values())) for name, c in counts.items()))
+                if counts
+                else None
+            )
+            return conditional_response(
+                request,
+                "ews.GetFolder",
+                (tuple(all_ids), version),
+                build_getfolder,
+                media_type="text/xml",
+                memo_key=("ews.GetFolder", user.id, tuple(all_ids)),
             )
-            resp = soap_envelope(body)
-            log_ews("getfolder_response", {"bytes": len(resp)})
-            return Response(content=resp, media_type="text/xml")
         if "SyncFolderHierarchy" in text:
             # Return full default tree as "Create" changes with a static sync state
             def f_mail(fid: str, name: str) -> str:
@@ -909,21 +1073,33 @@ async def ews_aspx(request: Request):
             has_state = re.search(r"<SyncState>(.*?)</SyncState>", text)
             sync_state = has_state.group(1) if has_state else "HIER_BASE_1"
             resp_changes = "" if has_state else changes
-            body = (
-                f'<m:SyncFolderHierarchyResponse xmlns:m="{EWS_NS_MESSAGES}" xmlns:t="{EWS_NS_TYPES}">'
-                f"<m:ResponseMessages>"
-                f'<m:SyncFolderHierarchyResponseMessage ResponseClass="Success">'
-                f"<m:ResponseCode>NoError</m:ResponseCode>"
-                f"<m:SyncState>{sync_state}</m:SyncState>"
-                f"<m:IncludesLastFolderInRange>true</m:IncludesLastFolderInRange>"
-                f"<m:Changes>{resp_changes}</m:Changes>"
-                f"</m:SyncFolderHierarchyResponseMessage>"
-                f"</m:ResponseMessages>"
-                f"</m:SyncFolderHierarchyResponse>"
+
+            def build_hierarchy() -> str:
+                body = (
+                    f'<m:SyncFolderHierarchyResponse xmlns:m="{EWS_NS_MESSAGES}" xmlns:t="{EWS_NS_TYPES}">'
+                    f"<m:ResponseMessages>"
+                    f'<m:SyncFolderHierarchyResponseMessage ResponseClass="Success">'
+                    f"<m:ResponseCode>NoError</m:ResponseCode>"
+                    f"<m:SyncState>{sync_state}</m:SyncState>"
+                    f"<m:IncludesLastFolderInRange>true</m:IncludesLastFolderInRange>"
+                    f"<m:Changes>{resp_changes}</m:Changes>"
+                    f"</m:SyncFolderHierarchyResponseMessage>"
+                    f"</m:ResponseMessages>"
+                    f"</m:SyncFolderHierarchyResponse>"
+                )
+                resp = soap_envelope(body)
+                log_ews("syncfolderhierarchy_response", {"bytes": len(resp)})
+                return resp
+
+            # The default tree is static: the body only depends on the sync state
+            return conditional_response(
+                request,
+                "ews.SyncFolderHierarchy",
+                (bool(has_state), sync_state),
+                build_hierarchy,
+                media_type="text/xml",
+                memo_key=("ews.SyncFolderHierarchy", bool(has_state), sync_state),
             )
-            resp = soap_envelope(body)
-            log_ews("syncfolderhierarchy_response", {"bytes": len(resp)})
-            return Response(content=resp, media_type="text/xml")
         if "SyncFolderItems" in text:
             # Stateful delta sync per folder using last seen ITEM id watermark in SyncState
             import re
@@ -1671,50 +1847,52 @@ async def ews_aspx(request: Request):
             )
             return Response(content=soap_envelope(body), media_type="text/xml")
         if "GetAttachment" in text:
-            # Return file content for requested AttachmentIds
+            # Stream file content for requested AttachmentIds: metadata in one
+            # query, bytes base64-encoded block by block inside the envelope
             import os
             import re
 
             ids = re.findall(r'<t:AttachmentId[^>]*Id="ATT_(\d+)"', text)
-            attachments = []
-            for aid in ids:
-                a = (
-                    db.query(EmailAttachment)
-                    .filter(EmailAttachment.id == int(aid))
-                    .first()
-                )
-                if not a:
+            found = load_attachments(db, user.id, ids)
+            segments = []
+            for aid in dict.fromkeys(ids):
+                a = found.get(aid)
+                if not a or not a.file_path or not os.path.exists(a.file_path):
                     continue
-                content_b64 = ""
-                try:
-                    with open(a.file_path, "rb") as f:
-                        content_b64 = (
-                            __import__("base64").b64encode(f.read()).decode("ascii")
-                        )
-                except Exception:
-                    content_b64 = ""
-                attachments.append(
+                segments.append(
                     "".join(
                         [
                             "<t:FileAttachment>",
                             f'<t:AttachmentId Id="ATT_{a.id}"/>',
                             f"<t:Name>{_xml(a.filename or 'attachment')}</t:Name>",
-                            f"<t:Content>{content_b64}</t:Content>",
-                            "</t:FileAttachment>",
+                            "<t:Content>",
                         ]
+                    ).encode("utf-8")
+                )
+                segments.append(
+                    FileSegment.whole(
+                        a.file_path, os.path.getsize(a.file_path), encode_base64=True
                     )
                 )
-            body = (
+                segments.append(b"</t:Content></t:FileAttachment>")
+            head, tail = soap_envelope("\0").split("\0")
+            head += (
                 f'<m:GetAttachmentResponse xmlns:m="{EWS_NS_MESSAGES}" xmlns:t="{EWS_NS_TYPES}">'
                 f"<m:ResponseMessages>"
                 f'<m:GetAttachmentResponseMessageType ResponseClass="Success">'
                 f"<m:ResponseCode>NoError</m:ResponseCode>"
-                f"<m:Attachments>{''.join(attachments)}</m:Attachments>"
+                f"<m:Attachments>"
+            )
+            tail = (
+                f"</m:Attachments>"
                 f"</m:GetAttachmentResponseMessageType>"
                 f"</m:ResponseMessages>"
                 f"</m:GetAttachmentResponse>"
+            ) + tail
+            return streaming_segments_response(
+                [head.encode("utf-8"), *segments, tail.encode("utf-8")],
+                "text/xml",
             )
-            return Response(content=soap_envelope(body), media_type="text/xml")
         if "CreateAttachment" in text:
             # Save file attachment to disk and DB, link to target item
             import os
@@ -1759,11 +1937,14 @@ async def ews_aspx(request: Request):
             )
             return Response(content=soap_envelope(body), media_type="text/xml")
         if "GetUserAvailability" in text:
-            body = (
-                f'<m:GetUserAvailabilityResponse xmlns:m="{EWS_NS_MESSAGES}" xmlns:t="{EWS_NS_TYPES}">'
-                f"<m:FreeBusyResponseArray/>"
-                f"</m:GetUserAvailabilityResponse>"
-            )
+            try:
+                body = get_user_availability(db, text)
+            except (ET.ParseError, ValueError):
+                body = (
+                    f'<m:GetUserAvailabilityResponse xmlns:m="{EWS_NS_MESSAGES}" xmlns:t="{EWS_NS_TYPES}">'
+                    f"<m:FreeBusyResponseArray/>"
+                    f"</m:GetUserAvailabilityResponse>"
+                )
             return Response(content=soap_envelope(body), media_type="text/xml")
         # Default minimal
         log_ews(
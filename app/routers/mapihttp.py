@@ -3,19 +3,21 @@ import hashlib
 import logging
 import os
 import struct
+import threading
 import time
 import uuid
 import hmac
 from datetime import datetime
 from typing import Optional, Tuple, Dict, Any
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import Response
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from ..auth import authenticate_user
-from ..database import SessionLocal, User, get_db
+from ..db_executor import db_session_scope, offload_to_db_pool
+from ..database import SessionLocal, User
 from ..diagnostic_logger import (
     _write_json_line,
     log_mapi_request,
@@ -143,16 +145,27 @@ def _build_auth_challenge_response(request_id: str, ntlm_token: Optional[str] =
     return response
 
 
-# Initialize RPC processor
-rpc_processor = None
+# One RPC processor per MAPI session: ROP handle tables belong to a session,
+# and a session's Execute calls are sequential, so sessions never wait on
+# each other. Each Execute gives its processor a Session of its own.
+_rpc_processors: Dict[str, Tuple[MapiRpcProcessor, threading.Lock]] = {}
+_rpc_processors_lock = threading.Lock()
 
 
-def get_rpc_processor():
-    global rpc_processor
-    if rpc_processor is None:
-        db = SessionLocal()
-        rpc_processor = MapiRpcProcessor(db)
-    return rpc_processor
+def get_rpc_processor(session_cookie: str) -> Tuple[MapiRpcProcessor, threading.Lock]:
+    with _rpc_processors_lock:
+        entry = _rpc_processors.get(session_cookie)
+        if entry is None:
+            # Forget processors of sessions that expired or disconnected
+            for cookie in [c for c in _rpc_processors if not session_manager.get_session(c)]:
+                del _rpc_processors[cookie]
+            entry = _rpc_processors[session_cookie] = (MapiRpcProcessor(None), threading.Lock())
+    return entry
+
+
+def drop_rpc_processor(session_cookie: str) -> None:
+    with _rpc_processors_lock:
+        _rpc_processors.pop(session_cookie, None)
 
 
 def _to_utf16le(s: str) -> bytes:
@@ -511,6 +524,7 @@ def _finalize_ntlm_authentication(
 
 
 @router.post("/emsmdb")
+@offload_to_db_pool
 async def mapi_emsmdb(request: Request):
     """MAPI/HTTP EMSMDB endpoint - handles mailbox operations"""
     body = await request.body()
@@ -873,14 +887,16 @@ async def mapi_emsmdb(request: Request):
             session_manager.update_activity(session_cookie)
 
             # Process RPC data
-            processor = get_rpc_processor()
-            rpc_response = processor.process_rpc(
-                session_cookie,
-                rpc_data,
-                max_response_size=parsed_request.get("max_response", 0),
-                request_flags=parsed_request.get("flags", 0),
-                aux_in=parsed_request.get("aux_in", b""),
-            )
+            processor, processor_lock = get_rpc_processor(session_cookie)
+            with processor_lock, db_session_scope() as rpc_db:
+                processor.db = rpc_db
+                rpc_response = processor.process_rpc(
+                    session_cookie,
+                    rpc_data,
+                    max_response_size=parsed_request.get("max_response", 0),
+                    request_flags=parsed_request.get("flags", 0),
+                    aux_in=parsed_request.get("aux_in", b""),
+                )
 
             # Build Execute response
             response_data = response_builder.build_execute_response(
@@ -908,6 +924,7 @@ async def mapi_emsmdb(request: Request):
 
             if session_cookie:
                 session_manager.remove_session(session_cookie)
+                drop_rpc_processor(session_cookie)
             else:
                 log_mapi(
                     "missing_session_cookie",
@@ -959,7 +976,8 @@ async def mapi_emsmdb(request: Request):
 
 @router.get("/nspi")
 @router.post("/nspi")
-async def mapi_nspi(request: Request, db: Session = Depends(get_db)):
+@offload_to_db_pool
+async def mapi_nspi(request: Request):
     """MAPI/HTTP NSPI endpoint - handles address book operations"""
     body = await request.body()
     ua = request.headers.get("User-Agent", "")
@@ -986,7 +1004,6 @@ async def mapi_nspi(request: Request, db: Session = Depends(get_db)):
             if operation == 0x01:  # NspiGetMatches (GAL search)
                 log_mapi("nspi_get_matches", {"request_id": request_id})
 
-                gal_service = GalService(db)
                 search_term = ""
                 if len(body) > 8:
                     candidate = body[8:]
@@ -1002,7 +1019,9 @@ async def mapi_nspi(request: Request, db: Session = Depends(get_db)):
                             .strip("\x00")
                             .strip()
                         )
-                entries = gal_service.search(search_term or None, limit=100)
+                # Opened here, on the DB pool thread that uses it
+                with db_session_scope() as db:
+                    entries = GalService(db).search(search_term or None, limit=100)
 
                 # Build NSPI response with user data
                 response_data = struct.pack("<I", 0)  # Success status
@@ -0,0 +1,78 @@
+"""
+Metrics endpoint
+Prometheus text exposition of app.metrics plus sampled queue depths.
+
+Every service entrypoint includes this router next to MetricsMiddleware.
+Gauges are read at scrape time: delivery queue depth by status (one
+GROUP BY on queued_emails, run in the threadpool), EWS streaming
+subscriptions and their undelivered events, EAS Ping waiters, the EAS
+Sync replay cache, WebSocket connections and outbox depth, and event loop
+lag.
+"""
+from typing import Dict, Optional, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+from sqlalchemy import func
+
+from ..database import SessionLocal
+from ..ews_push import ews_push_hub
+from ..loop_lag import loop_lag_monitor
+from ..metrics import metrics
+from ..push_notifications import push_manager
+from ..services.sync_replay import sync_replay_cache
+from ..websocket_manager import manager as websocket_manager
+
+router = APIRouter(tags=["Metrics"])
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _delivery_queue_depth() -> Optional[Dict[Tuple[str], int]]:
+    from ..email_queue import QueuedEmail
+
+    with SessionLocal() as db:
+        rows = db.query(QueuedEmail.status, func.count(QueuedEmail.id)).group_by(QueuedEmail.status).all()
+    return {(status or "unknown",): count for status, count in rows}
+
+
+def _websocket(key: str):
+    return lambda: websocket_manager.get_stats()[key]
+
+
+def _sync_replay() -> Dict[Tuple[str], float]:
+    stats = sync_replay_cache.stats()
+    return {(key,): stats[key] for key in ("hits", "misses", "evictions", "entries", "bytes")}
+
+
+def _loop_lag() -> Dict[Tuple[str], Optional[float]]:
+    stats = loop_lag_monitor.get_stats()
+    return {("0.5",): stats["lag_ms_p50"], ("0.99",): stats["lag_ms_p99"], ("max",): stats["lag_ms_max"]}
+
+
+metrics.gauge("delivery_queue_depth", "Outbound delivery queue entries by status", _delivery_queue_depth, ("status",))
+metrics.gauge(
+    "ews_streaming_subscriptions", "Active EWS streaming subscriptions", lambda: ews_push_hub.get_stats()["subscriptions"]
+)
+metrics.gauge(
+    "ews_streaming_queued_events",
+    "EWS notifications waiting for a GetStreamingEvents call",
+    lambda: ews_push_hub.get_stats()["queued_events"],
+)
+metrics.gauge("eas_ping_waiters", "EAS Ping requests parked for changes", push_manager.get_active_connections_count)
+metrics.gauge("eas_sync_replay_cache", "EAS Sync replay cache lookups, evictions and size", _sync_replay, ("stat",))
+metrics.gauge(
+    "eas_sync_replay_hit_ratio",
+    "Share of Sync retries answered from the replay cache",
+    lambda: sync_replay_cache.stats()["hit_ratio"],
+)
+metrics.gauge("websocket_connections", "Open WebSocket connections", _websocket("connections"))
+metrics.gauge("websocket_queue_depth", "Messages queued across WebSocket outboxes", _websocket("queue_depth_total"))
+metrics.gauge("event_loop_lag_ms", "Event loop wake-up lag over the sampling window", _loop_lag, ("quantile",))
+metrics.gauge("event_loop_stalls", "Event loop stalls above LOOP_LAG_WARN_MS since start", lambda: loop_lag_monitor.stalls)
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    # Sync handler: the queue gauge queries the database from the threadpool
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
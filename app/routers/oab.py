@@ -7,199 +7,198 @@ and cache the Global Address List locally.
 Key endpoints:
 - /oab/oab.xml: OAB manifest file
 - /oab/{oab_id}/oab.xml: Specific OAB version
-- /oab/{oab_id}/{file}: OAB data files
+- /oab/{oab_id}/{sequence}/{file}: OAB data files and differential patches
+- /oab/{oab_id}/{file}: redirect to the current sequence's file
+
+The files themselves are generated in the background by
+app.services.oab_builder and served here as static, versioned artifacts
+with ETag/If-None-Match, Range and gzip support. Each sequence has its own
+URLs, so a cached response can never belong to a different version.
 
 References:
 - [MS-OXWOAB]: Offline Address Book (OAB) File Format and Schema
 - [MS-OXOAB]: Offline Address Book (OAB) Protocol
 """
 
+import asyncio
 import logging
-import uuid
-from datetime import datetime, timezone
+import os
+import re
 from typing import Optional
-from fastapi import APIRouter, Request, HTTPException, Depends
-from fastapi.responses import Response
-from sqlalchemy.orm import Session
 
-from ..database import get_db, User
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response
+
+from ..conditional import conditional_response, conditional_stats, is_not_modified
 from ..diagnostic_logger import log_oab
+from ..services.oab_builder import OAB_DATA_FILES, OAB_ID, OabVersion, oab_generator
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 # OAB Configuration
 OAB_VERSION = "4.0"
-OAB_ID = "default-oab"
-OAB_DN = "/o=First Organization/ou=Exchange Administrative Group/cn=addrlists/cn=oabs/cn=default offline address book"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CHANGES_RE = re.compile(r"^changes-(\d+)\.oab$")
+
+
+async def _current_version() -> OabVersion:
+    version = oab_generator.store.current()
+    if version is None:
+        # First request before the background job has published anything
+        version = await asyncio.to_thread(oab_generator.ensure_current)
+    if version is None:
+        raise HTTPException(status_code=503, detail="OAB not generated yet")
+    return version
+
+
+def _not_modified(request: Request, *etags: str) -> bool:
+    return any(is_not_modified(request, etag) for etag in etags)
+
+
+def _parse_range(header: Optional[str], size: int):
+    """Return (start, end) for a single satisfiable byte range, None to ignore it."""
+    match = _RANGE_RE.match((header or "").strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(0, size - int(last))
+        end = size - 1
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _read_slice(path: str, start: int, length: int) -> bytes:
+    with open(path, "rb") as handle:
+        handle.seek(start)
+        return handle.read(length)
+
 
 @router.get("/oab/oab.xml")
-async def oab_manifest(request: Request, db: Session = Depends(get_db)):
+async def oab_manifest(request: Request):
     """OAB manifest file - tells Outlook about available address books"""
-    
+
     client_ip = request.client.host if request.client else "unknown"
     user_agent = request.headers.get("user-agent", "")
-    
+
     log_oab("manifest_request", {
         "client_ip": client_ip,
         "user_agent": user_agent,
         "oab_id": OAB_ID
     })
-    
-    # Get user count for OAB size estimation
-    user_count = db.query(User).count()
-    
-    # Generate OAB manifest XML
-    manifest_xml = f"""<?xml version="1.0" encoding="utf-8"?>
-<OAB xmlns="http://schemas.microsoft.com/exchange/2003/oab" 
-     xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-     xsi:schemaLocation="http://schemas.microsoft.com/exchange/2003/oab oab.xsd">
-  <OAL>
-    <Name>Default Global Address List</Name>
-    <DN>{OAB_DN}</DN>
-    <Id>{OAB_ID}</Id>
-    <Version>{OAB_VERSION}</Version>
-    <Size>{user_count * 1024}</Size>
-    <LastModified>{datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}</LastModified>
-    <Files>
-      <File>
-        <Name>browse.oab</Name>
-        <Size>{user_count * 512}</Size>
-        <SHA1>0000000000000000000000000000000000000000</SHA1>
-      </File>
-      <File>
-        <Name>details.oab</Name>
-        <Size>{user_count * 256}</Size>
-        <SHA1>1111111111111111111111111111111111111111</SHA1>
-      </File>
-      <File>
-        <Name>rdndex.oab</Name>
-        <Size>4096</Size>
-        <SHA1>2222222222222222222222222222222222222222</SHA1>
-      </File>
-    </Files>
-  </OAL>
-</OAB>"""
-    
-    log_oab("manifest_response", {
-        "oab_id": OAB_ID,
-        "user_count": user_count,
-        "version": OAB_VERSION
-    })
-    
-    return Response(
-        content=manifest_xml,
-        media_type="application/xml",
-        headers={
-            "Cache-Control": "public, max-age=3600",
-            "Content-Type": "application/xml; charset=utf-8"
-        }
+
+    version = await _current_version()
+    _, manifest_xml = oab_generator.store.manifest()
+    headers = {"Cache-Control": "public, max-age=3600"}
+
+    def build():
+        log_oab("manifest_response", {
+            "oab_id": OAB_ID,
+            "record_count": version.record_count,
+            "sequence": version.sequence,
+            "version": OAB_VERSION
+        })
+        return manifest_xml
+
+    return conditional_response(
+        request,
+        "oab.manifest",
+        None,
+        build,
+        etag=version.etag,
+        media_type="application/xml; charset=utf-8",
+        headers=headers,
     )
 
 @router.get("/oab/{oab_id}/oab.xml")
-async def oab_version_manifest(oab_id: str, request: Request, db: Session = Depends(get_db)):
+async def oab_version_manifest(oab_id: str, request: Request):
     """OAB version-specific manifest"""
-    
-    if oab_id != OAB_ID:
-        raise HTTPException(status_code=404, detail="OAB not found")
-    
-    # Return the same manifest for now
-    return await oab_manifest(request, db)
-
-@router.get("/oab/{oab_id}/browse.oab")
-async def oab_browse_file(oab_id: str, request: Request, db: Session = Depends(get_db)):
-    """OAB browse file - contains basic user information for browsing"""
-    
+
     if oab_id != OAB_ID:
         raise HTTPException(status_code=404, detail="OAB not found")
-    
-    log_oab("browse_request", {"oab_id": oab_id})
-    
-    # Get all users for the address book
-    users = db.query(User).order_by(User.full_name.asc()).all()
-    
-    # Create a simplified OAB browse file
-    # In a real implementation, this would be binary OAB format
-    # For now, we'll create a minimal structure
-    
-    oab_data = b"OAB4"  # OAB version 4 header
-    oab_data += len(users).to_bytes(4, byteorder='little')  # User count
-    
-    for user in users:
-        # Add user entry (simplified format)
-        display_name = (user.full_name or user.username or "").encode('utf-8')[:64]
-        email = (user.email or "").encode('utf-8')[:128]
-        
-        oab_data += len(display_name).to_bytes(2, byteorder='little')
-        oab_data += display_name
-        oab_data += len(email).to_bytes(2, byteorder='little')
-        oab_data += email
-    
-    log_oab("browse_response", {
-        "oab_id": oab_id,
-        "user_count": len(users),
-        "data_size": len(oab_data)
-    })
-    
-    return Response(
-        content=oab_data,
-        media_type="application/octet-stream",
-        headers={
-            "Cache-Control": "public, max-age=1800",
-            "Content-Type": "application/octet-stream"
-        }
-    )
 
-@router.get("/oab/{oab_id}/details.oab")
-async def oab_details_file(oab_id: str, request: Request, db: Session = Depends(get_db)):
-    """OAB details file - contains detailed user properties"""
-    
+    return await oab_manifest(request)
+
+def _check_file(oab_id: str, file_name: str) -> None:
     if oab_id != OAB_ID:
         raise HTTPException(status_code=404, detail="OAB not found")
-    
-    log_oab("details_request", {"oab_id": oab_id})
-    
-    # Create minimal details file
-    details_data = b"OABD"  # OAB details header
-    details_data += b"\x00" * 1024  # Minimal details data
-    
-    log_oab("details_response", {
-        "oab_id": oab_id,
-        "data_size": len(details_data)
-    })
-    
-    return Response(
-        content=details_data,
-        media_type="application/octet-stream",
-        headers={
-            "Cache-Control": "public, max-age=1800",
-            "Content-Type": "application/octet-stream"
-        }
+    if file_name not in OAB_DATA_FILES and not _CHANGES_RE.match(file_name):
+        raise HTTPException(status_code=404, detail="OAB file not found")
+
+
+@router.get("/oab/{oab_id}/{file_name}")
+async def oab_current_file(oab_id: str, file_name: str):
+    """Unversioned file URL: redirect to the file of the current sequence"""
+
+    _check_file(oab_id, file_name)
+    version = await _current_version()
+    return RedirectResponse(
+        f"/oab/{oab_id}/{version.sequence}/{file_name}",
+        status_code=307,
+        headers={"Cache-Control": "no-cache"},
     )
 
-@router.get("/oab/{oab_id}/rdndex.oab")
-async def oab_rdndex_file(oab_id: str, request: Request):
-    """OAB RDN index file - contains distinguished name index"""
-    
-    if oab_id != OAB_ID:
-        raise HTTPException(status_code=404, detail="OAB not found")
-    
-    log_oab("rdndex_request", {"oab_id": oab_id})
-    
-    # Create minimal RDN index file
-    rdndex_data = b"OABR"  # OAB RDN index header
-    rdndex_data += b"\x00" * 4092  # Minimal index data
-    
-    log_oab("rdndex_response", {
+
+@router.get("/oab/{oab_id}/{sequence}/{file_name}")
+async def oab_file(oab_id: str, sequence: int, file_name: str, request: Request):
+    """OAB browse/details/rdndex files and changes-<sequence>.oab patches of one sequence"""
+
+    _check_file(oab_id, file_name)
+    version = oab_generator.store.version(sequence)
+    if version is None:
+        # Pruned (or never published): the client must re-read the manifest
+        raise HTTPException(status_code=404, detail="OAB version not found")
+    oab_entry = version.file(file_name)
+    if oab_entry is None:
+        # Patch from a sequence we no longer keep: client must take a full download
+        raise HTTPException(status_code=404, detail="OAB file not found")
+
+    etag = f'"{oab_entry.sha1}"'
+    headers = {
+        "Cache-Control": "public, max-age=86400, immutable",
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "X-OAB-Sequence": str(version.sequence),
+        "Vary": "Accept-Encoding",
+    }
+    log_oab("file_request", {
         "oab_id": oab_id,
-        "data_size": len(rdndex_data)
+        "file": file_name,
+        "sequence": version.sequence,
+        "range": request.headers.get("range"),
     })
-    
-    return Response(
-        content=rdndex_data,
-        media_type="application/octet-stream",
-        headers={
-            "Cache-Control": "public, max-age=3600",
-            "Content-Type": "application/octet-stream"
-        }
-    )
+
+    # The gzip representation gets its own strong validator
+    gzip_etag = f'"{oab_entry.sha1}-gz"'
+    if _not_modified(request, etag, gzip_etag):
+        conditional_stats.record("oab.file", "not_modified")
+        return Response(status_code=304, headers=headers)
+    conditional_stats.record("oab.file", "built")
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range.strip() == etag:
+        byte_range = _parse_range(request.headers.get("range"), oab_entry.size)
+    if byte_range is not None:
+        start, end = byte_range
+        data = await asyncio.to_thread(_read_slice, oab_entry.path, start, end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{oab_entry.size}"
+        return Response(
+            content=data,
+            status_code=206,
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+
+    accept_encoding = request.headers.get("accept-encoding", "")
+    if "gzip" in accept_encoding.lower() and os.path.exists(oab_entry.gzip_path):
+        headers["Content-Encoding"] = "gzip"
+        headers["ETag"] = gzip_etag
+        return FileResponse(oab_entry.gzip_path, media_type="application/octet-stream", headers=headers)
+    return FileResponse(oab_entry.path, media_type="application/octet-stream", headers=headers)
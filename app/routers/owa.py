@@ -1,16 +1,17 @@
 import asyncio
+import json
 import os
+import re
 import socket
 import subprocess
 import time
-from collections import deque
 from datetime import datetime, timedelta
 from typing import Optional, Union
 
 import requests
 import shutil
 from fastapi import APIRouter, Body, Depends, HTTPException, Request
-from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy import and_, or_, text
 from sqlalchemy.orm import Session
@@ -18,12 +19,14 @@ from sqlalchemy.orm import Session
 from ..auth import get_current_user_from_cookie
 from ..config import settings
 from ..database import Email, User, engine, get_db
+from ..db_engine import prefer_replica
 from ..diagnostic_logger import outlook_health
 from ..email_delivery import email_delivery
 from ..email_parser import get_email_preview, parse_email_content
 from ..mime_utils import plain_to_html
-from ..email_queue import EmailQueueStatus, QueuedEmail
+from ..email_queue import EmailQueueStatus, QueuedEmail, email_queue
 from ..email_service import EmailService
+from ..log_reader import parse_time_param, read_lines, search_lines, tail_lines
 from ..language import (
     get_all_translations,
     get_direction,
@@ -32,6 +35,8 @@ from ..language import (
 )
 from ..models import EmailCreate, EmailSummary
 from ..queue_processor import queue_processor
+from ..services import mail_search
+from ..services.message_list import FOLDERS, InvalidCursor, changes_since, get_headers, list_headers
 from ..smtp_server import start_smtp_server, stop_smtp_server
 
 router = APIRouter(prefix="/owa", tags=["owa"])
@@ -41,6 +46,7 @@ LOGS_BASE = os.environ.get("LOGS_DIR", "logs")
 DOCKER_BIN = shutil.which("docker")
 DOCKER_TIMEOUT = 6
 DEFAULT_LOG_TAIL = 200
+MESSAGE_PAGE_SIZE = 50
 
 DOCKER_SERVICES = [
     {
@@ -156,9 +162,22 @@ def _read_log_file(rel_path: str, limit: int) -> list[str]:
         raise ValueError("Invalid log path reference")
     if not os.path.exists(full_path):
         raise FileNotFoundError(full_path)
-    with open(full_path, "r", encoding="utf-8", errors="ignore") as handle:
-        lines = deque(handle, maxlen=limit)
-    return list(lines)
+    return tail_lines(full_path, limit)
+
+
+SMTP_LOG_FILES = {
+    "internal_smtp": "internal_smtp.log",
+    "smtp_errors": "smtp_errors.log",
+    "email_processing": "email_processing.log",
+    "external_smtp": "external_smtp.log",
+    "smtp_connections": "smtp_connections.log",
+}
+
+
+def _smtp_log_path(log: str) -> tuple[str, str]:
+    logs_dir = os.environ.get("LOGS_DIR", "./logs")
+    filename = SMTP_LOG_FILES.get(log, "internal_smtp.log")
+    return filename, os.path.join(logs_dir, filename)
 
 
 async def _docker_container_status(container: Optional[str]) -> Optional[dict]:
@@ -417,23 +436,89 @@ def owa_home(
 def owa_inbox(
     request: Request,
     folder: str = "inbox",
-    limit: int = 50,
     current_user: Union[User, RedirectResponse] = Depends(get_current_user_from_cookie),
-    db: Session = Depends(get_db),
 ):
-    """OWA Inbox page"""
+    """OWA Inbox page
+
+    Renders the shell only; rows come from /owa/api/messages as the list
+    scrolls, so opening a large mailbox costs the same as an empty one.
+    """
     if isinstance(current_user, RedirectResponse):
         return current_user
 
-    email_service = EmailService(db)
-    emails = email_service.get_user_emails(current_user.id, folder, limit)
-
     return templates.TemplateResponse(
         "owa/inbox.html",
-        get_template_context(request, user=current_user, emails=emails, folder=folder),
+        get_template_context(
+            request, user=current_user, folder=folder, page_size=MESSAGE_PAGE_SIZE
+        ),
     )
 
 
+@router.get("/api/messages")
+def owa_api_messages(
+    folder: str = "inbox",
+    limit: int = MESSAGE_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    current_user: Union[User, RedirectResponse] = Depends(get_current_user_from_cookie),
+    db: Session = Depends(get_db),
+):
+    """Header rows for the OWA message list, one keyset page at a time"""
+    if isinstance(current_user, RedirectResponse):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        return list_headers(
+            prefer_replica(db, current_user.id), current_user.id, folder, limit, cursor
+        )
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@router.get("/api/messages/changes")
+def owa_api_message_changes(
+    since: str,
+    current_user: Union[User, RedirectResponse] = Depends(get_current_user_from_cookie),
+    db: Session = Depends(get_db),
+):
+    """Rows added, updated or removed in a folder since a changes token"""
+    if isinstance(current_user, RedirectResponse):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        return changes_since(
+            prefer_replica(db, current_user.id), current_user.id, since
+        )
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@router.get("/api/search")
+def owa_api_search(
+    q: str,
+    folder: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    offset: int = 0,
+    limit: int = MESSAGE_PAGE_SIZE,
+    current_user: Union[User, RedirectResponse] = Depends(get_current_user_from_cookie),
+    db: Session = Depends(get_db),
+):
+    """Ranked full-text search of the mailbox, one offset page of header rows"""
+    if isinstance(current_user, RedirectResponse):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if folder is not None and folder not in FOLDERS:
+        raise HTTPException(status_code=400, detail=f"unknown folder {folder!r}")
+    db = prefer_replica(db, current_user.id)
+    found = mail_search.search(
+        db, current_user.id, q, folder=folder, since=since, until=until, offset=offset, limit=limit
+    )
+    return {
+        "query": q,
+        "folder": folder,
+        "total": found["total"],
+        "offset": found["offset"],
+        "messages": get_headers(db, found["ids"]),
+    }
+
+
 @router.get("/compose", response_class=HTMLResponse)
 def owa_compose(
     request: Request,
@@ -457,10 +542,7 @@ def owa_admin_dashboard(
         return current_user
     if not getattr(current_user, "admin", False):
         raise HTTPException(status_code=403, detail="Forbidden")
-    from ..email_queue import EmailQueue
-
-    queue = EmailQueue()
-    stats = queue.get_queue_stats()
+    stats = email_queue.get_queue_stats()
     return templates.TemplateResponse(
         "owa/admin.html",
         get_template_context(request, user=current_user, queue_stats=stats),
@@ -478,11 +560,7 @@ def owa_admin_queues(
     if not getattr(current_user, "admin", False):
         raise HTTPException(status_code=403, detail="Forbidden")
     # Queue stats and listings
-    from ..database import Email
-    from ..email_queue import EmailQueue, QueuedEmail
-
-    queue = EmailQueue()
-    stats = queue.get_queue_stats()
+    stats = email_queue.get_queue_stats()
     # Recent outbound (queued) emails
     queued_emails = (
         db.query(QueuedEmail).order_by(QueuedEmail.created_at.desc()).limit(20).all()
@@ -543,6 +621,8 @@ def owa_admin_smtp_logs_data(
     q: Optional[str] = None,
     match_only: bool = True,
     max_lines: int = 300,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
     current_user: Union[User, RedirectResponse] = Depends(get_current_user_from_cookie),
 ):
     """Return tail of selected SMTP-related log with optional filtering.
@@ -552,57 +632,83 @@ def owa_admin_smtp_logs_data(
       - q: optional substring (case-insensitive)
       - match_only: if true, only include matching lines when q is set
       - max_lines: number of tail lines to consider
+      - since/until: optional ISO timestamps bounding the lines considered
     """
     if isinstance(current_user, RedirectResponse):
         return current_user
     if not getattr(current_user, "admin", False):
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    logs_dir = os.environ.get("LOGS_DIR", "./logs")
-    log_map = {
-        "internal_smtp": "internal_smtp.log",
-        "smtp_errors": "smtp_errors.log",
-        "email_processing": "email_processing.log",
-        "external_smtp": "external_smtp.log",
-        "smtp_connections": "smtp_connections.log",
-    }
-    filename = log_map.get(log, "internal_smtp.log")
-    full_path = os.path.join(logs_dir, filename)
+    filename, full_path = _smtp_log_path(log)
 
     lines = []
     try:
         if os.path.exists(full_path):
-            with open(full_path, "r", encoding="utf-8", errors="ignore") as f:
-                all_lines = f.readlines()
-                tail_lines = all_lines[
-                    -max(1, min(max_lines, 2000)) :
-                ]  # cap to prevent huge payloads
-                if q:
-                    query = q.lower()
-                    if match_only:
-                        lines = [ln for ln in tail_lines if query in ln.lower()]
-                    else:
-                        # include all tail lines but mark matches client-side
-                        lines = tail_lines
-                else:
-                    lines = tail_lines
-        else:
-            lines = []
+            # cap to prevent huge payloads
+            recent = read_lines(
+                full_path,
+                max(1, min(max_lines, 2000)),
+                since=parse_time_param(since),
+                until=parse_time_param(until),
+            )
+            if q and match_only:
+                query = q.lower()
+                lines = [ln for ln in recent if query in ln.lower()]
+            else:
+                # include all tail lines but mark matches client-side
+                lines = recent
     except Exception:
         lines = []
 
-    # Trim trailing newlines for JSON cleanliness, client will join with \n
-    clean = [ln.rstrip("\n") for ln in lines]
     return {
         "file": filename,
-        "count": len(clean),
+        "count": len(lines),
         "max": max_lines,
         "query": q or "",
         "match_only": match_only,
-        "lines": clean,
+        "lines": lines,
     }
 
 
+@router.get("/admin/smtp-logs/search")
+def owa_admin_smtp_logs_search(
+    request: Request,
+    q: str,
+    log: str = "internal_smtp",
+    max_results: int = 500,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    current_user: Union[User, RedirectResponse] = Depends(get_current_user_from_cookie),
+):
+    """Search the whole selected SMTP log, newest first, streaming NDJSON.
+
+    Each match is sent as {"line": ...} as soon as it is found, followed by a
+    final {"done": true, "count": n} record. Unlike /data, the search is not
+    limited to the tail of the file.
+    """
+    if isinstance(current_user, RedirectResponse):
+        return current_user
+    if not getattr(current_user, "admin", False):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    filename, full_path = _smtp_log_path(log)
+    if not os.path.exists(full_path):
+        raise HTTPException(status_code=404, detail=f"Log file not found: {filename}")
+    limit = max(1, min(max_results, 5000))
+    since_dt = parse_time_param(since)
+    until_dt = parse_time_param(until)
+
+    # Sync generator: Starlette iterates it in the threadpool, off the event loop
+    def _results():
+        count = 0
+        for line in search_lines(full_path, q, limit, since=since_dt, until=until_dt):
+            count += 1
+            yield json.dumps({"line": line}) + "\n"
+        yield json.dumps({"done": True, "count": count, "file": filename}) + "\n"
+
+    return StreamingResponse(_results(), media_type="application/x-ndjson")
+
+
 @router.post("/admin/smtp-logs/clear")
 def owa_admin_smtp_logs_clear(
     request: Request,
@@ -783,16 +889,13 @@ async def outlook_health_data(
         logs_dir = os.getenv("LOGS_DIR", "logs")
         health_issues_file = os.path.join(logs_dir, "outlook", "health_issues.log")
         if os.path.exists(health_issues_file):
-            with open(health_issues_file, "r") as f:
-                lines = f.readlines()[-50:]  # Last 50 issues
-                for line in lines:
-                    try:
-                        import json
-
-                        issue = json.loads(line.strip())
-                        health_issues.append(issue)
-                    except:
-                        continue
+            lines = await asyncio.to_thread(tail_lines, health_issues_file, 50)  # Last 50 issues
+            for line in lines:
+                try:
+                    issue = json.loads(line.strip())
+                    health_issues.append(issue)
+                except:
+                    continue
     except Exception as e:
         pass
 
@@ -986,20 +1089,8 @@ async def owa_admin_action_queue_flush(
         cycles += 1
         await email_delivery.process_queue(db)
         # Check if more work remains
-        pending = (
-            db.query(QueuedEmail)
-            .filter(QueuedEmail.status == EmailQueueStatus.PENDING.value)
-            .count()
-        )
-        retry_ready = (
-            db.query(QueuedEmail)
-            .filter(
-                QueuedEmail.status == EmailQueueStatus.RETRY.value,
-                QueuedEmail.next_retry_at <= now,
-            )
-            .count()
-        )
-        if pending == 0 and retry_ready == 0:
+        stats = email_queue.get_queue_stats()
+        if not stats.get("pending") and not stats.get("retry_ready"):
             break
     return {"status": "flushed", "fast_forwarded": updated, "cycles": cycles}
 
@@ -1068,8 +1159,9 @@ async def owa_admin_action_queue_resend(
     queued.status = EmailQueueStatus.PENDING.value
     queued.retry_count = 0
     queued.error_message = None
-    queued.next_retry_at = None
-    queued.updated_at = datetime.utcnow()
+    queued.lease_owner = None
+    queued.next_retry_at = datetime.utcnow()
+    queued.updated_at = queued.next_retry_at
     db.commit()
 
     await email_delivery.process_queue(db)
@@ -1187,9 +1279,7 @@ def owa_admin_audit_logs(
             full = os.path.join(logs_dir, path)
             if not os.path.exists(full):
                 return ""
-            with open(full, "r", encoding="utf-8", errors="ignore") as f:
-                lines = f.readlines()
-                return "".join(lines[-max_lines:])
+            return "".join(line + "\n" for line in tail_lines(full, max_lines))
         except Exception:
             return ""
 
@@ -1290,14 +1380,21 @@ async def owa_send_email(
 
     form_data = await request.form()
 
-    email_data = EmailCreate(
-        subject=form_data.get("subject", ""),
-        body=form_data.get("body", ""),
-        recipient_email=form_data.get("recipient_email", ""),
-    )
-
     email_service = EmailService(db)
     try:
+        # "a@x, b@y; c@z" addresses one message to several recipients
+        recipients = [
+            address.strip()
+            for address in re.split(r"[,;]", form_data.get("recipient_email", ""))
+            if address.strip()
+        ] or [""]
+        email_data = EmailCreate(
+            subject=form_data.get("subject", ""),
+            body=form_data.get("body", ""),
+            recipient_email=recipients[0],
+            additional_recipients=recipients[1:],
+        )
+
         email_service.send_email(email_data, current_user.id)
         return templates.TemplateResponse(
             "owa/success.html",
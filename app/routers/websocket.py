@@ -80,7 +80,8 @@ async def get_connections():
         "user_connections": {
             str(user_id): len(connections) 
             for user_id, connections in manager.active_connections.items()
-        }
+        },
+        "metrics": manager.get_stats()
     }
 
 @router.get("/test")
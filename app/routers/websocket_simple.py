@@ -64,4 +64,5 @@ async def get_connections():
             str(user_id): len(connections)
             for user_id, connections in manager.active_connections.items()
         },
+        "metrics": manager.get_stats(),
     }
@@ -0,0 +1,187 @@
+"""
+Autodiscover Cache
+Rendered Autodiscover responses and the per-user settings behind them.
+
+Outlook calls Autodiscover at every start and reconnect, and after a
+network blip every client calls it at once. The answer only depends on the
+mailbox (display name, uuid), the requested schema and the host, so:
+- mailbox profiles are cached per normalized address for ``ttl`` seconds,
+  including misses, so unknown addresses do not hit the database either
+- rendered payloads are cached per (address, schema, host, protocol)
+- user inserts/updates/deletes committed in this process drop that
+  address at once; changes from other processes age out with the TTL
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, object_session
+
+from ..database import User
+
+logger = logging.getLogger(__name__)
+
+AUTODISCOVER_CACHE_TTL = float(os.getenv("AUTODISCOVER_CACHE_TTL", "300"))
+AUTODISCOVER_CACHE_SIZE = int(os.getenv("AUTODISCOVER_CACHE_SIZE", "10000"))
+
+_PENDING_KEY = "autodiscover_cache_pending"
+
+
+def normalize_email(address: Optional[str]) -> str:
+    return (address or "").strip().lower()
+
+
+@dataclass(frozen=True)
+class MailboxProfile:
+    """The per-user part of an Autodiscover response."""
+
+    email: str  # as stored, so every spelling of the address gets the same answer
+    display_name: str
+    user_uuid: Optional[str]
+
+    @classmethod
+    def from_user(cls, user: User, address: str) -> "MailboxProfile":
+        return cls(
+            email=user.email,
+            display_name=user.full_name or user.username or address,
+            user_uuid=getattr(user, "uuid", None),
+        )
+
+
+def load_profile(db: Session, address: str) -> Optional[MailboxProfile]:
+    """Look up a mailbox by address (exact match first, then case-insensitive)."""
+    user = db.query(User).filter(User.email == address).first()
+    if user is None:
+        user = db.query(User).filter(func.lower(User.email) == normalize_email(address)).first()
+    return MailboxProfile.from_user(user, address) if user is not None else None
+
+
+class AutodiscoverCache:
+    """TTL + LRU cache of mailbox profiles and rendered responses."""
+
+    def __init__(self, ttl: float = AUTODISCOVER_CACHE_TTL, max_entries: int = AUTODISCOVER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._profiles: "OrderedDict[str, Tuple[Optional[MailboxProfile], float]]" = OrderedDict()
+        self._responses: "OrderedDict[Tuple, Tuple[object, float]]" = OrderedDict()
+        self._keys_by_email: Dict[str, Set[Tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, store: OrderedDict, key: Hashable):
+        entry = store.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        store.move_to_end(key)
+        return entry
+
+    def _evict(self) -> None:
+        while len(self._responses) > self.max_entries:
+            key, _entry = self._responses.popitem(last=False)
+            keys = self._keys_by_email.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_email[key[0]]
+        while len(self._profiles) > self.max_entries:
+            self._profiles.popitem(last=False)
+
+    # --- Profiles ---------------------------------------------------------------
+
+    def cached_profile(self, address: str) -> Tuple[bool, Optional[MailboxProfile]]:
+        """(found in cache, profile); a cached miss is (True, None)."""
+        with self._lock:
+            entry = self._get(self._profiles, normalize_email(address))
+        return (True, entry[0]) if entry is not None else (False, None)
+
+    def store_profile(self, address: str, profile: Optional[MailboxProfile]) -> None:
+        with self._lock:
+            self._profiles[normalize_email(address)] = (profile, time.monotonic() + self.ttl)
+            self._profiles.move_to_end(normalize_email(address))
+            self._evict()
+
+    # --- Responses --------------------------------------------------------------
+
+    def get_response(self, key: Tuple):
+        """Cached payload for ``key`` (first element is the normalized address), or None."""
+        with self._lock:
+            entry = self._get(self._responses, key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def store_response(self, key: Tuple, payload) -> None:
+        with self._lock:
+            self._responses[key] = (payload, time.monotonic() + self.ttl)
+            self._responses.move_to_end(key)
+            self._keys_by_email.setdefault(key[0], set()).add(key)
+            self._evict()
+
+    # --- Invalidation -----------------------------------------------------------
+
+    def invalidate_email(self, address: str) -> None:
+        email = normalize_email(address)
+        with self._lock:
+            self._profiles.pop(email, None)
+            for key in self._keys_by_email.pop(email, ()):
+                self._responses.pop(key, None)
+
+    def invalidate(self) -> None:
+        """Drop everything (e.g. after a hostname or port change)."""
+        with self._lock:
+            self._profiles.clear()
+            self._responses.clear()
+            self._keys_by_email.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "profiles": len(self._profiles),
+                "responses": len(self._responses),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+autodiscover_cache = AutodiscoverCache()
+
+
+# --- Change tracking ----------------------------------------------------------
+# Addresses touched by a flush are dropped once the transaction commits.
+
+
+def _stage(target: User) -> None:
+    session = object_session(target)
+    if session is None:
+        return
+    pending = session.info.setdefault(_PENDING_KEY, set())
+    pending.add(normalize_email(target.email))
+    for previous in sa_inspect(target).attrs.email.history.deleted or ():
+        pending.add(normalize_email(previous))
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _on_user_write(mapper, connection, target) -> None:
+    _stage(target)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session) -> None:
+    for address in session.info.pop(_PENDING_KEY, ()):
+        autodiscover_cache.invalidate_email(address)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
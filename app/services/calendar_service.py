@@ -18,6 +18,20 @@ from ..models import (
     CalendarFolderResponse,
     CalendarFolderTree,
 )
+from .recurrence import Occurrence, series_for
+
+
+def _occurrence_copy(master: CalendarEvent, occurrence: Occurrence) -> CalendarEvent:
+    """Transient CalendarEvent for one occurrence of a recurring master."""
+    copy = CalendarEvent(
+        **{
+            column.key: getattr(master, column.key)
+            for column in CalendarEvent.__table__.columns
+        }
+    )
+    copy.start_time = occurrence.start
+    copy.end_time = occurrence.end
+    return copy
 
 
 class CalendarService:
@@ -176,11 +190,23 @@ class CalendarService:
             ),
             tags=json.dumps(event_data.tags) if event_data.tags else None,
         )
+        self._apply_recurrence(event, event_data)
         self.db.add(event)
         self.db.commit()
         self.db.refresh(event)
         return event
 
+    @staticmethod
+    def _apply_recurrence(event: CalendarEvent, event_data: CalendarEventCreate) -> None:
+        pattern = event_data.recurrence_pattern
+        if isinstance(pattern, dict):
+            pattern = json.dumps(pattern)
+        event.is_recurring = bool(pattern)
+        event.recurrence_pattern = pattern or None
+        event.recurrence_start = event_data.start_time if pattern else None
+        event.recurrence_end = event_data.recurrence_end if pattern else None
+        event.recurrence_count = event_data.recurrence_count if pattern else None
+
     def get_calendar_events(
         self,
         user_id: int,
@@ -256,6 +282,8 @@ class CalendarService:
             if event_data.tags:
                 event.tags = json.dumps(event_data.tags)
 
+            self._apply_recurrence(event, event_data)
+
             # Recalculate duration
             event.duration = str(event_data.end_time - event_data.start_time)
             event.updated_at = datetime.utcnow()
@@ -277,19 +305,40 @@ class CalendarService:
     def get_events_by_date_range(
         self, user_id: int, start_date: datetime, end_date: datetime
     ) -> List[CalendarEvent]:
-        """Get events within a date range"""
-        return (
+        """Get events overlapping a date range, recurring series expanded.
+
+        Each occurrence of a series is returned as a detached copy of the
+        master carrying the occurrence's start and end time.
+        """
+        events = (
             self.db.query(CalendarEvent)
             .filter(
-                and_(
-                    CalendarEvent.owner_id == user_id,
-                    CalendarEvent.start_time >= start_date,
-                    CalendarEvent.end_time <= end_date,
-                )
+                CalendarEvent.owner_id == user_id,
+                CalendarEvent.start_time < end_date,
+                or_(
+                    CalendarEvent.end_time > start_date,
+                    # Masters can start long before the range and still recur in it
+                    and_(
+                        CalendarEvent.is_recurring.is_(True),
+                        or_(
+                            CalendarEvent.recurrence_end.is_(None),
+                            CalendarEvent.recurrence_end >= start_date,
+                        ),
+                    ),
+                ),
             )
-            .order_by(CalendarEvent.start_time)
             .all()
         )
+        expanded: List[CalendarEvent] = []
+        for event in events:
+            series = series_for(event)
+            if series is None:
+                if event.end_time > start_date:
+                    expanded.append(event)
+                continue
+            for occurrence in series.occurrences(start_date, end_date):
+                expanded.append(_occurrence_copy(event, occurrence))
+        return sorted(expanded, key=lambda e: (e.start_time, e.id))
 
     def get_upcoming_events(self, user_id: int, days: int = 7) -> List[CalendarEvent]:
         """Get upcoming events for the next N days"""
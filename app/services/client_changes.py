@@ -0,0 +1,270 @@
+"""
+Client Changes
+Sync <Commands> and MoveItems from ActiveSync clients, applied in bulk.
+
+The Sync handler logged the client's Delete ServerIds and dropped them,
+ignored Change (read state), and MoveItems answered a canned success, so
+a client reconnecting with hundreds of queued changes kept resending
+them. Each request's changes are now applied as one batch:
+- one SELECT loads every referenced row the user owns (sender or
+  recipient), with the fields that decide folder membership and size
+- one UPDATE per change type (delete, mark read, mark unread, restore),
+  each restricted to the ids that actually change and re-checking
+  ownership in its WHERE clause, inside the request's transaction
+- bulk UPDATEs bypass the ORM flush hook, so the folder counter deltas
+  are computed from the loaded rows and applied here; Email objects
+  already in the session are expired
+- every item gets its own status: Sync uses MS-ASCMD 1 (success) and
+  8 (object not found), MoveItems 3 (success), 1 (invalid source),
+  2 (invalid destination) and 4 (same folder). Repeating a batch after a
+  lost response succeeds again instead of failing
+- one coalesced notification per batch (a WebSocket email_update and an
+  EAS push per affected folder), sent when the transaction commits
+
+Mail folders are derived from the row flags (see database.email_folders):
+Delete and moves to Deleted Items set is_deleted, moves out of it clear
+it. A Delete inside Deleted Items is accepted but keeps the row, like the
+other protocols' soft delete.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from ..database import Email, apply_folder_deltas, email_folders
+
+logger = logging.getLogger(__name__)
+
+# MS-ASCMD Sync per-item status
+STATUS_SUCCESS = "1"
+STATUS_NOT_FOUND = "8"
+
+# MS-ASCMD MoveItems status
+MOVE_INVALID_SOURCE = "1"
+MOVE_INVALID_DESTINATION = "2"
+MOVE_SUCCESS = "3"
+MOVE_SAME_FOLDER = "4"
+
+_PENDING_KEY = "client_changes_pending"
+
+_Row = Dict[str, object]
+
+
+def parse_server_id(server_id: Optional[str]) -> Optional[int]:
+    """Email id of a ServerId ("1:42", or a bare "42"); None when malformed."""
+    value = (server_id or "").rpartition(":")[2]
+    return int(value) if value.isdigit() else None
+
+
+def _owner(user_id: int):
+    return or_(Email.sender_id == user_id, Email.recipient_id == user_id)
+
+
+def _load_rows(db: Session, user_id: int, ids: Iterable[int]) -> Dict[int, _Row]:
+    """Rows of ``ids`` owned by the user, in one query."""
+    ids = sorted(set(ids))
+    if not ids:
+        return {}
+    size = func.length(func.coalesce(Email.mime_content, Email.body, ""))
+    query = (
+        select(Email.id, Email.recipient_id, Email.sender_id, Email.is_deleted, Email.is_read, size.label("size"))
+        .where(Email.id.in_(ids), _owner(user_id))
+    )
+    return {row.id: dict(row._mapping) for row in db.execute(query)}
+
+
+def _listed_in(row: _Row, user_id: int, folder: str) -> bool:
+    return any(
+        owner == user_id and name == folder
+        for owner, name, _unread in email_folders(row["recipient_id"], row["sender_id"], row["is_deleted"], row["is_read"])
+    )
+
+
+def _apply(db: Session, user_id: int, rows: Dict[int, _Row], targets: Dict[int, Dict[str, bool]]) -> Set[int]:
+    """
+    Write ``targets`` ({email id: {"is_deleted"/"is_read": value}}) with one
+    UPDATE per (column, value), keep the folder counters exact and return
+    the ids that changed.
+    """
+    batches: Dict[Tuple[str, bool], List[int]] = {}
+    for email_id, values in targets.items():
+        for column, value in values.items():
+            if bool(rows[email_id][column]) != value:
+                batches.setdefault((column, value), []).append(email_id)
+    if not batches:
+        return set()
+
+    now = datetime.utcnow()
+    changed: Set[int] = set()
+    for (column, value), ids in sorted(batches.items()):
+        # Read state belongs to the recipient; deletion to either side
+        owner = Email.recipient_id == user_id if column == "is_read" else _owner(user_id)
+        db.execute(
+            update(Email)
+            .where(Email.id.in_(ids), owner)
+            .values({column: value, "updated_at": now})
+            .execution_options(synchronize_session=False)
+        )
+        changed.update(ids)
+
+    deltas: Dict[Tuple[int, str], List[int]] = {}
+
+    def add(row: _Row, sign: int) -> None:
+        for owner_id, folder, unread in email_folders(
+            row["recipient_id"], row["sender_id"], row["is_deleted"], row["is_read"]
+        ):
+            entry = deltas.setdefault((owner_id, folder), [0, 0, 0])
+            entry[0] += sign
+            entry[1] += sign * unread
+            entry[2] += sign * (row["size"] or 0)
+
+    for email_id in changed:
+        before = rows[email_id]
+        after = dict(before, **targets[email_id])
+        add(before, -1)
+        add(after, 1)
+        rows[email_id] = after
+    apply_folder_deltas(db.connection(), deltas)
+
+    # Objects loaded earlier in this session would still show the old flags
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, Email) and obj.id in changed:
+            db.expire(obj)
+    return changed
+
+
+def apply_sync_commands(
+    db: Session,
+    user_id: int,
+    collection_id: str,
+    commands: dict,
+    folders: Dict[str, str],
+) -> List[dict]:
+    """
+    Apply a collection's parsed <Commands> (see parse_wbxml_sync_commands).
+
+    Returns [{"kind": "delete"|"change", "server_id", "status"}] in request
+    order. A Change of properties the mailbox does not store (flags) is
+    accepted without effect.
+    """
+    folder = folders.get(collection_id)
+    deletes = commands.get("deletes") or []
+    changes = commands.get("changes") or []
+    items = [("delete", server_id, None) for server_id in deletes]
+    items.extend(("change", change["server_id"], change.get("read")) for change in changes)
+    rows = _load_rows(db, user_id, filter(None, (parse_server_id(sid) for _kind, sid, _read in items)))
+
+    results = []
+    targets: Dict[int, Dict[str, bool]] = {}
+    for kind, server_id, read in items:
+        email_id = parse_server_id(server_id)
+        row = rows.get(email_id)
+        # Deleted rows stay addressable so a resent Delete is not an error
+        if folder is None or row is None or not (
+            _listed_in(row, user_id, folder) or (kind == "delete" and row["is_deleted"])
+        ):
+            results.append({"kind": kind, "server_id": server_id, "status": STATUS_NOT_FOUND})
+            continue
+        if kind == "delete":
+            targets.setdefault(email_id, {})["is_deleted"] = True
+        elif read is not None and row["recipient_id"] == user_id:
+            targets.setdefault(email_id, {})["is_read"] = read
+        results.append({"kind": kind, "server_id": server_id, "status": STATUS_SUCCESS})
+
+    changed = _apply(db, user_id, rows, targets)
+    if changed:
+        stage_notification(db, user_id, changed, {collection_id})
+    return results
+
+
+def move_items(db: Session, user_id: int, moves: List[dict], folders: Dict[str, str]) -> List[dict]:
+    """
+    Apply parsed MoveItems requests (see parse_wbxml_moveitems_request).
+
+    Returns [{"src_msg_id", "status", "dst_msg_id"}] in request order.
+    Mail can move between Inbox or Sent Items and Deleted Items; a move
+    the row cannot make (e.g. received mail into Sent Items) is an invalid
+    destination.
+    """
+    rows = _load_rows(db, user_id, filter(None, (parse_server_id(m.get("src_msg_id")) for m in moves)))
+    results = []
+    targets: Dict[int, Dict[str, bool]] = {}
+    touched: Set[str] = set()
+    for move in moves:
+        src_msg_id = move.get("src_msg_id")
+        src_fld_id, dst_fld_id = move.get("src_fld_id"), move.get("dst_fld_id")
+        result = {"src_msg_id": src_msg_id, "status": MOVE_SUCCESS, "dst_msg_id": None}
+        results.append(result)
+        email_id = parse_server_id(src_msg_id)
+        row = rows.get(email_id)
+        source, destination = folders.get(src_fld_id), folders.get(dst_fld_id)
+        if source is None or row is None:
+            result["status"] = MOVE_INVALID_SOURCE
+            continue
+        if destination is None:
+            result["status"] = MOVE_INVALID_DESTINATION
+            continue
+        if source == destination:
+            result["status"] = MOVE_SAME_FOLDER
+            continue
+        target = dict(row, **targets.get(email_id, {}))
+        if _listed_in(target, user_id, destination):
+            # Already there (e.g. the client resent the request)
+            result["dst_msg_id"] = f"{dst_fld_id}:{email_id}"
+            continue
+        if not _listed_in(target, user_id, source):
+            result["status"] = MOVE_INVALID_SOURCE
+            continue
+        target["is_deleted"] = destination == "deleted"
+        if not _listed_in(target, user_id, destination):
+            result["status"] = MOVE_INVALID_DESTINATION
+            continue
+        targets.setdefault(email_id, {})["is_deleted"] = target["is_deleted"]
+        result["dst_msg_id"] = f"{dst_fld_id}:{email_id}"
+        touched.update((src_fld_id, dst_fld_id))
+
+    changed = _apply(db, user_id, rows, targets)
+    if changed:
+        stage_notification(db, user_id, changed, touched)
+    return results
+
+
+# --- Notifications ------------------------------------------------------------
+# One per batch, sent once the changes are committed.
+
+
+def stage_notification(db: Session, user_id: int, email_ids: Iterable[int], collection_ids: Iterable[str]) -> None:
+    pending = db.info.setdefault(_PENDING_KEY, {})
+    ids, collections = pending.setdefault(user_id, (set(), set()))
+    ids.update(email_ids)
+    collections.update(collection_ids)
+
+
+def _notify(user_id: int, email_ids: Set[int], collection_ids: Set[str]) -> None:
+    from ..websocket_manager import manager
+
+    try:
+        manager.notify_email_update(
+            user_id, {"action": "bulk_update", "email_ids": sorted(email_ids), "count": len(email_ids)}
+        )
+    except Exception as exc:
+        logger.debug("WebSocket update for user %s failed: %s", user_id, exc)
+    from ..push_notifications import schedule_notify_new_email
+
+    # Wake the user's other devices parked in Ping or a hanging Sync; runs
+    # after commit on a DB pool thread, so delivered on the main loop
+    for collection_id in sorted(collection_ids):
+        schedule_notify_new_email(user_id, folder_id=collection_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _send_pending(session: Session) -> None:
+    for user_id, (email_ids, collection_ids) in session.info.pop(_PENDING_KEY, {}).items():
+        _notify(user_id, email_ids, collection_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
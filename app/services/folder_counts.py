@@ -0,0 +1,181 @@
+"""
+Folder Counts
+Materialized total, unread and size per (mailbox, mail folder).
+
+EWS GetFolder, ActiveSync GetItemEstimate, MAPI folder properties and the
+OWA stats summary each used to count on their own: COUNT(*) per folder per
+request, ``len()`` of a list capped at the window size, or a hardcoded 0.
+They now read ``folder_counters``, one primary-key lookup per mailbox:
+- the counters are maintained in the same transaction as the Email rows
+  they count (session after_flush hook in database.py), so inserts,
+  read-flag changes, deletes and moves between folders keep them exact
+- reconcile() recomputes them from the emails table and corrects drift,
+  e.g. from raw SQL writes; FolderCountReconciler runs it periodically
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.orm import Session
+
+from ..database import Email, FolderCounter, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+FOLDERS = ("inbox", "sent", "deleted")
+RECONCILE_INTERVAL = int(os.getenv("FOLDER_COUNTS_RECONCILE_INTERVAL", "3600"))
+
+_Totals = Tuple[int, int, int]
+
+
+def _empty() -> Dict[str, int]:
+    return {"total": 0, "unread": 0, "size": 0}
+
+
+def get_counts(db: Session, user_id: int) -> Dict[str, Dict[str, int]]:
+    """Counters for every mail folder of ``user_id``; missing ones read as 0."""
+    counts = {folder: _empty() for folder in FOLDERS}
+    for row in db.query(FolderCounter).filter(FolderCounter.user_id == user_id):
+        counts[row.folder] = {
+            "total": row.total_count,
+            "unread": row.unread_count,
+            "size": row.size_bytes,
+        }
+    return counts
+
+
+def get_folder_count(db: Session, user_id: int, folder: str) -> Dict[str, int]:
+    row = db.get(FolderCounter, (user_id, folder))
+    if row is None:
+        return _empty()
+    return {"total": row.total_count, "unread": row.unread_count, "size": row.size_bytes}
+
+
+def _actual_totals(db: Session, user_id: Optional[int]) -> Dict[Tuple[int, str], _Totals]:
+    """Counters as recomputed from the emails table (same rules as email_folders)."""
+    size = func.length(func.coalesce(Email.mime_content, Email.body, ""))
+    unread = case((Email.is_read == True, 0), else_=1)  # noqa: E712
+    memberships = (
+        ("inbox", Email.recipient_id, unread, Email.is_deleted == False, None),  # noqa: E712
+        ("sent", Email.sender_id, 0, Email.is_deleted == False, None),  # noqa: E712
+        ("deleted", Email.recipient_id, unread, Email.is_deleted == True, None),  # noqa: E712
+        (
+            "deleted",
+            Email.sender_id,
+            0,
+            Email.is_deleted == True,  # noqa: E712
+            or_(Email.recipient_id.is_(None), Email.recipient_id != Email.sender_id),
+        ),
+    )
+    totals: Dict[Tuple[int, str], _Totals] = {}
+    for folder, owner, unread_expr, state, extra in memberships:
+        query = (
+            db.query(owner, func.count(Email.id), func.sum(unread_expr), func.sum(size))
+            .filter(owner.isnot(None), state)
+        )
+        if extra is not None:
+            query = query.filter(extra)
+        if user_id is not None:
+            query = query.filter(owner == user_id)
+        for owner_id, count, unread_count, size_bytes in query.group_by(owner):
+            total, unread_total, size_total = totals.get((owner_id, folder), (0, 0, 0))
+            totals[(owner_id, folder)] = (
+                total + count,
+                unread_total + int(unread_count or 0),
+                size_total + int(size_bytes or 0),
+            )
+    return totals
+
+
+def reconcile(db: Session, user_id: Optional[int] = None) -> int:
+    """Rewrite counters that drifted from the emails table; returns how many.
+
+    The counter rows are locked first, so on Postgres a concurrent writer
+    either committed before the recount (and is in it) or waits and
+    applies its delta on top.
+    """
+    query = db.query(FolderCounter)
+    if user_id is not None:
+        query = query.filter(FolderCounter.user_id == user_id)
+    stored = {(row.user_id, row.folder): row for row in query.with_for_update()}
+    actual = _actual_totals(db, user_id)
+
+    fixed = 0
+    now = datetime.utcnow()
+    for key in set(stored) | set(actual):
+        total, unread, size = actual.get(key, (0, 0, 0))
+        row = stored.get(key)
+        if row is None:
+            row = FolderCounter(user_id=key[0], folder=key[1])
+            db.add(row)
+        elif (row.total_count, row.unread_count, row.size_bytes) == (total, unread, size):
+            continue
+        else:
+            logger.info(
+                "Folder counter %s drifted: %s -> %s",
+                key,
+                (row.total_count, row.unread_count, row.size_bytes),
+                (total, unread, size),
+            )
+        row.total_count, row.unread_count, row.size_bytes = total, unread, size
+        row.updated_at = now
+        fixed += 1
+    db.commit()
+    return fixed
+
+
+class FolderCountReconciler:
+    """Background job that periodically corrects folder counter drift."""
+
+    def __init__(self, interval: int = RECONCILE_INTERVAL):
+        self.interval = interval
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+
+    def run_once(self) -> int:
+        db = SessionLocal()
+        try:
+            return reconcile(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._reconcile_loop())
+        logger.info("Folder count reconciler started")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        logger.info("Folder count reconciler stopped")
+
+    async def _reconcile_loop(self):
+        while self.running:
+            try:
+                await asyncio.sleep(self.interval)
+                fixed = await asyncio.to_thread(self.run_once)
+                if fixed:
+                    logger.warning(f"Corrected {fixed} folder counter(s)")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error reconciling folder counters: {e}")
+
+
+# Global reconciler instance
+folder_count_reconciler = FolderCountReconciler()
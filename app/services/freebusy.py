@@ -0,0 +1,310 @@
+"""
+Free/Busy Index
+Per-user merged busy intervals for availability lookups.
+
+EWS GetUserAvailability, the calendar REST API and CalDAV scheduling all ask
+the same question: when is each of these mailboxes busy this week? Answering
+it from the calendar_events table means loading and expanding every
+recurring series of every attendee on every request. Instead each user's
+calendar is kept in memory as
+- single events sorted by start (a window is two binary searches)
+- recurring series as RecurrenceSeries objects (expanded lazily per window)
+- merged busy intervals per week, built on first use
+
+The index is kept current through the DAV change log: one grouped MAX()
+over ``dav_changes`` per lookup tells which users changed since they were
+loaded, and only the changed events are re-read and patched in. That works
+the same for writes made by this process and by any other service.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..database import CalendarEvent, DavChange, User
+from .dav_sync import changes_since
+from .recurrence import Occurrence, RecurrenceSeries, build_series
+
+logger = logging.getLogger(__name__)
+
+# Ordered by precedence: where intervals overlap the highest level wins
+STATUSES = ("free", "tentative", "busy", "oof")
+LEVELS = {status: level for level, status in enumerate(STATUSES)}
+# EWS LegacyFreeBusyType names and MergedFreeBusy digits (4 = NoData)
+LEGACY_NAMES = ("Free", "Tentative", "Busy", "OOF")
+NO_DATA = "4"
+
+WEEK = timedelta(days=7)
+# Above this many changed events a user is reloaded rather than patched
+FULL_RELOAD_CHANGES = 500
+# Merged weeks cached per user before the cache is reset
+MAX_CACHED_WEEKS = 104
+
+_EVENT_COLUMNS = (
+    CalendarEvent.id,
+    CalendarEvent.owner_id,
+    CalendarEvent.start_time,
+    CalendarEvent.end_time,
+    CalendarEvent.is_recurring,
+    CalendarEvent.recurrence_pattern,
+    CalendarEvent.recurrence_end,
+    CalendarEvent.recurrence_count,
+    CalendarEvent.meeting_status,
+    CalendarEvent.updated_at,
+)
+
+
+def status_level(status: Optional[str]) -> int:
+    level = LEVELS.get(status)
+    if level is None:
+        # Unknown values count as busy, like Exchange's default show-as
+        level = LEVELS.get((status or "busy").lower(), LEVELS["busy"])
+    return level
+
+
+def _week_start(moment: datetime) -> datetime:
+    day = moment.date() - timedelta(days=moment.weekday())
+    return datetime(day.year, day.month, day.day)
+
+
+def merge_busy(occurrences: Iterable[Occurrence]) -> List[Occurrence]:
+    """Collapse overlapping occurrences into disjoint intervals, highest status wins.
+
+    Free occurrences are dropped; touching intervals of the same status join.
+    """
+    points: List[Tuple[datetime, int, int]] = []
+    for occ in occurrences:
+        level = status_level(occ.status)
+        if level == 0 or occ.end <= occ.start:
+            continue
+        points.append((occ.start, 1, level))
+        points.append((occ.end, -1, level))
+    points.sort()
+    merged: List[Occurrence] = []
+    counts = [0] * len(STATUSES)
+    current = 0
+    since: Optional[datetime] = None
+    i = 0
+    while i < len(points):
+        at = points[i][0]
+        while i < len(points) and points[i][0] == at:
+            counts[points[i][2]] += points[i][1]
+            i += 1
+        level = next((lv for lv in range(len(STATUSES) - 1, 0, -1) if counts[lv] > 0), 0)
+        if level == current:
+            continue
+        if current:
+            _append(merged, Occurrence(since, at, STATUSES[current]))
+        current, since = level, at
+    return merged
+
+
+def _append(merged: List[Occurrence], occ: Occurrence) -> None:
+    if merged and merged[-1].status == occ.status and merged[-1].end >= occ.start:
+        merged[-1] = Occurrence(merged[-1].start, max(merged[-1].end, occ.end), occ.status)
+    else:
+        merged.append(occ)
+
+
+def merged_free_busy(
+    intervals: List[Occurrence], start: datetime, end: datetime, slot_minutes: int = 30
+) -> str:
+    """EWS MergedFreeBusy digits: the highest status within each slot."""
+    slot = timedelta(minutes=max(slot_minutes, 5))
+    digits = []
+    pos = 0
+    cursor = start
+    while cursor < end:
+        slot_end = min(cursor + slot, end)
+        while pos < len(intervals) and intervals[pos].end <= cursor:
+            pos += 1
+        level = 0
+        scan = pos
+        while scan < len(intervals) and intervals[scan].start < slot_end:
+            level = max(level, status_level(intervals[scan].status))
+            scan += 1
+        digits.append(str(level))
+        cursor = slot_end
+    return "".join(digits)
+
+
+class _UserCalendar:
+    """Busy data of one mailbox as of ``revision`` of its calendar change log."""
+
+    def __init__(self, revision: int):
+        self.revision = revision
+        self.singles: Dict[int, Occurrence] = {}
+        self.by_start: List[Tuple[datetime, datetime, str, int]] = []
+        self.longest = timedelta(0)
+        self.series: Dict[int, RecurrenceSeries] = {}
+        self.weeks: Dict[datetime, List[Occurrence]] = {}
+
+    def _invalidate(self, start: datetime, end: datetime) -> None:
+        week = _week_start(start)
+        while True:
+            self.weeks.pop(week, None)
+            week += WEEK
+            if week >= end:
+                break
+
+    def remove(self, event_id: int) -> None:
+        single = self.singles.pop(event_id, None)
+        if single is not None:
+            item = (single.start, single.end, single.status, event_id)
+            pos = bisect_left(self.by_start, item)
+            if pos < len(self.by_start) and self.by_start[pos] == item:
+                del self.by_start[pos]
+            self._invalidate(single.start, single.end)
+        if self.series.pop(event_id, None) is not None:
+            self.weeks.clear()
+
+    def add(self, row) -> None:
+        if status_level(row.meeting_status) == 0:
+            return  # "show as free" never blocks time
+        # The index owns its series; the shared series cache serves per-request paths
+        series = build_series(row)
+        if series is not None:
+            self.series[row.id] = series
+            self.weeks.clear()
+            return
+        if row.end_time < row.start_time:
+            return
+        single = Occurrence(row.start_time, row.end_time, STATUSES[status_level(row.meeting_status)])
+        self.singles[row.id] = single
+        insort(self.by_start, (single.start, single.end, single.status, row.id))
+        self.longest = max(self.longest, single.end - single.start)
+        self._invalidate(single.start, single.end)
+
+    def _build_week(self, week: datetime) -> List[Occurrence]:
+        week_end = week + WEEK
+        lo = bisect_left(self.by_start, (week - self.longest,))
+        hi = bisect_left(self.by_start, (week_end,))
+        items = [Occurrence(s, e, st) for s, e, st, _id in self.by_start[lo:hi] if e > week]
+        for series in self.series.values():
+            items.extend(series.expand(week, week_end))  # the merged week is the cache
+        clipped = [
+            Occurrence(max(o.start, week), min(o.end, week_end), o.status) for o in merge_busy(items)
+        ]
+        if len(self.weeks) >= MAX_CACHED_WEEKS:
+            self.weeks.clear()
+        self.weeks[week] = clipped
+        return clipped
+
+    def busy(self, start: datetime, end: datetime) -> List[Occurrence]:
+        result: List[Occurrence] = []
+        week = _week_start(start)
+        while week < end:
+            merged = self.weeks.get(week)
+            if merged is None:
+                merged = self._build_week(week)
+            for occ in merged:
+                if occ.end <= start or occ.start >= end:
+                    continue
+                _append(result, Occurrence(max(occ.start, start), min(occ.end, end), occ.status))
+            week += WEEK
+        return result
+
+
+class FreeBusyIndex:
+    """Process-wide busy-interval index, loaded per user on first lookup."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users: Dict[int, _UserCalendar] = {}
+
+    def _revisions(self, db: Session, user_ids: List[int]) -> Dict[int, int]:
+        rows = (
+            db.query(DavChange.owner_id, func.max(DavChange.id))
+            .filter(DavChange.collection == "calendar", DavChange.owner_id.in_(user_ids))
+            .group_by(DavChange.owner_id)
+            .all()
+        )
+        revisions = {user_id: 0 for user_id in user_ids}
+        revisions.update({owner_id: revision or 0 for owner_id, revision in rows})
+        return revisions
+
+    def _load(self, db: Session, user_ids: List[int], revisions: Dict[int, int]) -> None:
+        started = time.perf_counter()
+        calendars = {user_id: _UserCalendar(revisions[user_id]) for user_id in user_ids}
+        rows = db.query(*_EVENT_COLUMNS).filter(CalendarEvent.owner_id.in_(user_ids)).all()
+        for row in rows:
+            calendars[row.owner_id].add(row)
+        with self._lock:
+            self._users.update(calendars)
+        logger.info(
+            "Free/busy index loaded %d users (%d events) in %.1f ms",
+            len(user_ids),
+            len(rows),
+            (time.perf_counter() - started) * 1000,
+        )
+
+    def _patch(self, db: Session, user_id: int, calendar: _UserCalendar) -> bool:
+        """Apply changes since the user's revision; False when a reload is cheaper."""
+        changed, deleted, newest = changes_since(db, user_id, "calendar", calendar.revision)
+        if len(changed) + len(deleted) > FULL_RELOAD_CHANGES:
+            return False
+        rows = (
+            db.query(*_EVENT_COLUMNS)
+            .filter(CalendarEvent.owner_id == user_id, CalendarEvent.id.in_(changed))
+            .all()
+            if changed
+            else []
+        )
+        with self._lock:
+            if calendar.revision >= newest:
+                return True  # another thread got there first
+            for event_id in changed | deleted:
+                calendar.remove(event_id)
+            for row in rows:
+                calendar.add(row)
+            calendar.revision = newest
+        return True
+
+    def refresh(self, db: Session, user_ids: Iterable[int]) -> None:
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return
+        revisions = self._revisions(db, user_ids)
+        missing = []
+        for user_id in user_ids:
+            with self._lock:
+                calendar = self._users.get(user_id)
+            if calendar is None:
+                missing.append(user_id)
+            elif calendar.revision < revisions[user_id] and not self._patch(db, user_id, calendar):
+                missing.append(user_id)
+        if missing:
+            self._load(db, missing, revisions)
+
+    def busy_intervals(
+        self, db: Session, user_ids: Iterable[int], start: datetime, end: datetime
+    ) -> Dict[int, List[Occurrence]]:
+        """Merged busy intervals in [start, end) for each user id."""
+        user_ids = list(user_ids)
+        self.refresh(db, user_ids)
+        with self._lock:
+            return {user_id: self._users[user_id].busy(start, end) for user_id in user_ids}
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+
+freebusy_index = FreeBusyIndex()
+
+
+def resolve_mailboxes(db: Session, addresses: Iterable[str]) -> Dict[str, int]:
+    """Lower-cased address -> user id for the addresses that are local mailboxes."""
+    wanted = {address.strip().lower() for address in addresses if address and address.strip()}
+    if not wanted:
+        return {}
+    rows = db.query(User.id, User.email).filter(func.lower(User.email).in_(wanted)).all()
+    return {email.lower(): user_id for user_id, email in rows}
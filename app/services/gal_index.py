@@ -0,0 +1,461 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, object_session
+
+from ..database import GlobalAddressEntry
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) a process checks whether other processes changed the GAL
+REFRESH_INTERVAL = float(os.getenv("GAL_INDEX_REFRESH_SECONDS", "30"))
+
+# Field weights used for ranking: names beat addresses beat organisation data,
+# and the first word of the display name beats the rest of it
+WEIGHT_NAME_LEADING = 4
+WEIGHT_NAME = 3
+WEIGHT_EMAIL = 2
+WEIGHT_ORG = 1
+WEIGHTS = (WEIGHT_NAME_LEADING, WEIGHT_NAME, WEIGHT_EMAIL, WEIGHT_ORG)
+
+# Results of recent queries, dropped whenever the index changes
+RESULT_CACHE_SIZE = 512
+
+_TOKEN_SPLIT = re.compile(r"[^\w]+|_", re.UNICODE)
+_PENDING_KEY = "gal_index_pending"
+
+
+def normalize(value: Optional[str]) -> str:
+    """Casefold and strip accents so "José" matches "jose"."""
+    if not value:
+        return ""
+    if value.isascii():
+        return value.lower()
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    return [tok for tok in _TOKEN_SPLIT.split(normalize(value)) if tok]
+
+
+@dataclass(frozen=True)
+class GalIndexEntry:
+    """Immutable snapshot of an active GAL row, attribute-compatible with the ORM model."""
+
+    id: Optional[int]
+    uuid: Optional[str]
+    user_id: Optional[int]
+    display_name: str
+    given_name: Optional[str]
+    surname: Optional[str]
+    email: str
+    company: Optional[str]
+    department: Optional[str]
+    job_title: Optional[str]
+    office_location: Optional[str]
+    business_phone: Optional[str]
+    mobile_phone: Optional[str]
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def from_model(cls, entry: GlobalAddressEntry) -> "GalIndexEntry":
+        return cls(
+            id=entry.id,
+            uuid=entry.uuid,
+            user_id=entry.user_id,
+            display_name=entry.display_name or entry.email,
+            given_name=entry.given_name,
+            surname=entry.surname,
+            email=entry.email,
+            company=entry.company,
+            department=entry.department,
+            job_title=entry.job_title,
+            office_location=entry.office_location,
+            business_phone=entry.business_phone,
+            mobile_phone=entry.mobile_phone,
+            updated_at=entry.updated_at,
+        )
+
+    @property
+    def key(self) -> str:
+        return self.email.lower()
+
+    def weighted_tokens(self) -> Dict[str, int]:
+        """Return token -> best field weight for this entry."""
+        tokens: Dict[str, int] = {}
+
+        def add(values: Iterable[str], weight: int) -> None:
+            for tok in values:
+                if tokens.get(tok, 0) < weight:
+                    tokens[tok] = weight
+
+        display_tokens = tokenize(self.display_name)
+        add(display_tokens[:1], WEIGHT_NAME_LEADING)
+        add(display_tokens[1:], WEIGHT_NAME)
+        add(tokenize(self.given_name), WEIGHT_NAME)
+        add(tokenize(self.surname), WEIGHT_NAME)
+        local, _at, domain = normalize(self.email).strip().partition("@")
+        add(tokenize(local), WEIGHT_EMAIL)
+        # The whole domain is one token (it contains a "." so it never collides
+        # with word tokens); domain-only queries resolve with one prefix lookup
+        add([domain] if domain else [], WEIGHT_ORG)
+        add(tokenize(self.company), WEIGHT_ORG)
+        add(tokenize(self.department), WEIGHT_ORG)
+        return tokens
+
+
+def _level(weight: int, exact: bool) -> int:
+    """Score of one query term: field weight first, exact token beats prefix."""
+    return weight * 2 + (1 if exact else 0)
+
+
+class GalSearchIndex:
+    """In-memory prefix index over active Global Address List entries.
+
+    For every field weight the index keeps a sorted array of distinct tokens,
+    and every token maps to its entries pre-sorted by display name. A prefix
+    lookup is therefore two binary searches per weight, and single-term
+    queries walk weights from best to worst merging the already-sorted
+    posting lists until ``limit`` entries are found. Multi-term queries score
+    candidates of the most selective term and check the remaining terms per
+    entry.
+
+    The index is loaded on first use, patched after every committed GAL change
+    made in this process, and re-checked against the database every
+    ``REFRESH_INTERVAL`` seconds to pick up changes from other services.
+    """
+
+    def __init__(self, refresh_interval: float = REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._reset()
+        self._loaded = False
+        self._signature: Optional[Tuple[int, object]] = None
+        self._checked_at = 0.0
+        self._local_changes = False
+        self.version = 0
+
+    def _reset(self) -> None:
+        self._entries: Dict[str, GalIndexEntry] = {}
+        self._entry_tokens: Dict[str, Dict[str, int]] = {}
+        self._sort_keys: Dict[str, Tuple[str, str]] = {}
+        self._ordered: List[Tuple[str, str]] = []
+        self._tokens: Dict[int, List[str]] = {weight: [] for weight in WEIGHTS}
+        self._postings: Dict[Tuple[str, int], List[Tuple[str, str]]] = {}
+        self._cache: "OrderedDict[Tuple[Tuple[str, ...], str, str, int], List[GalIndexEntry]]" = OrderedDict()
+
+    # --- Loading --------------------------------------------------------------
+
+    def rebuild(self, entries: Iterable[GalIndexEntry]) -> None:
+        """Replace the index contents with ``entries``."""
+        with self._lock:
+            self._reset()
+            for entry in entries:
+                key = entry.key
+                tokens = entry.weighted_tokens()
+                sort_key = (normalize(entry.display_name), key)
+                self._entries[key] = entry
+                self._entry_tokens[key] = tokens
+                self._sort_keys[key] = sort_key
+                self._ordered.append(sort_key)
+                for tok, weight in tokens.items():
+                    posting = self._postings.get((tok, weight))
+                    if posting is None:
+                        self._postings[(tok, weight)] = [sort_key]
+                        self._tokens[weight].append(tok)
+                    else:
+                        posting.append(sort_key)
+            self._ordered.sort()
+            for weight in WEIGHTS:
+                self._tokens[weight].sort()
+            for posting in self._postings.values():
+                posting.sort()
+            self._loaded = True
+            self.version += 1
+
+    def _signature_query(self, db: Session) -> Tuple[int, object]:
+        count, latest = (
+            db.query(func.count(GlobalAddressEntry.id), func.max(GlobalAddressEntry.updated_at))
+            .filter(GlobalAddressEntry.is_active.is_(True))
+            .one()
+        )
+        return int(count or 0), latest
+
+    def _patched_signature_locked(self) -> Tuple[int, object]:
+        """The signature the database has if only this process's patches changed it."""
+        latest = max((e.updated_at for e in self._entries.values() if e.updated_at), default=None)
+        return len(self._entries), latest
+
+    def ensure_fresh(self, db: Session) -> None:
+        """Load the index, or rebuild it if another process changed the GAL."""
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.refresh_interval:
+            return
+        signature = self._signature_query(db)
+        with self._lock:
+            self._checked_at = now
+            if self._loaded and self._local_changes:
+                # Our own committed changes already patched the index; it is
+                # current unless another process changed the GAL as well
+                self._local_changes = False
+                if signature == self._patched_signature_locked():
+                    self._signature = signature
+                    return
+            elif self._loaded and signature == self._signature:
+                return
+        rows = db.query(GlobalAddressEntry).filter(GlobalAddressEntry.is_active.is_(True)).all()
+        started = time.perf_counter()
+        self.rebuild(GalIndexEntry.from_model(row) for row in rows)
+        with self._lock:
+            self._signature = signature
+        logger.info(
+            "GAL index rebuilt: %d entries in %.1f ms",
+            len(rows),
+            (time.perf_counter() - started) * 1000,
+        )
+
+    # --- Incremental maintenance ----------------------------------------------
+
+    @staticmethod
+    def _discard(sorted_list: list, item) -> None:
+        pos = bisect_left(sorted_list, item)
+        if pos < len(sorted_list) and sorted_list[pos] == item:
+            del sorted_list[pos]
+
+    def _remove_locked(self, key: str) -> None:
+        tokens = self._entry_tokens.pop(key, None)
+        sort_key = self._sort_keys.pop(key, None)
+        self._entries.pop(key, None)
+        if sort_key is None:
+            return
+        self._discard(self._ordered, sort_key)
+        for tok, weight in (tokens or {}).items():
+            posting = self._postings.get((tok, weight))
+            if posting is None:
+                continue
+            self._discard(posting, sort_key)
+            if not posting:
+                del self._postings[(tok, weight)]
+                self._discard(self._tokens[weight], tok)
+
+    def _changed_locked(self) -> None:
+        self._cache.clear()
+        self._local_changes = True
+        self.version += 1
+
+    def upsert(self, entry: GalIndexEntry) -> None:
+        with self._lock:
+            if not self._loaded:
+                return
+            key = entry.key
+            self._remove_locked(key)
+            tokens = entry.weighted_tokens()
+            sort_key = (normalize(entry.display_name), key)
+            self._entries[key] = entry
+            self._entry_tokens[key] = tokens
+            self._sort_keys[key] = sort_key
+            insort(self._ordered, sort_key)
+            for tok, weight in tokens.items():
+                posting = self._postings.get((tok, weight))
+                if posting is None:
+                    self._postings[(tok, weight)] = [sort_key]
+                    insort(self._tokens[weight], tok)
+                else:
+                    insort(posting, sort_key)
+            self._changed_locked()
+
+    def remove(self, email: str) -> None:
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove_locked(email.lower())
+            self._changed_locked()
+
+    def invalidate(self) -> None:
+        """Force a signature check on the next search (e.g. after bulk UPDATEs)."""
+        with self._lock:
+            self._checked_at = 0.0
+            self._local_changes = False
+
+    # --- Queries --------------------------------------------------------------
+
+    def _matching_tokens(self, weight: int, prefix: str) -> List[str]:
+        tokens = self._tokens[weight]
+        start = bisect_left(tokens, prefix)
+        end = bisect_left(tokens, prefix + "\U0010ffff", start)
+        return tokens[start:end]
+
+    def _search_single(self, term: str, limit: int) -> List[str]:
+        found: List[str] = []
+        seen = set()
+        for weight in WEIGHTS:
+            matched = self._matching_tokens(weight, term)
+            if not matched:
+                continue
+            exact = [self._postings[(term, weight)]] if matched[0] == term else []
+            prefix = [self._postings[(tok, weight)] for tok in matched if tok != term]
+            for lists in (exact, prefix):
+                for _name, key in heapq.merge(*lists):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    found.append(key)
+                    if len(found) >= limit:
+                        return found
+        return found
+
+    def _search_multi(self, terms: List[str], limit: int) -> List[str]:
+        # Start from the most selective term's entry set (built with C-level set
+        # unions), narrow it with the other terms, then score the survivors
+        per_term = []
+        for term in terms:
+            lists = [
+                self._postings[(tok, weight)]
+                for weight in WEIGHTS
+                for tok in self._matching_tokens(weight, term)
+            ]
+            per_term.append((sum(map(len, lists)), term, lists))
+        per_term.sort(key=lambda item: item[0])
+
+        matches = set().union(*per_term[0][2])
+        for size, term, lists in per_term[1:]:
+            if not matches:
+                return []
+            if len(matches) * 8 < size:
+                matches = {
+                    sort_key
+                    for sort_key in matches
+                    if any(tok.startswith(term) for tok in self._entry_tokens[sort_key[1]])
+                }
+            else:
+                matches &= set().union(*lists)
+
+        scored = []
+        for sort_key in matches:
+            tokens = self._entry_tokens[sort_key[1]].items()
+            score = 0
+            for term in terms:
+                best = 0
+                for tok, weight in tokens:
+                    if weight * 2 + 1 > best and tok.startswith(term):
+                        value = _level(weight, tok == term)
+                        if value > best:
+                            best = value
+                score += best
+            scored.append((-score, sort_key))
+        return [sort_key[1] for _score, sort_key in heapq.nsmallest(limit, scored)]
+
+    def search(self, query: Optional[str], limit: int = 25) -> List[GalIndexEntry]:
+        """Ranked prefix search; every query token must prefix-match the entry.
+
+        An address-shaped query ("john.smith@exa") matches its local part as
+        tokens and its domain part as a prefix of the entry's domain. A
+        domain-only query ("example.com", "@example") is looked up as a prefix
+        of the indexed domains, falling back to tokens if none matches.
+        """
+        text = normalize(query).strip()
+        local, at, domain = text.partition("@")
+        terms = tokenize(local)
+        domain = domain.strip()
+        literal = ""
+        if len(text.split()) == 1:
+            if at and not terms:
+                literal = domain
+            elif not at and "." in text:
+                literal = text
+        if not terms and not literal:
+            return self.all(limit) if not at else []
+        cache_key = (tuple(terms), domain, literal, limit)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                return cached
+            # Over-fetch when filtering by domain so the filter rarely starves the page
+            fetch = limit * 4 if domain else limit
+            keys = self._search_single(literal, fetch) if literal else []
+            if not keys and terms:
+                if len(terms) == 1:
+                    keys = self._search_single(terms[0], fetch)
+                else:
+                    keys = self._search_multi(terms, fetch)
+            if domain:
+                keys = [key for key in keys if key.partition("@")[2].startswith(domain)]
+            results = [self._entries[key] for key in keys[:limit]]
+            self._cache[cache_key] = results
+            if len(self._cache) > RESULT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return results
+
+    def all(self, limit: int = 200) -> List[GalIndexEntry]:
+        with self._lock:
+            return [self._entries[key] for _name, key in self._ordered[:limit]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+gal_index = GalSearchIndex()
+
+
+# --- Change tracking ----------------------------------------------------------
+# GAL rows are written from several places (user registration, GalService,
+# ensure_global_address_list). Mapper events capture every ORM flush; the
+# snapshots are applied to the index only once the transaction commits.
+
+
+def _stage(target: GlobalAddressEntry, removed: bool = False) -> None:
+    session = object_session(target)
+    if session is None:
+        return
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    for previous in sa_inspect(target).attrs.email.history.deleted or ():
+        if previous:
+            pending[previous.lower()] = None
+    if removed or not target.is_active:
+        pending[target.email.lower()] = None
+    else:
+        pending[target.email.lower()] = GalIndexEntry.from_model(target)
+
+
+@event.listens_for(GlobalAddressEntry, "after_insert")
+@event.listens_for(GlobalAddressEntry, "after_update")
+def _on_gal_write(mapper, connection, target) -> None:
+    _stage(target)
+
+
+@event.listens_for(GlobalAddressEntry, "after_delete")
+def _on_gal_delete(mapper, connection, target) -> None:
+    _stage(target, removed=True)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    for key, snapshot in pending.items():
+        if snapshot is None:
+            gal_index.remove(key)
+        else:
+            gal_index.upsert(snapshot)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from typing import Iterable, List, Optional
 
-from sqlalchemy import or_
 from sqlalchemy.orm import Session
 
 from ..database import (
@@ -10,6 +9,7 @@ from ..database import (
     User,
     sync_gal_entry_for_user,
 )
+from .gal_index import GalIndexEntry, gal_index
 
 
 class GalService:
@@ -34,34 +34,19 @@ class GalService:
 
     # --- Queries ---------------------------------------------------------
 
-    def search(self, query: Optional[str], limit: int = 25) -> List[GlobalAddressEntry]:
-        """Search GAL entries by display name, email, company, or department."""
-        q = (
-            self.db.query(GlobalAddressEntry)
-            .filter(GlobalAddressEntry.is_active.is_(True))
-            .order_by(GlobalAddressEntry.display_name.asc())
-        )
-        if query:
-            pattern = f"%{query}%"
-            q = q.filter(
-                or_(
-                    GlobalAddressEntry.display_name.ilike(pattern),
-                    GlobalAddressEntry.email.ilike(pattern),
-                    GlobalAddressEntry.company.ilike(pattern),
-                    GlobalAddressEntry.department.ilike(pattern),
-                )
-            )
-        return q.limit(limit).all()
-
-    def get_all(self, limit: int = 200) -> List[GlobalAddressEntry]:
-        """Return up to `limit` GAL entries."""
-        return (
-            self.db.query(GlobalAddressEntry)
-            .filter(GlobalAddressEntry.is_active.is_(True))
-            .order_by(GlobalAddressEntry.display_name.asc())
-            .limit(limit)
-            .all()
-        )
+    def search(self, query: Optional[str], limit: int = 25) -> List[GalIndexEntry]:
+        """Ranked prefix search over display name, email, company, or department.
+
+        Served from the shared in-memory GAL index; results are read-only
+        snapshots with the same attributes as `GlobalAddressEntry`.
+        """
+        gal_index.ensure_fresh(self.db)
+        return gal_index.search(query, limit=limit)
+
+    def get_all(self, limit: int = 200) -> List[GalIndexEntry]:
+        """Return up to `limit` GAL entries ordered by display name."""
+        gal_index.ensure_fresh(self.db)
+        return gal_index.all(limit=limit)
 
     def get_by_email(self, email: str) -> Optional[GlobalAddressEntry]:
         """Fetch a GAL entry by primary email."""
@@ -0,0 +1,272 @@
+"""
+Hanging Sync
+Wait/HeartbeatInterval and empty/partial Sync requests (MS-ASCMD 2.2.2.20).
+
+Devices that prefer a hanging Sync over Ping send Wait (minutes) or
+HeartbeatInterval (seconds) and expect the server to hold the request
+until something changes; once a full request has been sent they may send
+an empty body ("same as last time") or <Partial/> with only the
+collections that changed. The Sync handler answered all of these at once,
+so such devices ended up polling. Now:
+- the last full request per device is kept parsed in SyncRequestCache;
+  empty and partial requests are expanded from it, and a miss (restart,
+  another worker) answers Status 13 so the client resends it in full
+- changed_collections() checks every requested collection with a fixed
+  number of queries (one for the sync states, one for the newest message
+  per folder) instead of one query per collection
+- hang() parks on the push manager's event for the mailbox and re-checks
+  on every notification until the heartbeat expires; it commits before
+  parking, so no row locks or transaction are held while the request hangs
+- the Sync handler runs on the DB pool, so it does not hang there: it
+  returns a ParkedSync and the dispatcher awaits hang() on the event loop
+  (only the checks go to the pool), then answers every collection that
+  changed in one response
+"""
+import asyncio
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..database import ActiveSyncState, Email
+from ..db_executor import run_in_db_thread
+from ..push_notifications import push_manager
+from .message_list import folder_filter
+
+logger = logging.getLogger(__name__)
+
+SYNC_REQUEST_CACHE_SIZE = int(os.getenv("SYNC_REQUEST_CACHE_SIZE", "10000"))
+# MS-ASCMD limits: Wait 1-59 minutes, HeartbeatInterval 60-3540 seconds
+MIN_HEARTBEAT = 60
+MAX_HEARTBEAT = 3540
+# Operators may cap how long a request is held (e.g. below a proxy timeout)
+SYNC_MAX_HEARTBEAT = int(os.getenv("SYNC_MAX_HEARTBEAT", str(MAX_HEARTBEAT)))
+
+
+@dataclass
+class ParkedSync:
+    """
+    Returned by the Sync handler instead of a response when nothing has
+    changed yet: the dispatcher holds the request on the event loop with
+    hang() and runs the handler again with the collections that changed.
+    """
+
+    device_id: str
+    collections: List[dict]
+    timeout: int
+    headers: dict
+
+
+class SyncRequestCache:
+    """LRU of the last full (parsed) Sync request per (user, device)."""
+
+    def __init__(self, max_entries: int = SYNC_REQUEST_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._requests: "OrderedDict[Tuple[int, str], dict]" = OrderedDict()
+
+    def get(self, user_id: int, device_id: str) -> Optional[dict]:
+        with self._lock:
+            cached = self._requests.get((user_id, device_id))
+            if cached is None:
+                return None
+            self._requests.move_to_end((user_id, device_id))
+            return copy.deepcopy(cached)
+
+    def store(self, user_id: int, device_id: str, request: dict) -> None:
+        with self._lock:
+            self._requests[(user_id, device_id)] = copy.deepcopy(request)
+            self._requests.move_to_end((user_id, device_id))
+            while len(self._requests) > self.max_entries:
+                self._requests.popitem(last=False)
+
+
+sync_request_cache = SyncRequestCache()
+
+
+def resolve_request(user_id: int, device_id: str, request: dict) -> Optional[dict]:
+    """
+    The effective Sync request: ``request`` itself when it is complete, or
+    the cached request it refers to, merged with any collections and
+    Wait/HeartbeatInterval/WindowSize it does carry. None when the request
+    is empty or partial and nothing is cached.
+
+    The result becomes the cached request. It is flagged ``expanded`` when
+    the cache was used and ``has_commands`` when the client sent changes;
+    collections taken from the cache are flagged ``cached``, because their
+    SyncKey is the one sent back then, not the one the client holds now.
+    """
+    has_commands = any(c["has_commands"] for c in request["collections"])
+    expanded = request["partial"] or not request["collections"]
+    if expanded:
+        cached = sync_request_cache.get(user_id, device_id)
+        if cached is None:
+            return None
+        sent = {c["collection_id"]: c for c in request["collections"]}
+        merged = [sent.pop(c["collection_id"], dict(c, cached=True)) for c in cached["collections"]]
+        merged.extend(sent.values())
+        for key in ("wait", "heartbeat_interval", "window_size"):
+            if request[key] is not None:
+                cached[key] = request[key]
+        if request["wait"] is not None:
+            cached["heartbeat_interval"] = None
+        elif request["heartbeat_interval"] is not None:
+            cached["wait"] = None
+        request = dict(cached, collections=merged, partial=False)
+    stored = copy.deepcopy(request)
+    for collection in stored["collections"]:
+        # Commands are one-shot; never replay them from the cache
+        collection["has_commands"] = False
+        collection.pop("cached", None)
+    sync_request_cache.store(user_id, device_id, stored)
+    return dict(request, expanded=expanded, has_commands=has_commands)
+
+
+def heartbeat_seconds(request: dict) -> Tuple[Optional[int], Optional[str]]:
+    """
+    (seconds to hold the request, None) or (None, limit) when Wait or
+    HeartbeatInterval is out of range; limit is the value to put in the
+    Status 14 response's <Limit>. (None, None) means do not hang.
+    """
+    if request.get("wait") is not None:
+        wait = request["wait"]
+        if not 1 <= wait <= MAX_HEARTBEAT // 60:
+            return None, "1" if wait < 1 else str(MAX_HEARTBEAT // 60)
+        return min(wait * 60, SYNC_MAX_HEARTBEAT), None
+    if request.get("heartbeat_interval") is not None:
+        interval = request["heartbeat_interval"]
+        if not MIN_HEARTBEAT <= interval <= MAX_HEARTBEAT:
+            return None, str(MIN_HEARTBEAT if interval < MIN_HEARTBEAT else MAX_HEARTBEAT)
+        return min(interval, SYNC_MAX_HEARTBEAT), None
+    return None, None
+
+
+def changed_collections(
+    db: Session,
+    user_id: int,
+    device_id: str,
+    collections: List[dict],
+    folders: Dict[str, str],
+) -> List[str]:
+    """
+    Requested collections the client should hear about now, in request order.
+
+    A collection counts as changed when a batch awaits acknowledgement,
+    when the client's SyncKey is not the committed one (a mismatch the Sync
+    handler must answer; not checked for ``cached`` collections), or when
+    its folder holds a message newer than the last one synced. Collections
+    without a mail folder never report changes.
+    """
+    ids = [c["collection_id"] for c in collections]
+    states = {
+        row.collection_id: row
+        for row in db.execute(
+            select(
+                ActiveSyncState.collection_id,
+                ActiveSyncState.sync_key,
+                ActiveSyncState.pending_sync_key,
+                ActiveSyncState.last_synced_email_id,
+            ).where(
+                ActiveSyncState.user_id == user_id,
+                ActiveSyncState.device_id == device_id,
+                ActiveSyncState.collection_id.in_(ids),
+            )
+        )
+    }
+    mail = [cid for cid in dict.fromkeys(ids) if cid in folders]
+    newest: Dict[str, Optional[int]] = {}
+    if mail:
+        row = db.execute(
+            select(
+                *(
+                    select(func.max(Email.id))
+                    .where(folder_filter(user_id, folders[cid]))
+                    .scalar_subquery()
+                    .label(f"c{index}")
+                    for index, cid in enumerate(mail)
+                )
+            )
+        ).one()
+        newest = dict(zip(mail, row))
+
+    changed = []
+    for collection in collections:
+        cid = collection["collection_id"]
+        if cid not in folders:
+            continue
+        state = states.get(cid)
+        if (
+            state is None
+            or state.pending_sync_key
+            or (
+                not collection.get("cached")
+                and (collection.get("sync_key") or "0") != (state.sync_key or "0")
+            )
+            or (newest.get(cid) or 0) > (state.last_synced_email_id or 0)
+        ):
+            changed.append(cid)
+    return changed
+
+
+def _check_and_release(
+    db: Session,
+    user_id: int,
+    device_id: str,
+    collections: List[dict],
+    folders: Dict[str, str],
+) -> List[str]:
+    changed = changed_collections(db, user_id, device_id, collections, folders)
+    # End the read transaction at once; the wait may go on for minutes
+    db.commit()
+    return changed
+
+
+async def hang(
+    db: Session,
+    user_id: int,
+    device_id: str,
+    collections: List[dict],
+    folders: Dict[str, str],
+    timeout: float,
+) -> Tuple[List[str], bool]:
+    """
+    (changed collection ids, waited). Returns at once with the changes
+    when there are any. Otherwise waits on the mailbox's push
+    notifications and re-checks on each wake-up until something changed
+    or ``timeout`` seconds passed (then []).
+
+    Meant to be awaited on the event loop: every check runs on the DB pool
+    and commits ``db``, so neither a pool thread nor a transaction (or the
+    device and state rows the handler locked) is held while parked. After
+    it returns the caller is in a new transaction and must reload what it
+    locks.
+    """
+    # Subscribe before the first check so mail arriving in between wakes us
+    subscription = await push_manager.subscribe(user_id, [c["collection_id"] for c in collections])
+    try:
+        changed = await run_in_db_thread(_check_and_release, db, user_id, device_id, collections, folders)
+        if changed:
+            return changed, False
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], True
+            try:
+                await asyncio.wait_for(subscription.wait(), remaining)
+            except asyncio.TimeoutError:
+                return [], True
+            subscription.clear()
+            changed = await run_in_db_thread(_check_and_release, db, user_id, device_id, collections, folders)
+            if changed:
+                return changed, True
+            logger.debug("Hanging Sync for user %s woke without changes", user_id)
+    finally:
+        await push_manager.unsubscribe(subscription)
@@ -0,0 +1,322 @@
+"""
+Mail Search
+Per-mailbox full-text index over subject, sender, recipients and body.
+
+EAS Search only looked at the GAL, EWS FindItem ignored its QueryString and
+OWA filtered the rows it had already downloaded, so finding an older
+message meant pulling the whole mailbox. Email rows are now indexed in
+``email_search``:
+- SQLite: an FTS5 table keyed by emails.id; the ``mailbox`` column holds
+  one token per owning user (sender and recipient), so a query intersects
+  the caller's postings inside the index instead of filtering every hit
+  across all mailboxes afterwards
+- Postgres: a weighted tsvector (subject A, sender B, recipients C, body D)
+  over unaccent()ed text plus the owning user ids, both GIN-indexed
+- the index is written in the same flush as the Email rows it describes
+  (session hook in database.py), so every ingest path (SMTP, EWS
+  CreateItem, internal delivery) and every delete keeps it current;
+  backfill() indexes mail stored before the index existed
+
+search() takes prefix terms ("repo" matches "report"), optional field
+prefixes (from:, to:, subject:, body:) and folder/date filters, and returns
+one ranked page of ids plus the total number of hits. Other databases fall
+back to LIKE scans.
+"""
+import html
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, column, func, literal_column, or_, select, table, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from ..database import Email, MessageContent, User
+from .gal_index import tokenize
+from .message_list import folder_filter
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = "email_search"
+MAX_PAGE_SIZE = 200
+# Body text kept per message; long threads quote themselves below this
+BODY_CHARS = int(os.getenv("MAIL_SEARCH_BODY_CHARS", "65536"))
+BACKFILL_BATCH = int(os.getenv("MAIL_SEARCH_BACKFILL_BATCH", "2000"))
+
+_TEXT_COLUMNS = ("subject", "sender", "recipients", "body")
+# Query prefix -> indexed column
+_FIELDS = {"from": "sender", "to": "recipients", "cc": "recipients", "subject": "subject", "body": "body"}
+# bm25 weight per FTS5 column (mailbox tokens never score)
+_FTS_WEIGHTS = "0.0, 10.0, 4.0, 2.0, 1.0"
+_PG_LABELS = {"subject": "A", "sender": "B", "recipients": "C", "body": "D"}
+# Join target only; the table's DDL is in create_index()
+_search_table = table(SEARCH_TABLE, column("rowid"), column("email_id"))
+
+_QUERY_TERM = re.compile(r"(?:([A-Za-z]+):)?(\S+)")
+_HIDDEN_HTML = re.compile(r"<(style|script|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_SPACE = re.compile(r"\s+")
+
+
+def supported(dialect_name: str) -> bool:
+    return dialect_name in ("sqlite", "postgresql")
+
+
+def create_index(connection: Connection) -> None:
+    """Create the search table for this database (idempotent)."""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "mailbox, subject, sender, recipients, body, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    elif dialect == "postgresql":
+        # tokenize() strips diacritics from queries; documents must match
+        connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS unaccent")
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "email_id INTEGER PRIMARY KEY REFERENCES emails(id) ON DELETE CASCADE, "
+            "owner_ids INTEGER[] NOT NULL, "
+            "document TSVECTOR NOT NULL)"
+        )
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS idx_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)"
+        )
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS idx_{SEARCH_TABLE}_owners ON {SEARCH_TABLE} USING GIN (owner_ids)"
+        )
+
+
+# --- Documents ----------------------------------------------------------------
+
+
+def plain_text(body: Optional[str], body_html: Optional[str]) -> str:
+    """Searchable body text: the plain part, else the HTML part without markup."""
+    value = body
+    if not value and body_html:
+        value = html.unescape(_HTML_TAG.sub(" ", _HIDDEN_HTML.sub(" ", body_html)))
+    return _SPACE.sub(" ", value or "")[:BODY_CHARS].strip()
+
+
+def _mailbox_token(user_id: int) -> str:
+    return f"mbx{user_id}"
+
+
+def _documents(connection: Connection, rows: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Index documents for Email rows (ORM objects or rows with the same names)."""
+    rows = list(rows)
+    user_ids = {uid for row in rows for uid in (row.sender_id, row.recipient_id) if uid is not None}
+    addresses: Dict[int, str] = {}
+    if user_ids:
+        for user_id, full_name, email in connection.execute(
+            select(User.id, User.full_name, User.email).where(User.id.in_(user_ids))
+        ):
+            addresses[user_id] = f"{full_name} {email}" if full_name else email or ""
+
+    documents = []
+    for row in rows:
+        owners = sorted({uid for uid in (row.sender_id, row.recipient_id) if uid is not None})
+        if not owners:
+            continue
+        documents.append(
+            {
+                "email_id": row.id,
+                "owners": owners,
+                "mailbox": " ".join(_mailbox_token(uid) for uid in owners),
+                "subject": row.subject or "",
+                "sender": addresses.get(row.sender_id) or row.external_sender or "",
+                "recipients": addresses.get(row.recipient_id) or row.external_recipient or "",
+                "body": plain_text(row.body, row.body_html),
+            }
+        )
+    return documents
+
+
+def remove_emails(connection: Connection, email_ids: Iterable[int]) -> None:
+    email_ids = list(email_ids)
+    if not email_ids or not supported(connection.dialect.name):
+        return
+    key = "rowid" if connection.dialect.name == "sqlite" else "email_id"
+    connection.execute(
+        text(f"DELETE FROM {SEARCH_TABLE} WHERE {key} IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": email_ids},
+    )
+
+
+def index_emails(connection: Connection, emails: Iterable[Any]) -> int:
+    """(Re)index Email rows; returns how many documents were written."""
+    if not supported(connection.dialect.name):
+        return 0
+    emails = list(emails)
+    remove_emails(connection, [email.id for email in emails])
+    documents = _documents(connection, emails)
+    if not documents:
+        return 0
+    if connection.dialect.name == "sqlite":
+        connection.execute(
+            text(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, mailbox, subject, sender, recipients, body) "
+                "VALUES (:email_id, :mailbox, :subject, :sender, :recipients, :body)"
+            ),
+            documents,
+        )
+    else:
+        weighted = " || ".join(
+            f"setweight(to_tsvector('simple', unaccent(:{name})), '{_PG_LABELS[name]}')" for name in _TEXT_COLUMNS
+        )
+        connection.execute(
+            text(
+                f"INSERT INTO {SEARCH_TABLE} (email_id, owner_ids, document) "
+                f"VALUES (:email_id, :owners, {weighted})"
+            ),
+            documents,
+        )
+    return len(documents)
+
+
+def _indexed_ids(connection: Connection, email_ids: List[int]) -> set:
+    key = "rowid" if connection.dialect.name == "sqlite" else "email_id"
+    return set(
+        connection.execute(
+            text(f"SELECT {key} FROM {SEARCH_TABLE} WHERE {key} IN :ids").bindparams(
+                bindparam("ids", expanding=True)
+            ),
+            {"ids": email_ids},
+        ).scalars()
+    )
+
+
+def backfill(engine: Engine, batch_size: int = BACKFILL_BATCH) -> int:
+    """Index every email missing from the index, in keyset batches; returns how many."""
+    if not supported(engine.dialect.name):
+        return 0
+    emails = Email.__table__
+    contents = MessageContent.__table__
+    query = (
+        select(
+            emails.c.id,
+            emails.c.subject,
+            func.coalesce(emails.c.body, contents.c.body).label("body"),
+            func.coalesce(emails.c.body_html, contents.c.body_html).label("body_html"),
+            emails.c.sender_id,
+            emails.c.recipient_id,
+            emails.c.external_sender,
+            emails.c.external_recipient,
+        )
+        .select_from(emails.outerjoin(contents, contents.c.id == emails.c.content_id))
+        .order_by(emails.c.id)
+        .limit(batch_size)
+    )
+    total = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(query.where(emails.c.id > last_id)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            done = _indexed_ids(conn, [row.id for row in rows])
+            total += index_emails(conn, [row for row in rows if row.id not in done])
+    if total:
+        logger.info("Indexed %d emails for search", total)
+    return total
+
+
+# --- Queries ------------------------------------------------------------------
+
+
+def parse_query(query: Optional[str]) -> List[Tuple[Optional[str], str]]:
+    """(column or None for any, normalized prefix term) for each query token."""
+    terms: List[Tuple[Optional[str], str]] = []
+    for prefix, value in _QUERY_TERM.findall(query or ""):
+        name = _FIELDS.get(prefix.lower()) if prefix else None
+        if prefix and name is None:
+            # "re:" or "10:30" is text, not a field
+            value = f"{prefix} {value}"
+        terms.extend((name, token) for token in tokenize(value))
+    return terms
+
+
+def _fts_match(user_id: int, terms: List[Tuple[Optional[str], str]]) -> str:
+    # Tokens are word characters only, so quoting them is enough escaping
+    parts = [f'mailbox : "{_mailbox_token(user_id)}"']
+    for name, token in terms:
+        scope = name or "{" + " ".join(_TEXT_COLUMNS) + "}"
+        parts.append(f'{scope} : "{token}"*')
+    return " AND ".join(parts)
+
+
+def _pg_tsquery(terms: List[Tuple[Optional[str], str]]) -> str:
+    return " & ".join(f"{token}:*{_PG_LABELS[name] if name else ''}" for name, token in terms)
+
+
+def search(
+    db: Session,
+    user_id: int,
+    query: Optional[str],
+    folder: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    offset: int = 0,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """One ranked page of the user's matching email ids, plus the total hit count.
+
+    ``folder`` is one of message_list.FOLDERS (None searches all mail);
+    ``since``/``until`` bound the received time.
+    """
+    terms = parse_query(query)
+    offset = max(0, offset)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if not terms:
+        return {"total": 0, "offset": offset, "ids": []}
+
+    filters = [folder_filter(user_id, folder) if folder else or_(Email.sender_id == user_id, Email.recipient_id == user_id)]
+    if since is not None:
+        filters.append(Email.created_at >= since)
+    if until is not None:
+        filters.append(Email.created_at < until)
+
+    dialect = db.get_bind().dialect.name
+    base = db.query(Email.id)
+    if dialect == "sqlite":
+        base = base.join(_search_table, _search_table.c.rowid == Email.id).filter(
+            text(f"{SEARCH_TABLE} MATCH :match")
+        )
+        params = {"match": _fts_match(user_id, terms)}
+        rank = literal_column(f"bm25({SEARCH_TABLE}, {_FTS_WEIGHTS})").asc()
+    elif dialect == "postgresql":
+        base = base.join(_search_table, _search_table.c.email_id == Email.id).filter(
+            text(f"{SEARCH_TABLE}.owner_ids @> ARRAY[CAST(:owner AS INTEGER)]"),
+            text(f"{SEARCH_TABLE}.document @@ to_tsquery('simple', unaccent(:tsquery))"),
+        )
+        params = {"owner": user_id, "tsquery": _pg_tsquery(terms)}
+        rank = literal_column(
+            f"ts_rank({SEARCH_TABLE}.document, to_tsquery('simple', unaccent(:tsquery)))"
+        ).desc()
+    else:
+        columns = {"subject": (Email.subject,), "body": (Email.body, Email.body_html)}
+        for name, token in terms:
+            fields = columns.get(name) or columns["subject"] + columns["body"]
+            base = base.filter(or_(*(field.ilike(f"%{token}%") for field in fields)))
+        params = {}
+        rank = None
+
+    base = base.filter(and_(*filters)).params(**params)
+    total = base.count()
+    ordering = [Email.created_at.desc(), Email.id.desc()]
+    if rank is not None:
+        ordering.insert(0, rank)
+    ids = [row.id for row in base.order_by(*ordering).offset(offset).limit(limit)]
+    return {"total": total, "offset": offset, "ids": ids}
+
+
+def load_emails(db: Session, email_ids: List[int]) -> List[Email]:
+    """Email rows for search hits, in hit order."""
+    if not email_ids:
+        return []
+    by_id = {email.id: email for email in db.query(Email).filter(Email.id.in_(email_ids))}
+    return [by_id[email_id] for email_id in email_ids if email_id in by_id]
@@ -0,0 +1,233 @@
+"""
+OWA Message List
+Header-only mailbox listing by keyset cursor, plus deltas since a token.
+
+The OWA inbox used to render the whole folder server-side: up to ``limit``
+Email ORM objects with bodies, MIME and both user relationships, on every
+navigation. The page now renders an empty shell and pulls rows from here:
+- list_headers() returns one page of header rows ordered by
+  (created_at desc, id desc); the next page starts strictly after the
+  opaque cursor, so page N costs the same as page 1 on a 100k mailbox
+- only the columns the list shows are selected, with a bounded prefix of
+  the body for the preview; the full message is fetched on open
+- changes_since() returns rows touched since a token, classified into
+  upserts (still in the folder) and removed ids (deleted, restored or moved
+  out), so the client patches the list in place instead of reloading
+
+Deltas are driven by ``emails.updated_at``. Writers stamp it with their
+own clock, so the watermark is re-read with a small overlap
+(OWA_DELTA_OVERLAP seconds) and upserts are idempotent on the client. Hard
+deletes leave no row behind and show up on the next full page load.
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session, aliased
+
+from ..database import Email, User
+from ..email_parser import get_email_preview
+
+FOLDERS = ("inbox", "sent", "deleted")
+MAX_PAGE_SIZE = 200
+PREVIEW_LENGTH = 120
+# Body prefix read for the preview; enough to get past MIME headers and markup
+PREVIEW_SOURCE_CHARS = int(os.getenv("OWA_PREVIEW_SOURCE_CHARS", "2048"))
+DELTA_OVERLAP = timedelta(seconds=float(os.getenv("OWA_DELTA_OVERLAP", "2")))
+# Above this many changed rows the client is told to reload the first page
+MAX_DELTA_ROWS = int(os.getenv("OWA_MAX_DELTA_ROWS", "500"))
+
+
+class InvalidCursor(ValueError):
+    """Cursor or delta token that does not decode, or belongs to another folder."""
+
+
+def _encode(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode(token: str) -> Dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+    except (binascii.Error, ValueError) as exc:
+        raise InvalidCursor("malformed cursor") from exc
+    if not isinstance(payload, dict):
+        raise InvalidCursor("malformed cursor")
+    return payload
+
+
+def _parse_time(value: Any) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError) as exc:
+        raise InvalidCursor("malformed cursor timestamp") from exc
+
+
+def _check_folder(folder: str) -> None:
+    if folder not in FOLDERS:
+        raise InvalidCursor(f"unknown folder {folder!r}")
+
+
+def _header_query(db: Session):
+    sender = aliased(User)
+    recipient = aliased(User)
+    return (
+        db.query(
+            Email.id,
+            Email.subject,
+            Email.is_read,
+            Email.is_deleted,
+            Email.sender_id,
+            Email.recipient_id,
+            Email.created_at,
+            Email.updated_at,
+            func.coalesce(sender.email, Email.external_sender).label("sender"),
+            func.coalesce(recipient.email, Email.external_recipient).label("recipient"),
+            func.substr(func.coalesce(Email.body_html, Email.body), 1, PREVIEW_SOURCE_CHARS).label("preview_source"),
+        )
+        .outerjoin(sender, sender.id == Email.sender_id)
+        .outerjoin(recipient, recipient.id == Email.recipient_id)
+    )
+
+
+def folder_filter(user_id: int, folder: str):
+    """Rows listed in ``folder`` of the user's mailbox (also used by mail search)."""
+    if folder == "inbox":
+        return and_(Email.recipient_id == user_id, Email.is_deleted == False)  # noqa: E712
+    if folder == "sent":
+        return and_(Email.sender_id == user_id, Email.is_deleted == False)  # noqa: E712
+    return and_(or_(Email.sender_id == user_id, Email.recipient_id == user_id), Email.is_deleted == True)  # noqa: E712
+
+
+def _owner_filter(user_id: int, folder: str):
+    """Rows that can enter or leave ``folder``, whatever their deleted flag."""
+    if folder == "inbox":
+        return Email.recipient_id == user_id
+    if folder == "sent":
+        return Email.sender_id == user_id
+    return or_(Email.sender_id == user_id, Email.recipient_id == user_id)
+
+
+def _in_folder(row, user_id: int, folder: str) -> bool:
+    if folder == "inbox":
+        return row.recipient_id == user_id and not row.is_deleted
+    if folder == "sent":
+        return row.sender_id == user_id and not row.is_deleted
+    return bool(row.is_deleted)
+
+
+def _serialize(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "subject": row.subject or "",
+        "sender": row.sender or "",
+        "recipient": row.recipient or "",
+        "preview": get_email_preview(row.preview_source, PREVIEW_LENGTH) if row.preview_source else "",
+        "is_read": bool(row.is_read),
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+
+
+def _delta_token(folder: str, watermark: datetime) -> str:
+    return _encode({"f": folder, "w": watermark.isoformat()})
+
+
+def list_headers(
+    db: Session,
+    user_id: int,
+    folder: str = "inbox",
+    limit: int = 50,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """One page of header rows, newest first, starting after ``cursor``."""
+    _check_folder(folder)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # Taken before the read so a write racing the page is replayed as a delta
+    watermark = datetime.utcnow()
+
+    query = _header_query(db).filter(folder_filter(user_id, folder))
+    if cursor:
+        position = _decode(cursor)
+        if position.get("f") != folder:
+            raise InvalidCursor("cursor belongs to another folder")
+        created_at, email_id = _parse_time(position.get("t")), position.get("i")
+        if not isinstance(email_id, int):
+            raise InvalidCursor("malformed cursor id")
+        query = query.filter(
+            or_(
+                Email.created_at < created_at,
+                and_(Email.created_at == created_at, Email.id < email_id),
+            )
+        )
+    rows = query.order_by(Email.created_at.desc(), Email.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode({"f": folder, "t": last.created_at.isoformat(), "i": last.id})
+    return {
+        "folder": folder,
+        "messages": [_serialize(row) for row in rows],
+        "next_cursor": next_cursor,
+        "changes_token": _delta_token(folder, watermark),
+    }
+
+
+def get_headers(db: Session, email_ids: List[int]) -> List[Dict[str, Any]]:
+    """Header rows for ``email_ids`` in the given order (e.g. search hits)."""
+    if not email_ids:
+        return []
+    rows = {row.id: row for row in _header_query(db).filter(Email.id.in_(email_ids))}
+    return [_serialize(rows[email_id]) for email_id in email_ids if email_id in rows]
+
+
+def changes_since(db: Session, user_id: int, token: str) -> Dict[str, Any]:
+    """Rows changed in the token's folder since it was issued.
+
+    ``reset`` is set when more than MAX_DELTA_ROWS changed; the client
+    should then reload the first page instead of patching.
+    """
+    position = _decode(token)
+    folder = position.get("f")
+    _check_folder(folder)
+    since = _parse_time(position.get("w")) - DELTA_OVERLAP
+    watermark = datetime.utcnow()
+
+    rows = (
+        _header_query(db)
+        .filter(_owner_filter(user_id, folder), Email.updated_at >= since)
+        .order_by(Email.updated_at.asc(), Email.id.asc())
+        .limit(MAX_DELTA_ROWS + 1)
+        .all()
+    )
+    if len(rows) > MAX_DELTA_ROWS:
+        return {
+            "folder": folder,
+            "reset": True,
+            "upserts": [],
+            "removed": [],
+            "changes_token": _delta_token(folder, watermark),
+        }
+
+    upserts: List[Dict[str, Any]] = []
+    removed: List[int] = []
+    for row in rows:
+        if _in_folder(row, user_id, folder):
+            upserts.append(_serialize(row))
+        else:
+            removed.append(row.id)
+    return {
+        "folder": folder,
+        "reset": False,
+        "upserts": upserts,
+        "removed": removed,
+        "changes_token": _delta_token(folder, watermark),
+    }
+
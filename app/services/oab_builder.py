@@ -0,0 +1,616 @@
+"""
+Offline Address Book generation.
+
+Builds versioned OAB artifacts from the GAL in the background so downloads
+are served as static files instead of being rebuilt per request:
+
+- details.oab: OAB v4 full details file ([MS-OXOAB] 2.9) with one
+  OAB_V4_REC per GAL entry
+- browse.oab:  compact display name / address list in display-name order
+- rdndex.oab:  address-sorted index of record offsets into details.oab
+- changes-<from>.oab: differential patch from an earlier sequence
+
+Only details.oab follows the v4 layout. browse.oab ("OAB4" magic),
+rdndex.oab ("OABR") and the patches ("OABP") are this server's own
+companion formats: v4 has no separate browse/RDN index files, and its
+differential patch format is LZX-based, which is not implemented here.
+
+Each file is stored raw (for Range requests) and gzip-compressed under its
+sequence's directory and served from /oab/<id>/<sequence>/<file>. The
+sequence number only advances when the SHA-1 of the record content changes,
+so identical rebuilds never invalidate client caches.
+
+Every service process runs the generator against the same directory, so
+publishing holds an advisory lock on it (``.publish.lock``) and never
+deletes or reuses a version directory that may already be served.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+from ..database import SessionLocal
+from .gal_index import GalIndexEntry, gal_index
+
+logger = logging.getLogger(__name__)
+
+OAB_STORAGE_DIR = os.getenv("OAB_STORAGE_DIR", os.path.join("data", "oab"))
+OAB_KEEP_VERSIONS = int(os.getenv("OAB_KEEP_VERSIONS", "5"))
+OAB_REBUILD_INTERVAL = int(os.getenv("OAB_REBUILD_INTERVAL", "300"))
+
+OAB_ID = "default-oab"
+OAB_NAME = "Default Global Address List"
+OAB_DN = "/o=First Organization/ou=Exchange Administrative Group/cn=addrlists/cn=oabs/cn=default offline address book"
+OAB_DATA_FILES = ("browse.oab", "details.oab", "rdndex.oab")
+
+# [MS-OXOAB] 2.9.1 OAB_HDR.ulVersion for full details files
+OAB_V4_VERSION = 0x00000020
+
+# Property types
+PT_LONG = 0x0003
+PT_BOOLEAN = 0x000B
+PT_STRING8 = 0x001E
+PT_UNICODE = 0x001F
+
+# OAB_PROP_REC.ulFlags
+OAB_PROP_ANR = 0x01
+OAB_PROP_RDN = 0x02
+OAB_PROP_INDEX = 0x04
+
+PR_OAB_NAME = 0x6800001F
+PR_OAB_SEQUENCE = 0x68010003
+PR_OAB_DN = 0x6804001E
+
+PR_OBJECT_TYPE = 0x0FFE0003
+PR_DISPLAY_TYPE = 0x39000003
+PR_DISPLAY_NAME = 0x3001001F
+PR_EMAIL_ADDRESS = 0x3003001F
+PR_SMTP_ADDRESS = 0x39FE001F
+PR_GIVEN_NAME = 0x3A06001F
+PR_SURNAME = 0x3A11001F
+PR_COMPANY_NAME = 0x3A16001F
+PR_TITLE = 0x3A17001F
+PR_DEPARTMENT_NAME = 0x3A18001F
+PR_OFFICE_LOCATION = 0x3A19001F
+PR_BUSINESS_TELEPHONE_NUMBER = 0x3A08001F
+PR_MOBILE_TELEPHONE_NUMBER = 0x3A1C001F
+
+MAPI_MAILUSER = 6
+DT_MAILUSER = 0
+
+HEADER_PROPS: Sequence[Tuple[int, int]] = (
+    (PR_OAB_NAME, 0),
+    (PR_OAB_DN, 0),
+    (PR_OAB_SEQUENCE, 0),
+)
+
+RECORD_PROPS: Sequence[Tuple[int, int]] = (
+    (PR_SMTP_ADDRESS, OAB_PROP_ANR | OAB_PROP_RDN | OAB_PROP_INDEX),
+    (PR_DISPLAY_NAME, OAB_PROP_ANR | OAB_PROP_INDEX),
+    (PR_EMAIL_ADDRESS, 0),
+    (PR_OBJECT_TYPE, 0),
+    (PR_DISPLAY_TYPE, 0),
+    (PR_GIVEN_NAME, OAB_PROP_ANR),
+    (PR_SURNAME, OAB_PROP_ANR),
+    (PR_COMPANY_NAME, 0),
+    (PR_DEPARTMENT_NAME, 0),
+    (PR_TITLE, 0),
+    (PR_OFFICE_LOCATION, 0),
+    (PR_BUSINESS_TELEPHONE_NUMBER, 0),
+    (PR_MOBILE_TELEPHONE_NUMBER, 0),
+)
+
+
+# --- OAB v4 encoding ---------------------------------------------------------
+
+
+def encode_v4_int(value: int) -> bytes:
+    """Variable-length integer used inside OAB_V4_REC values."""
+    value &= 0xFFFFFFFF
+    if value <= 0x7F:
+        return bytes((value,))
+    size = (value.bit_length() + 7) // 8
+    return bytes((0x80 | size,)) + value.to_bytes(size, "little")
+
+
+def _encode_value(prop_tag: int, value) -> bytes:
+    prop_type = prop_tag & 0xFFFF
+    if prop_type == PT_LONG:
+        return encode_v4_int(int(value))
+    if prop_type == PT_BOOLEAN:
+        return b"\x01" if value else b"\x00"
+    if prop_type == PT_STRING8:
+        return str(value).encode("ascii", "replace") + b"\x00"
+    return str(value).encode("utf-8") + b"\x00"
+
+
+def encode_v4_record(props: Sequence[Tuple[int, int]], values: Dict[int, object]) -> bytes:
+    """OAB_V4_REC: cbSize, presence bit array, then the present values in order."""
+    presence = bytearray((len(props) + 7) // 8)
+    parts = []
+    for index, (prop_tag, _flags) in enumerate(props):
+        value = values.get(prop_tag)
+        if value is None or value == "":
+            continue
+        presence[index // 8] |= 0x80 >> (index % 8)
+        parts.append(_encode_value(prop_tag, value))
+    body = bytes(presence) + b"".join(parts)
+    return struct.pack("<I", len(body) + 4) + body
+
+
+def _prop_table(props: Sequence[Tuple[int, int]]) -> bytes:
+    return struct.pack("<I", len(props)) + b"".join(struct.pack("<II", tag, flags) for tag, flags in props)
+
+
+def _metadata() -> bytes:
+    tables = _prop_table(HEADER_PROPS) + _prop_table(RECORD_PROPS)
+    return struct.pack("<I", len(tables) + 4) + tables
+
+
+def entry_record(entry: GalIndexEntry) -> bytes:
+    return encode_v4_record(
+        RECORD_PROPS,
+        {
+            PR_SMTP_ADDRESS: entry.email,
+            PR_DISPLAY_NAME: entry.display_name or entry.email,
+            PR_EMAIL_ADDRESS: entry.email,
+            PR_OBJECT_TYPE: MAPI_MAILUSER,
+            PR_DISPLAY_TYPE: DT_MAILUSER,
+            PR_GIVEN_NAME: entry.given_name,
+            PR_SURNAME: entry.surname,
+            PR_COMPANY_NAME: entry.company,
+            PR_DEPARTMENT_NAME: entry.department,
+            PR_TITLE: entry.job_title,
+            PR_OFFICE_LOCATION: entry.office_location,
+            PR_BUSINESS_TELEPHONE_NUMBER: entry.business_phone,
+            PR_MOBILE_TELEPHONE_NUMBER: entry.mobile_phone,
+        },
+    )
+
+
+def build_details(records: List[bytes], sequence: int) -> Tuple[bytes, List[int]]:
+    """Full details file; returns the file and each record's byte offset."""
+    header_record = encode_v4_record(
+        HEADER_PROPS,
+        {PR_OAB_NAME: OAB_NAME, PR_OAB_DN: OAB_DN, PR_OAB_SEQUENCE: sequence},
+    )
+    prefix = _metadata() + header_record
+    offsets = []
+    position = 12 + len(prefix)
+    for record in records:
+        offsets.append(position)
+        position += len(record)
+    body = prefix + b"".join(records)
+    header = struct.pack("<III", OAB_V4_VERSION, zlib.crc32(body) & 0xFFFFFFFF, len(records))
+    return header + body, offsets
+
+
+def _short_string(value: str, limit: int) -> bytes:
+    data = value.encode("utf-8")[:limit]
+    return struct.pack("<H", len(data)) + data
+
+
+def build_browse(entries: Sequence[GalIndexEntry]) -> bytes:
+    parts = [b"OAB4", struct.pack("<I", len(entries))]
+    for entry in entries:
+        parts.append(_short_string(entry.display_name or entry.email or "", 64))
+        parts.append(_short_string(entry.email or "", 128))
+    return b"".join(parts)
+
+
+def build_rdndex(entries: Sequence[GalIndexEntry], offsets: Sequence[int]) -> bytes:
+    ordered = sorted(zip((entry.key for entry in entries), offsets))
+    parts = [b"OABR", struct.pack("<I", len(ordered))]
+    for key, offset in ordered:
+        parts.append(struct.pack("<I", offset))
+        parts.append(_short_string(key, 256))
+    return b"".join(parts)
+
+
+def parse_rdndex(data: bytes) -> List[Tuple[str, int]]:
+    if data[:4] != b"OABR":
+        raise ValueError("Not an OAB RDN index")
+    (count,) = struct.unpack_from("<I", data, 4)
+    pos = 8
+    result = []
+    for _ in range(count):
+        offset, size = struct.unpack_from("<IH", data, pos)
+        pos += 6
+        result.append((data[pos : pos + size].decode("utf-8", "replace"), offset))
+        pos += size
+    return result
+
+
+def read_records(details: bytes, rdndex: bytes) -> Dict[str, bytes]:
+    """Map address -> OAB_V4_REC bytes for a stored version."""
+    records = {}
+    for key, offset in parse_rdndex(rdndex):
+        (size,) = struct.unpack_from("<I", details, offset)
+        records[key] = details[offset : offset + size]
+    return records
+
+
+def build_changes(
+    old: Dict[str, bytes], new: Dict[str, bytes], from_sequence: int, to_sequence: int
+) -> bytes:
+    """Differential patch: removed addresses followed by added/changed records."""
+    removed = sorted(key for key in old if key not in new)
+    changed = sorted(key for key, record in new.items() if old.get(key) != record)
+    parts = [b"OABP", struct.pack("<III", from_sequence, to_sequence, len(removed))]
+    parts.extend(_short_string(key, 256) for key in removed)
+    parts.append(struct.pack("<I", len(changed)))
+    parts.extend(new[key] for key in changed)
+    return b"".join(parts)
+
+
+def changes_file_name(from_sequence: int) -> str:
+    return f"changes-{from_sequence}.oab"
+
+
+# --- Versioned storage -------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class OabFile:
+    name: str
+    size: int
+    sha1: str
+    path: str
+    gzip_path: str
+
+
+@dataclass(frozen=True)
+class OabVersion:
+    sequence: int
+    content_sha: str
+    created: str
+    directory: str
+    files: Dict[str, OabFile]
+    record_count: int
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.content_sha[:16]}-{self.sequence}"'
+
+    def file(self, name: str) -> Optional[OabFile]:
+        return self.files.get(name)
+
+
+def _sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_path(version: OabVersion, name: str) -> str:
+    """Path of a file relative to the OAB URL; every sequence has its own."""
+    return f"{version.sequence}/{name}"
+
+
+def render_manifest(version: OabVersion, diffs: Sequence[OabFile]) -> bytes:
+    files = "".join(
+        f"""
+      <File>
+        <Name>{escape(file_path(version, f.name))}</Name>
+        <Size>{f.size}</Size>
+        <SHA1>{f.sha1}</SHA1>
+      </File>"""
+        for f in (version.files[name] for name in OAB_DATA_FILES)
+    )
+    diff_xml = "".join(
+        f"""
+      <Diff>
+        <Name>{escape(file_path(version, f.name))}</Name>
+        <Size>{f.size}</Size>
+        <SHA1>{f.sha1}</SHA1>
+      </Diff>"""
+        for f in diffs
+    )
+    total = sum(version.files[name].size for name in OAB_DATA_FILES)
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<OAB xmlns="http://schemas.microsoft.com/exchange/2003/oab"
+     xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+     xsi:schemaLocation="http://schemas.microsoft.com/exchange/2003/oab oab.xsd">
+  <OAL>
+    <Name>{escape(OAB_NAME)}</Name>
+    <DN>{escape(OAB_DN)}</DN>
+    <Id>{OAB_ID}</Id>
+    <Version>4.0</Version>
+    <Sequence>{version.sequence}</Sequence>
+    <Size>{total}</Size>
+    <LastModified>{version.created}</LastModified>
+    <Files>{files}{diff_xml}
+    </Files>
+  </OAL>
+</OAB>""".encode("utf-8")
+
+
+class OabStore:
+    """Versioned OAB artifacts on disk, published atomically per sequence."""
+
+    def __init__(self, root: str = OAB_STORAGE_DIR, keep_versions: int = OAB_KEEP_VERSIONS):
+        self.root = root
+        self.keep_versions = max(1, keep_versions)
+        self._lock = threading.Lock()
+        self._current: Optional[OabVersion] = None
+        self._manifest: bytes = b""
+        self._state_mtime: Optional[float] = None
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.root, "current.json")
+
+    def _version_dir(self, sequence: int) -> str:
+        return os.path.join(self.root, str(sequence))
+
+    def _load_version(self, sequence: int) -> Optional[OabVersion]:
+        directory = self._version_dir(sequence)
+        try:
+            with open(os.path.join(directory, "version.json"), "r", encoding="utf-8") as handle:
+                meta = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        files = {
+            name: OabFile(
+                name=name,
+                size=info["size"],
+                sha1=info["sha1"],
+                path=os.path.join(directory, name),
+                gzip_path=os.path.join(directory, name + ".gz"),
+            )
+            for name, info in meta["files"].items()
+        }
+        return OabVersion(
+            sequence=meta["sequence"],
+            content_sha=meta["content_sha"],
+            created=meta["created"],
+            directory=directory,
+            files=files,
+            record_count=meta["record_count"],
+        )
+
+    def current(self) -> Optional[OabVersion]:
+        """Current version, re-read when another process published a newer one."""
+        try:
+            mtime = os.stat(self._state_path).st_mtime
+        except OSError:
+            return self._current
+        with self._lock:
+            if self._current is None or mtime != self._state_mtime:
+                try:
+                    with open(self._state_path, "r", encoding="utf-8") as handle:
+                        sequence = json.load(handle)["sequence"]
+                except (OSError, ValueError, KeyError):
+                    return self._current
+                version = self._load_version(sequence)
+                if version is not None:
+                    self._current = version
+                    self._manifest = self._read_manifest(version)
+                    self._state_mtime = mtime
+            return self._current
+
+    def version(self, sequence: int) -> Optional[OabVersion]:
+        """A published version that is still on disk, None once pruned."""
+        current = self.current()
+        if current is not None and current.sequence == sequence:
+            return current
+        if current is None or sequence > current.sequence:
+            # Not published yet (or a leftover of an interrupted publish)
+            return None
+        return self._load_version(sequence)
+
+    def _read_manifest(self, version: OabVersion) -> bytes:
+        try:
+            with open(os.path.join(version.directory, "oab.xml"), "rb") as handle:
+                return handle.read()
+        except OSError:
+            return render_manifest(version, [])
+
+    def manifest(self) -> Tuple[Optional[OabVersion], bytes]:
+        version = self.current()
+        return version, self._manifest
+
+    @contextmanager
+    def publish_lock(self) -> Iterator[None]:
+        """Exclusive across processes sharing ``root`` (and threads of this one)."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".publish.lock"), "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def publish(self, entries: Sequence[GalIndexEntry]) -> OabVersion:
+        """Write a new version for ``entries`` unless the content is unchanged."""
+        records = [entry_record(entry) for entry in entries]
+        content_sha = _sha1(b"".join(records))
+        with self.publish_lock():
+            # Re-read under the lock: another process may have just published
+            previous = self.current()
+            if previous is not None and previous.content_sha == content_sha:
+                return previous
+            sequence = previous.sequence + 1 if previous else 1
+            existing = self._load_version(sequence)
+            if existing is not None and existing.content_sha == content_sha:
+                # Written by a publisher that stopped before switching current.json
+                return self._set_current(existing, self._read_manifest(existing))
+            # Never replace a directory that may be in use: take the next free sequence
+            while os.path.exists(self._version_dir(sequence)):
+                sequence += 1
+            return self._publish_locked(entries, records, content_sha, previous, sequence)
+
+    def _publish_locked(
+        self,
+        entries: Sequence[GalIndexEntry],
+        records: List[bytes],
+        content_sha: str,
+        previous: Optional[OabVersion],
+        sequence: int,
+    ) -> OabVersion:
+        details, offsets = build_details(records, sequence)
+        rdndex = build_rdndex(entries, offsets)
+        payloads = {
+            "browse.oab": build_browse(entries),
+            "details.oab": details,
+            "rdndex.oab": rdndex,
+        }
+        new_records = dict(zip((entry.key for entry in entries), records))
+        for old in self._previous_versions(previous):
+            try:
+                with open(old.files["details.oab"].path, "rb") as d, open(old.files["rdndex.oab"].path, "rb") as r:
+                    old_records = read_records(d.read(), r.read())
+            except (OSError, KeyError, ValueError, struct.error) as exc:
+                logger.warning("Skipping OAB diff from sequence %s: %s", old.sequence, exc)
+                continue
+            payloads[changes_file_name(old.sequence)] = build_changes(
+                old_records, new_records, old.sequence, sequence
+            )
+
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=f".{sequence}-", dir=self.root)
+        meta_files = {}
+        for name, data in payloads.items():
+            with open(os.path.join(staging, name), "wb") as handle:
+                handle.write(data)
+            with open(os.path.join(staging, name + ".gz"), "wb") as handle:
+                handle.write(gzip.compress(data, compresslevel=9, mtime=0))
+            meta_files[name] = {"size": len(data), "sha1": _sha1(data)}
+        created = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with open(os.path.join(staging, "version.json"), "w", encoding="utf-8") as handle:
+            json.dump(
+                {
+                    "sequence": sequence,
+                    "content_sha": content_sha,
+                    "created": created,
+                    "record_count": len(records),
+                    "files": meta_files,
+                },
+                handle,
+            )
+
+        target = self._version_dir(sequence)
+        files = {
+            name: OabFile(
+                name=name,
+                size=meta["size"],
+                sha1=meta["sha1"],
+                path=os.path.join(target, name),
+                gzip_path=os.path.join(target, name + ".gz"),
+            )
+            for name, meta in meta_files.items()
+        }
+        version = OabVersion(sequence, content_sha, created, target, files, len(records))
+        diffs = [f for name, f in sorted(files.items()) if name not in OAB_DATA_FILES]
+        manifest = render_manifest(version, diffs)
+        with open(os.path.join(staging, "oab.xml"), "wb") as handle:
+            handle.write(manifest)
+        # Complete before it appears; the target is free (checked under the lock)
+        os.rename(staging, target)
+        self._set_current(version, manifest)
+        self._prune(sequence)
+        logger.info("Published OAB sequence %s (%s records)", sequence, len(records))
+        return version
+
+    def _set_current(self, version: OabVersion, manifest: bytes) -> OabVersion:
+        state_tmp = self._state_path + ".tmp"
+        with open(state_tmp, "w", encoding="utf-8") as handle:
+            json.dump({"sequence": version.sequence}, handle)
+        os.replace(state_tmp, self._state_path)
+        with self._lock:
+            self._current = version
+            self._manifest = manifest
+            self._state_mtime = os.stat(self._state_path).st_mtime
+        return version
+
+    def _previous_versions(self, previous: Optional[OabVersion]) -> List[OabVersion]:
+        if previous is None:
+            return []
+        versions = []
+        for sequence in range(previous.sequence, max(0, previous.sequence - self.keep_versions + 1), -1):
+            version = previous if sequence == previous.sequence else self._load_version(sequence)
+            if version is not None:
+                versions.append(version)
+        return versions
+
+    def _prune(self, sequence: int) -> None:
+        for name in os.listdir(self.root):
+            if name.isdigit() and int(name) <= sequence - self.keep_versions:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+
+class OabGenerator:
+    """Background job that republishes the OAB when the GAL changes."""
+
+    def __init__(self, store: Optional[OabStore] = None, interval: int = OAB_REBUILD_INTERVAL):
+        self.store = store or OabStore()
+        self.interval = interval
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+        self._built_gal_version: Optional[int] = None
+        self._build_lock = threading.Lock()
+
+    def build_if_changed(self, force: bool = False) -> Optional[OabVersion]:
+        with self._build_lock:
+            db = SessionLocal()
+            try:
+                gal_index.ensure_fresh(db)
+            finally:
+                db.close()
+            current = self.store.current()
+            if not force and current is not None and self._built_gal_version == gal_index.version:
+                return current
+            self._built_gal_version = gal_index.version
+            return self.store.publish(gal_index.all(limit=len(gal_index)))
+
+    def ensure_current(self) -> Optional[OabVersion]:
+        """Current version, building the first one synchronously if needed."""
+        return self.store.current() or self.build_if_changed()
+
+    async def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._build_loop())
+        logger.info("OAB generator started")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        logger.info("OAB generator stopped")
+
+    async def _build_loop(self):
+        while self.running:
+            try:
+                await asyncio.to_thread(self.build_if_changed)
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error generating OAB: {e}")
+                await asyncio.sleep(30)
+
+
+# Global OAB generator instance
+oab_generator = OabGenerator()
@@ -0,0 +1,398 @@
+"""
+Recurrence Engine
+Lazy expansion of recurring calendar series.
+
+``CalendarEvent.recurrence_pattern`` holds an RRULE-style JSON object::
+
+    {"freq": "WEEKLY", "interval": 2, "byday": ["MO", "WE"],
+     "count": 10, "until": "2025-06-30T00:00:00",
+     "exdates": ["2025-02-03T09:00:00"],
+     "exceptions": [{"original_start": "2025-02-05T09:00:00",
+                     "start": "2025-02-06T14:00:00", "end": "2025-02-06T15:00:00"},
+                    {"original_start": "2025-02-12T09:00:00", "cancelled": true}]}
+
+A bare RFC 5545 rule string ("FREQ=DAILY;COUNT=5") is accepted as well, and
+the ``recurrence_end`` / ``recurrence_count`` columns fill in UNTIL / COUNT
+when the pattern omits them. The event's start_time is DTSTART.
+
+Supported: DAILY, WEEKLY (BYDAY), MONTHLY and YEARLY (BYMONTHDAY, BYMONTH,
+ordinal BYDAY such as "2TU" or "-1FR"), INTERVAL, COUNT, UNTIL. Expansion
+only walks the periods that can overlap the requested window (series with a
+COUNT are walked from their start, which COUNT bounds), and every series
+keeps a small cache of the windows it already expanded. Parsed series are
+cached by (event id, updated_at), so an edited event is simply a new key.
+"""
+import json
+import logging
+import threading
+from bisect import bisect_left
+from calendar import monthrange
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+
+# Upper bound on candidate dates examined per expansion (guards odd rules)
+MAX_CANDIDATES = 100_000
+# Expanded windows remembered per series, and parsed series kept per process
+WINDOW_CACHE_SIZE = 8
+SERIES_CACHE_SIZE = 20_000
+
+
+class Occurrence(NamedTuple):
+    start: datetime
+    end: datetime
+    status: str
+
+
+def _parse_dt(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    raw = str(value).strip()
+    if not raw:
+        return None
+    try:
+        if len(raw) in (8, 16) and raw[:8].isdigit():  # 20250203 / 20250203T090000Z
+            return datetime.strptime(raw.rstrip("Z"), "%Y%m%dT%H%M%S" if "T" in raw else "%Y%m%d")
+        if raw.endswith("Z"):
+            raw = raw[:-1]
+        parsed = datetime.fromisoformat(raw)
+        return parsed.replace(tzinfo=None) if parsed.tzinfo is None else (
+            parsed - parsed.utcoffset()
+        ).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [part for part in str(value).split(",") if part.strip()]
+
+
+def parse_pattern(pattern) -> Dict:
+    """Normalise a stored pattern (JSON text, dict or RRULE string) to a dict."""
+    if not pattern:
+        return {}
+    if isinstance(pattern, dict):
+        data = pattern
+    else:
+        text = str(pattern).strip()
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = {"rrule": text}
+        if isinstance(data, str):
+            data = {"rrule": data}
+        if not isinstance(data, dict):
+            return {}
+    rule = {str(key).lower(): value for key, value in data.items()}
+    rrule = rule.pop("rrule", None)
+    if rrule:
+        for part in str(rrule).replace("RRULE:", "").split(";"):
+            key, _, value = part.partition("=")
+            if key and value:
+                rule.setdefault(key.strip().lower(), value.strip())
+    return rule
+
+
+def _byday(values) -> List[Tuple[int, int]]:
+    """[(ordinal or 0, weekday index)] from ["MO", "2TU", "-1FR"]."""
+    parsed = []
+    for value in _as_list(values):
+        token = str(value).strip().upper()
+        day = token[-2:]
+        if day not in WEEKDAYS:
+            continue
+        ordinal = token[:-2]
+        try:
+            parsed.append((int(ordinal) if ordinal else 0, WEEKDAYS.index(day)))
+        except ValueError:
+            continue
+    return parsed
+
+
+def _ints(values) -> List[int]:
+    result = []
+    for value in _as_list(values):
+        try:
+            result.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return result
+
+
+def _month_days(year: int, month: int, bymonthday: List[int], byday: List[Tuple[int, int]], default_day: int) -> List[int]:
+    last = monthrange(year, month)[1]
+    days = set()
+    for day in bymonthday:
+        actual = day if day > 0 else last + day + 1
+        if 1 <= actual <= last:
+            days.add(actual)
+    first_weekday = date(year, month, 1).weekday()
+    for ordinal, weekday in byday:
+        first = 1 + (weekday - first_weekday) % 7
+        matches = list(range(first, last + 1, 7))
+        if ordinal == 0:
+            days.update(matches)
+        elif -len(matches) <= ordinal <= len(matches) and ordinal != 0:
+            days.add(matches[ordinal - 1] if ordinal > 0 else matches[ordinal])
+    if not bymonthday and not byday and default_day <= last:
+        days.add(default_day)  # RFC 5545: months without that day are skipped
+    return sorted(days)
+
+
+class RecurrenceSeries:
+    """Immutable expansion rules for one recurring event."""
+
+    def __init__(
+        self,
+        start: datetime,
+        end: datetime,
+        pattern=None,
+        status: str = "busy",
+        until: Optional[datetime] = None,
+        count: Optional[int] = None,
+    ):
+        rule = parse_pattern(pattern)
+        self.dtstart = _parse_dt(rule.get("dtstart")) or start
+        self.duration = max(end - start, timedelta(0))
+        self.status = (status or "busy").lower()
+        freq = str(rule.get("freq", "DAILY")).upper()
+        self.freq = freq if freq in FREQUENCIES else "DAILY"
+        self.interval = max(_ints(rule.get("interval")) or [1])
+        counts = _ints(rule.get("count"))
+        self.count = counts[0] if counts else count
+        self.until = _parse_dt(rule.get("until")) or until
+        self.byday = _byday(rule.get("byday"))
+        self.bymonthday = _ints(rule.get("bymonthday"))
+        self.bymonth = sorted(m for m in _ints(rule.get("bymonth")) if 1 <= m <= 12)
+        self.exdates: FrozenSet[datetime] = frozenset(
+            filter(None, (_parse_dt(v) for v in _as_list(rule.get("exdates") or rule.get("exdate"))))
+        )
+        # original start -> replacement occurrence (None when cancelled)
+        self.exceptions: Dict[datetime, Optional[Occurrence]] = {}
+        for item in rule.get("exceptions") or []:
+            if not isinstance(item, dict):
+                continue
+            original = _parse_dt(item.get("original_start"))
+            if original is None:
+                continue
+            if item.get("cancelled") or item.get("deleted"):
+                self.exceptions[original] = None
+                continue
+            new_start = _parse_dt(item.get("start")) or original
+            new_end = _parse_dt(item.get("end")) or new_start + self.duration
+            self.exceptions[original] = Occurrence(new_start, new_end, item.get("status") or self.status)
+        self._moved = sorted(occ for occ in self.exceptions.values() if occ is not None)
+        # Precomputed period geometry for DAILY/WEEKLY (the hot path)
+        first = self.dtstart.date()
+        self._week0 = datetime.combine(first - timedelta(days=first.weekday()), self.dtstart.time())
+        self._step = timedelta(days=self.interval * (7 if self.freq == "WEEKLY" else 1))
+        weekdays = sorted({wd for _ordinal, wd in self.byday}) or [first.weekday()]
+        self._offsets = [timedelta(days=wd) for wd in weekdays]
+        self._windows: "OrderedDict[Tuple[datetime, datetime], Tuple[Occurrence, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # --- Candidate generation -------------------------------------------------
+
+    def _first_period(self, not_before: datetime) -> int:
+        """Index of the period containing ``not_before`` (0 if COUNT needs the full walk)."""
+        if self.count is not None or not_before <= self.dtstart:
+            return 0  # COUNT is defined from the start of the series
+        if self.freq == "DAILY":
+            return (not_before - self.dtstart).days // self.interval
+        if self.freq == "WEEKLY":
+            return (not_before - self._week0).days // (7 * self.interval)
+        months = (not_before.year - self.dtstart.year) * 12 + not_before.month - self.dtstart.month
+        if self.freq == "MONTHLY":
+            return months // self.interval
+        return months // (12 * self.interval)
+
+    def _period_starts(self, period: int) -> List[datetime]:
+        """Candidate starts in one period, sorted, before COUNT/UNTIL filtering."""
+        if self.freq == "DAILY":
+            return [self.dtstart + self._step * period]
+        if self.freq == "WEEKLY":
+            week = self._week0 + self._step * period
+            return [week + offset for offset in self._offsets]
+        clock = self.dtstart.time()
+        first = self.dtstart.date()
+        if self.freq == "MONTHLY":
+            index = first.year * 12 + first.month - 1 + period * self.interval
+            year, month = divmod(index, 12)
+            return [
+                datetime.combine(date(year, month + 1, day), clock)
+                for day in _month_days(year, month + 1, self.bymonthday, self.byday, first.day)
+            ]
+        year = first.year + period * self.interval
+        starts = []
+        for month in self.bymonth or [first.month]:
+            for day in _month_days(year, month, self.bymonthday, self.byday, first.day):
+                starts.append(datetime.combine(date(year, month, day), clock))
+        return starts
+
+    def iter_starts(self, not_before: Optional[datetime] = None) -> Iterator[datetime]:
+        """Regular occurrence starts (before exceptions) in order, lazily."""
+        emitted = 0
+        examined = 0
+        period = self._first_period(not_before) if not_before else 0
+        while examined < MAX_CANDIDATES:
+            try:
+                candidates = self._period_starts(period)
+            except (ValueError, OverflowError):
+                return  # ran past datetime.max
+            examined += len(candidates) or 1
+            for start in candidates:
+                if start < self.dtstart:
+                    continue
+                if self.until is not None and start > self.until:
+                    return
+                if self.count is not None and emitted >= self.count:
+                    return
+                emitted += 1
+                yield start
+            period += 1
+
+    # --- Windows ----------------------------------------------------------------
+
+    def expand(self, window_start: datetime, window_end: datetime) -> Tuple[Occurrence, ...]:
+        """Occurrences overlapping [window_start, window_end), uncached."""
+        found = []
+        for start in self.iter_starts(window_start - self.duration):
+            if start >= window_end:
+                break
+            end = start + self.duration
+            if end <= window_start and not (self.duration == timedelta(0) and start == window_start):
+                continue
+            if start in self.exdates or start in self.exceptions:
+                continue
+            found.append(Occurrence(start, end, self.status))
+        # Moved occurrences land wherever their exception says, inside or out of the window
+        pos = bisect_left(self._moved, (window_start - timedelta(days=366),))
+        for occ in self._moved[pos:]:
+            if occ.start >= window_end:
+                break
+            if occ.end > window_start:
+                found.append(occ)
+        found.sort()
+        return tuple(found)
+
+    def occurrences(self, window_start: datetime, window_end: datetime) -> Tuple[Occurrence, ...]:
+        """Occurrences overlapping [window_start, window_end), cached per window."""
+        key = (window_start, window_end)
+        with self._lock:
+            cached = self._windows.get(key)
+            if cached is not None:
+                self._windows.move_to_end(key)
+                return cached
+        found = self.expand(window_start, window_end)
+        with self._lock:
+            self._windows[key] = found
+            if len(self._windows) > WINDOW_CACHE_SIZE:
+                self._windows.popitem(last=False)
+        return found
+
+    def has_occurrence(self, window_start: datetime, window_end: Optional[datetime] = None) -> bool:
+        """Whether any occurrence overlaps the window; stops at the first one."""
+        for occ in self._moved:
+            if occ.end > window_start and (window_end is None or occ.start < window_end):
+                return True
+        for start in self.iter_starts(window_start - self.duration):
+            if window_end is not None and start >= window_end:
+                return False
+            if start + self.duration > window_start and start not in self.exdates and start not in self.exceptions:
+                return True
+        return False
+
+    def to_rrule(self) -> str:
+        """RFC 5545 RRULE value for iCalendar output."""
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        elif self.until is not None:
+            parts.append(f"UNTIL={self.until.strftime('%Y%m%dT%H%M%SZ')}")
+        if self.byday:
+            parts.append(
+                "BYDAY=" + ",".join(f"{o or ''}{WEEKDAYS[wd]}" for o, wd in self.byday)
+            )
+        if self.bymonthday:
+            parts.append("BYMONTHDAY=" + ",".join(map(str, self.bymonthday)))
+        if self.bymonth:
+            parts.append("BYMONTH=" + ",".join(map(str, self.bymonth)))
+        return ";".join(parts)
+
+
+_series_cache: "OrderedDict[Tuple, RecurrenceSeries]" = OrderedDict()
+_series_lock = threading.Lock()
+
+
+def build_series(event) -> Optional[RecurrenceSeries]:
+    """RecurrenceSeries for a recurring event (ORM row or row tuple), uncached.
+
+    ``event`` needs id, start_time, end_time, is_recurring, recurrence_pattern,
+    recurrence_end, recurrence_count and meeting_status.
+    """
+    if not getattr(event, "is_recurring", False) or not event.recurrence_pattern:
+        return None
+    try:
+        return RecurrenceSeries(
+            event.start_time,
+            event.end_time,
+            event.recurrence_pattern,
+            status=event.meeting_status,
+            until=event.recurrence_end,
+            count=event.recurrence_count,
+        )
+    except Exception as exc:
+        logger.warning("Unreadable recurrence pattern on event %s: %s", event.id, exc)
+        return None
+
+
+def series_for(event) -> Optional[RecurrenceSeries]:
+    """build_series() through the process-wide cache (keyed by id and updated_at)."""
+    if not getattr(event, "is_recurring", False) or not event.recurrence_pattern:
+        return None
+    key = (
+        event.id,
+        getattr(event, "updated_at", None),
+        event.start_time,
+        event.end_time,
+        event.recurrence_pattern,
+        event.recurrence_end,
+        event.recurrence_count,
+        event.meeting_status,
+    )
+    with _series_lock:
+        series = _series_cache.get(key)
+        if series is not None:
+            _series_cache.move_to_end(key)
+            return series
+    series = build_series(event)
+    if series is None:
+        return None
+    with _series_lock:
+        _series_cache[key] = series
+        if len(_series_cache) > SERIES_CACHE_SIZE:
+            _series_cache.popitem(last=False)
+    return series
+
+
+def expand_event(event, window_start: datetime, window_end: datetime) -> List[Occurrence]:
+    """Occurrences of any event (recurring or not) overlapping the window."""
+    series = series_for(event)
+    if series is not None:
+        return list(series.occurrences(window_start, window_end))
+    if event.start_time < window_end and (
+        event.end_time > window_start or event.start_time == event.end_time == window_start
+    ):
+        return [Occurrence(event.start_time, event.end_time, event.meeting_status or "busy")]
+    return []
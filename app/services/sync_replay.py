@@ -0,0 +1,142 @@
+"""
+Sync Replay Cache
+Encoded WBXML of staged (pending) Sync batches, replayed on client retries.
+
+A device that loses the response to a Sync retries with its previous
+SyncKey, and the handler rebuilt the pending batch from scratch: the
+folder query, a payload per message and the WBXML encoding, on exactly
+the flaky links where retries are common. Every response that stages a
+pending batch is now kept here, keyed by (user, device, collection,
+pending SyncKey), and a retry is answered with the same bytes:
+- entries are validated against a fingerprint of the batch (item ids,
+  WindowSize, body preference, truncation), so a key that is reissued
+  after a reset or a retry with other options rebuilds instead
+- stores and invalidations are staged on the session and applied when it
+  commits, so a rolled back request never leaves an entry for a key the
+  database does not hold; confirming the batch (commit of the next key)
+  or a SyncKey 0 reset drops the collection's entries
+- bounded by entry count and total bytes (LRU); responses larger than
+  SYNC_REPLAY_MAX_RESPONSE are not kept
+- hits, misses and evictions feed the /metrics gauges
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+SYNC_REPLAY_CACHE_SIZE = int(os.getenv("SYNC_REPLAY_CACHE_SIZE", "5000"))
+SYNC_REPLAY_CACHE_BYTES = int(os.getenv("SYNC_REPLAY_CACHE_BYTES", str(64 * 1024 * 1024)))
+SYNC_REPLAY_MAX_RESPONSE = int(os.getenv("SYNC_REPLAY_MAX_RESPONSE", str(4 * 1024 * 1024)))
+
+_PENDING_KEY = "sync_replay_pending"
+
+# (user_id, device_id, collection_id, sync_key)
+ReplayKey = Tuple[int, str, str, str]
+
+
+class SyncReplayCache:
+    """LRU of encoded Sync responses, bounded by entries and bytes."""
+
+    def __init__(
+        self,
+        max_entries: int = SYNC_REPLAY_CACHE_SIZE,
+        max_bytes: int = SYNC_REPLAY_CACHE_BYTES,
+        max_response: int = SYNC_REPLAY_MAX_RESPONSE,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_response = max_response
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[ReplayKey, Tuple[Hashable, bytes]]" = OrderedDict()
+        self._keys_by_collection: Dict[Tuple[int, str, str], Set[ReplayKey]] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _drop(self, key: ReplayKey) -> None:
+        _fingerprint, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+        keys = self._keys_by_collection.get(key[:3])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_collection[key[:3]]
+
+    def get(self, key: ReplayKey, fingerprint: Hashable) -> Optional[bytes]:
+        """The stored response for ``key`` if it was built for ``fingerprint``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def store(self, key: ReplayKey, fingerprint: Hashable, payload: bytes) -> None:
+        with self._lock:
+            # A new pending batch supersedes the collection's earlier ones
+            for stale in list(self._keys_by_collection.get(key[:3], ())):
+                self._drop(stale)
+            if len(payload) > self.max_response:
+                return
+            self._entries[key] = (fingerprint, payload)
+            self._keys_by_collection.setdefault(key[:3], set()).add(key)
+            self._bytes += len(payload)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, user_id: int, device_id: str, collection_id: str) -> None:
+        with self._lock:
+            for key in list(self._keys_by_collection.get((user_id, device_id, collection_id), ())):
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_collection.clear()
+            self._bytes = 0
+
+    # --- Transactional staging ---------------------------------------------------
+
+    def stage(self, db: Session, key: ReplayKey, fingerprint: Hashable, payload: bytes) -> None:
+        """Store ``payload`` once ``db`` commits the state that issued ``key``."""
+        db.info.setdefault(_PENDING_KEY, []).append((self.store, (key, fingerprint, payload)))
+
+    def stage_invalidate(self, db: Session, user_id: int, device_id: str, collection_id: str) -> None:
+        """Drop the collection's entries once ``db`` commits."""
+        db.info.setdefault(_PENDING_KEY, []).append((self.invalidate, (user_id, device_id, collection_id)))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+sync_replay_cache = SyncReplayCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session) -> None:
+    for apply, args in session.info.pop(_PENDING_KEY, ()):
+        apply(*args)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
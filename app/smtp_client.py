@@ -241,34 +241,107 @@ class SMTPClient:
         Returns:
             SMTPDeliveryResult object
         """
+        results = self.deliver_message(
+            sender, [recipient], subject, body, headers, mx_server, mx_port
+        )
+        return results[recipient]
+
+    def deliver_message(
+        self,
+        sender: str,
+        recipients: List[str],
+        subject: str,
+        body: str,
+        headers: Dict = None,
+        mx_server: str = None,
+        mx_port: int = 25,
+    ) -> Dict[str, SMTPDeliveryResult]:
+        """
+        Deliver one message to several recipients behind the same MX
+
+        One connection and one DATA transfer with a RCPT TO per recipient;
+        the server can still refuse recipients individually.
+
+        Args:
+            sender: Sender email address
+            recipients: Recipient email addresses
+            subject: Email subject
+            body: Email body
+            headers: Additional headers; "To" is kept as the visible list
+            mx_server: MX server hostname
+            mx_port: MX server port
+
+        Returns:
+            SMTPDeliveryResult per recipient
+        """
+
+        def every(result: SMTPDeliveryResult) -> Dict[str, SMTPDeliveryResult]:
+            return {recipient: result for recipient in recipients}
+
         if not mx_server:
-            return SMTPDeliveryResult(
-                success=False, error_message="No MX server provided"
+            return every(
+                SMTPDeliveryResult(success=False, error_message="No MX server provided")
             )
 
         server = None
         try:
-            # Create email message
+            visible_to = (headers or {}).get("To") or ", ".join(recipients)
             message = self.create_email_message(
-                sender, recipient, subject, body, headers
+                sender, visible_to, subject, body, headers
             )
 
-            # Connect to server
             server = self.connect_to_server(mx_server, mx_port)
             if not server:
-                return SMTPDeliveryResult(
-                    success=False,
-                    error_message=f"Failed to connect to {mx_server}:{mx_port}",
+                return every(
+                    SMTPDeliveryResult(
+                        success=False,
+                        error_message=f"Failed to connect to {mx_server}:{mx_port}",
+                    )
                 )
 
-            # Send email
-            result = self.send_email(server, sender, recipient, message)
-            return result
+            logger.info(
+                f"Sending email from {sender} to {len(recipients)} recipient(s) via {mx_server}"
+            )
+            try:
+                refused = server.sendmail(sender, recipients, message.as_string())
+            except smtplib.SMTPRecipientsRefused as e:
+                refused = e.recipients
+            except smtplib.SMTPDataError as e:
+                error_msg = f"Data error: {e}"
+                logger.error(error_msg)
+                return every(
+                    SMTPDeliveryResult(
+                        success=False, error_message=error_msg, response_code=e.smtp_code
+                    )
+                )
 
+            results = {}
+            for recipient in recipients:
+                if recipient in refused:
+                    code, reply = refused[recipient]
+                    if isinstance(reply, bytes):
+                        reply = reply.decode(errors="ignore")
+                    error_msg = f"Recipient refused: {code} {reply}"
+                    logger.error(f"{recipient}: {error_msg}")
+                    results[recipient] = SMTPDeliveryResult(
+                        success=False, error_message=error_msg, response_code=code
+                    )
+                else:
+                    results[recipient] = SMTPDeliveryResult(success=True)
+            logger.info(
+                f"Sent email from {sender} via {mx_server}: "
+                f"{len(recipients) - len(refused)} accepted, {len(refused)} refused"
+            )
+            return results
+
+        except smtplib.SMTPException as e:
+            error_msg = f"SMTP error: {e}"
+            logger.error(error_msg)
+            return every(SMTPDeliveryResult(success=False, error_message=error_msg))
         except Exception as e:
             error_msg = f"Delivery error: {e}"
             logger.error(error_msg)
-            return SMTPDeliveryResult(success=False, error_message=error_msg)
+            return every(SMTPDeliveryResult(success=False, error_message=error_msg))
 
         finally:
             # Close connection
@@ -2,6 +2,7 @@ import asyncio
 import base64
 import email
 import html as html_unescape
+import itertools
 import logging
 import os
 import re
@@ -18,8 +19,9 @@ from email.utils import parseaddr
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from .database import Email, SessionLocal, User
-from .ews_push import trigger_ews_push
+from .database import SessionLocal, User
+from .message_store import deliver_to_mailboxes, notify_new_mail
+from .metrics import command_timer
 from .email_parser import decode_payload, html_to_text, parse_mime_email
 from .mime_utils import plain_to_html
 from .smtp_logger import smtp_logger
@@ -52,6 +54,89 @@ def create_ssl_context():
         return None
 
 
+_SMTP_VERBS = {"EHLO", "HELO", "STARTTLS", "MAIL", "RCPT", "DATA", "BDAT", "QUIT", "RSET", "NOOP", "VRFY", "AUTH"}
+
+# Advertised SIZE limit; DATA and BDAT transactions above it are refused
+SMTP_MAX_MESSAGE_SIZE = int(os.getenv("SMTP_MAX_MESSAGE_SIZE", "33554432"))
+# Longest command or DATA line accepted before the connection is dropped
+SMTP_MAX_LINE = int(os.getenv("SMTP_MAX_LINE", "1048576"))
+SMTP_READ_CHUNK = 65536
+# Log one in N commands at DEBUG (0 disables command logging)
+SMTP_COMMAND_LOG_SAMPLE = int(os.getenv("SMTP_COMMAND_LOG_SAMPLE", "100"))
+
+_command_log_counter = itertools.count()
+
+
+def _smtp_verb(upper_line: str) -> str:
+    """Metrics label for a command line; unknown input collapses to one label."""
+    verb = upper_line.split(" ", 1)[0].split(":", 1)[0]
+    return verb if verb in _SMTP_VERBS else "UNKNOWN"
+
+
+def _log_command(connection_id: str, verb: str, command: str) -> None:
+    """Sampled DEBUG log of a command line; AUTH arguments are never logged."""
+    if not SMTP_COMMAND_LOG_SAMPLE or not logger.isEnabledFor(logging.DEBUG):
+        return
+    if next(_command_log_counter) % SMTP_COMMAND_LOG_SAMPLE:
+        return
+    logger.debug(f"🔗 [{connection_id}] Command: {verb if verb == 'AUTH' else command}")
+
+
+class _SMTPInput:
+    """
+    Buffered reader over a client connection.
+
+    Unlike StreamReader it can tell whether another complete command is
+    already buffered (pipelined by the client), so replies are only flushed
+    once the batch is exhausted (RFC 2920), and it reads BDAT chunks as
+    exact octet counts, binary safe (RFC 3030).
+    """
+
+    def __init__(self, reader: asyncio.StreamReader):
+        self.reader = reader
+        self.buffer = bytearray()
+
+    def has_line(self) -> bool:
+        return b"\n" in self.buffer
+
+    def discard(self) -> None:
+        """Drop buffered input (plaintext pipelined past STARTTLS)."""
+        self.buffer.clear()
+
+    async def _fill(self) -> bool:
+        chunk = await self.reader.read(SMTP_READ_CHUNK)
+        self.buffer.extend(chunk)
+        return bool(chunk)
+
+    async def readline(self) -> bytes:
+        while True:
+            index = self.buffer.find(b"\n")
+            if index >= 0:
+                line = bytes(self.buffer[: index + 1])
+                del self.buffer[: index + 1]
+                return line
+            if len(self.buffer) > SMTP_MAX_LINE:
+                raise ValueError("SMTP line too long")
+            if not await self._fill():
+                line = bytes(self.buffer)
+                self.buffer.clear()
+                return line
+
+    async def read_chunk(self, size: int, keep: bool = True) -> bytes:
+        """Exactly ``size`` octets; with keep=False they are consumed and dropped."""
+        parts = []
+        remaining = size
+        while remaining:
+            if not self.buffer and not await self._fill():
+                raise asyncio.IncompleteReadError(b"".join(parts), size)
+            take = min(remaining, len(self.buffer))
+            if keep:
+                parts.append(bytes(self.buffer[:take]))
+            del self.buffer[:take]
+            remaining -= take
+        return b"".join(parts)
+
+
 class EmailHandler:
     """Custom SMTP server for processing incoming emails using asyncio and socket with TLS support"""
 
@@ -73,137 +158,216 @@ class EmailHandler:
 
         logger.info(f"🔗 [{connection_id}] New connection from {peer}")
 
+        stream = _SMTPInput(reader)
+        pending = []
+
+        def reply(text: str) -> None:
+            pending.append(text.encode() + b"\r\n")
+
+        async def flush(force: bool = False) -> None:
+            # Pipelined commands still buffered: answer them all in one write
+            if pending and (force or not stream.has_line()):
+                writer.write(b"".join(pending))
+                pending.clear()
+                await writer.drain()
+
         try:
             # Send SMTP greeting
-            writer.write(b"220 Python SMTP Server Ready\r\n")
-            await writer.drain()
+            reply("220 Python SMTP Server Ready")
+            await flush(force=True)
 
             # SMTP state
             mail_from = None
             rcpt_to = []
             data_mode = False
             data_buffer = []
+            data_size = 0
+            bdat_chunks = []
+            bdat_size = 0
             tls_started = False
 
             while True:
-                # Read command
-                line_bytes = await reader.readline()
+                # Flush batched replies before blocking on the next read
+                await flush()
+                line_bytes = await stream.readline()
                 if not line_bytes:
                     break
 
                 line_text = line_bytes.decode("utf-8", errors="ignore")
-                upper_line = line_text.strip().upper()
 
                 if data_mode:
                     stripped = line_text.rstrip("\r\n")
-                    if stripped == ".":
-                        logger.info(f"🔗 [{connection_id}] End of data received")
-                        data_content = "".join(data_buffer)
-
-                        # Process the email
-                        result = await self.process_email(
-                            connection_id, peer, mail_from, rcpt_to, data_content
-                        )
-
-                        writer.write(f"{result}\r\n".encode())
-                        await writer.drain()
-
-                        # Reset for next email
-                        mail_from = None
-                        rcpt_to = []
-                        data_mode = False
-                        data_buffer = []
-                    else:
-                        data_buffer.append(line_text)
+                    if stripped != ".":
+                        if line_text.startswith(".."):
+                            line_text = line_text[1:]  # Dot-stuffing
+                        data_size += len(line_text)
+                        if data_size <= SMTP_MAX_MESSAGE_SIZE:
+                            data_buffer.append(line_text)
+                        continue
+                    logger.debug(f"🔗 [{connection_id}] End of data received")
+                    with command_timer("smtp", "MESSAGE"):
+                        if data_size > SMTP_MAX_MESSAGE_SIZE:
+                            result = "552 Message size exceeds fixed maximum message size"
+                        else:
+                            result = await self.process_email(
+                                connection_id, peer, mail_from, rcpt_to, "".join(data_buffer)
+                            )
+                        reply(result)
+
+                    # Reset for next email
+                    mail_from = None
+                    rcpt_to = []
+                    data_mode = False
+                    data_buffer = []
+                    data_size = 0
                     continue
 
                 command = line_text.strip()
-                logger.info(f"🔗 [{connection_id}] Command: {command}")
-
-                if upper_line.startswith("EHLO"):
-                    capabilities = [
-                        "250-Hello",
-                        "250-SIZE 33554432",
-                        "250-8BITMIME",
-                        "250-SMTPUTF8",
-                    ]
-                    if self.ssl_context and not tls_started:
-                        capabilities.insert(
-                            1,
-                            "250-STARTTLS",
+                upper_line = command.upper()
+                verb = _smtp_verb(upper_line)
+                _log_command(connection_id, verb, command)
+
+                with command_timer("smtp", verb):
+                    if upper_line.startswith("EHLO"):
+                        capabilities = [
+                            "250-Hello",
+                            f"250-SIZE {SMTP_MAX_MESSAGE_SIZE}",
+                            "250-8BITMIME",
+                            "250-SMTPUTF8",
+                            "250-PIPELINING",
+                            "250-CHUNKING",
+                        ]
+                        if self.ssl_context and not tls_started:
+                            capabilities.insert(
+                                1,
+                                "250-STARTTLS",
+                            )
+                        capabilities.append("250 HELP")
+                        reply("\r\n".join(capabilities))
+
+                    elif upper_line.startswith("HELO"):
+                        reply("250 Hello")
+
+                    elif upper_line == "STARTTLS":
+                        if not self.ssl_context:
+                            reply("454 TLS not available")
+                        elif tls_started or writer.get_extra_info("ssl_object"):
+                            reply("503 TLS already active")
+                        else:
+                            reply("220 Ready to start TLS")
+                            await flush(force=True)
+                            # Anything pipelined after STARTTLS arrived in
+                            # plaintext and must not be executed (RFC 3207)
+                            stream.discard()
+                            try:
+                                await writer.start_tls(self.ssl_context)
+                                tls_started = True
+                                mail_from = None
+                                rcpt_to = []
+                                bdat_chunks = []
+                                bdat_size = 0
+                                logger.info(f"🔗 [{connection_id}] TLS negotiation successful")
+                            except Exception as tls_error:
+                                logger.error(
+                                    f"❌ [{connection_id}] TLS negotiation failed: {tls_error}"
+                                )
+                                reply("454 TLS not available")
+
+                    elif upper_line.startswith("MAIL FROM:"):
+                        raw_from = command[10:].strip()
+                        # Extract address before SMTP parameters (e.g., SIZE=...)
+                        addr_part = raw_from.split()[0] if raw_from else ""
+                        parsed = parseaddr(addr_part)[1] or addr_part.strip("<> \t\r\n")
+                        mail_from = parsed.strip().lower()
+                        rcpt_to = []
+                        bdat_chunks = []
+                        bdat_size = 0
+                        logger.debug(f"🔗 [{connection_id}] Mail from: {mail_from}")
+                        reply("250 OK")
+
+                    elif upper_line.startswith("RCPT TO:"):
+                        # Normalize recipient to pure email address (no display name, no brackets)
+                        rcpt_raw = command[8:].strip()
+                        rcpt_addr = parseaddr(rcpt_raw)[1] or rcpt_raw.strip("<> \t\r\n")
+                        rcpt_addr = rcpt_addr.strip().lower()
+                        rcpt_to.append(rcpt_addr)
+                        logger.debug(
+                            f"🔗 [{connection_id}] Rcpt to (normalized): {rcpt_addr} (raw: {rcpt_raw})"
                         )
-                    capabilities.append("250 HELP")
-                    writer.write(("\r\n".join(capabilities) + "\r\n").encode())
-                    await writer.drain()
-
-                elif upper_line.startswith("HELO"):
-                    writer.write(b"250 Hello\r\n")
-                    await writer.drain()
-
-                elif upper_line == "STARTTLS":
-                    if not self.ssl_context:
-                        writer.write(b"454 TLS not available\r\n")
-                        await writer.drain()
-                        continue
-                    if tls_started or writer.get_extra_info("ssl_object"):
-                        writer.write(b"503 TLS already active\r\n")
-                        await writer.drain()
-                        continue
-
-                    writer.write(b"220 Ready to start TLS\r\n")
-                    await writer.drain()
+                        reply("250 OK")
+
+                    elif upper_line == "DATA":
+                        if bdat_chunks:
+                            reply("503 DATA not allowed after BDAT")
+                        else:
+                            data_mode = True
+                            logger.debug(f"🔗 [{connection_id}] Entering DATA mode")
+                            reply("354 End data with <CR><LF>.<CR><LF>")
+                            # DATA ends a pipelined batch: the client waits for 354
+                            await flush(force=True)
+                            continue
+
+                    elif verb == "BDAT":
+                        args = upper_line.split()
+                        if len(args) not in (2, 3) or not args[1].isdigit() or (
+                            len(args) == 3 and args[2] != "LAST"
+                        ):
+                            # Chunk length unknown: the stream cannot be resynchronized
+                            reply("501 Syntax: BDAT <size> [LAST]")
+                            await flush(force=True)
+                            break
+                        size = int(args[1])
+                        last = len(args) == 3
+                        accept = mail_from is not None and rcpt_to
+                        too_big = bdat_size + size > SMTP_MAX_MESSAGE_SIZE
+                        # The chunk is always consumed, even when it is refused
+                        chunk = await stream.read_chunk(size, keep=bool(accept) and not too_big)
+                        if not accept:
+                            reply("503 Need MAIL FROM and RCPT TO before BDAT")
+                            continue
+                        if too_big:
+                            reply("552 Message size exceeds fixed maximum message size")
+                            mail_from = None
+                            rcpt_to = []
+                            bdat_chunks = []
+                            bdat_size = 0
+                            continue
+                        bdat_chunks.append(chunk)
+                        bdat_size += size
+                        if not last:
+                            reply(f"250 {size} octets received")
+                            continue
+                        with command_timer("smtp", "MESSAGE"):
+                            result = await self.process_email(
+                                connection_id,
+                                peer,
+                                mail_from,
+                                rcpt_to,
+                                b"".join(bdat_chunks).decode("utf-8", errors="ignore"),
+                            )
+                        reply(result)
+                        mail_from = None
+                        rcpt_to = []
+                        bdat_chunks = []
+                        bdat_size = 0
 
-                    try:
-                        await writer.start_tls(self.ssl_context)
-                        tls_started = True
+                    elif upper_line == "RSET":
                         mail_from = None
                         rcpt_to = []
-                        data_mode = False
-                        data_buffer = []
-                        logger.info(f"🔗 [{connection_id}] TLS negotiation successful")
-                    except Exception as tls_error:
-                        logger.error(
-                            f"❌ [{connection_id}] TLS negotiation failed: {tls_error}"
-                        )
-                        writer.write(b"454 TLS not available\r\n")
-                        await writer.drain()
-
-                elif command.upper().startswith("MAIL FROM:"):
-                    raw_from = command[10:].strip()
-                    # Extract address before SMTP parameters (e.g., SIZE=...)
-                    addr_part = raw_from.split()[0]
-                    parsed = parseaddr(addr_part)[1] or addr_part.strip("<> \t\r\n")
-                    mail_from = parsed.strip().lower()
-                    logger.info(f"🔗 [{connection_id}] Mail from: {mail_from}")
-                    writer.write(b"250 OK\r\n")
-                    await writer.drain()
-
-                elif command.upper().startswith("RCPT TO:"):
-                    # Normalize recipient to pure email address (no display name, no brackets)
-                    rcpt_raw = command[8:].strip()
-                    rcpt_addr = parseaddr(rcpt_raw)[1] or rcpt_raw.strip("<> \t\r\n")
-                    rcpt_addr = rcpt_addr.strip().lower()
-                    rcpt_to.append(rcpt_addr)
-                    logger.info(
-                        f"🔗 [{connection_id}] Rcpt to (normalized): {rcpt_addr} (raw: {rcpt_raw})"
-                    )
-                    writer.write(b"250 OK\r\n")
-                    await writer.drain()
-
-                elif command.upper() == "DATA":
-                    data_mode = True
-                    logger.info(f"🔗 [{connection_id}] Entering DATA mode")
-                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
-                    await writer.drain()
-
-                elif command.upper() == "QUIT":
-                    writer.write(b"221 Goodbye\r\n")
-                    await writer.drain()
-                    break
+                        bdat_chunks = []
+                        bdat_size = 0
+                        reply("250 OK")
 
-                else:
-                    writer.write(b"500 Command not recognized\r\n")
-                    await writer.drain()
+                    elif upper_line.startswith("NOOP"):
+                        reply("250 OK")
+
+                    elif upper_line == "QUIT":
+                        reply("221 Goodbye")
+                        await flush(force=True)
+                        break
+
+                    else:
+                        reply("500 Command not recognized")
 
         except Exception as e:
             logger.error(f"❌ [{connection_id}] Error handling client: {e}")
@@ -228,9 +392,10 @@ class EmailHandler:
             sender = mail_from or msg.get("From", "").strip()
             # Prefer RCPT command recipients; fallback to parsing To header
             if rcpt_to:
-                recipient = rcpt_to[0]
+                recipients = list(rcpt_to)
             else:
-                recipient = parseaddr(msg.get("To", "") or "")[1].strip().lower()
+                recipients = [parseaddr(msg.get("To", "") or "")[1].strip().lower()]
+            recipient = ", ".join(recipients)
 
             # Decode subject (RFC 2047) and strip HTML tags/entities
             raw_subject = msg.get("Subject", "")
@@ -427,20 +592,25 @@ class EmailHandler:
                 if plain_body and not html_body:
                     html_body = plain_to_html(plain_body)
 
-            # Normalize recipient to bare address and lowercase
-            normalized_recipient = (
-                (parseaddr(recipient)[1] or recipient).strip().lower()
+            # Normalize recipients to bare addresses and lowercase
+            normalized_recipients = list(
+                dict.fromkeys(
+                    (parseaddr(address)[1] or address).strip().lower()
+                    for address in recipients
+                    if address
+                )
             )
+            normalized_recipient = ", ".join(normalized_recipients)
             # Normalize sender as well
             normalized_sender = (parseaddr(sender)[1] or sender).strip().lower()
-            # Find recipient user (case-insensitive, by email only)
-            recipient_user = (
+            # Find every recipient user in one query (case-insensitive, by email only)
+            recipient_users = (
                 self.db.query(User)
-                .filter(func.lower(User.email) == normalized_recipient)
-                .first()
+                .filter(func.lower(User.email).in_(normalized_recipients))
+                .all()
             )
 
-            if recipient_user:
+            if recipient_users:
                 # Create email record
                 # Ensure subject not empty
                 safe_subject = subject if subject else "(no subject)"
@@ -473,99 +643,52 @@ class EmailHandler:
 
                 mime_content_b64 = base64.b64encode(raw_source_bytes).decode("ascii")
 
-                email_record = Email(
+                # One stored body, one mailbox row per recipient, one transaction
+                email_records = deliver_to_mailboxes(
+                    self.db,
+                    [user.id for user in recipient_users],
                     subject=safe_subject,
                     body=plain_body or body,
                     body_html=html_body,
                     mime_content=mime_content_b64,
                     mime_content_type=mime_type,
                     sender_id=None,  # External sender
-                    recipient_id=recipient_user.id,
-                    is_external=True,
                     external_sender=normalized_sender,
+                    is_external=True,
                 )
-                self.db.add(email_record)
-                self.db.commit()
-                self.db.refresh(email_record)
-
-                try:
-                    trigger_ews_push(
-                        user_id=recipient_user.id,
-                        folder_id="DF_inbox",
-                        item_id=email_record.id,
-                    )
-                except Exception as exc:
-                    logger.debug(
-                        "EWS push trigger failed for SMTP delivery %s: %s",
-                        email_record.id,
-                        exc,
-                    )
-
-                # CRITICAL: Trigger ActiveSync push notification immediately
-                # This notifies any connected iPhone/device via Ping command
-                try:
-                    import asyncio
 
-                    from .push_notifications import notify_new_email
+                # EWS, ActiveSync Ping and WebSocket, once per mailbox
+                notify_new_mail(email_records, sender=sender)
+                logger.info(
+                    f"📱 Triggered push notifications for users {[user.id for user in recipient_users]}"
+                )
 
-                    # Notify ActiveSync devices about new email
-                    asyncio.create_task(
-                        notify_new_email(recipient_user.id, folder_id="1")
+                # Log successful processing
+                addresses = {user.id: user.email.lower() for user in recipient_users}
+                for email_record in email_records:
+                    recipient_address = addresses[email_record.recipient_id]
+                    smtp_logger.log_internal_email_received(
+                        sender, recipient_address, subject, len(data_content)
                     )
-
-                    logger.info(
-                        f"📱 Triggered ActiveSync push notification for user {recipient_user.id}"
+                    smtp_logger.log_email_processing(
+                        "EMAIL_STORED",
+                        {
+                            "connection_id": connection_id,
+                            "email_id": email_record.id,
+                            "sender": sender,
+                            "recipient": recipient_address,
+                            "is_external_sender": True,
+                            "recipient_user_id": email_record.recipient_id,
+                        },
                     )
-                except Exception as notify_error:
-                    # Don't fail email delivery if notification fails
+
+                unknown = set(normalized_recipients) - set(addresses.values())
+                if unknown:
                     logger.warning(
-                        f"Failed to trigger ActiveSync notification: {notify_error}"
+                        f"⚠️ [{connection_id}] Skipped unknown recipients: {sorted(unknown)}"
                     )
-
-                # Send WebSocket notification to recipient
-                from .email_parser import get_email_preview
-                from .websocket_manager import manager
-
-                # Create email data for notification
-                email_data = {
-                    "id": email_record.id,
-                    "subject": email_record.subject,
-                    "sender": sender,
-                    "preview": get_email_preview(
-                        (email_record.body_html or email_record.body or ""), 100
-                    ),
-                    "is_read": email_record.is_read,
-                    "created_at": email_record.created_at.isoformat(),
-                }
-
-                # Send notification asynchronously
-                import asyncio
-
-                asyncio.create_task(
-                    manager.send_email_notification(recipient_user.id, email_data)
-                )
-
-                # Log successful processing
-                smtp_logger.log_internal_email_received(
-                    sender, normalized_recipient, subject, len(data_content)
-                )
-                smtp_logger.log_email_processing(
-                    "EMAIL_STORED",
-                    {
-                        "connection_id": connection_id,
-                        "email_id": email_record.id,
-                        "sender": sender,
-                        "recipient": normalized_recipient,
-                        "is_external_sender": True,
-                        "recipient_user_id": recipient_user.id,
-                    },
-                )
-
-                logger.info(
-                    f"✅ [{connection_id}] Email received from {sender} to {normalized_recipient} (external: True)"
-                )
                 logger.info(
-                    f"📧 WebSocket notification sent to user {recipient_user.id}"
+                    f"✅ [{connection_id}] Email received from {sender} to {len(email_records)} mailbox(es) (external: True)"
                 )
                 return "250 OK"
             else:
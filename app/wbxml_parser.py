@@ -3,10 +3,13 @@ WBXML Parser for ActiveSync requests.
 Parses WBXML request bodies to extract SyncKey, provisioning details, and other parameters.
 """
 
+from app.metrics import wbxml_timed
+
 # Code page identifiers used by minimal parsers below
 CP_PROVISION = 0x0E
 
 
+@wbxml_timed("decode")
 def parse_wbxml_sync_request(wbxml_bytes: bytes) -> dict:
     """
     Parse WBXML Sync request to extract SyncKey, WindowSize, CollectionId, and
@@ -130,6 +133,293 @@ def parse_wbxml_sync_request(wbxml_bytes: bytes) -> dict:
         return {"sync_key": "0", "collection_id": "1", "window_size": "5"}
 
 
+@wbxml_timed("decode")
+def parse_wbxml_sync_collections(wbxml_bytes: bytes) -> dict:
+    """
+    Parse the request-level structure of a Sync request.
+
+    Returns {"wait", "heartbeat_interval", "window_size", "partial",
+    "collections"}; wait is in minutes and heartbeat_interval in seconds
+    (None when absent). Each collection is a dict with collection_id,
+    sync_key, window_size, get_changes, has_commands and body_preferences.
+    An empty body yields no collections, which is how clients ask the
+    server to reuse the previous request.
+    """
+    result = {
+        "wait": None,
+        "heartbeat_interval": None,
+        "window_size": None,
+        "partial": False,
+        "collections": [],
+    }
+    if not wbxml_bytes or not wbxml_bytes.startswith(b"\x03\x01"):
+        return result
+
+    SWITCH_PAGE = 0x00
+    END = 0x01
+    STR_I = 0x03
+    OPAQUE = 0xC3
+
+    # AirSync (code page 0)
+    TAGS = {
+        0x0B: "SyncKey",
+        0x0F: "Collection",
+        0x12: "CollectionId",
+        0x13: "GetChanges",
+        0x15: "WindowSize",
+        0x16: "Commands",
+        0x24: "Wait",
+        0x26: "Partial",
+        0x29: "HeartbeatInterval",
+    }
+
+    data = wbxml_bytes
+    # Header: version, public id, charset, string table length (skipped)
+    i = 4 + data[3] if len(data) > 3 else len(data)
+    cp = 0
+    stack = []
+    collection = None
+    collection_start = 0
+
+    while i < len(data):
+        b = data[i]
+        i += 1
+        if b == SWITCH_PAGE:
+            if i < len(data):
+                cp = data[i]
+                i += 1
+            continue
+        if b == END:
+            tag = stack.pop() if stack else None
+            if tag == "Collection" and collection is not None:
+                collection["body_preferences"] = _extract_body_preferences(
+                    data[collection_start:i]
+                )
+                if collection["collection_id"]:
+                    result["collections"].append(collection)
+                collection = None
+            continue
+        if b == STR_I:
+            end = data.find(b"\x00", i)
+            end = len(data) if end < 0 else end
+            text = data[i:end].decode("utf-8", errors="ignore").strip()
+            i = end + 1
+            tag = stack[-1] if stack else None
+            in_collection = collection is not None
+            if tag == "SyncKey" and in_collection:
+                collection["sync_key"] = text
+            elif tag == "CollectionId" and in_collection:
+                collection["collection_id"] = text
+            elif tag == "WindowSize" and in_collection:
+                collection["window_size"] = text
+            elif tag == "WindowSize" and collection is None:
+                result["window_size"] = text
+            elif tag in ("Wait", "HeartbeatInterval") and collection is None:
+                key = "wait" if tag == "Wait" else "heartbeat_interval"
+                result[key] = int(text) if text.isdigit() else -1
+            continue
+        if b == OPAQUE:
+            length = 0
+            while i < len(data):
+                octet = data[i]
+                i += 1
+                length = (length << 7) | (octet & 0x7F)
+                if not octet & 0x80:
+                    break
+            i += length
+            continue
+
+        tag = TAGS.get(b & 0x3F) if cp == 0 else None
+        if tag == "Collection" and collection is None:
+            collection = {
+                "collection_id": None,
+                "sync_key": None,
+                "window_size": None,
+                "get_changes": None,
+                "has_commands": False,
+                "body_preferences": [],
+            }
+            collection_start = i
+        elif tag == "Partial" and collection is None:
+            result["partial"] = True
+        elif tag == "GetChanges" and collection is not None:
+            collection["get_changes"] = True
+        elif tag == "Commands" and collection is not None:
+            collection["has_commands"] = True
+        if b & 0x40:
+            stack.append(tag)
+    return result
+
+
+def _wbxml_opaque_end(data: bytes, i: int) -> int:
+    """Index just past an OPAQUE value whose mb_u_int32 length starts at ``i``."""
+    length = 0
+    while i < len(data):
+        octet = data[i]
+        i += 1
+        length = (length << 7) | (octet & 0x7F)
+        if not octet & 0x80:
+            break
+    return i + length
+
+
+@wbxml_timed("decode")
+def parse_wbxml_sync_commands(wbxml_bytes: bytes) -> dict:
+    """
+    Parse the client changes of a Sync request in one pass.
+
+    Returns {collection_id: {"deletes": [server_id, ...], "changes":
+    [{"server_id", "read", "other"}, ...]}} for every collection with
+    <Commands>. ``read`` is the Email:Read value of a Change (None when
+    absent) and ``other`` tells whether the Change carried any other
+    property (flags, categories).
+    """
+    result = {}
+    if not wbxml_bytes or not wbxml_bytes.startswith(b"\x03\x01"):
+        return result
+
+    SWITCH_PAGE = 0x00
+    END = 0x01
+    STR_I = 0x03
+    OPAQUE = 0xC3
+    CP_AIRSYNC = 0
+    CP_EMAIL = 2
+
+    TAGS = {
+        0x08: "Change",
+        0x09: "Delete",
+        0x0D: "ServerId",
+        0x0F: "Collection",
+        0x12: "CollectionId",
+        0x16: "Commands",
+        0x1D: "ApplicationData",
+    }
+    EMAIL_READ = 0x15
+
+    data = wbxml_bytes
+    i = 4 + data[3] if len(data) > 3 else len(data)
+    cp = CP_AIRSYNC
+    stack = []
+    collection_id = None
+    commands = None
+    command = None
+
+    while i < len(data):
+        b = data[i]
+        i += 1
+        if b == SWITCH_PAGE:
+            if i < len(data):
+                cp = data[i]
+                i += 1
+            continue
+        if b == END:
+            tag = stack.pop() if stack else None
+            if tag in ("Change", "Delete") and command is not None:
+                if command["server_id"] and commands is not None:
+                    if tag == "Delete":
+                        commands["deletes"].append(command["server_id"])
+                    else:
+                        commands["changes"].append(command)
+                command = None
+            elif tag == "Collection":
+                if collection_id and commands is not None:
+                    entry = result.setdefault(collection_id, {"deletes": [], "changes": []})
+                    entry["deletes"].extend(commands["deletes"])
+                    entry["changes"].extend(commands["changes"])
+                collection_id = None
+                commands = None
+            continue
+        if b == STR_I:
+            end = data.find(b"\x00", i)
+            end = len(data) if end < 0 else end
+            text = data[i:end].decode("utf-8", errors="ignore").strip()
+            i = end + 1
+            tag = stack[-1] if stack else None
+            if tag == "CollectionId" and command is None:
+                collection_id = text
+            elif tag == "ServerId" and command is not None:
+                command["server_id"] = text
+            elif tag == "Read" and command is not None:
+                command["read"] = text == "1"
+            continue
+        if b == OPAQUE:
+            i = _wbxml_opaque_end(data, i)
+            continue
+
+        tag = TAGS.get(b & 0x3F) if cp == CP_AIRSYNC else None
+        if cp == CP_EMAIL and (b & 0x3F) == EMAIL_READ:
+            tag = "Read"
+        elif "ApplicationData" in stack and command is not None and cp != CP_AIRSYNC:
+            command["other"] = True
+        if tag == "Commands":
+            commands = {"deletes": [], "changes": []}
+        elif tag in ("Change", "Delete") and commands is not None and "Commands" in stack:
+            command = {"server_id": None, "read": None, "other": False}
+        if b & 0x40:
+            stack.append(tag)
+    return result
+
+
+@wbxml_timed("decode")
+def parse_wbxml_moveitems_request(wbxml_bytes: bytes) -> list:
+    """
+    Parse a MoveItems request into [{"src_msg_id", "src_fld_id",
+    "dst_fld_id"}, ...] in request order.
+    """
+    moves = []
+    if not wbxml_bytes or not wbxml_bytes.startswith(b"\x03\x01"):
+        return moves
+
+    SWITCH_PAGE = 0x00
+    END = 0x01
+    STR_I = 0x03
+    OPAQUE = 0xC3
+    CP_MOVE = 5
+
+    TAGS = {0x06: "Move", 0x07: "src_msg_id", 0x08: "src_fld_id", 0x09: "dst_fld_id"}
+
+    data = wbxml_bytes
+    i = 4 + data[3] if len(data) > 3 else len(data)
+    cp = 0
+    stack = []
+    move = None
+
+    while i < len(data):
+        b = data[i]
+        i += 1
+        if b == SWITCH_PAGE:
+            if i < len(data):
+                cp = data[i]
+                i += 1
+            continue
+        if b == END:
+            tag = stack.pop() if stack else None
+            if tag == "Move" and move is not None:
+                moves.append(move)
+                move = None
+            continue
+        if b == STR_I:
+            end = data.find(b"\x00", i)
+            end = len(data) if end < 0 else end
+            text = data[i:end].decode("utf-8", errors="ignore").strip()
+            i = end + 1
+            tag = stack[-1] if stack else None
+            if move is not None and tag in move:
+                move[tag] = text
+            continue
+        if b == OPAQUE:
+            i = _wbxml_opaque_end(data, i)
+            continue
+
+        tag = TAGS.get(b & 0x3F) if cp == CP_MOVE else None
+        if tag == "Move":
+            move = {"src_msg_id": None, "src_fld_id": None, "dst_fld_id": None}
+        if b & 0x40:
+            stack.append(tag)
+    return moves
+
+
+@wbxml_timed("decode")
 def parse_wbxml_foldersync_request(wbxml_bytes: bytes) -> dict:
     """
     Parse WBXML FolderSync request to extract SyncKey
@@ -195,6 +485,7 @@ def parse_wbxml_foldersync_request(wbxml_bytes: bytes) -> dict:
     return {"sync_key": sync_key or "0"}
 
 
+@wbxml_timed("decode")
 def parse_wbxml_provision_request(wbxml_bytes: bytes) -> dict:
     """
     Parse WBXML Provision request to extract PolicyKey, Status, and whether the client
@@ -389,6 +680,7 @@ def _extract_body_preferences(wbxml_bytes: bytes) -> list:
     return prefs
 
 
+@wbxml_timed("decode")
 def parse_wbxml_sync_fetch_and_delete(wbxml_bytes: bytes) -> dict:
     """
     Very small WBXML scanner to extract AirSync Fetch and Delete ServerIds from a Sync request.
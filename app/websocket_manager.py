@@ -1,85 +1,261 @@
 """
 WebSocket manager for real-time email notifications
+
+Every connection gets a bounded outbox drained by its own task, so a slow
+or dead browser tab only delays itself:
+- messages are JSON-encoded once and the same text is queued to each socket
+- when an outbox is full the oldest message is dropped; messages with a
+  coalesce key (heartbeats, updates for the same email) replace the pending
+  copy instead of queueing another one
+- a heartbeat pings every connection and closes sockets whose outbox has
+  not made progress within the send timeout
+- publishing is synchronous and thread-safe, so sync request handlers can
+  notify without spawning unbounded tasks
 """
 import asyncio
 import json
 import logging
-from typing import Dict, List, Set
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, List, Optional, Set
 from fastapi import WebSocket, WebSocketDisconnect
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))
+_LATENCY_SAMPLES = 1024
+
+
+class _Outbox:
+    """Pending messages for one socket, oldest first."""
+
+    __slots__ = ("websocket", "user_id", "pending", "wakeup", "task", "last_progress", "dropped", "_seq")
+
+    def __init__(self, websocket: WebSocket, user_id: Optional[int]):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.pending: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.last_progress = time.monotonic()
+        self.dropped = 0
+        self._seq = 0
+
+    def put(self, text: str, coalesce_key: Optional[Hashable], maxsize: int) -> bool:
+        """Queue ``text``; returns False if an older message had to be dropped."""
+        if coalesce_key is None:
+            self._seq += 1
+            key: Hashable = ("seq", self._seq)
+        else:
+            key = ("key", coalesce_key)
+        if not self.pending:
+            # Idle outbox: stall detection measures from the oldest pending message
+            self.last_progress = time.monotonic()
+        if key in self.pending:
+            # Coalesce in place: keep the queue position, send the newest payload
+            self.pending[key] = (text, self.pending[key][1])
+            self.wakeup.set()
+            return True
+        kept = True
+        if len(self.pending) >= maxsize:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+            kept = False
+        self.pending[key] = (text, time.monotonic())
+        self.wakeup.set()
+        return kept
+
+
 class ConnectionManager:
     """Manages WebSocket connections for real-time updates"""
-    
-    def __init__(self):
+
+    def __init__(
+        self,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        send_timeout: float = WS_SEND_TIMEOUT,
+        heartbeat_interval: float = WS_HEARTBEAT_INTERVAL,
+    ):
         # Active connections by user_id
         self.active_connections: Dict[int, List[WebSocket]] = {}
         # All active connections for broadcasting
         self.all_connections: Set[WebSocket] = set()
-        
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self._outboxes: Dict[WebSocket, _Outbox] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Metrics
+        self._latencies: deque = deque(maxlen=_LATENCY_SAMPLES)
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self.send_failures = 0
+        self.stalled_disconnects = 0
+
     async def connect(self, websocket: WebSocket, user_id: int = None):
         """Accept a new WebSocket connection"""
         await websocket.accept()
-        
+        self._loop = asyncio.get_running_loop()
+
         # Add to user-specific connections
         if user_id:
             if user_id not in self.active_connections:
                 self.active_connections[user_id] = []
             self.active_connections[user_id].append(websocket)
             logger.info(f"🔗 WebSocket connected for user {user_id}")
-        
+
         # Add to all connections
         self.all_connections.add(websocket)
+        outbox = _Outbox(websocket, user_id)
+        self._outboxes[websocket] = outbox
+        outbox.task = asyncio.create_task(self._drain(outbox))
+        if self.heartbeat_interval > 0 and (self._heartbeat_task is None or self._heartbeat_task.done()):
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
         logger.info(f"🔗 Total active connections: {len(self.all_connections)}")
-        
+
     def disconnect(self, websocket: WebSocket, user_id: int = None):
         """Remove a WebSocket connection"""
+        outbox = self._outboxes.pop(websocket, None)
+        if outbox is not None:
+            if user_id is None:
+                user_id = outbox.user_id
+            if outbox.task is not None and outbox.task is not asyncio.current_task():
+                outbox.task.cancel()
+
         # Remove from user-specific connections
         if user_id and user_id in self.active_connections:
             if websocket in self.active_connections[user_id]:
                 self.active_connections[user_id].remove(websocket)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
-        
+
         # Remove from all connections
         if websocket in self.all_connections:
             self.all_connections.remove(websocket)
-        
+
         logger.info(f"🔗 WebSocket disconnected. Total connections: {len(self.all_connections)}")
-    
+
+    # --- Outbound queues ---------------------------------------------------
+
+    def _enqueue(self, websockets, text: str, coalesce_key: Optional[Hashable] = None) -> int:
+        queued = 0
+        for websocket in list(websockets):
+            outbox = self._outboxes.get(websocket)
+            if outbox is None:
+                continue
+            if not outbox.put(text, coalesce_key, self.queue_size):
+                self.messages_dropped += 1
+            queued += 1
+        return queued
+
+    def _publish(self, message: dict, user_id: Optional[int], coalesce_key: Optional[Hashable]) -> None:
+        """Encode once and queue to the user's sockets (or everyone); safe from any thread."""
+        text = json.dumps(message)
+
+        def _deliver():
+            targets = self.all_connections if user_id is None else self.active_connections.get(user_id, ())
+            self._enqueue(targets, text, coalesce_key)
+
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return  # nobody has connected in this process
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            _deliver()
+        else:
+            loop.call_soon_threadsafe(_deliver)
+
+    def publish_to_user(self, user_id: int, message: dict, coalesce_key: Optional[Hashable] = None) -> None:
+        """Queue ``message`` for every socket of ``user_id`` without awaiting delivery."""
+        self._publish(message, user_id, coalesce_key)
+
+    def publish_broadcast(self, message: dict, coalesce_key: Optional[Hashable] = None) -> None:
+        """Queue ``message`` for every connected socket without awaiting delivery."""
+        self._publish(message, None, coalesce_key)
+
+    async def _drain(self, outbox: _Outbox) -> None:
+        websocket = outbox.websocket
+        try:
+            while True:
+                if not outbox.pending:
+                    outbox.wakeup.clear()
+                    await outbox.wakeup.wait()
+                    continue
+                _key, (text, enqueued_at) = outbox.pending.popitem(last=False)
+                # asyncio.timeout avoids wait_for's extra task per message
+                async with asyncio.timeout(self.send_timeout):
+                    await websocket.send_text(text)
+                now = time.monotonic()
+                outbox.last_progress = now
+                self._latencies.append(now - enqueued_at)
+                self.messages_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.send_failures += 1
+            logger.error(f"Error sending message to user {outbox.user_id}: {e!r}")
+            self.disconnect(websocket, outbox.user_id)
+
+    async def _heartbeat_loop(self) -> None:
+        ping = json.dumps({"type": "ping"})
+        while self._outboxes:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for websocket, outbox in list(self._outboxes.items()):
+                if outbox.pending and now - outbox.last_progress > max(self.send_timeout, self.heartbeat_interval) * 2:
+                    # Nothing delivered for two intervals while work is pending: treat as dead
+                    self.stalled_disconnects += 1
+                    logger.warning(f"Closing stalled WebSocket for user {outbox.user_id}")
+                    self.disconnect(websocket, outbox.user_id)
+                    try:
+                        await asyncio.wait_for(websocket.close(code=1011), timeout=1)
+                    except Exception:
+                        pass
+                    continue
+                outbox.put(ping, "heartbeat", self.queue_size)
+
+    def get_stats(self) -> dict:
+        """Queue depth and send latency metrics for monitoring endpoints."""
+        depths = [len(outbox.pending) for outbox in self._outboxes.values()]
+        latencies = sorted(self._latencies)
+
+        def _pct(pct: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct))] * 1000, 3)
+
+        return {
+            "connections": len(self._outboxes),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_capacity": self.queue_size,
+            "messages_sent": self.messages_sent,
+            "messages_dropped": self.messages_dropped,
+            "send_failures": self.send_failures,
+            "stalled_disconnects": self.stalled_disconnects,
+            "send_latency_ms_p50": _pct(0.50),
+            "send_latency_ms_p99": _pct(0.99),
+        }
+
+    # --- Public messaging API ------------------------------------------------
+
     async def send_personal_message(self, message: dict, user_id: int):
         """Send message to specific user"""
-        if user_id in self.active_connections:
-            dead_connections = []
-            for websocket in self.active_connections[user_id]:
-                try:
-                    await websocket.send_text(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Error sending message to user {user_id}: {e}")
-                    dead_connections.append(websocket)
-            
-            # Clean up dead connections
-            for websocket in dead_connections:
-                self.disconnect(websocket, user_id)
-    
+        self.publish_to_user(user_id, message)
+
     async def broadcast(self, message: dict):
         """Broadcast message to all connected clients"""
-        dead_connections = []
-        for websocket in self.all_connections:
-            try:
-                await websocket.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error broadcasting message: {e}")
-                dead_connections.append(websocket)
-        
-        # Clean up dead connections
-        for websocket in dead_connections:
-            self.all_connections.remove(websocket)
-    
-    async def send_email_notification(self, user_id: int, email_data: dict):
-        """Send new email notification to specific user"""
+        self.publish_broadcast(message)
+
+    def notify_new_email(self, user_id: int, email_data: dict):
+        """Queue a new email notification for a user (callable from sync code)"""
         # Keep payload aligned with front-end expectations (id, subject, sender, preview, created_at)
         payload = {
             "id": email_data.get("id"),
@@ -96,23 +272,33 @@ class ConnectionManager:
             "data": payload,
         }
 
-        await self.send_personal_message(message, user_id)
+        self.publish_to_user(user_id, message)
         logger.info(
             "📧 Email notification sent to user %s: %s",
             user_id,
             payload.get("subject"),
         )
-    
-    async def send_email_update(self, user_id: int, email_data: dict):
-        """Send email update notification (mark as read, delete, etc.)"""
+
+    def notify_email_update(self, user_id: int, email_data: dict):
+        """Queue an email update (mark as read, delete, etc.); repeated actions on one email coalesce"""
         message = {
             "type": "email_update",
             "timestamp": datetime.utcnow().isoformat(),
             "data": email_data
         }
-        
-        await self.send_personal_message(message, user_id)
+
+        email_id = email_data.get("email_id", email_data.get("id"))
+        coalesce_key = ("email_update", email_id, email_data.get("action")) if email_id is not None else None
+        self.publish_to_user(user_id, message, coalesce_key)
         logger.info(f"📧 Email update sent to user {user_id}")
 
+    async def send_email_notification(self, user_id: int, email_data: dict):
+        """Send new email notification to specific user"""
+        self.notify_new_email(user_id, email_data)
+
+    async def send_email_update(self, user_id: int, email_data: dict):
+        """Send email update notification (mark as read, delete, etc.)"""
+        self.notify_email_update(user_id, email_data)
+
 # Global connection manager instance
 manager = ConnectionManager()
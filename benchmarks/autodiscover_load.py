@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Autodiscover throughput under a reconnect storm.
+
+Seeds --users mailboxes in a temporary SQLite database and drives the
+Autodiscover router in-process (raw ASGI calls, no network or HTTP client)
+with --concurrency clients POSTing Outlook requests for random mailboxes,
+plus anonymous probes and JSON lookups. Runs twice:
+- uncached: cache TTL 0, so every request looks up the user and renders
+- cached: the default cache (first request per mailbox misses)
+
+Usage:
+  python benchmarks/autodiscover_load.py --users 2000 --requests 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'autodiscover.db')}")
+os.environ.setdefault("LOGS_DIR", os.path.join(_tmp, "logs"))
+
+from fastapi import FastAPI  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from app.database import Base, engine  # noqa: E402
+from app.routers import autodiscover  # noqa: E402
+from app.services.autodiscover_cache import autodiscover_cache  # noqa: E402
+
+POX = (
+    '<Autodiscover xmlns="http://schemas.microsoft.com/exchange/autodiscover/outlook/requestschema/2006">'
+    "<Request><EMailAddress>{email}</EMailAddress>"
+    "<AcceptableResponseSchema>http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a"
+    "</AcceptableResponseSchema></Request></Autodiscover>"
+)
+
+
+def _seed(users: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (username, email, full_name, hashed_password) "
+                "VALUES (:u, :e, :n, 'x')"
+            ),
+            [{"u": f"user{i}", "e": f"user{i}@example.com", "n": f"User {i}"} for i in range(users)],
+        )
+
+
+async def _call(app: FastAPI, method: str, path: str, query: str = "", body: bytes = b"") -> int:
+    """Minimal in-process ASGI request (no HTTP client overhead)."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "https",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"owa.example.com"), (b"user-agent", b"Microsoft Office/16.0")],
+        "client": ("198.51.100.7", 50000),
+        "server": ("owa.example.com", 443),
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def _run(app: FastAPI, users: int, requests: int, concurrency: int) -> float:
+    rng = random.Random(1)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            kind = rng.random()
+            email = f"user{rng.randrange(users)}@example.com"
+            if kind < 0.7:
+                code = await _call(app, "POST", "/Autodiscover/Autodiscover.xml", body=POX.format(email=email).encode())
+            elif kind < 0.9:
+                code = await _call(app, "GET", f"/autodiscover/autodiscover.json/v1.0/{email}", "Protocol=AutodiscoverV1")
+            else:
+                code = await _call(app, "GET", "/autodiscover/autodiscover.xml")  # anonymous probe
+            assert code == 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return requests / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    _seed(args.users)
+    app = FastAPI()
+    app.include_router(autodiscover.router)
+
+    default_ttl = autodiscover_cache.ttl
+    autodiscover_cache.ttl = 0
+    uncached = asyncio.run(_run(app, args.users, args.requests, args.concurrency))
+    autodiscover_cache.invalidate()
+    autodiscover_cache.ttl = default_ttl
+    autodiscover_cache.hits = autodiscover_cache.misses = 0
+    cached = asyncio.run(_run(app, args.users, args.requests, args.concurrency))
+
+    print(f"{args.requests} requests, {args.users} mailboxes, concurrency {args.concurrency}")
+    print(f"uncached: {uncached:8.0f} req/s")
+    print(f"cached:   {cached:8.0f} req/s  {autodiscover_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Steady-state polling with and without validators.
+
+Seeds --users mailboxes (--emails messages and --events calendar events
+each) in a temporary SQLite database and replays --polls polls per
+endpoint, picking a random user each time. Before a poll the user's data
+changes with probability --change-rate (an event is edited or a message
+marked read). Each endpoint is polled twice:
+- unconditional: clients never send If-None-Match
+- conditional: clients send the ETag of their last 200 response
+
+Endpoints: CalDAV collection GET, CalDAV item GET, EWS GetFolder
+(inbox/sent totals, POST so served from the validator memo) and the OWA
+message list JSON. EWS never gets a 304 and reuses its memoized body in
+both passes, so its "reused" and "cpu saved" columns are the ones to read.
+Authentication is resolved by username so the numbers
+show the response work, not PBKDF2.
+
+Usage:
+  python benchmarks/conditional_polls.py --users 50 --polls 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'conditional.db')}")
+os.environ.setdefault("LOGS_DIR", os.path.join(_tmp, "logs"))
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from app.auth import get_current_user_from_cookie  # noqa: E402
+from app.conditional import conditional_stats  # noqa: E402
+from app.database import Base, SessionLocal, User, engine  # noqa: E402
+from app.routers import caldav_carddav, emails, ews  # noqa: E402
+
+GETFOLDER = (
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+    '<m:GetFolder><m:FolderIds><t:DistinguishedFolderId Id="inbox"/>'
+    '<t:DistinguishedFolderId Id="sentitems"/></m:FolderIds></m:GetFolder></soap:Body></soap:Envelope>'
+)
+
+
+def _seed(users: int, emails_per_user: int, events_per_user: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    epoch = datetime(2025, 1, 6, 9)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (id, username, email, hashed_password) VALUES (:id, :u, :e, 'x')"),
+            [{"id": i, "u": f"user{i}", "e": f"user{i}@example.com"} for i in range(1, users + 1)],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO emails (uuid, subject, body, sender_id, recipient_id, is_read, is_deleted, "
+                "created_at, updated_at) VALUES (:uuid, :s, 'body', :sender, :recipient, 0, 0, :t, :t)"
+            ),
+            [
+                {
+                    "uuid": f"{u}-{n}",
+                    "s": f"Message {n}",
+                    "sender": (u % users) + 1,
+                    "recipient": u,
+                    "t": epoch + timedelta(minutes=n),
+                }
+                for u in range(1, users + 1)
+                for n in range(emails_per_user)
+            ],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO calendar_events (uuid, change_key, owner_id, subject, start_time, end_time, "
+                "updated_at) VALUES (:uuid, :ck, :owner, :s, :start, :end, :start)"
+            ),
+            [
+                {
+                    "uuid": f"ev-{u}-{n}",
+                    "ck": f"ck-{u}-{n}",
+                    "owner": u,
+                    "s": f"Meeting {n}",
+                    "start": epoch + timedelta(hours=n),
+                    "end": epoch + timedelta(hours=n, minutes=30),
+                }
+                for u in range(1, users + 1)
+                for n in range(events_per_user)
+            ],
+        )
+
+
+def _change(rng: random.Random, user_id: int) -> None:
+    """Edit one of the user's events and flip one message's read flag (ORM, so change logs fire)."""
+    from app.database import CalendarEvent, Email
+
+    with SessionLocal() as db:
+        event = db.query(CalendarEvent).filter(CalendarEvent.owner_id == user_id).first()
+        event.subject = f"Meeting {rng.random():.6f}"
+        message = db.query(Email).filter(Email.recipient_id == user_id).first()
+        message.is_read = not message.is_read
+        db.commit()
+
+
+def _client() -> TestClient:
+    by_name = lambda db, username, password: db.query(User).filter(User.username == username).first()  # noqa: E731
+    caldav_carddav.authenticate_user = by_name
+    ews.authenticate_user = by_name
+    app = FastAPI()
+    app.include_router(caldav_carddav.router)
+    app.include_router(ews.router)
+    app.include_router(emails.router)
+
+    def cookie_user(request: Request):
+        name = request.headers["authorization"].split(" ", 1)[1]
+        username = base64.b64decode(name).decode().split(":", 1)[0]
+        with SessionLocal() as db:
+            return db.query(User).filter(User.username == username).first()
+
+    app.dependency_overrides[get_current_user_from_cookie] = cookie_user
+    return TestClient(app)
+
+
+def _auth(user_id: int) -> str:
+    return "Basic " + base64.b64encode(f"user{user_id}:x".encode()).decode()
+
+
+ENDPOINTS = {
+    "dav.calendar": ("GET", "/caldav/calendar/", None),
+    "dav.calendar.item": ("GET", "/caldav/calendar/CAL_{first_event}.ics", None),
+    "ews.GetFolder": ("POST", "/EWS/Exchange.asmx", GETFOLDER),
+    "owa.emails": ("GET", "/emails/?folder=inbox&limit=50", None),
+}
+
+
+def _poll(client, args, name: str, conditional: bool) -> float:
+    method, path, body = ENDPOINTS[name]
+    rng = random.Random(11)
+    etags = {}
+    started = time.perf_counter()
+    for _ in range(args.polls):
+        user_id = rng.randint(1, args.users)
+        if rng.random() < args.change_rate:
+            _change(rng, user_id)
+        headers = {"Authorization": _auth(user_id)}
+        if conditional and user_id in etags:
+            headers["If-None-Match"] = etags[user_id]
+        first_event = (user_id - 1) * args.events + 1
+        response = client.request(method, path.format(first_event=first_event), content=body, headers=headers)
+        assert response.status_code in (200, 304), (name, response.status_code, response.text[:200])
+        if response.status_code == 200 and "etag" in response.headers:
+            etags[user_id] = response.headers["etag"]
+    return (time.perf_counter() - started) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--polls", type=int, default=2000)
+    parser.add_argument("--change-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    _seed(args.users, args.emails, args.events)
+    client = _client()
+    print(f"{args.users} users, {args.emails} messages + {args.events} events each, "
+          f"{args.polls} polls per endpoint, change rate {args.change_rate:.0%}")
+    print(f"{'endpoint':<20}{'plain ms':>10}{'cond ms':>10}{'304 share':>11}{'reused':>8}{'cpu saved ms':>14}")
+    for name in ENDPOINTS:
+        plain_ms = _poll(client, args, name, conditional=False)
+        conditional_stats.reset()
+        cond_ms = _poll(client, args, name, conditional=True)
+        stats = conditional_stats.snapshot().get(name, {})
+        print(
+            f"{name:<20}{plain_ms:>10.0f}{cond_ms:>10.0f}{stats.get('not_modified_ratio', 0):>11.1%}"
+            f"{stats.get('reused', 0):>8}{stats.get('cpu_saved_ms', 0):>14.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Applying a device's queued changes: per-item ORM writes vs one batch.
+
+Seeds three mailboxes with --emails messages each in a temporary SQLite
+database. A reconnecting device has --changes Deletes and --changes
+read-state Changes queued; they are applied three ways:
+- per item: EmailService.delete_email / mark_as_read, one query and one
+  commit per change (what the web UI does for a single message)
+- batched: client_changes.apply_sync_commands in one transaction
+- Sync: the same changes sent as <Commands> in one Sync request through
+  the ActiveSync router (includes the rest of the Sync response)
+
+Reports wall time and SQL statements for each, and checks the folder
+counters still match the messages afterwards.
+
+Usage:
+  python benchmarks/eas_client_changes.py --emails 2000 --changes 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'client_changes.db')}")
+os.environ.setdefault("LOGS_DIR", os.path.join(_tmp, "logs"))
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event, text  # noqa: E402
+
+from app.auth import get_current_user_from_basic_auth  # noqa: E402
+from app.database import Base, SessionLocal, User, engine, get_db  # noqa: E402
+from app.email_service import EmailService  # noqa: E402
+from app.routers import activesync  # noqa: E402
+from app.services import client_changes, folder_counts  # noqa: E402
+from app.wbxml_parser import parse_wbxml_sync_commands  # noqa: E402
+
+FOLDERS = {"1": "inbox", "3": "deleted", "4": "sent"}
+
+
+def _seed(emails_per_user: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (id, username, email, hashed_password) VALUES (:id, :u, :e, 'x')"),
+            [{"id": i, "u": f"user{i}", "e": f"user{i}@example.com"} for i in (1, 2, 3)],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO emails (uuid, subject, body, sender_id, recipient_id, is_read, is_deleted, "
+                "created_at, updated_at) VALUES (:uuid, :s, 'body', 3, :recipient, 0, 0, "
+                "CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"
+            ),
+            [
+                {"uuid": f"{u}-{n}", "s": f"Message {n}", "recipient": u}
+                for u in (1, 2, 3)
+                for n in range(emails_per_user)
+            ],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO activesync_devices (user_id, device_id, device_type, policy_key, is_provisioned) "
+                "VALUES (3, 'bench', 'iPhone', '77', 1)"
+            )
+        )
+    with SessionLocal() as db:
+        folder_counts.reconcile(db, None)
+        db.commit()
+
+
+@contextmanager
+def _measure(label: str):
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", record)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        event.remove(engine, "before_cursor_execute", record)
+        print(f"{label:<12}{elapsed:>10.1f}{len(statements):>12}")
+
+
+def _ids(user_id: int, count: int) -> tuple[list[int], list[int]]:
+    with SessionLocal() as db:
+        query = text("SELECT id FROM emails WHERE recipient_id = :u ORDER BY id")
+        ids = [row[0] for row in db.execute(query, {"u": user_id})]
+    return ids[:count], ids[count : 2 * count]
+
+
+def _str(tag: int, value: str) -> bytes:
+    return bytes([tag | 0x40, 0x03]) + value.encode() + b"\x00\x01"
+
+
+def _commands(deletes: list[int], reads: list[int]) -> bytes:
+    body = b"".join(b"\x49" + _str(0x0D, f"1:{i}") + b"\x01" for i in deletes)
+    body += b"".join(
+        b"\x48" + _str(0x0D, f"1:{i}") + b"\x5d\x00\x02" + _str(0x15, "1") + b"\x00\x00\x01\x01" for i in reads
+    )
+    return body
+
+
+def _sync_body(sync_key: str, commands: bytes = b"") -> bytes:
+    body = b"\x03\x01j\x00\x45\x5c\x4f" + _str(0x0B, sync_key) + _str(0x12, "1")
+    if commands:
+        body += b"\x56" + commands + b"\x01"
+    return body + b"\x01\x01\x01"
+
+
+def _sync_client() -> TestClient:
+    with SessionLocal() as db:
+        user = db.get(User, 3)
+        db.expunge(user)
+    app = FastAPI()
+    app.include_router(activesync.router)
+    app.dependency_overrides[get_db] = lambda: (yield from _session())
+    app.dependency_overrides[get_current_user_from_basic_auth] = lambda: user
+    return TestClient(app)
+
+
+def _session():
+    with SessionLocal() as db:
+        yield db
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--changes", type=int, default=500)
+    args = parser.parse_args()
+    if 2 * args.changes > args.emails:
+        parser.error("--emails must be at least twice --changes")
+
+    _seed(args.emails)
+    print(f"{args.emails} messages per mailbox, {args.changes} deletes + {args.changes} read changes")
+    print(f"{'path':<12}{'ms':>10}{'statements':>12}")
+
+    deletes, reads = _ids(1, args.changes)
+    with _measure("per item"):
+        with SessionLocal() as db:
+            service = EmailService(db)
+            for email_id in deletes:
+                service.delete_email(email_id, 1)
+            for email_id in reads:
+                service.mark_as_read(email_id, 1)
+
+    deletes, reads = _ids(2, args.changes)
+    commands = parse_wbxml_sync_commands(_sync_body("1", _commands(deletes, reads)))["1"]
+    with _measure("batched"):
+        with SessionLocal() as db:
+            results = client_changes.apply_sync_commands(db, 2, "1", commands, FOLDERS)
+            db.commit()
+    assert all(r["status"] == client_changes.STATUS_SUCCESS for r in results)
+
+    client = _sync_client()
+    url = "/activesync/Microsoft-Server-ActiveSync?Cmd=Sync&DeviceId=bench&DeviceType=iPhone"
+    headers = {"X-MS-PolicyKey": "77", "MS-ASProtocolVersion": "14.1"}
+
+    def sync(key: str, body: bytes = b"") -> bytes:
+        response = client.post(url, content=_sync_body(key, body), headers=headers)
+        assert response.status_code == 200, response.status_code
+        return response.content
+
+    # The device is up to date, so the timed request only carries the changes
+    with engine.begin() as conn:
+        ids = [row[0] for row in conn.execute(text("SELECT id FROM emails WHERE recipient_id = 3 ORDER BY id"))]
+        conn.execute(
+            text(
+                "INSERT INTO activesync_state (uuid, user_id, device_id, collection_id, sync_key, "
+                "last_synced_email_id, synced_email_ids) VALUES ('bench', 3, 'bench', '1', '7', :last, :ids)"
+            ),
+            {"last": ids[-1], "ids": json.dumps(ids)},
+        )
+    key = "7"
+    deletes, reads = _ids(3, args.changes)
+    with _measure("Sync"):
+        sync(key, _commands(deletes, reads))
+
+    with SessionLocal() as db:
+        applied = db.execute(
+            text("SELECT SUM(is_deleted), SUM(is_read) FROM emails WHERE recipient_id = 3")
+        ).one()
+        assert tuple(applied) == (args.changes, args.changes), applied
+
+    with SessionLocal() as db:
+        drift = folder_counts.reconcile(db, None)
+    print(f"folder counter rows corrected afterwards: {drift}")
+
+
+if __name__ == "__main__":
+    main()
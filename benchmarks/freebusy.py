@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Multi-user free/busy lookups over recurring calendars.
+
+Seeds --users mailboxes with --series recurring series each (daily, weekly
+and monthly rules with exceptions) and measures a one-week free/busy query
+for all of them:
+- naive: load every event row of the attendees and expand each series from
+  scratch, as a request handler without the index would
+- index cold: first lookup through FreeBusyIndex (loads the users)
+- index warm: repeated lookups, and a 10-attendee meeting lookup
+- after an edit: one series changed, then the lookup again (incremental patch)
+
+Usage:
+  python benchmarks/freebusy.py --users 500 --series 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.database import Base, CalendarEvent  # noqa: E402
+from app.services.freebusy import FreeBusyIndex, merge_busy  # noqa: E402
+from app.services.recurrence import RecurrenceSeries  # noqa: E402
+
+EPOCH = datetime(2024, 1, 1)
+DAYS = ("MO", "TU", "WE", "TH", "FR")
+
+
+def _pattern(rng: random.Random) -> dict:
+    kind = rng.random()
+    if kind < 0.2:
+        rule = {"freq": "DAILY", "interval": rng.choice((1, 2))}
+    elif kind < 0.8:
+        rule = {"freq": "WEEKLY", "byday": rng.sample(DAYS, rng.randint(1, 3))}
+    else:
+        rule = {"freq": "MONTHLY", "byday": [f"{rng.randint(1, 4)}{rng.choice(DAYS)}"]}
+    if rng.random() < 0.3:
+        moved = EPOCH + timedelta(days=rng.randint(0, 500), hours=rng.randint(8, 16))
+        rule["exceptions"] = [{"original_start": moved.isoformat(), "cancelled": True}]
+    return rule
+
+
+def _seed(path: str, users: int, series: int) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(7)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (id, username, email, hashed_password) VALUES (:id, :u, :e, 'x')"),
+            [{"id": i, "u": f"user{i}", "e": f"user{i}@example.com"} for i in range(1, users + 1)],
+        )
+        rows = []
+        for owner in range(1, users + 1):
+            for n in range(series):
+                start = EPOCH + timedelta(days=rng.randint(0, 300), hours=rng.randint(8, 17), minutes=rng.choice((0, 30)))
+                rows.append(
+                    {
+                        "uuid": f"{owner}-{n}",
+                        "change_key": f"ck-{owner}-{n}",
+                        "owner": owner,
+                        "subject": f"Series {n}",
+                        "start": start,
+                        "end": start + timedelta(minutes=rng.choice((30, 60, 90))),
+                        "pattern": json.dumps(_pattern(rng)),
+                        "status": rng.choice(("busy", "busy", "tentative", "oof")),
+                        "now": EPOCH,
+                    }
+                )
+        # Bulk insert below the ORM, so no dav_changes rows (like pre-existing data)
+        conn.execute(
+            text(
+                "INSERT INTO calendar_events (uuid, change_key, owner_id, subject, start_time, end_time, "
+                "is_recurring, recurrence_pattern, meeting_status, updated_at) "
+                "VALUES (:uuid, :change_key, :owner, :subject, :start, :end, 1, :pattern, :status, :now)"
+            ),
+            rows,
+        )
+    engine.dispose()
+
+
+def _naive(db, user_ids, start, end):
+    rows = (
+        db.query(CalendarEvent)
+        .filter(CalendarEvent.owner_id.in_(user_ids), CalendarEvent.start_time < end)
+        .all()
+    )
+    busy = {user_id: [] for user_id in user_ids}
+    for row in rows:
+        series = RecurrenceSeries(row.start_time, row.end_time, row.recurrence_pattern, row.meeting_status)
+        busy[row.owner_id].extend(series.occurrences(start, end))
+    return {user_id: merge_busy(items) for user_id, items in busy.items()}
+
+
+def _timed(func, repeat: int = 1):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--series", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "freebusy.db")
+        started = time.perf_counter()
+        _seed(path, args.users, args.series)
+        print(f"seeded {args.users} users x {args.series} series in {time.perf_counter() - started:.1f}s")
+
+        Session = sessionmaker(bind=create_engine(f"sqlite:///{path}"))
+        user_ids = list(range(1, args.users + 1))
+        start = datetime(2025, 3, 3)
+        end = start + timedelta(days=7)
+        meeting = user_ids[:10]
+
+        with Session() as db:
+            naive, naive_ms = _timed(lambda: _naive(db, user_ids, start, end))
+            _m, naive_meeting_ms = _timed(lambda: _naive(db, meeting, start, end), args.repeat)
+
+            index = FreeBusyIndex()
+            cold, cold_ms = _timed(lambda: index.busy_intervals(db, user_ids, start, end))
+            assert cold == naive, "index and naive expansion disagree"
+            _w, warm_ms = _timed(lambda: index.busy_intervals(db, user_ids, start, end), args.repeat)
+            _m, meeting_ms = _timed(lambda: index.busy_intervals(db, meeting, start, end), args.repeat)
+            _n, next_week_ms = _timed(
+                lambda: index.busy_intervals(db, user_ids, end, end + timedelta(days=7))
+            )
+
+            event = db.query(CalendarEvent).filter(CalendarEvent.owner_id == 1).first()
+            event.recurrence_pattern = json.dumps({"freq": "DAILY"})
+            db.commit()
+            _e, edit_ms = _timed(lambda: index.busy_intervals(db, user_ids, start, end))
+
+        intervals = sum(len(v) for v in cold.values())
+        print(f"week of {start:%Y-%m-%d}: {intervals} merged busy intervals across {args.users} users")
+        print(f"naive expand, all users:      {naive_ms:9.1f} ms")
+        print(f"naive expand, 10 attendees:   {naive_meeting_ms:9.1f} ms")
+        print(f"index cold load, all users:   {cold_ms:9.1f} ms")
+        print(f"index warm, all users:        {warm_ms:9.1f} ms")
+        print(f"index warm, 10 attendees:     {meeting_ms:9.2f} ms")
+        print(f"index next week, all users:   {next_week_ms:9.1f} ms")
+        print(f"index after one edit:         {edit_ms:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark GAL prefix-search latency on a synthetic directory.
+
+Builds the in-memory GalSearchIndex from N synthetic entries (no database)
+and replays a mix of 1-3 character prefixes, full names, email fragments
+and two-term queries, reporting p50/p95/p99 latency.
+
+Usage:
+  python benchmarks/gal_search.py --entries 100000 --queries 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.gal_index import GalIndexEntry, GalSearchIndex  # noqa: E402
+
+FIRST = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+         "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Yonatan", "Noa",
+         "José", "Zoë", "Chen", "Aiko", "Omar", "Fatima", "Ivan", "Olga", "Lars", "Ingrid"]
+LAST = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+        "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+        "Shtrum", "Cohen", "Levi", "Tanaka", "Müller", "Schmidt", "Ivanov", "Nielsen", "Dubois", "Rossi"]
+DEPARTMENTS = ["Sales", "Engineering", "Finance", "Legal", "Support", "Marketing", "Operations", "HR"]
+COMPANIES = ["Contoso", "Fabrikam", "Northwind", "Tailspin", "Litware"]
+
+
+def synthetic_entries(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    for i in range(count):
+        first = rng.choice(FIRST)
+        last = rng.choice(LAST)
+        yield GalIndexEntry(
+            id=i,
+            uuid=None,
+            user_id=None,
+            display_name=f"{first} {last}",
+            given_name=first,
+            surname=last,
+            email=f"{first.lower()}.{last.lower()}{i}@example.com",
+            company=rng.choice(COMPANIES),
+            department=rng.choice(DEPARTMENTS),
+            job_title=None,
+            office_location=None,
+            business_phone=None,
+            mobile_phone=None,
+        )
+
+
+def query_mix(count: int, seed: int = 11):
+    rng = random.Random(seed)
+    for _ in range(count):
+        first = rng.choice(FIRST).lower()
+        last = rng.choice(LAST).lower()
+        kind = rng.random()
+        if kind < 0.15:
+            yield first[:1]
+        elif kind < 0.45:
+            yield last[: rng.randint(2, 3)]
+        elif kind < 0.70:
+            yield f"{first} {last}"
+        elif kind < 0.85:
+            yield f"{first}.{last}{rng.randint(0, 99999)}"
+        else:
+            yield f"{first[:3]} {last[:2]}"
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    index = GalSearchIndex()
+    started = time.perf_counter()
+    index.rebuild(synthetic_entries(args.entries))
+    print(f"built index of {len(index)} entries in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    latencies = []
+    for query in query_mix(args.queries):
+        t0 = time.perf_counter()
+        index.search(query, limit=args.limit)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    upsert_started = time.perf_counter()
+    for entry in synthetic_entries(200, seed=99):
+        index.upsert(entry)
+    upsert_ms = (time.perf_counter() - upsert_started) * 1000 / 200
+
+    print(
+        f"queries={len(latencies)} p50={statistics.median(latencies):.2f}ms "
+        f"p95={_percentile(latencies, 95):.2f}ms p99={_percentile(latencies, 99):.2f}ms "
+        f"max={max(latencies):.2f}ms upsert={upsert_ms:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Mixed-load event loop lag benchmark.
+
+Runs a burst of "protocol requests" that each spend --work-ms in blocking
+code (standing in for a synchronous SQLAlchemy query or PBKDF2 check)
+while --pings long-poll style tasks wake up every 50 ms. Reports loop lag
+(how late the pings wake) and request throughput with the blocking work
+run inline on the loop versus on the DB pool.
+
+Usage:
+  python benchmarks/loop_lag.py --requests 200 --work-ms 20 --pings 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db_executor import DB_EXECUTOR_WORKERS, run_in_db_thread  # noqa: E402
+from app.loop_lag import LoopLagMonitor  # noqa: E402
+
+
+def _blocking_work(work_ms: float) -> None:
+    time.sleep(work_ms / 1000)
+
+
+async def _ping(stop: asyncio.Event, lags: list) -> None:
+    while not stop.is_set():
+        expected = time.perf_counter() + 0.05
+        await asyncio.sleep(0.05)
+        lags.append(max(0.0, (time.perf_counter() - expected) * 1000))
+
+
+async def _request(mode: str, work_ms: float) -> None:
+    if mode == "inline":
+        _blocking_work(work_ms)
+    else:
+        await run_in_db_thread(_blocking_work, work_ms)
+    await asyncio.sleep(0)
+
+
+async def _run(mode: str, requests: int, work_ms: float, pings: int, concurrency: int) -> dict:
+    monitor = LoopLagMonitor(interval=0.01, warn_ms=100)
+    await monitor.start()
+    stop = asyncio.Event()
+    lags: list = []
+    ping_tasks = [asyncio.create_task(_ping(stop, lags)) for _ in range(pings)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            await _request(mode, work_ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*ping_tasks)
+    await monitor.stop()
+
+    lags.sort()
+    stats = monitor.get_stats()
+    return {
+        "elapsed_s": elapsed,
+        "req_per_s": requests / elapsed,
+        "ping_p99_ms": lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0,
+        "loop_lag_p99_ms": stats["lag_ms_p99"],
+        "loop_lag_max_ms": stats["lag_ms_max"],
+        "stalls": stats["stalls"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--work-ms", type=float, default=20.0)
+    parser.add_argument("--pings", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=DB_EXECUTOR_WORKERS)
+    args = parser.parse_args()
+
+    for mode in ("inline", "offloaded"):
+        result = asyncio.run(_run(mode, args.requests, args.work_ms, args.pings, args.concurrency))
+        print(
+            f"{mode:>9}: {result['elapsed_s']:.2f}s  {result['req_per_s']:.0f} req/s  "
+            f"ping p99 {result['ping_p99_ms']:.1f} ms  loop lag p99 {result['loop_lag_p99_ms']} ms  "
+            f"max {result['loop_lag_max_ms']} ms  stalls {result['stalls']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
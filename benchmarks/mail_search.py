@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark mailbox full-text search latency on a synthetic message store.
+
+Fills a temporary SQLite database with N messages spread over M mailboxes
+(Zipf-distributed vocabulary, so some terms are in most messages and most
+terms are rare), builds the index with mail_search.backfill() and replays a
+mix of prefix, multi-term, field (from:) and folder/date-filtered queries
+for random mailboxes, reporting p50/p95/p99 latency per query kind.
+``--scan-queries`` also times the LIKE scan over the mailbox that a search
+without the index amounts to.
+
+Usage:
+  python benchmarks/mail_search.py --messages 1000000 --mailboxes 1000 --queries 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, or_  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.database import Base, Email, User  # noqa: E402
+from app.services import mail_search  # noqa: E402
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "te", "vo", "zi", "pa", "de", "go", "hu", "ji", "be", "fo"]
+INSERT_CHUNK = 20000
+
+
+def vocabulary(size: int, seed: int = 3):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _zipf_word(rng: random.Random, words) -> str:
+    return words[min(len(words) - 1, int(rng.paretovariate(1.05)) - 1)]
+
+
+def populate(engine, messages: int, mailboxes: int, words, seed: int = 5) -> None:
+    rng = random.Random(seed)
+    # Shuffled so the most frequent words are not also the alphabetically first
+    ranked = words[:]
+    rng.shuffle(ranked)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(User),
+            [
+                {"id": uid, "username": f"user{uid}", "email": f"user{uid}@example.com", "hashed_password": "x"}
+                for uid in range(1, mailboxes + 1)
+            ],
+        )
+    start = datetime(2024, 1, 1)
+    for offset in range(0, messages, INSERT_CHUNK):
+        rows = []
+        for i in range(offset, min(messages, offset + INSERT_CHUNK)):
+            rows.append(
+                {
+                    "id": i + 1,
+                    "subject": " ".join(_zipf_word(rng, ranked) for _ in range(rng.randint(3, 8))),
+                    "body": " ".join(_zipf_word(rng, ranked) for _ in range(rng.randint(20, 120))),
+                    "sender_id": rng.randint(1, mailboxes),
+                    "recipient_id": rng.randint(1, mailboxes),
+                    "is_read": rng.random() < 0.7,
+                    "is_deleted": rng.random() < 0.05,
+                    "created_at": start + timedelta(seconds=i * 30),
+                }
+            )
+        with engine.begin() as conn:
+            conn.execute(insert(Email.__table__), rows)
+
+
+def query_mix(count: int, mailboxes: int, words, seed: int = 11):
+    rng = random.Random(seed)
+    frequent = words[:50]
+    for _ in range(count):
+        user_id = rng.randint(1, mailboxes)
+        kind = rng.random()
+        if kind < 0.3:
+            yield "prefix", user_id, rng.choice(words)[:3], {}
+        elif kind < 0.5:
+            yield "word", user_id, rng.choice(words), {}
+        elif kind < 0.7:
+            yield "two_terms", user_id, f"{rng.choice(frequent)} {rng.choice(words)[:3]}", {}
+        elif kind < 0.85:
+            yield "from", user_id, f"from:user{rng.randint(1, mailboxes)} {rng.choice(words)[:2]}", {}
+        else:
+            since = datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 300))
+            yield "filtered", user_id, rng.choice(words)[:4], {"folder": "inbox", "since": since}
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _scan(db, user_id: int, query: str):
+    """Unindexed search: LIKE over every message of the mailbox."""
+    rows = db.query(Email.id).filter(or_(Email.sender_id == user_id, Email.recipient_id == user_id))
+    for term in query.split():
+        term = term.partition(":")[2] or term
+        rows = rows.filter(or_(Email.subject.ilike(f"%{term}%"), Email._body.ilike(f"%{term}%")))
+    return rows.order_by(Email.created_at.desc()).limit(50).all()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--mailboxes", type=int, default=1000)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--scan-queries", type=int, default=50)
+    parser.add_argument("--db", help="SQLite file to use (default: a temporary file)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="mail_search_"), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    words = vocabulary(args.vocabulary)
+
+    started = time.perf_counter()
+    populate(engine, args.messages, args.mailboxes, words)
+    print(f"stored {args.messages} messages in {time.perf_counter() - started:.1f}s ({path})")
+
+    started = time.perf_counter()
+    indexed = mail_search.backfill(engine)
+    elapsed = time.perf_counter() - started
+    print(f"indexed {indexed} messages in {elapsed:.1f}s ({indexed / max(elapsed, 1e-9):.0f}/s)")
+
+    Session = sessionmaker(bind=engine)
+    latencies = {}
+    with Session() as db:
+        for kind, user_id, query, filters in query_mix(args.queries, args.mailboxes, words):
+            t0 = time.perf_counter()
+            mail_search.search(db, user_id, query, limit=args.limit, **filters)
+            latencies.setdefault(kind, []).append((time.perf_counter() - t0) * 1000)
+
+        scan = []
+        for _kind, user_id, query, _filters in query_mix(args.scan_queries, args.mailboxes, words, seed=13):
+            t0 = time.perf_counter()
+            _scan(db, user_id, query)
+            scan.append((time.perf_counter() - t0) * 1000)
+
+    everything = [value for values in latencies.values() for value in values]
+    for kind, values in sorted(latencies.items()) + [("all", everything)] + ([("like_scan", scan)] if scan else []):
+        print(
+            f"{kind:<10} n={len(values):<5} p50={statistics.median(values):.2f}ms "
+            f"p95={_percentile(values, 95):.2f}ms p99={_percentile(values, 99):.2f}ms max={max(values):.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
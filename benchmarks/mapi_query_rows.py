@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark bytes-on-wire and round trips for a MAPI contents-table listing.
+
+Drives RopProcessor directly with RopQueryRows requests until the table
+reports BOOKMARK_END, framing every ROP output buffer with RPC_HEADER_EXT
+exactly as MapiRpcProcessor does. Compares:
+- legacy:      50 rows per Execute, uncompressed (previous behaviour)
+- budgeted:    as many rows as fit in MaxRopOut, uncompressed
+- compressed:  as many rows as fit in MaxRopOut, LZ77 compressed
+
+Usage:
+  python benchmarks/mapi_query_rows.py --rows 10000 --max-response 32768
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import struct
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.mapi_compression import RPC_HEADER_EXT_SIZE, encode_rpc_buffer  # noqa: E402
+from app.mapi_protocol import MapiPropertyTags  # noqa: E402
+from app.mapi_rop import QueryRowsOrigin, RopId, RopProcessor  # noqa: E402
+from app.mapi_store import MapiMessage  # noqa: E402
+
+COLUMNS = [
+    MapiPropertyTags.PR_SUBJECT,
+    MapiPropertyTags.PR_SENDER_NAME,
+    MapiPropertyTags.PR_SENDER_EMAIL_ADDRESS,
+    MapiPropertyTags.PR_MESSAGE_SIZE,
+    MapiPropertyTags.PR_MESSAGE_FLAGS,
+    MapiPropertyTags.PR_CREATION_TIME,
+]
+
+# Execute request/response envelope overhead per round trip (headers excluded)
+EXECUTE_OVERHEAD = 24
+
+
+def _messages(count: int):
+    base = datetime(2025, 1, 1)
+    senders = ["alice", "bob", "carol", "dave", "erin", "frank"]
+    for i in range(count):
+        sender = senders[i % len(senders)]
+        created = base + timedelta(minutes=i)
+        yield MapiMessage(
+            message_id=str(i),
+            folder_id="inbox",
+            subject="",
+            sender_name="",
+            sender_email="",
+            recipient_name="",
+            recipient_email="",
+            body_text="",
+            body_html="",
+            creation_time=created,
+            last_modification_time=created,
+            message_size=0,
+            message_flags=0,
+            entry_id=b"",
+            properties={
+                MapiPropertyTags.PR_SUBJECT: f"Weekly status report #{i} for project {i % 37}",
+                MapiPropertyTags.PR_SENDER_NAME: sender.title(),
+                MapiPropertyTags.PR_SENDER_EMAIL_ADDRESS: f"{sender}@example.com",
+                MapiPropertyTags.PR_MESSAGE_SIZE: 2048 + (i % 4096),
+                MapiPropertyTags.PR_MESSAGE_FLAGS: i % 2,
+                MapiPropertyTags.PR_CREATION_TIME: created,
+            },
+        )
+
+
+def _query_rows_request(row_count: int) -> bytes:
+    rop = struct.pack("<BBBBH", RopId.RopQueryRows, 0, 1, 0, row_count) + b"\x00" * 6
+    return struct.pack("<HHI", 8 + len(rop), 1, 0) + rop
+
+
+def run(rows: int, max_response: int, mode: str) -> dict:
+    processor = RopProcessor("bench@example.com")
+    processor.handle_manager.create_handle(
+        "contents_table",
+        {"messages": list(_messages(rows)), "folder_name": "inbox", "columns": COLUMNS, "current_row": 0},
+    )
+
+    if mode == "legacy":
+        row_count, budget, compress = 50, 0xFFFF, False
+    else:
+        row_count, budget, compress = 0xFFFF, max_response - RPC_HEADER_EXT_SIZE, mode == "compressed"
+
+    request = _query_rows_request(row_count)
+    round_trips = 0
+    wire_bytes = 0
+    payload_bytes = 0
+    fetched = 0
+    started = time.perf_counter()
+    while True:
+        payload = processor.process_rop_buffer(request, max_size=budget)
+        framed = encode_rpc_buffer(payload, compress=compress)
+        round_trips += 1
+        payload_bytes += len(payload)
+        wire_bytes += len(framed) + len(request) + EXECUTE_OVERHEAD
+        origin, returned = struct.unpack_from("<BH", payload, 14)
+        fetched += returned
+        if origin == QueryRowsOrigin.BOOKMARK_END or returned == 0:
+            break
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "rows": fetched,
+        "round_trips": round_trips,
+        "rop_bytes": payload_bytes,
+        "wire_bytes": wire_bytes,
+        "seconds": elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--max-response", type=int, default=0x8000, help="Execute MaxRopOut in bytes")
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'rows':>8}{'trips':>8}{'rop bytes':>12}{'wire bytes':>12}{'ms':>10}")
+    for mode in ("legacy", "budgeted", "compressed"):
+        result = run(args.rows, args.max_response, mode)
+        print(
+            f"{result['mode']:<12}{result['rows']:>8}{result['round_trips']:>8}"
+            f"{result['rop_bytes']:>12}{result['wire_bytes']:>12}{result['seconds'] * 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
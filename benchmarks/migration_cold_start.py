@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Cold-start cost of schema migrations on a large SQLite mailbox database.
+
+Builds a legacy database (no schema_migrations table, emails without uuid
+values) with --rows emails, then measures:
+- first start: time until migrate_database() returns (what blocks the
+  health check) and until the background UUID backfill finishes
+- warm start: migrate_database() against the now-current schema
+
+Usage:
+  python benchmarks/migration_cold_start.py --rows 1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from app.database import Base  # noqa: E402
+from app.migrations import migrate_database  # noqa: E402
+from app import migrations  # noqa: E402
+
+
+def _build_legacy(path: str, rows: int) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    batch = 50_000
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (id, username, email, hashed_password, is_active) "
+                "VALUES (1, 'bench', 'bench@example.com', 'x', 1)"
+            )
+        )
+        for start in range(0, rows, batch):
+            conn.execute(
+                text(
+                    "INSERT INTO emails (subject, body, recipient_id, is_read, is_deleted, is_external) "
+                    "VALUES (:subject, 'body', 1, 0, 0, 0)"
+                ),
+                [{"subject": f"Message {i}"} for i in range(start, min(rows, start + batch))],
+            )
+    engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "legacy.db")
+        started = time.perf_counter()
+        _build_legacy(path, args.rows)
+        print(f"built legacy database with {args.rows} emails in {time.perf_counter() - started:.1f}s")
+
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        started = time.perf_counter()
+        migrate_database(engine)
+        blocking = time.perf_counter() - started
+        migrations._background_thread.join()
+        backfill = time.perf_counter() - started
+        print(f"first start: startup blocked {blocking:.2f}s, background backfill done after {backfill:.1f}s")
+
+        started = time.perf_counter()
+        migrate_database(engine)
+        print(f"warm start:  {(time.perf_counter() - started) * 1000:.1f} ms")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
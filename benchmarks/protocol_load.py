@@ -0,0 +1,698 @@
+#!/usr/bin/env python3
+"""
+Protocol-level load generator for EAS, EWS, MAPI/HTTP and SMTP.
+
+Seeds a synthetic database (--users mailboxes with --mailbox messages
+each), starts the service in-process (uvicorn on an ephemeral port plus the
+SMTP listener, no lifespan background jobs) and drives simulated clients
+over real sockets through realistic flows:
+
+- eas:  Provision + ack, FolderSync, Sync from key 0 paging until
+        MoreAvailable clears, a Ping loop, ItemOperations Fetch
+- ews:  FindItem, SyncFolderItems paging, Subscribe + GetStreamingEvents
+        released by an SMTP delivery (new-mail notification latency)
+- mapi: Connect, Execute (RopLogon) loop, Disconnect
+- smtp: inbound burst over --smtp-connections parallel sessions
+
+Each phase runs its clients concurrently (--concurrency). Every request is
+tagged with an X-LoadGen-Op header; a middleware puts the tag in a context
+variable and a SQLAlchemy listener counts statements per operation, so SQL
+per request is exact even while flows interleave. RSS is sampled after
+each phase.
+
+Baselines: --save-baseline writes the per-operation results as JSON,
+--compare reads one and exits 1 when requests/sec or p95 regress beyond
+--tolerance, or when SQL per request or the error count grows (for CI).
+Protocol-level failures (a non-Success EWS ResponseClass, an EAS reply that
+is not WBXML) count as errors as well as HTTP 4xx/5xx.
+
+Usage:
+  python benchmarks/protocol_load.py --users 20 --mailbox 200
+  python benchmarks/protocol_load.py --save-baseline benchmarks/baselines/protocol_load.json
+  python benchmarks/protocol_load.py --compare benchmarks/baselines/protocol_load.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import contextvars
+import json
+import logging
+import os
+import re
+import resource
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'protocol_load.db')}")
+os.environ.setdefault("LOGS_DIR", os.path.join(_tmp, "logs"))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from sqlalchemy import event, text  # noqa: E402
+
+from activesync.wbxml_builder import WBXMLWriter  # noqa: E402
+from app.auth import get_password_hash  # noqa: E402
+from app.database import Base, engine  # noqa: E402
+from app.ews_push import ews_push_hub  # noqa: E402
+from app.main import app as service_app  # noqa: E402
+from app.smtp_server import EmailHandler  # noqa: E402
+
+PASSWORD = "LoadGen-Passw0rd"
+DOMAIN = "loadgen.example.com"
+
+# --- WBXML (MS-ASWBXML code pages and tokens used by the flows) ----------------
+
+CP_AIRSYNC, CP_FOLDERHIERARCHY, CP_PING, CP_PROVISION, CP_AIRSYNCBASE, CP_ITEMOPS = 0, 7, 13, 14, 17, 20
+AS_SYNC, AS_COLLECTION, AS_SYNCKEY, AS_SERVERID, AS_STATUS = 0x05, 0x0F, 0x0B, 0x0D, 0x0E
+AS_COLLECTIONID, AS_GETCHANGES, AS_MOREAVAILABLE, AS_WINDOWSIZE = 0x12, 0x13, 0x14, 0x15
+AS_OPTIONS, AS_COLLECTIONS = 0x17, 0x1C
+FH_SYNCKEY, FH_FOLDERSYNC = 0x12, 0x16
+PING_PING, PING_HEARTBEAT, PING_FOLDERS, PING_FOLDER, PING_ID, PING_CLASS = 0x05, 0x08, 0x09, 0x0A, 0x0B, 0x0C
+PV_PROVISION, PV_POLICIES, PV_POLICY, PV_POLICYTYPE, PV_POLICYKEY, PV_STATUS = 0x05, 0x06, 0x07, 0x08, 0x09, 0x0B
+ASB_BODYPREFERENCE, ASB_TYPE, ASB_TRUNCATIONSIZE = 0x05, 0x06, 0x07
+IO_ITEMOPERATIONS, IO_FETCH, IO_STORE, IO_OPTIONS = 0x05, 0x06, 0x07, 0x08
+
+
+def wbxml(root) -> bytes:
+    """Encode ``(page, token, content)`` trees; content is a str, None or a list."""
+    writer = WBXMLWriter()
+    writer.header()
+
+    def emit(node) -> None:
+        page, token, content = node
+        writer.page(page)
+        if content is None:
+            writer.start(token, with_content=False)
+            return
+        writer.start(token)
+        if isinstance(content, str):
+            writer.write_str(content)
+        else:
+            for child in content:
+                emit(child)
+        writer.end()
+
+    emit(root)
+    return writer.bytes()
+
+
+def wbxml_values(data: bytes) -> List[Tuple[int, int, Optional[str]]]:
+    """Flat (page, token, inline text or None) list of the elements in ``data``."""
+    if not data.startswith(b"\x03\x01"):
+        return []
+    out: List[Tuple[int, int, Optional[str]]] = []
+    page = 0
+    i = 4 + data[3] if len(data) > 3 else len(data)
+    while i < len(data):
+        byte = data[i]
+        i += 1
+        if byte == 0x00:  # SWITCH_PAGE
+            page = data[i]
+            i += 1
+        elif byte == 0x01:  # END
+            continue
+        elif byte == 0x03:  # STR_I belongs to the previous tag
+            end = data.index(b"\x00", i)
+            if out:
+                out[-1] = (out[-1][0], out[-1][1], data[i:end].decode("utf-8", "replace"))
+            i = end + 1
+        elif byte == 0xC3:  # OPAQUE
+            length = 0
+            while True:
+                part = data[i]
+                i += 1
+                length = (length << 7) | (part & 0x7F)
+                if not part & 0x80:
+                    break
+            i += length
+        else:
+            out.append((page, byte & 0x3F, None))
+    return out
+
+
+def _first(values, page: int, token: int) -> Optional[str]:
+    return next((v for p, t, v in values if p == page and t == token and v is not None), None)
+
+
+# --- Measurements ---------------------------------------------------------------
+
+_op: contextvars.ContextVar = contextvars.ContextVar("loadgen_op", default=None)
+
+
+class SqlCounter:
+    """Statements per operation tag; untagged statements go to the current phase."""
+
+    def __init__(self):
+        self.phase = "setup"
+        self.counts: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        key = _op.get() or f"{self.phase}.*"
+        with self._lock:
+            self.counts[key] += 1
+
+
+class TaggingMiddleware:
+    """Copies the client's X-LoadGen-Op header into the SQL counter's context."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"x-loadgen-op":
+                    _op.set(value.decode())
+                    break
+        await self.app(scope, receive, send)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.phase_seconds: Dict[str, float] = {}
+        self.rss_mb: Dict[str, float] = {}
+
+    def add(self, op: str, seconds: float, ok: bool) -> None:
+        self.latencies[op].append(seconds * 1000)
+        if not ok:
+            self.errors[op] += 1
+
+    def results(self, sql: SqlCounter) -> Dict[str, dict]:
+        rows = {}
+        for op, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            phase = op.split(".", 1)[0]
+
+            def pct(p: float) -> float:
+                return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+            statements = sql.counts.get(op, 0)
+            if phase == "smtp":
+                statements += sql.counts.get("smtp.*", 0)
+            rows[op] = {
+                "requests": len(samples),
+                "errors": self.errors.get(op, 0),
+                "rps": round(len(samples) / self.phase_seconds[phase], 1),
+                "p50_ms": round(statistics.median(ordered), 2),
+                "p95_ms": round(pct(0.95), 2),
+                "p99_ms": round(pct(0.99), 2),
+                "sql_per_request": round(statements / len(samples), 2),
+            }
+        return rows
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# --- Service --------------------------------------------------------------------
+
+
+class LocalService:
+    """The app on an ephemeral port plus the SMTP listener, on a background loop."""
+
+    def __init__(self):
+        self.port = 0
+        self.smtp_port = 0
+        self._ready = threading.Event()
+        self._server: Optional[uvicorn.Server] = None
+        self._thread = threading.Thread(target=self._run, name="loadgen-service", daemon=True)
+
+    def _run(self) -> None:
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        ews_push_hub.set_loop(loop)
+        smtp = await asyncio.start_server(EmailHandler(None).handle_client, "127.0.0.1", 0)
+        self.smtp_port = smtp.sockets[0].getsockname()[1]
+        config = uvicorn.Config(
+            TaggingMiddleware(service_app), host="127.0.0.1", port=0, lifespan="off", log_level="warning"
+        )
+        self._server = uvicorn.Server(config)
+        task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            await asyncio.sleep(0.01)
+        self.port = self._server.servers[0].sockets[0].getsockname()[1]
+        self._ready.set()
+        await task
+        smtp.close()
+
+    def start(self) -> None:
+        self._thread.start()
+        self._ready.wait(30)
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+        self._thread.join(10)
+
+
+def seed(users: int, mailbox: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    hashed = get_password_hash(PASSWORD)
+    epoch = datetime(2025, 1, 6, 8)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (id, username, email, full_name, hashed_password, is_active) "
+                "VALUES (:id, :u, :e, :n, :h, 1)"
+            ),
+            [
+                {"id": i, "u": f"user{i}", "e": f"user{i}@{DOMAIN}", "n": f"Load User {i}", "h": hashed}
+                for i in range(1, users + 1)
+            ],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO emails (uuid, subject, body, body_html, sender_id, recipient_id, is_read, "
+                "is_deleted, is_external, created_at, updated_at) VALUES (:uuid, :s, :b, :h, :sender, "
+                ":recipient, 0, 0, 0, :t, :t)"
+            ),
+            [
+                {
+                    "uuid": f"seed-{u}-{n}",
+                    "s": f"Status report {n} for project {n % 17}",
+                    "b": f"Plain body {n} " * 20,
+                    "h": f"<p>HTML body {n}</p>" * 20,
+                    "sender": (u % users) + 1,
+                    "recipient": u,
+                    "t": epoch + timedelta(minutes=n),
+                }
+                for u in range(1, users + 1)
+                for n in range(mailbox)
+            ],
+        )
+
+
+# --- Clients --------------------------------------------------------------------
+
+
+def _basic(user: int) -> str:
+    return "Basic " + base64.b64encode(f"user{user}@{DOMAIN}:{PASSWORD}".encode()).decode()
+
+
+class Client:
+    def __init__(self, http: httpx.AsyncClient, recorder: Recorder, user: int):
+        self.http = http
+        self.recorder = recorder
+        self.user = user
+
+    async def call(self, op: str, method: str, path: str, ok=None, **kwargs) -> httpx.Response:
+        headers = kwargs.pop("headers", {})
+        headers.update({"Authorization": _basic(self.user), "X-LoadGen-Op": op})
+        started = time.perf_counter()
+        response = await self.http.request(method, path, headers=headers, **kwargs)
+        elapsed = time.perf_counter() - started
+        good = response.status_code < 400 and (ok is None or ok(response))
+        self.recorder.add(op, elapsed, good)
+        return response
+
+
+class EasDevice(Client):
+    def __init__(self, http, recorder, user: int, args):
+        super().__init__(http, recorder, user)
+        self.args = args
+        self.device_id = f"LOADGEN{user:06d}"
+        self.policy_key = "0"
+
+    async def command(self, cmd: str, body: bytes, ok=None) -> httpx.Response:
+        return await self.call(
+            f"eas.{cmd}",
+            "POST",
+            "/Microsoft-Server-ActiveSync",
+            ok=ok,
+            params={"Cmd": cmd, "User": f"user{self.user}@{DOMAIN}", "DeviceId": self.device_id, "DeviceType": "Android"},
+            headers={
+                "Content-Type": "application/vnd.ms-sync.wbxml",
+                "MS-ASProtocolVersion": "14.1",
+                "User-Agent": "Android-Mail/2023.10 LoadGen",
+                "X-MS-PolicyKey": self.policy_key,
+            },
+            content=body,
+        )
+
+    def _provision(self, key: Optional[str]) -> bytes:
+        policy = [(CP_PROVISION, PV_POLICYTYPE, "MS-EAS-Provisioning-WBXML")]
+        if key:
+            policy += [(CP_PROVISION, PV_POLICYKEY, key), (CP_PROVISION, PV_STATUS, "1")]
+        return wbxml((CP_PROVISION, PV_PROVISION, [(CP_PROVISION, PV_POLICIES, [(CP_PROVISION, PV_POLICY, policy)])]))
+
+    def _sync(self, key: str) -> bytes:
+        collection = [(CP_AIRSYNC, AS_SYNCKEY, key), (CP_AIRSYNC, AS_COLLECTIONID, "1")]
+        if key != "0":
+            collection += [
+                (CP_AIRSYNC, AS_GETCHANGES, None),
+                (CP_AIRSYNC, AS_WINDOWSIZE, str(self.args.window)),
+                (
+                    CP_AIRSYNC,
+                    AS_OPTIONS,
+                    [(CP_AIRSYNCBASE, ASB_BODYPREFERENCE, [(CP_AIRSYNCBASE, ASB_TYPE, "2"), (CP_AIRSYNCBASE, ASB_TRUNCATIONSIZE, "32768")])],
+                ),
+            ]
+        return wbxml((CP_AIRSYNC, AS_SYNC, [(CP_AIRSYNC, AS_COLLECTIONS, [(CP_AIRSYNC, AS_COLLECTION, collection)])]))
+
+    async def run(self) -> None:
+        response = await self.command("Provision", self._provision(None))
+        temporary = response.headers.get("X-MS-PolicyKey", "0")
+        response = await self.command("Provision", self._provision(temporary))
+        self.policy_key = response.headers.get("X-MS-PolicyKey", temporary)
+
+        await self.command(
+            "FolderSync",
+            wbxml((CP_FOLDERHIERARCHY, FH_FOLDERSYNC, [(CP_FOLDERHIERARCHY, FH_SYNCKEY, "0")])),
+            ok=lambda r: r.content.startswith(b"\x03\x01"),
+        )
+
+        key, server_ids = "0", []
+        for _ in range(self.args.max_pages):
+            response = await self.command("Sync", self._sync(key), ok=lambda r: r.content.startswith(b"\x03\x01"))
+            values = wbxml_values(response.content)
+            server_ids += [v for p, t, v in values if p == CP_AIRSYNC and t == AS_SERVERID and v]
+            new_key = _first(values, CP_AIRSYNC, AS_SYNCKEY)
+            more = any(p == CP_AIRSYNC and t == AS_MOREAVAILABLE for p, t, _v in values)
+            if not new_key or (key != "0" and not more):
+                break
+            key = new_key
+
+        ping = wbxml(
+            (
+                CP_PING,
+                PING_PING,
+                [
+                    (CP_PING, PING_HEARTBEAT, "480"),
+                    (CP_PING, PING_FOLDERS, [(CP_PING, PING_FOLDER, [(CP_PING, PING_ID, "1"), (CP_PING, PING_CLASS, "Email")])]),
+                ],
+            )
+        )
+        for _ in range(self.args.pings):
+            await self.command("Ping", ping)
+
+        if server_ids:
+            fetch = [
+                (CP_ITEMOPS, IO_STORE, "Mailbox"),
+                (CP_AIRSYNC, AS_COLLECTIONID, "1"),
+                (CP_AIRSYNC, AS_SERVERID, server_ids[0]),
+                (CP_ITEMOPS, IO_OPTIONS, [(CP_AIRSYNCBASE, ASB_BODYPREFERENCE, [(CP_AIRSYNCBASE, ASB_TYPE, "2")])]),
+            ]
+            await self.command(
+                "ItemOperations",
+                wbxml((CP_ITEMOPS, IO_ITEMOPERATIONS, [(CP_ITEMOPS, IO_FETCH, fetch)])),
+                ok=lambda r: r.content.startswith(b"\x03\x01"),
+            )
+
+
+SOAP = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types" '
+    'xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">'
+    '<soap:Header><t:RequestServerVersion Version="Exchange2013_SP1"/></soap:Header>'
+    "<soap:Body>{}</soap:Body></soap:Envelope>"
+)
+FIND_ITEM = (
+    '<m:FindItem Traversal="Shallow"><m:ItemShape><t:BaseShape>IdOnly</t:BaseShape></m:ItemShape>'
+    '<m:IndexedPageItemView MaxEntriesReturned="50" Offset="0" BasePoint="Beginning"/>'
+    '<m:ParentFolderIds><t:DistinguishedFolderId Id="inbox"/></m:ParentFolderIds></m:FindItem>'
+)
+SYNC_FOLDER_ITEMS = (
+    '<SyncFolderItems xmlns="http://schemas.microsoft.com/exchange/services/2006/messages">'
+    "<ItemShape><t:BaseShape>IdOnly</t:BaseShape></ItemShape>"
+    '<SyncFolderId><t:FolderId Id="DF_inbox"/></SyncFolderId>'
+    "{state}<MaxChangesReturned>{page}</MaxChangesReturned></SyncFolderItems>"
+)
+SUBSCRIBE = (
+    "<m:Subscribe><m:StreamingSubscriptionRequest><t:FolderIds>"
+    '<t:DistinguishedFolderId Id="inbox"/></t:FolderIds><t:EventTypes>'
+    "<t:EventType>NewMailEvent</t:EventType></t:EventTypes></m:StreamingSubscriptionRequest></m:Subscribe>"
+)
+GET_STREAMING_EVENTS = (
+    "<m:GetStreamingEvents><m:SubscriptionIds><m:SubscriptionId>{}</m:SubscriptionId></m:SubscriptionIds>"
+    "<m:ConnectionTimeout>1</m:ConnectionTimeout></m:GetStreamingEvents>"
+)
+_SYNC_STATE = re.compile(r"<m:SyncState>([^<]*)</m:SyncState>")
+_SUBSCRIPTION = re.compile(r"<m:SubscriptionId>([^<]+)</m:SubscriptionId>")
+
+
+class EwsClient(Client):
+    def __init__(self, http, recorder, user: int, args, smtp_port: int):
+        super().__init__(http, recorder, user)
+        self.args = args
+        self.smtp_port = smtp_port
+
+    async def soap(self, op: str, body: str, ok=None) -> httpx.Response:
+        return await self.call(
+            f"ews.{op}",
+            "POST",
+            "/EWS/Exchange.asmx",
+            ok=ok or (lambda r: 'ResponseClass="Success"' in r.text),
+            headers={"Content-Type": "text/xml; charset=utf-8"},
+            content=SOAP.format(body),
+        )
+
+    async def run(self) -> None:
+        await self.soap("FindItem", FIND_ITEM)
+        state = ""
+        for _ in range(self.args.max_pages):
+            response = await self.soap(
+                "SyncFolderItems", SYNC_FOLDER_ITEMS.format(state=state, page=self.args.window)
+            )
+            match = _SYNC_STATE.search(response.text)
+            if not match or "<t:Create>" not in response.text:
+                break
+            state = f"<SyncState>{match.group(1)}</SyncState>"
+
+        response = await self.soap("Subscribe", SUBSCRIBE)
+        match = _SUBSCRIPTION.search(response.text)
+        if not match:
+            return
+        stream = asyncio.create_task(
+            self.soap(
+                "GetStreamingEvents",
+                GET_STREAMING_EVENTS.format(match.group(1)),
+                ok=lambda r: "<t:NewMailEvent>" in r.text,
+            )
+        )
+        await asyncio.sleep(0.05)  # let the long-poll park before the mail arrives
+        await send_mail(self.smtp_port, self.user, "Streaming probe")
+        await stream
+
+
+async def send_mail(port: int, user: int, subject: str, count: int = 1, recorder: Optional[Recorder] = None) -> None:
+    """Deliver ``count`` messages to ``user`` over one SMTP session."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def reply() -> str:
+        while True:
+            line = (await reader.readline()).decode(errors="replace")
+            if len(line) < 4 or line[3] != "-":
+                return line
+
+    async def command(line: str) -> str:
+        writer.write(line.encode() + b"\r\n")
+        await writer.drain()
+        return await reply()
+
+    await reply()
+    await command("EHLO loadgen.local")
+    for n in range(count):
+        started = time.perf_counter()
+        await command("MAIL FROM:<sender@external.example>")
+        await command(f"RCPT TO:<user{user}@{DOMAIN}>")
+        await command("DATA")
+        message = (
+            f"From: sender@external.example\r\nTo: user{user}@{DOMAIN}\r\nSubject: {subject} {n}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n\r\n" + "Load test body line.\r\n" * 40
+        )
+        result = await command(message + ".")
+        if recorder is not None:
+            recorder.add("smtp.message", time.perf_counter() - started, result.startswith("250"))
+    await command("QUIT")
+    writer.close()
+
+
+def _connect_body(user: int) -> bytes:
+    dn = f"/o=LoadGen/ou=Exchange Administrative Group/cn=Recipients/cn=user{user}".encode() + b"\x00"
+    payload = struct.pack("<I", len(dn)) + dn + struct.pack("<IIIII", 0, 1252, 1033, 1033, 0)
+    return struct.pack("<QI", 0, len(payload)) + payload
+
+
+def _execute_body() -> bytes:
+    # RopLogon: LogonFlags, OpenFlags, StoreState, EssdnSize (private mailbox, no ESSDN)
+    rop = struct.pack("<BBBB", 0xFE, 0, 0, 0) + struct.pack("<BIIH", 0x01, 0x01000000, 0, 0)
+    rop_buffer = struct.pack("<HHI", 8 + len(rop), 1, 0) + rop
+    rpc = struct.pack("<II", 8, 0x02) + rop_buffer  # EcDoRpc
+    payload = struct.pack("<II", 0, len(rpc)) + rpc + struct.pack("<II", 0x8000, 0)
+    return struct.pack("<QI", 0x01, len(payload)) + payload  # request type Execute
+
+
+def _disconnect_body() -> bytes:
+    return struct.pack("<QI", 0x02, 4) + struct.pack("<I", 0)
+
+
+class MapiClient(Client):
+    def __init__(self, http, recorder, user: int, args):
+        super().__init__(http, recorder, user)
+        self.args = args
+
+    async def request(self, kind: str, body: bytes, cookie: str = "") -> httpx.Response:
+        headers = {"Content-Type": "application/mapi-http", "X-RequestType": kind, "User-Agent": "Microsoft Office/16.0 LoadGen"}
+        if cookie:
+            headers["X-SessionCookie"] = cookie
+        return await self.call(f"mapi.{kind}", "POST", "/mapi/emsmdb", headers=headers, content=body)
+
+    async def run(self) -> None:
+        response = await self.request("Connect", _connect_body(self.user))
+        cookie = response.headers.get("X-SessionCookie", "")
+        if not cookie:
+            return
+        for _ in range(self.args.executes):
+            await self.request("Execute", _execute_body(), cookie)
+        await self.request("Disconnect", _disconnect_body(), cookie)
+
+
+# --- Runner ---------------------------------------------------------------------
+
+
+async def run_phase(name: str, clients, concurrency: int, recorder: Recorder, sql: SqlCounter) -> None:
+    sql.phase = name
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(client) -> None:
+        async with semaphore:
+            await client.run()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(client) for client in clients))
+    recorder.phase_seconds[name] = time.perf_counter() - started
+    recorder.rss_mb[name] = round(_rss_mb(), 1)
+
+
+class _SmtpBurst:
+    def __init__(self, port: int, user: int, count: int, recorder: Recorder):
+        self.port, self.user, self.count, self.recorder = port, user, count, recorder
+
+    async def run(self) -> None:
+        await send_mail(self.port, self.user, "Burst", self.count, self.recorder)
+
+
+async def drive(args, service: LocalService, recorder: Recorder, sql: SqlCounter) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{service.port}", limits=limits, timeout=60) as http:
+        users = range(1, args.users + 1)
+        phases = {
+            "eas": lambda: [EasDevice(http, recorder, u, args) for u in users],
+            "ews": lambda: [EwsClient(http, recorder, u, args, service.smtp_port) for u in users],
+            "mapi": lambda: [MapiClient(http, recorder, u, args) for u in users],
+            "smtp": lambda: [
+                _SmtpBurst(service.smtp_port, (n % args.users) + 1, args.smtp_messages // args.smtp_connections, recorder)
+                for n in range(args.smtp_connections)
+            ],
+        }
+        for name in args.protocols:
+            await run_phase(name, phases[name](), args.concurrency, recorder, sql)
+
+
+def compare(results: Dict[str, dict], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)["operations"]
+    problems = []
+    for op, base in baseline.items():
+        now = results.get(op)
+        if now is None:
+            problems.append(f"{op}: missing from this run")
+            continue
+        if now["rps"] < base["rps"] * (1 - tolerance):
+            problems.append(f"{op}: {now['rps']} req/s vs baseline {base['rps']}")
+        if now["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{op}: p95 {now['p95_ms']} ms vs baseline {base['p95_ms']}")
+        # Statement counts are deterministic, so they get a tight bound
+        if now["sql_per_request"] > base["sql_per_request"] * 1.1 + 0.5:
+            problems.append(f"{op}: {now['sql_per_request']} SQL/request vs baseline {base['sql_per_request']}")
+        if now["errors"] > base["errors"]:
+            problems.append(f"{op}: {now['errors']} errors vs baseline {base['errors']}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--mailbox", type=int, default=200, help="messages per mailbox")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--protocols", default="eas,ews,mapi,smtp")
+    parser.add_argument("--window", type=int, default=50, help="Sync WindowSize / SyncFolderItems page")
+    parser.add_argument("--max-pages", type=int, default=20)
+    parser.add_argument("--pings", type=int, default=3)
+    parser.add_argument("--executes", type=int, default=10)
+    parser.add_argument("--smtp-messages", type=int, default=400)
+    parser.add_argument("--smtp-connections", type=int, default=20)
+    parser.add_argument("--save-baseline")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed latency/throughput drift")
+    args = parser.parse_args()
+    args.protocols = [p.strip() for p in args.protocols.split(",") if p.strip()]
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    started = time.perf_counter()
+    seed(args.users, args.mailbox)
+    print(f"seeded {args.users} users x {args.mailbox} messages in {time.perf_counter() - started:.1f}s")
+
+    sql = SqlCounter()
+    event.listen(engine, "before_cursor_execute", sql)
+    recorder = Recorder()
+    service = LocalService()
+    service.start()
+    try:
+        asyncio.run(drive(args, service, recorder, sql))
+    finally:
+        service.stop()
+
+    results = recorder.results(sql)
+    print(f"{'operation':<22}{'reqs':>7}{'errs':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'SQL/req':>9}")
+    for op, row in results.items():
+        print(
+            f"{op:<22}{row['requests']:>7}{row['errors']:>6}{row['rps']:>9.1f}{row['p50_ms']:>9.1f}"
+            f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['sql_per_request']:>9.1f}"
+        )
+    print("RSS after phase (MB): " + ", ".join(f"{k} {v}" for k, v in recorder.rss_mb.items()))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        meta = {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare")}
+        with open(args.save_baseline, "w") as handle:
+            json.dump({"args": meta, "rss_mb": recorder.rss_mb, "operations": results}, handle, indent=2, sort_keys=True)
+        print(f"baseline written to {args.save_baseline}")
+    if args.compare:
+        problems = compare(results, args.compare, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"no regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Benchmark inbound SMTP throughput over a high-latency link.
+
+Starts the inbound EmailHandler on a temporary SQLite database behind a
+local TCP proxy that delays every segment by half of --rtt in each
+direction, then delivers --messages messages per client mode and reports
+messages/sec:
+- lockstep: one command per round trip, DATA (what the server forced
+  before PIPELINING was advertised)
+- pipelined: MAIL, RCPT and DATA sent as one group (RFC 2920), then the
+  message body
+- bdat: MAIL, RCPT and BDAT LAST (RFC 3030) for --window messages per
+  group, so a round trip is paid per window rather than per command
+
+Usage:
+  python benchmarks/smtp_pipelining.py --rtt 1 10 100 --messages 50 --window 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app import smtp_server  # noqa: E402
+from app.database import Base, User  # noqa: E402
+
+MESSAGE = (
+    b"From: list@remote.test\r\nTo: user@example.com\r\nSubject: Weekly digest\r\n\r\n"
+    + b"A line of digest text that stands in for a mailing list post.\r\n" * 40
+)
+
+
+async def _pump(reader, writer, delay: float) -> None:
+    """Forward bytes after ``delay`` seconds, preserving order."""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def deliver():
+        while True:
+            due, data = await queue.get()
+            if data is None:
+                writer.close()
+                return
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            writer.write(data)
+            await writer.drain()
+
+    sender = asyncio.create_task(deliver())
+    while True:
+        data = await reader.read(65536)
+        queue.put_nowait((time.perf_counter() + delay, data or None))
+        if not data:
+            break
+    await sender
+
+
+async def start_proxy(target_port: int, rtt_ms: float):
+    delay = rtt_ms / 2000
+
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", target_port)
+        await asyncio.gather(
+            _pump(client_reader, server_writer, delay),
+            _pump(server_reader, client_writer, delay),
+            return_exceptions=True,
+        )
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def _replies(reader, count: int) -> None:
+    seen = 0
+    while seen < count:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        if line[3:4] != b"-":
+            if line[:1] not in (b"2", b"3"):
+                raise RuntimeError(line.decode().strip())
+            seen += 1
+
+
+async def deliver(port: int, mode: str, messages: int, window: int) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await _replies(reader, 1)
+    writer.write(b"EHLO bench\r\n")
+    await _replies(reader, 1)
+    envelope = [b"MAIL FROM:<list@remote.test>\r\n", b"RCPT TO:<user@example.com>\r\n"]
+    data = MESSAGE + b".\r\n"
+    if mode == "lockstep":
+        for _ in range(messages):
+            for command in envelope + [b"DATA\r\n", data]:
+                writer.write(command)
+                await _replies(reader, 1)
+    elif mode == "pipelined":
+        for _ in range(messages):
+            writer.write(b"".join(envelope) + b"DATA\r\n")
+            await _replies(reader, 3)
+            writer.write(data)
+            await _replies(reader, 1)
+    else:
+        chunk = f"BDAT {len(MESSAGE)} LAST\r\n".encode() + MESSAGE
+        for offset in range(0, messages, window):
+            batch = min(window, messages - offset)
+            writer.write((b"".join(envelope) + chunk) * batch)
+            await _replies(reader, 3 * batch)
+    writer.write(b"QUIT\r\n")
+    await _replies(reader, 1)
+    writer.close()
+
+
+async def run(args) -> None:
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="smtp_pipelining_"), "bench.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        if not db.query(User).filter(User.email == "user@example.com").first():
+            db.add(User(username="user", email="user@example.com", hashed_password="x"))
+            db.commit()
+
+    handler = smtp_server.EmailHandler()
+    handler.db.close()
+    handler.db = Session()
+    server = await asyncio.start_server(handler.handle_client, "127.0.0.1", 0)
+    server_port = server.sockets[0].getsockname()[1]
+
+    for rtt in args.rtt:
+        proxy = await start_proxy(server_port, rtt)
+        port = proxy.sockets[0].getsockname()[1]
+        results = []
+        for mode in ("lockstep", "pipelined", "bdat"):
+            started = time.perf_counter()
+            await deliver(port, mode, args.messages, args.window)
+            elapsed = time.perf_counter() - started
+            results.append(f"{mode}={args.messages / elapsed:.1f}/s")
+        print(f"rtt={rtt:g}ms  " + "  ".join(results))
+        proxy.close()
+    server.close()
+    # Let delayed proxy segments and connection teardown finish
+    pending = asyncio.all_tasks() - {asyncio.current_task()}
+    if pending:
+        await asyncio.wait(pending, timeout=max(args.rtt) / 1000 + 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt", type=float, nargs="+", default=[1, 10, 100], help="simulated round trip times (ms)")
+    parser.add_argument("--messages", type=int, default=50, help="messages per client mode and RTT")
+    parser.add_argument("--window", type=int, default=10, help="messages per pipelined BDAT group")
+    parser.add_argument("--db", help="SQLite file to use (default: a temporary file)")
+    args = parser.parse_args()
+    # Per-message INFO logging would dominate the loopback timings
+    logging.getLogger(smtp_server.__name__).setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
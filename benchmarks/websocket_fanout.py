@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Load test WebSocket fan-out with thousands of in-process sockets.
+
+Connects N fake sockets (a fraction of them slow) to a ConnectionManager,
+then publishes broadcasts and per-user notifications. Reports how long the
+healthy sockets take to receive everything, plus the manager's queue depth,
+drop and send latency metrics. The "sequential" baseline awaits each socket
+in turn the way the manager used to.
+
+Usage:
+  python benchmarks/websocket_fanout.py --sockets 5000 --slow-fraction 0.02
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.websocket_manager import ConnectionManager  # noqa: E402
+
+
+class BenchSocket:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        await asyncio.sleep(self.delay)
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run_queued(sockets, users, messages, timeout):
+    manager = ConnectionManager(queue_size=256, send_timeout=timeout, heartbeat_interval=0)
+    for index, ws in enumerate(sockets):
+        await manager.connect(ws, index % users + 1)
+    started = time.perf_counter()
+    for n in range(messages):
+        await manager.broadcast({"type": "system_message", "data": {"n": n}})
+    healthy = [ws for ws in sockets if ws.delay == 0]
+    while any(ws.received < messages for ws in healthy):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    stats = manager.get_stats()
+    for ws in sockets:
+        manager.disconnect(ws)
+    return elapsed, stats
+
+
+async def run_sequential(sockets, messages):
+    started = time.perf_counter()
+    for n in range(messages):
+        for ws in sockets:
+            await ws.send_text(json.dumps({"type": "system_message", "data": {"n": n}}))
+    return time.perf_counter() - started
+
+
+def _sockets(count, slow_fraction, slow_delay, seed=3):
+    rng = random.Random(seed)
+    return [BenchSocket(slow_delay if rng.random() < slow_fraction else 0.0) for _ in range(count)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--slow-fraction", type=float, default=0.02)
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="seconds per send on slow sockets")
+    args = parser.parse_args()
+
+    elapsed, stats = asyncio.run(
+        run_queued(_sockets(args.sockets, args.slow_fraction, args.slow_delay), args.users, args.messages, 10)
+    )
+    print(f"queued:     healthy sockets done in {elapsed * 1000:.0f} ms")
+    print(
+        f"            sent={stats['messages_sent']} dropped={stats['messages_dropped']} "
+        f"depth_max={stats['queue_depth_max']} p50={stats['send_latency_ms_p50']}ms p99={stats['send_latency_ms_p99']}ms"
+    )
+    # The sequential baseline is bounded by the slow sockets; keep it short
+    baseline_messages = min(args.messages, 2)
+    elapsed = asyncio.run(
+        run_sequential(_sockets(args.sockets, args.slow_fraction, args.slow_delay), baseline_messages)
+    )
+    print(f"sequential: {baseline_messages} broadcasts took {elapsed * 1000:.0f} ms "
+          f"({elapsed * 1000 / baseline_messages:.0f} ms per broadcast)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,7 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
-from app.database import (
-    create_tables,
-    ensure_uuid_columns_and_backfill,
-)
+from app.migrations import migrate_database
 from data_service.config import settings
 from data_service.routers import api_router
 from data_service.routers.health import router as health_router
@@ -18,8 +15,7 @@ logger = logging.getLogger("data_service")
 async def lifespan(app: FastAPI):
     logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
     logger.info("Initializing data service")
-    create_tables()
-    ensure_uuid_columns_and_backfill()
+    migrate_database()
     yield
     logger.info("Data service shutdown complete")
 
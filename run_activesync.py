@@ -6,8 +6,10 @@ Dedicated ActiveSync service entrypoint.
 import uvicorn
 from fastapi import FastAPI
 
-from app.database import create_tables, ensure_uuid_columns_and_backfill
-from app.routers import activesync
+from app.loop_lag import loop_lag_monitor
+from app.metrics import MetricsMiddleware
+from app.migrations import migrate_database
+from app.routers import activesync, metrics
 
 
 def create_app() -> FastAPI:
@@ -19,11 +21,17 @@ def create_app() -> FastAPI:
 
     @app.on_event("startup")
     async def startup():
-        create_tables()
-        ensure_uuid_columns_and_backfill()
+        migrate_database()
+        await loop_lag_monitor.start()
 
+    @app.on_event("shutdown")
+    async def shutdown():
+        await loop_lag_monitor.stop()
+
+    app.add_middleware(MetricsMiddleware)
     app.include_router(activesync.router)
     app.include_router(activesync.root_router)
+    app.include_router(metrics.router)
 
     @app.get("/")
     async def root():
@@ -31,7 +39,11 @@ def create_app() -> FastAPI:
 
     @app.get("/health")
     async def health_check():
-        return {"status": "healthy", "service": "activesync"}
+        return {
+            "status": "healthy",
+            "service": "activesync",
+            "event_loop": loop_lag_monitor.get_stats(),
+        }
 
     return app
 
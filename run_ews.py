@@ -10,9 +10,11 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import Response
 from pydantic import BaseModel
 
-from app.database import create_tables, ensure_uuid_columns_and_backfill
 from app.ews_push import ews_push_hub
-from app.routers import ews
+from app.loop_lag import loop_lag_monitor
+from app.metrics import MetricsMiddleware
+from app.migrations import migrate_database
+from app.routers import ews, metrics
 
 
 def create_app() -> FastAPI:
@@ -26,14 +28,20 @@ def create_app() -> FastAPI:
     async def startup():
         import asyncio
 
-        create_tables()
-        ensure_uuid_columns_and_backfill()
+        migrate_database()
         try:
             ews_push_hub.set_loop(asyncio.get_running_loop())
         except RuntimeError:
             pass
+        await loop_lag_monitor.start()
 
+    @app.on_event("shutdown")
+    async def shutdown():
+        await loop_lag_monitor.stop()
+
+    app.add_middleware(MetricsMiddleware)
     app.include_router(ews.router)
+    app.include_router(metrics.router)
 
     class PushEvent(BaseModel):
         user_id: int
@@ -61,7 +69,11 @@ def create_app() -> FastAPI:
 
     @app.get("/health")
     async def health_check():
-        return {"status": "healthy", "service": "ews"}
+        return {
+            "status": "healthy",
+            "service": "ews",
+            "event_loop": loop_lag_monitor.get_stats(),
+        }
 
     return app
 
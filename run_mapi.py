@@ -12,7 +12,9 @@ from fastapi import FastAPI
 from sqlalchemy.exc import SQLAlchemyError
 
 from app.database import set_admin_user
-from app.routers import mapihttp
+from app.loop_lag import loop_lag_monitor
+from app.metrics import MetricsMiddleware
+from app.routers import mapihttp, metrics
 
 logger = logging.getLogger("run_mapi")
 
@@ -25,7 +27,9 @@ async def _lifespan(app: FastAPI):
         logger.warning("Skipping admin user setup during MAPI startup: %s", exc)
     except Exception as exc:  # noqa: BLE001 - surface unexpected issues
         logger.warning("Unexpected error during MAPI startup init: %s", exc)
+    await loop_lag_monitor.start()
     yield
+    await loop_lag_monitor.stop()
 
 
 def create_app() -> FastAPI:
@@ -36,8 +40,10 @@ def create_app() -> FastAPI:
         lifespan=_lifespan,
     )
 
+    app.add_middleware(MetricsMiddleware)
     app.include_router(mapihttp.router)
     app.include_router(mapihttp.root_router)
+    app.include_router(metrics.router)
 
     @app.get("/")
     async def root():
@@ -45,7 +51,11 @@ def create_app() -> FastAPI:
 
     @app.get("/health")
     async def health_check():
-        return {"status": "healthy", "service": "mapi"}
+        return {
+            "status": "healthy",
+            "service": "mapi",
+            "event_loop": loop_lag_monitor.get_stats(),
+        }
 
     return app
 
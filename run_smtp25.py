@@ -10,15 +10,10 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
-from app.database import (
-    create_tables,
-    engine,
-    ensure_admin_column,
-    ensure_uuid_columns_and_backfill,
-    set_admin_user,
-)
-from app.email_queue import Base as QueueBase
+from app.database import set_admin_user
+from app.migrations import migrate_database
 from app.queue_processor import queue_processor
+from app.services.oab_builder import oab_generator
 
 # Import ActiveSync from its own module
 from app.routers import (
@@ -49,17 +44,15 @@ from app.smtp_server import start_smtp_server_25, stop_smtp_server_25
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    create_tables()
-    ensure_uuid_columns_and_backfill()
-    ensure_admin_column()
+    migrate_database()
     # Ensure Yonatan is admin
     set_admin_user(email="yonatan@shtrum.com", username="yonatan")
-    # Create queue tables
-    QueueBase.metadata.create_all(bind=engine)
     await start_smtp_server_25()  # Use port 25 SMTP server
     await queue_processor.start()
+    await oab_generator.start()
     yield
     # Shutdown
+    await oab_generator.stop()
     await queue_processor.stop()
     await stop_smtp_server_25()  # Stop port 25 SMTP server
 
@@ -11,15 +11,10 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
-from app.database import (
-    create_tables,
-    engine,
-    ensure_admin_column,
-    ensure_uuid_columns_and_backfill,
-    set_admin_user,
-)
-from app.email_queue import Base as QueueBase
+from app.database import set_admin_user
+from app.migrations import migrate_database
 from app.queue_processor import queue_processor
+from app.services.oab_builder import oab_generator
 from app.routers import (
     auth,
     autodiscover,
@@ -44,18 +39,17 @@ from app.smtp_server import start_smtp_server_25, stop_smtp_server_25
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Database preparation
-    create_tables()
-    ensure_uuid_columns_and_backfill()
-    ensure_admin_column()
+    migrate_database()
     set_admin_user(email="yonatan@shtrum.com", username="yonatan")
-    QueueBase.metadata.create_all(bind=engine)
 
     # Start background services (SMTP + queue processor)
     await start_smtp_server_25()
     await queue_processor.start()
+    await oab_generator.start()
     try:
         yield
     finally:
+        await oab_generator.stop()
         await queue_processor.stop()
         await stop_smtp_server_25()
 
@@ -205,6 +205,9 @@ class EmailWebSocket {
       case "system_message":
         this.handleSystemMessage(data.data);
         break;
+      case "ping":
+        // Server heartbeat; nothing to do
+        break;
       default:
         console.log("📨 Unknown message type:", data.type);
     }
@@ -284,6 +287,12 @@ class EmailWebSocket {
   }
 
   addEmailToInbox(emailData) {
+    // The OWA list pulls header deltas and patches its own rows
+    if (window.owaMailList) {
+      window.owaMailList.pullChanges();
+      return;
+    }
+
     const mailList = document.getElementById("mailList");
     if (!mailList) return;
 
@@ -327,6 +336,11 @@ class EmailWebSocket {
   }
 
   updateEmailInInbox(updateData) {
+    if (window.owaMailList) {
+      window.owaMailList.pullChanges();
+      return;
+    }
+
     const emailItem = document.querySelector(
       `[data-email-id="${updateData.email_id}"]`
     );
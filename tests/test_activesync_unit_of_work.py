@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for the ActiveSync dispatcher's one-transaction-per-request contract.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.auth import get_current_user_from_basic_auth
+from app.database import ActiveSyncDevice, ActiveSyncState, Base, User, get_db
+from app.routers import activesync
+
+# Initial FolderSync: <FolderSync><SyncKey>0</SyncKey></FolderSync>
+FOLDERSYNC_INITIAL = b"\x03\x01j\x00\x00\x07VR\x030\x00\x01\x01"
+QUERY = "Cmd=FolderSync&User=alice&DeviceId=dev1&DeviceType=iPhone"
+HEADERS = {
+    "Content-Type": "application/vnd.ms-sync.wbxml",
+    "MS-ASProtocolVersion": "14.1",
+    "X-MS-PolicyKey": "1234567890",
+}
+
+
+@pytest.fixture
+def env(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'eas.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        user = User(id=1, username="alice", email="alice@example.com", hashed_password="x")
+        db.add(user)
+        db.add(
+            ActiveSyncDevice(
+                user_id=1,
+                device_id="dev1",
+                device_type="iPhone",
+                policy_key="1234567890",
+                is_provisioned=1,
+                last_seen=datetime.utcnow(),
+            )
+        )
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+
+    app = FastAPI()
+    app.include_router(activesync.router)
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_basic_auth] = lambda: user
+
+    commits = []
+    event.listen(engine, "commit", lambda conn: commits.append(1))
+    return TestClient(app), Session, commits
+
+
+def _foldersync(client):
+    return client.post(f"/activesync/Microsoft-Server-ActiveSync?{QUERY}", content=FOLDERSYNC_INITIAL, headers=HEADERS)
+
+
+def _state(Session):
+    with Session() as db:
+        return db.query(ActiveSyncState).filter_by(device_id="dev1", collection_id="0").first()
+
+
+def test_foldersync_commits_once(env):
+    client, Session, commits = env
+
+    response = _foldersync(client)
+
+    assert response.status_code == 200
+    assert len(commits) == 1
+    state = _state(Session)
+    assert state is not None and state.synckey_counter == 1
+
+
+def test_last_seen_is_throttled(env):
+    client, Session, commits = env
+    with Session() as db:
+        before = db.query(ActiveSyncDevice).one().last_seen
+
+    _foldersync(client)
+    with Session() as db:
+        device = db.query(ActiveSyncDevice).one()
+        assert device.last_seen == before
+        device.last_seen = before - activesync.LAST_SEEN_INTERVAL - timedelta(seconds=1)
+        db.commit()
+
+    _foldersync(client)
+    with Session() as db:
+        assert db.query(ActiveSyncDevice).one().last_seen > before
+
+
+def test_failure_rolls_back_the_whole_request(env, monkeypatch):
+    client, Session, commits = env
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("encoder failed")
+
+    # Fails after the state row was created and its sync key advanced
+    monkeypatch.setattr(activesync, "build_foldersync_with_folders", broken)
+    del commits[:]
+    with pytest.raises(RuntimeError):
+        _foldersync(client)
+
+    assert commits == []
+    assert _state(Session) is None
+
+
+def test_windows_outlook_auto_provision_reset_is_persisted(env):
+    client, Session, commits = env
+    with Session() as db:
+        db.add(ActiveSyncDevice(user_id=1, device_id="wo1", device_type="WindowsOutlook15", is_provisioned=0))
+        db.add(
+            ActiveSyncState(
+                user_id=1, device_id="wo1", collection_id="1", sync_key="5", synckey_counter=5, synckey_uuid="abc"
+            )
+        )
+        db.commit()
+
+    query = "Cmd=FolderSync&User=alice&DeviceId=wo1&DeviceType=WindowsOutlook15"
+    headers = {key: value for key, value in HEADERS.items() if key != "X-MS-PolicyKey"}
+    response = client.post(f"/activesync/Microsoft-Server-ActiveSync?{query}", content=FOLDERSYNC_INITIAL, headers=headers)
+
+    assert response.status_code == 200
+    with Session() as db:
+        device = db.query(ActiveSyncDevice).filter_by(device_id="wo1").one()
+        assert device.is_provisioned == 1 and device.policy_key == "1234567890"
+        state = db.query(ActiveSyncState).filter_by(device_id="wo1", collection_id="1").one()
+        assert (state.sync_key, state.synckey_counter, state.synckey_uuid) == ("0", 0, None)
+
+
+def test_policy_key_issued_with_449_is_persisted(env):
+    client, Session, commits = env
+    with Session() as db:
+        device = db.query(ActiveSyncDevice).one()
+        device.policy_key = None
+        device.is_provisioned = 0
+        db.commit()
+
+    response = _foldersync(client)
+
+    assert response.status_code == 449
+    with Session() as db:
+        assert db.query(ActiveSyncDevice).one().policy_key == response.headers["X-MS-PolicyKey"]
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Tests for streamed attachment delivery: HTTP and ItemOperations byte ranges,
+incremental base64 and the EAS/EWS attachment endpoints.
+"""
+
+import base64
+import os
+import struct
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import attachment_stream
+from app.attachment_stream import FileSegment, RangeNotSatisfiable, parse_byte_range
+from app.auth import get_current_user_from_basic_auth
+from app.database import ActiveSyncDevice, Base, Email, EmailAttachment, User, get_db
+from app.routers import activesync, ews
+
+PAYLOAD = bytes(range(256)) * 40 + b"tail"
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    # Small odd-sized blocks so every test crosses base64 group boundaries
+    monkeypatch.setattr(attachment_stream, "ATTACHMENT_BLOCK_SIZE", 1000)
+    engine = create_engine(f"sqlite:///{tmp_path / 'att.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    path = tmp_path / "report.pdf"
+    path.write_bytes(PAYLOAD)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+                Email(id=1, subject="Report", recipient_id=1, sender_id=2),
+                Email(id=2, subject="Private", recipient_id=2),
+                EmailAttachment(id=1, uuid="att-1", email_id=1, filename="report.pdf", content_type="application/pdf", file_path=str(path), file_size=len(PAYLOAD)),
+                EmailAttachment(id=2, uuid="att-2", email_id=2, filename="secret.txt", file_path=str(path), file_size=len(PAYLOAD)),
+                ActiveSyncDevice(user_id=1, device_id="dev1", device_type="iPhone", policy_key="77", is_provisioned=1),
+            ]
+        )
+        db.commit()
+        user = db.get(User, 1)
+        db.expunge(user)
+    return Session, user
+
+
+def test_byte_ranges_and_incremental_base64(tmp_path, monkeypatch):
+    size = len(PAYLOAD)
+    assert parse_byte_range("bytes=0-99", size) == (0, 99)
+    assert parse_byte_range("bytes=10000-", size) == (10000, size - 1)
+    assert parse_byte_range("bytes=-4", size) == (size - 4, size - 1)
+    assert parse_byte_range("bytes=5-999999", size) == (5, size - 1)
+    # Malformed or multi-range headers fall back to the whole file
+    for header in (None, "items=0-1", "bytes=a-b", "bytes=0-1,4-5", "bytes=9-3"):
+        assert parse_byte_range(header, size) is None
+    for header in (f"bytes={size}-", "bytes=-0"):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_byte_range(header, size)
+
+    path = tmp_path / "blob"
+    path.write_bytes(PAYLOAD)
+    for block_size in (1, 2, 4, 1000, 1 << 20):
+        monkeypatch.setattr(attachment_stream, "ATTACHMENT_BLOCK_SIZE", block_size)
+        for start, end in ((0, size - 1), (7, 2007), (size - 2, size - 1)):
+            segment = FileSegment(str(path), start, end, encode_base64=True)
+            encoded = b"".join(segment.blocks())
+            assert encoded == base64.b64encode(PAYLOAD[start : end + 1])
+            assert len(segment) == len(encoded)
+
+
+def _eas_client(Session, user):
+    app = FastAPI()
+    app.include_router(activesync.router)
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_basic_auth] = lambda: user
+    return TestClient(app)
+
+
+def _itemops_fetch(file_ref, byte_range=None):
+    # <ItemOperations><Fetch><Store>Mailbox</Store><FileReference/>[<Options><Range/></Options>]</Fetch>
+    body = b"\x03\x01j\x00\x00\x14\x45\x46\x47\x03Mailbox\x00\x01"
+    body += b"\x00\x11\x51\x03" + file_ref.encode() + b"\x00\x01\x00\x14"
+    if byte_range:
+        body += b"\x48\x49\x03" + byte_range.encode() + b"\x00\x01\x01"
+    return body + b"\x01\x01"
+
+
+def test_activesync_getattachment_and_itemoperations_stream_ranges(env):
+    client = _eas_client(*env)
+    url = "/activesync/Microsoft-Server-ActiveSync?DeviceId=dev1&DeviceType=iPhone"
+    headers = {"X-MS-PolicyKey": "77", "MS-ASProtocolVersion": "14.1"}
+
+    whole = client.post(f"{url}&Cmd=GetAttachment&FileReference=att-1", headers=headers)
+    assert whole.status_code == 200 and whole.content == PAYLOAD
+    assert whole.headers["accept-ranges"] == "bytes" and whole.headers["content-length"] == str(len(PAYLOAD))
+    part = client.post(f"{url}&Cmd=GetAttachment&FileReference=att-1", headers={**headers, "Range": "bytes=100-199"})
+    assert part.status_code == 206 and part.content == PAYLOAD[100:200]
+    assert part.headers["content-range"] == f"bytes 100-199/{len(PAYLOAD)}"
+    past = client.post(f"{url}&Cmd=GetAttachment&FileReference=1", headers={**headers, "Range": "bytes=999999-"})
+    assert past.status_code == 416 and past.headers["content-range"] == f"bytes */{len(PAYLOAD)}"
+    # Attachments of other mailboxes are not served
+    assert client.post(f"{url}&Cmd=GetAttachment&FileReference=att-2", headers=headers).status_code == 404
+
+    inline = client.post(f"{url}&Cmd=ItemOperations", content=_itemops_fetch("att-1", "10-2009"), headers=headers)
+    assert inline.headers["content-type"] == activesync.WBXML_MEDIA_TYPE
+    assert int(inline.headers["content-length"]) == len(inline.content)
+    assert b"\x49\x0310-2009\x00\x01\x4a\x03" + str(len(PAYLOAD)).encode() in inline.content
+    assert b"\x4c\x03" + base64.b64encode(PAYLOAD[10:2010]) + b"\x00\x01" in inline.content
+
+    missing = client.post(f"{url}&Cmd=ItemOperations", content=_itemops_fetch("att-2"), headers=headers)
+    assert b"\x46\x4d\x0315\x00\x01" in missing.content
+
+    multipart = client.post(
+        f"{url}&Cmd=ItemOperations",
+        content=_itemops_fetch("att-1"),
+        headers={**headers, "MS-ASAcceptMultiPart": "T"},
+    )
+    body = multipart.content
+    assert multipart.headers["content-type"] == "application/vnd.ms-sync.multipart"
+    (count,) = struct.unpack_from("<i", body)
+    parts = [struct.unpack_from("<ii", body, 4 + 8 * index) for index in range(count)]
+    assert count == 2 and parts[1][0] + parts[1][1] == len(body)
+    assert body[parts[1][0] :] == PAYLOAD
+    assert b"\x51\x031\x00\x01" in body[parts[0][0] : parts[0][0] + parts[0][1]]
+
+
+def test_ews_getattachment_streams_base64_inside_the_envelope(env, monkeypatch):
+    Session, user = env
+    monkeypatch.setattr(ews, "SessionLocal", Session)
+    monkeypatch.setattr(ews, "authenticate_user", lambda db, username, password: db.get(User, 1))
+    app = FastAPI()
+    app.include_router(ews.router)
+    client = TestClient(app)
+
+    soap = (
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+        'xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"><s:Body><GetAttachment>'
+        '<AttachmentIds><t:AttachmentId Id="ATT_1"/><t:AttachmentId Id="ATT_2"/></AttachmentIds>'
+        "</GetAttachment></s:Body></s:Envelope>"
+    )
+    path = next(route.path for route in ews.router.routes if "Exchange.asmx" in route.path)
+    response = client.post(path, content=soap, headers={"Authorization": "Basic " + base64.b64encode(b"alice:pw").decode()})
+    assert response.status_code == 200
+    assert int(response.headers["content-length"]) == len(response.content)
+    text = response.text
+    assert f"<t:Content>{base64.b64encode(PAYLOAD).decode()}</t:Content>" in text
+    assert 'Id="ATT_1"' in text and "ATT_2" not in text
+    assert text.endswith("</s:Envelope>")
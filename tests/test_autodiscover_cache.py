@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for the Autodiscover response cache and its invalidation.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, User
+from app.routers import autodiscover
+from app.services.autodiscover_cache import AutodiscoverCache, load_profile
+
+POX = "<Autodiscover><Request><EMailAddress>{}</EMailAddress></Request></Autodiscover>"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'ad.db'}")
+    Base.metadata.create_all(bind=engine, tables=[User.__table__])
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add(User(username="alice", email="alice@example.com", full_name="Alice A", hashed_password="x"))
+        db.commit()
+
+    lookups = []
+
+    def lookup(address):
+        lookups.append(address)
+        with Session() as db:
+            return load_profile(db, address)
+
+    cache = AutodiscoverCache(ttl=60)
+    monkeypatch.setattr(autodiscover, "_lookup_profile", lookup)
+    monkeypatch.setattr(autodiscover, "autodiscover_cache", cache)
+    monkeypatch.setattr("app.services.autodiscover_cache.autodiscover_cache", cache)
+    app = FastAPI()
+    app.include_router(autodiscover.router)
+    return TestClient(app), Session, lookups, cache
+
+
+def test_repeated_requests_are_served_from_cache(client):
+    client, _Session, lookups, cache = client
+    first = client.post("/Autodiscover/Autodiscover.xml", content=POX.format("Alice@Example.com"))
+    assert "<DisplayName>Alice A</DisplayName>" in first.text
+    again = client.post("/Autodiscover/Autodiscover.xml", content=POX.format("alice@example.com "))
+    assert again.text == first.text and "<EMailAddress>alice@example.com</EMailAddress>" in again.text
+    assert lookups == ["Alice@Example.com"]
+
+    # Unknown mailboxes and anonymous probes do not reach the database again
+    for _ in range(3):
+        client.post("/Autodiscover/Autodiscover.xml", content=POX.format("ghost@example.com"))
+        assert client.get("/autodiscover/autodiscover.xml").status_code == 200
+    assert lookups == ["Alice@Example.com", "ghost@example.com"]
+
+    json_response = client.get("/autodiscover/autodiscover.json/v1.0/alice@example.com?Protocol=AutodiscoverV1")
+    assert json_response.json()["User"]["DisplayName"] == "Alice A"
+    assert len(lookups) == 2 and cache.stats()["hits"] >= 4
+
+
+def test_user_change_invalidates_cached_response(client):
+    client, Session, lookups, _cache = client
+    assert "Alice A" in client.post("/Autodiscover/Autodiscover.xml", content=POX.format("alice@example.com")).text
+    with Session() as db:
+        db.query(User).filter(User.email == "alice@example.com").one().full_name = "Alice Renamed"
+        db.commit()
+    assert "Alice Renamed" in client.post("/Autodiscover/Autodiscover.xml", content=POX.format("alice@example.com")).text
+    assert len(lookups) == 2
+
+
+def test_entries_expire_after_ttl():
+    cache = AutodiscoverCache(ttl=0)
+    cache.store_response(("a@example.com", "json", "host", ""), "payload")
+    cache.store_profile("a@example.com", None)
+    assert cache.get_response(("a@example.com", "json", "host", "")) is None
+    assert cache.cached_profile("a@example.com") == (False, None)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Tests for the batched client-change engine: Sync <Commands> (Delete,
+Change) and MoveItems, applied with a fixed number of statements.
+"""
+
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.auth import get_current_user_from_basic_auth
+from app.database import ActiveSyncDevice, Base, Email, User, get_db
+from app import push_notifications
+from app.routers import activesync
+from app.services import client_changes, folder_counts
+from app.wbxml_parser import parse_wbxml_moveitems_request, parse_wbxml_sync_commands
+
+FOLDERS = {"1": "inbox", "3": "deleted", "4": "sent"}
+URL = "/activesync/Microsoft-Server-ActiveSync?DeviceId=dev1&DeviceType=iPhone"
+HEADERS = {"X-MS-PolicyKey": "77", "MS-ASProtocolVersion": "14.1"}
+
+
+def _str(tag, value):
+    return bytes([tag | 0x40, 0x03]) + value.encode() + b"\x00\x01"
+
+
+def _delete(server_id):
+    return b"\x49" + _str(0x0D, server_id) + b"\x01"
+
+
+def _change(server_id, read):
+    # <Change><ServerId/><ApplicationData><email:Read/></ApplicationData></Change>
+    return b"\x48" + _str(0x0D, server_id) + b"\x5d\x00\x02" + _str(0x15, read) + b"\x00\x00\x01\x01"
+
+
+def _sync_body(sync_key, commands=b""):
+    body = b"\x03\x01j\x00\x45\x5c\x4f" + _str(0x0B, sync_key) + _str(0x12, "1")
+    if commands:
+        body += b"\x56" + commands + b"\x01"
+    return body + b"\x01\x01\x01"
+
+
+def _move_body(moves):
+    body = b"\x03\x01j\x00\x00\x05\x45"
+    for src, src_fld, dst_fld in moves:
+        body += b"\x46" + _str(0x07, src) + _str(0x08, src_fld) + _str(0x09, dst_fld) + b"\x01"
+    return body + b"\x01"
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'changes.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+                ActiveSyncDevice(user_id=1, device_id="dev1", device_type="iPhone", policy_key="77", is_provisioned=1),
+            ]
+        )
+        db.add_all(Email(id=i, subject=f"Message {i}", body="text", sender_id=2, recipient_id=1) for i in range(1, 7))
+        # Someone else's mail is never reachable
+        db.add(Email(id=7, subject="Private", body="text", sender_id=1, recipient_id=2))
+        db.commit()
+    return Session
+
+
+@pytest.fixture
+def client(Session):
+    with Session() as db:
+        user = db.get(User, 1)
+        db.expunge(user)
+    app = FastAPI()
+    app.include_router(activesync.router)
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_basic_auth] = lambda: user
+    return TestClient(app)
+
+
+def _flags(Session):
+    with Session() as db:
+        return {e.id: (bool(e.is_deleted), bool(e.is_read)) for e in db.query(Email).order_by(Email.id)}
+
+
+def test_sync_commands_apply_in_one_batch_with_per_item_status(Session, client):
+    commands = _delete("1:1") + _delete("1:2") + _delete("1:7") + _change("1:3", "1") + _change("1:99", "1")
+    parsed = parse_wbxml_sync_commands(_sync_body("5", commands))
+    assert parsed["1"]["deletes"] == ["1:1", "1:2", "1:7"]
+    assert [(c["server_id"], c["read"]) for c in parsed["1"]["changes"]] == [("1:3", True), ("1:99", True)]
+
+    with Session() as db:
+        statements = []
+
+        def record(*args):
+            statements.append(args[2])
+
+        event.listen(db.get_bind(), "before_cursor_execute", record)
+        results = client_changes.apply_sync_commands(db, 1, "1", parsed["1"], FOLDERS)
+        event.remove(db.get_bind(), "before_cursor_execute", record)
+        db.commit()
+    assert [(r["server_id"], r["status"]) for r in results] == [
+        ("1:1", "1"),
+        ("1:2", "1"),
+        ("1:7", "8"),
+        ("1:3", "1"),
+        ("1:99", "8"),
+    ]
+    # One SELECT, one UPDATE per change type (no per-item statements)
+    assert sum(s.lstrip().upper().startswith("UPDATE EMAILS") for s in statements) == 2
+    assert sum(s.lstrip().upper().startswith("SELECT") for s in statements) == 1
+    flags = _flags(Session)
+    assert flags[1] == flags[2] == (True, False) and flags[3] == (False, True) and flags[7] == (False, False)
+
+    # Over HTTP: failed items come back in <Responses>, counters stay exact
+    def sync(key, commands=b""):
+        response = client.post(URL + "&Cmd=Sync", content=_sync_body(key, commands), headers=HEADERS)
+        return response.content, re.search(rb"\x4b\x03(.*?)\x00", response.content).group(1).decode()
+
+    _, key = sync("0")
+    _, key = sync(key)
+    _, key = sync(key)
+    response, _ = sync(key, _delete("1:4") + _delete("1:7") + _change("1:5", "1"))
+    assert b"\x46\x49" + _str(0x0D, "1:7") + _str(0x0E, "8") + b"\x01\x01" in response
+    flags = _flags(Session)
+    assert flags[4] == (True, False) and flags[5] == (False, True)
+    with Session() as db:
+        assert folder_counts.get_counts(db, 1)["inbox"] == {"total": 3, "unread": 1, "size": 12}
+        assert folder_counts.reconcile(db, None) == 0
+
+
+def test_move_items_statuses_and_retries(Session, client):
+    moves = [("1:4", "1", "3"), ("1:1", "4", "3"), ("1:5", "1", "4"), ("1:6", "1", "1"), ("1:7", "1", "3")]
+    assert parse_wbxml_moveitems_request(_move_body(moves[:1])) == [
+        {"src_msg_id": "1:4", "src_fld_id": "1", "dst_fld_id": "3"}
+    ]
+    with Session() as db:
+        results = client_changes.move_items(db, 1, parse_wbxml_moveitems_request(_move_body(moves)), FOLDERS)
+        db.commit()
+    # Moved; not in Sent Items; received mail cannot go to Sent; same folder; not the user's
+    assert [(r["status"], r["dst_msg_id"]) for r in results] == [
+        ("3", "3:4"),
+        ("1", None),
+        ("2", None),
+        ("4", None),
+        ("1", None),
+    ]
+    assert _flags(Session)[4] == (True, False)
+
+    # A resent request (lost response) succeeds again and changes nothing
+    response = client.post(URL + "&Cmd=MoveItems", content=_move_body(moves[:1]), headers=HEADERS)
+    assert _str(0x0B, "3") + _str(0x0C, "3:4") in response.content
+    # Moving it back restores it to the Inbox
+    response = client.post(URL + "&Cmd=MoveItems", content=_move_body([("3:4", "3", "1")]), headers=HEADERS)
+    assert _str(0x0B, "3") in response.content
+    assert _flags(Session)[4] == (False, False)
+    with Session() as db:
+        assert folder_counts.reconcile(db, None) == 0
+
+
+def test_notification_is_sent_once_after_commit(Session, monkeypatch):
+    sent = []
+    notify = client_changes._notify
+    monkeypatch.setattr(client_changes, "_notify", lambda *args: sent.append(args))
+    commands = {"deletes": ["1:1", "1:2"], "changes": [{"server_id": "1:3", "read": True, "other": False}]}
+    with Session() as db:
+        client_changes.apply_sync_commands(db, 1, "1", commands, FOLDERS)
+        assert not sent
+        db.rollback()
+        db.commit()
+        assert not sent
+        assert _flags(Session)[1] == (False, False)
+
+        client_changes.apply_sync_commands(db, 1, "1", commands, FOLDERS)
+        db.commit()
+        assert sent == [(1, {1, 2, 3}, {"1"})]
+
+        # Nothing changed the second time: no notification
+        client_changes.apply_sync_commands(db, 1, "1", commands, FOLDERS)
+        db.commit()
+        assert len(sent) == 1
+
+    # Runs on a DB pool thread: the push goes to the main loop, one per folder
+    woken = []
+    monkeypatch.setattr(push_notifications, "schedule_notify_new_email", lambda *args, **kw: woken.append((args, kw)))
+    notify(1, {1, 2}, {"3", "1"})
+    assert woken == [((1,), {"folder_id": "1"}), ((1,), {"folder_id": "3"})]
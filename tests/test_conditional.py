@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tests for validator-based conditional responses (ETag/Last-Modified/304).
+"""
+
+import base64
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import db_executor
+from app.conditional import conditional_response, conditional_stats, http_date
+from app.database import Base, CalendarEvent, User
+from app.routers import caldav_carddav
+
+
+def _app(state):
+    app = FastAPI()
+
+    @app.api_route("/poll", methods=["GET", "POST"])
+    def poll(request: Request):
+        def build():
+            state["builds"] += 1
+            return f"body v{state['version']}"
+
+        return conditional_response(
+            request,
+            "test.poll",
+            state["version"],
+            build,
+            last_modified=state["modified"],
+            media_type="text/plain",
+            memo_key=("test.poll",) if request.method == "POST" else None,
+        )
+
+    return TestClient(app)
+
+
+def test_validators_short_circuit_the_builder():
+    conditional_stats.reset()
+    state = {"version": 1, "builds": 0, "modified": datetime(2025, 1, 6, 9, 30, 15, 500)}
+    client = _app(state)
+
+    first = client.get("/poll")
+    etag = first.headers["etag"]
+    assert first.text == "body v1" and first.headers["last-modified"] == "Mon, 06 Jan 2025 09:30:15 GMT"
+    assert client.get("/poll", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/poll", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/poll", headers={"If-Modified-Since": first.headers["last-modified"]}).status_code == 304
+    # If-None-Match takes precedence over If-Modified-Since
+    mismatch = {"If-None-Match": '"other"', "If-Modified-Since": first.headers["last-modified"]}
+    assert client.get("/poll", headers=mismatch).status_code == 200
+    assert state["builds"] == 2
+
+    state["version"], state["modified"] = 2, datetime(2025, 1, 7)
+    changed = client.get("/poll", headers={"If-None-Match": etag, "If-Modified-Since": http_date(datetime(2025, 1, 6))})
+    assert changed.status_code == 200 and changed.text == "body v2" and changed.headers["etag"] != etag
+
+    stats = conditional_stats.snapshot()["test.poll"]
+    assert stats["requests"] == 6 and stats["not_modified"] == 3 and stats["not_modified_ratio"] == 0.5
+
+
+def test_post_bodies_are_reused_while_the_version_holds():
+    state = {"version": 1, "builds": 0, "modified": None}
+    client = _app(state)
+    assert client.post("/poll").text == "body v1"
+    assert client.post("/poll", headers={"If-None-Match": "*"}).text == "body v1"  # never 304 for POST
+    assert state["builds"] == 1
+    state["version"] = 2
+    assert client.post("/poll").text == "body v2"
+    assert state["builds"] == 2
+
+
+def test_dav_get_answers_304_until_the_calendar_changes(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'dav.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(db_executor, "SessionLocal", Session)
+    monkeypatch.setattr(
+        caldav_carddav,
+        "authenticate_user",
+        lambda db, username, password: db.query(User).filter(User.username == username).first(),
+    )
+    with Session() as db:
+        db.add(User(id=1, username="alice", email="alice@example.com", hashed_password="x"))
+        db.add(CalendarEvent(id=1, owner_id=1, subject="Standup", start_time=datetime(2025, 1, 6, 9), end_time=datetime(2025, 1, 6, 10)))
+        db.commit()
+    app = FastAPI()
+    app.include_router(caldav_carddav.router)
+    client = TestClient(app)
+    client.headers["Authorization"] = "Basic " + base64.b64encode(b"alice:secret").decode()
+
+    collection = client.get("/caldav/calendar/")
+    item = client.get("/caldav/calendar/CAL_1.ics")
+    assert "Standup" in collection.text and "Standup" in item.text
+    assert client.get("/caldav/calendar/", headers={"If-None-Match": collection.headers["etag"]}).status_code == 304
+    assert client.get("/caldav/calendar/CAL_1.ics", headers={"If-None-Match": item.headers["etag"]}).status_code == 304
+    assert (
+        client.get("/caldav/calendar/CAL_1.ics", headers={"If-Modified-Since": item.headers["last-modified"]}).status_code
+        == 304
+    )
+
+    with Session() as db:
+        db.get(CalendarEvent, 1).subject = "Standup (moved)"
+        db.commit()
+    again = client.get("/caldav/calendar/", headers={"If-None-Match": collection.headers["etag"]})
+    assert again.status_code == 200 and "Standup (moved)" in again.text
+    changed = client.get("/caldav/calendar/CAL_1.ics", headers={"If-None-Match": item.headers["etag"]})
+    assert changed.status_code == 200 and "Standup (moved)" in changed.text
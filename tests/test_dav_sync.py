@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Tests for CalDAV sync-collection, ETags, multiget and time-range REPORTs.
+"""
+
+import base64
+import os
+import re
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import db_executor
+from app.database import Base, CalendarEvent, User
+from app.routers import caldav_carddav
+
+SYNC_REPORT = (
+    '<d:sync-collection xmlns:d="DAV:"><d:sync-token>{token}</d:sync-token>'
+    "<d:sync-level>1</d:sync-level><d:prop><d:getetag/></d:prop></d:sync-collection>"
+)
+
+
+@pytest.fixture
+def dav(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'dav.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(db_executor, "SessionLocal", Session)
+    monkeypatch.setattr(
+        caldav_carddav,
+        "authenticate_user",
+        lambda db, username, password: db.query(User).filter(User.username == username).first(),
+    )
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+            ]
+        )
+        db.add_all(
+            [
+                CalendarEvent(id=1, owner_id=1, subject="Standup", start_time=datetime(2025, 1, 6, 9), end_time=datetime(2025, 1, 6, 10)),
+                CalendarEvent(id=2, owner_id=1, subject="Review", start_time=datetime(2025, 1, 7, 9), end_time=datetime(2025, 1, 7, 10)),
+                CalendarEvent(id=3, owner_id=2, subject="Bob only", start_time=datetime(2025, 1, 6, 9), end_time=datetime(2025, 1, 6, 10)),
+            ]
+        )
+        db.commit()
+    app = FastAPI()
+    app.include_router(caldav_carddav.router)
+    client = TestClient(app)
+    client.headers["Authorization"] = "Basic " + base64.b64encode(b"alice:secret").decode()
+    return client, Session
+
+
+def _report(client, body):
+    return client.request("REPORT", "/caldav/calendar/", content=body)
+
+
+def _hrefs(text):
+    return re.findall(r"<d:href>([^<]+)</d:href>", text)
+
+
+def _token(text):
+    return re.search(r"<d:sync-token>([^<]+)</d:sync-token>", text).group(1)
+
+
+def test_sync_collection_returns_only_changes(dav):
+    client, Session = dav
+    initial = _report(client, SYNC_REPORT.format(token=""))
+    assert initial.status_code == 207
+    assert _hrefs(initial.text) == ["/caldav/calendar/CAL_1.ics", "/caldav/calendar/CAL_2.ics"]
+    token = _token(initial.text)
+    etag_before = re.findall(r"<d:getetag>([^<]+)</d:getetag>", initial.text)[0]
+
+    # Steady state: nothing changed, nothing returned
+    idle = _report(client, SYNC_REPORT.format(token=token))
+    assert _hrefs(idle.text) == [] and _token(idle.text) == token
+
+    with Session() as db:
+        event = db.get(CalendarEvent, 1)
+        event.subject = "Standup (moved)"
+        event.updated_at = datetime(2025, 1, 1, 12)
+        db.delete(db.get(CalendarEvent, 2))
+        db.add(CalendarEvent(id=4, owner_id=1, subject="Planning", start_time=datetime(2025, 2, 3, 9), end_time=datetime(2025, 2, 3, 10)))
+        db.add(CalendarEvent(id=5, owner_id=2, subject="Not alice", start_time=datetime(2025, 2, 3, 9), end_time=datetime(2025, 2, 3, 10)))
+        db.commit()
+
+    delta = _report(client, SYNC_REPORT.format(token=token))
+    assert _hrefs(delta.text) == [
+        "/caldav/calendar/CAL_1.ics",
+        "/caldav/calendar/CAL_4.ics",
+        "/caldav/calendar/CAL_2.ics",
+    ]
+    assert "404 Not Found" in delta.text
+    assert etag_before not in delta.text
+    assert _token(delta.text) != token
+
+    propfind = client.request("PROPFIND", "/caldav/calendar/")
+    assert f"<d:sync-token>{_token(delta.text)}</d:sync-token>" in propfind.text
+    assert "<cs:getctag>" in propfind.text
+
+    bad = _report(client, SYNC_REPORT.format(token="urn:bogus"))
+    assert bad.status_code == 403 and "valid-sync-token" in bad.text
+
+
+
+def test_owner_change_is_a_deletion_for_the_previous_owner(dav):
+    client, Session = dav
+    bob = {"Authorization": "Basic " + base64.b64encode(b"bob:secret").decode()}
+    alice_token = _token(_report(client, SYNC_REPORT.format(token="")).text)
+    bob_token = _token(client.request("REPORT", "/caldav/calendar/", content=SYNC_REPORT.format(token=""), headers=bob).text)
+
+    with Session() as db:
+        db.get(CalendarEvent, 1).owner_id = 2
+        db.commit()
+
+    alice = _report(client, SYNC_REPORT.format(token=alice_token))
+    assert _hrefs(alice.text) == ["/caldav/calendar/CAL_1.ics"] and "404 Not Found" in alice.text
+    assert _token(alice.text) != alice_token
+    moved = client.request("REPORT", "/caldav/calendar/", content=SYNC_REPORT.format(token=bob_token), headers=bob)
+    assert _hrefs(moved.text) == ["/caldav/calendar/CAL_1.ics"] and "404 Not Found" not in moved.text
+
+
+def test_multiget_and_time_range_are_owner_scoped(dav):
+    client, _Session = dav
+    multiget = _report(
+        client,
+        '<c:calendar-multiget xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">'
+        "<d:prop><d:getetag/><c:calendar-data/></d:prop>"
+        "<d:href>/caldav/calendar/CAL_1.ics</d:href><d:href>/caldav/calendar/CAL_3.ics</d:href>"
+        "</c:calendar-multiget>",
+    )
+    assert "SUMMARY:Standup" in multiget.text
+    assert "Bob only" not in multiget.text and "404 Not Found" in multiget.text
+
+    query = _report(
+        client,
+        '<c:calendar-query xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">'
+        "<d:prop><d:getetag/></d:prop><c:filter><c:comp-filter name=\"VCALENDAR\">"
+        '<c:comp-filter name="VEVENT"><c:time-range start="20250107T000000Z" end="20250108T000000Z"/>'
+        "</c:comp-filter></c:comp-filter></c:filter></c:calendar-query>",
+    )
+    assert _hrefs(query.text) == ["/caldav/calendar/CAL_2.ics"]
+    assert "BEGIN:VCALENDAR" not in query.text  # etag-only poll renders nothing
+
+    item = client.get("/caldav/calendar/CAL_1.ics")
+    assert item.status_code == 200
+    assert client.get("/caldav/calendar/CAL_1.ics", headers={"If-None-Match": item.headers["etag"]}).status_code == 304
+    assert client.get("/caldav/calendar/CAL_3.ics").status_code == 404
+    assert client.request("REPORT", "/caldav/calendar/", headers={"Authorization": ""}).status_code == 401
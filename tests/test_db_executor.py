@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests for offloading blocking protocol handlers to the DB pool.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.db_executor import offload_to_db_pool, on_db_worker, run_coroutine_in_db_thread, run_in_db_thread
+from app.loop_lag import LoopLagMonitor
+from app.push_notifications import PushNotificationManager
+
+
+def _build_app():
+    app = FastAPI()
+
+    @app.post("/blocking")
+    @offload_to_db_pool
+    async def blocking(request: Request):
+        body = await request.body()
+        return {
+            "thread": threading.current_thread().name,
+            "worker": on_db_worker(),
+            "body": body.decode(),
+        }
+
+    @app.post("/streaming")
+    @offload_to_db_pool(inline_when=lambda request, body: b"stream" in body)
+    async def streaming(request: Request):
+        await request.body()
+        return {"worker": on_db_worker()}
+
+    return app
+
+
+def test_handler_runs_on_db_worker_with_buffered_body():
+    client = TestClient(_build_app())
+    data = client.post("/blocking", content=b"<Sync/>").json()
+    assert data["worker"] is True
+    assert data["thread"].startswith("db-worker")
+    assert data["body"] == "<Sync/>"
+
+
+def test_inline_when_keeps_request_on_loop():
+    client = TestClient(_build_app())
+    assert client.post("/streaming", content=b"stream please").json()["worker"] is False
+    assert client.post("/streaming", content=b"plain").json()["worker"] is True
+
+
+def test_offloaded_blocking_work_does_not_stall_loop():
+    async def scenario():
+        monitor = LoopLagMonitor(interval=0.01, warn_ms=100)
+        await monitor.start()
+        await asyncio.gather(*(run_in_db_thread(time.sleep, 0.2) for _ in range(4)))
+        await monitor.stop()
+        inline = LoopLagMonitor(interval=0.01, warn_ms=100)
+        await inline.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.2)  # what an un-offloaded query does to the loop
+        await asyncio.sleep(0.02)
+        await inline.stop()
+        return monitor.get_stats(), inline.get_stats()
+
+    offloaded, inline = asyncio.run(scenario())
+    assert offloaded["stalls"] == 0
+    assert inline["stalls"] == 1
+    assert inline["lag_ms_max"] >= 150
+
+
+def test_push_waiters_on_the_loop_are_woken_from_pool_threads():
+    manager = PushNotificationManager()
+
+    async def notify_from_handler():
+        # What an offloaded handler does: its own loop, on a pool thread
+        assert on_db_worker()
+        return await manager.notify_new_content(1, "1")
+
+    async def scenario():
+        manager.set_loop(asyncio.get_running_loop())
+        waiter = await manager.subscribe(1, ["1"])
+        started = time.monotonic()
+        await run_coroutine_in_db_thread(notify_from_handler)
+        await asyncio.wait_for(waiter.wait(), 1)
+        woken_by_handler = time.monotonic() - started
+
+        # From a plain thread, delivered through the registered main loop
+        waiter.clear()
+        threading.Thread(target=manager.schedule_notify, args=(1, "1")).start()
+        await asyncio.wait_for(waiter.wait(), 1)
+        await manager.unsubscribe(waiter)
+        return woken_by_handler
+
+    assert asyncio.run(scenario()) < 0.5
+    assert manager.get_active_connections_count() == 0
+
+
+def test_mapi_sessions_do_not_share_a_processor():
+    from app.mapi_protocol import session_manager
+    from app.routers import mapihttp
+
+    first = session_manager.create_session("/o=Test/cn=a", "a@example.com")
+    second = session_manager.create_session("/o=Test/cn=b", "b@example.com")
+    try:
+        processor_a, lock_a = mapihttp.get_rpc_processor(first)
+        processor_b, lock_b = mapihttp.get_rpc_processor(second)
+        assert processor_a is not processor_b and lock_a is not lock_b
+        assert mapihttp.get_rpc_processor(first)[0] is processor_a
+        # One session's Execute holding its lock does not block another session
+        with lock_a:
+            assert lock_b.acquire(timeout=1)
+            lock_b.release()
+        mapihttp.drop_rpc_processor(first)
+        assert mapihttp.get_rpc_processor(first)[0] is not processor_a
+    finally:
+        for cookie in (first, second):
+            session_manager.remove_session(cookie)
+            mapihttp.drop_rpc_processor(cookie)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for pool profiles, SQLite pragmas and read-replica routing.
+
+Two SQLite files stand in for the primary and the replica; the replica is
+seeded with a distinguishable row so the tests can tell where a read went.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from app import db_engine
+from app.database import Base, Contact, DavChange, User
+from app.db_engine import (
+    RoutingSession,
+    build_engine,
+    mark_mailbox_write,
+    pool_settings,
+    prefer_replica,
+    replica_reads,
+)
+
+
+def _sessions(tmp_path):
+    primary = build_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = build_engine(f"sqlite:///{tmp_path / 'replica.db'}", read_only=True)
+    for engine, name in ((primary, "primary"), (replica, "replica")):
+        Base.metadata.create_all(bind=engine, tables=[User.__table__, Contact.__table__, DavChange.__table__])
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO users (id, username, email, hashed_password) "
+                    "VALUES (:id, :name, :email, 'x')"
+                ),
+                {"id": 1, "name": name, "email": f"{name}@example.com"},
+            )
+    return sessionmaker(
+        class_=RoutingSession, autoflush=False, bind=primary, replica_bind=replica
+    )
+
+
+def test_pool_profile_env_override(monkeypatch):
+    assert pool_settings("activesync")["pool_size"] == 12
+    assert pool_settings("unknown") == pool_settings("default")
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    assert pool_settings("ui")["pool_size"] == 3
+
+
+def test_sqlite_pragmas_applied(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+
+
+def test_reads_route_to_replica_only_when_opted_in(tmp_path):
+    Session = _sessions(tmp_path)
+    with Session() as db:
+        assert db.get(User, 1).username == "primary"
+    with Session() as db:
+        with replica_reads(db, mailbox_id=42):
+            assert db.query(User).one().username == "replica"
+        db.expire_all()
+        assert db.query(User).one().username == "primary"
+
+
+def test_read_your_writes_falls_back_to_primary(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_engine, "_recent_writes", {})
+    Session = _sessions(tmp_path)
+
+    # The session's own writes pin it to the primary
+    with Session() as db:
+        prefer_replica(db, mailbox_id=1)
+        db.add(Contact(owner_id=1, display_name="Fresh"))
+        db.commit()
+        assert [c.display_name for c in db.query(Contact).all()] == ["Fresh"]
+
+    # ...and so does a recent write to the same mailbox from another session
+    with Session() as db:
+        prefer_replica(db, mailbox_id=1)
+        assert db.query(User).one().username == "primary"
+    with Session() as db:
+        prefer_replica(db, mailbox_id=2)
+        assert db.query(User).one().username == "replica"
+
+    monkeypatch.setattr(db_engine, "DB_REPLICA_RYW_WINDOW", 0)
+    mark_mailbox_write(1)
+    with Session() as db:
+        prefer_replica(db, mailbox_id=1)
+        assert db.query(User).one().username == "replica"
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests for leased claims on the outbound email queue.
+"""
+
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.email_queue import Base, EmailQueue, EmailQueueStatus, QueuedEmail
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'queue.db'}", connect_args={"timeout": 30})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def _fill(queue, count):
+    for i in range(count):
+        queue.add_email(f"<m{i}@test>", "a@example.com", f"r{i}@remote.test", f"S{i}", "body", priority=5 + i % 2)
+
+
+def test_concurrent_workers_claim_disjoint_batches(Session):
+    workers = [EmailQueue(Session) for _ in range(4)]
+    _fill(workers[0], 60)
+    claimed = {worker.worker_id: [] for worker in workers}
+
+    def drain(worker):
+        while True:
+            batch = worker.claim_due(7)
+            if not batch:
+                return
+            claimed[worker.worker_id].extend(email.message_id for email in batch)
+
+    threads = [threading.Thread(target=drain, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    everything = [message_id for batch in claimed.values() for message_id in batch]
+    assert len(everything) == len(set(everything)) == 60
+    with Session() as db:
+        owners = {row.lease_owner for row in db.query(QueuedEmail)}
+        assert {row.status for row in db.query(QueuedEmail)} == {EmailQueueStatus.PROCESSING.value}
+    assert owners <= set(claimed)
+
+
+def test_expired_lease_is_reclaimed_and_fences_the_old_worker(Session):
+    first, second = EmailQueue(Session), EmailQueue(Session)
+    _fill(first, 1)
+    [email] = first.claim_due()
+    assert second.claim_due() == []
+    assert first.heartbeat() == 1
+
+    # The first worker stops heartbeating: its lease runs out
+    with Session() as db:
+        db.query(QueuedEmail).update({QueuedEmail.next_retry_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+    [again] = second.claim_due()
+    assert again.message_id == email.message_id and again.lease_owner == second.worker_id
+
+    assert first.mark_as_sent(email.message_id) is False
+    assert first.heartbeat() == 0 and not first._held
+    assert second.mark_as_sent(email.message_id) is True
+    with Session() as db:
+        row = db.query(QueuedEmail).one()
+        assert row.status == EmailQueueStatus.SENT.value and row.lease_owner is None
+
+
+
+def test_late_worker_cannot_change_a_message_another_worker_finished(Session):
+    first, second = EmailQueue(Session), EmailQueue(Session)
+    _fill(first, 1)
+    [email] = first.claim_due()
+    with Session() as db:
+        db.query(QueuedEmail).update({QueuedEmail.next_retry_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+    second.claim_due()
+    assert second.mark_as_sent(email.message_id) is True
+
+    # The first worker's delivery attempt ends after the row is already SENT
+    assert first.mark_for_retry(email.message_id, "timeout") is False
+    assert first.mark_as_failed(email.message_id, "timeout") is False
+    assert first.mark_as_processing(email.message_id) is False
+    assert second.mark_for_retry(email.message_id, "late") is False
+    with Session() as db:
+        row = db.query(QueuedEmail).one()
+        assert (row.status, row.retry_count, row.lease_owner, row.error_message) == (
+            EmailQueueStatus.SENT.value,
+            0,
+            None,
+            None,
+        )
+    assert second.claim_due() == [] and not first._held
+
+
+def test_stats_come_from_one_grouped_query(Session):
+    queue = EmailQueue(Session)
+    _fill(queue, 5)
+    claimed = queue.claim_due(3)
+    queue.mark_as_sent(claimed[0].message_id)
+    queue.mark_for_retry(claimed[1].message_id, "try later")
+    with Session() as db:
+        db.query(QueuedEmail).filter(QueuedEmail.status == EmailQueueStatus.RETRY.value).update(
+            {QueuedEmail.next_retry_at: datetime.utcnow() - timedelta(minutes=1)}
+        )
+        db.commit()
+
+    statements = []
+    engine = Session.kw["bind"]
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        stats = queue.get_queue_stats()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert len(statements) == 1 and "GROUP BY" in statements[0]
+    assert stats == {"pending": 2, "processing": 1, "sent": 1, "failed": 0, "retry": 1, "retry_ready": 1}
+    # Pending rows and the due retry; the row still under lease stays put
+    assert sorted(email.retry_count for email in queue.claim_due(5)) == [0, 0, 1]
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Tests for materialized folder counters: transactional upkeep and reconciliation.
+"""
+
+import base64
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.auth import get_current_user_from_cookie
+from app.database import Base, Email, FolderCounter, User, get_db
+from app.message_store import deliver_to_mailboxes
+from app.routers import emails as emails_router
+from app.routers import ews
+from app.services import folder_counts
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'counts.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+            ]
+        )
+        db.commit()
+    return Session
+
+
+def _totals(db, user_id):
+    return {folder: (c["total"], c["unread"]) for folder, c in folder_counts.get_counts(db, user_id).items()}
+
+
+def test_counters_follow_inserts_reads_moves_and_deletes(Session):
+    with Session() as db:
+        shared = deliver_to_mailboxes(db, [1, 2], "Both", "Hello", None, "TUlNRQ==", "text/plain", sender_id=2)
+        db.add(Email(subject="Note to self", body="x", sender_id=1, recipient_id=1))
+        db.add(Email(subject="Out", body="y", sender_id=1, external_recipient="z@remote.test"))
+        db.commit()
+        assert _totals(db, 1) == {"inbox": (2, 2), "sent": (2, 0), "deleted": (0, 0)}
+        assert folder_counts.get_folder_count(db, 1, "inbox")["size"] == len("TUlNRQ==") + 1
+
+        shared[0].is_read = True
+        db.commit()
+        assert _totals(db, 1)["inbox"] == (2, 1)
+
+        # Move to Deleted Items, then hard-delete
+        shared[0].is_deleted = True
+        db.commit()
+        assert _totals(db, 1) == {"inbox": (1, 1), "sent": (2, 0), "deleted": (1, 0)}
+        assert _totals(db, 2)["sent"] == (1, 0)
+        db.delete(shared[0])
+        db.commit()
+        assert _totals(db, 1)["deleted"] == (0, 0)
+
+        # A failed transaction leaves the counters untouched
+        db.add(Email(subject="Rolled back", body="r", recipient_id=1))
+        db.flush()
+        db.rollback()
+        assert _totals(db, 1)["inbox"] == (1, 1)
+        assert folder_counts.reconcile(db) == 0
+
+
+def test_reconcile_corrects_drift_and_backfills(Session):
+    with Session() as db:
+        deliver_to_mailboxes(db, [1, 2], "Both", "Hello", None, None, None)
+        # Writes that bypass the ORM are not counted
+        db.execute(text("UPDATE emails SET is_read = 1 WHERE recipient_id = 1"))
+        db.execute(text("DELETE FROM folder_counters WHERE user_id = 2"))
+        db.commit()
+        assert _totals(db, 1)["inbox"] == (1, 1)
+
+        assert folder_counts.reconcile(db) == 2
+        assert _totals(db, 1)["inbox"] == (1, 0)
+        assert _totals(db, 2)["inbox"] == (1, 1)
+        assert db.query(FolderCounter).count() == 2
+        assert folder_counts.reconcile(db, user_id=2) == 0
+
+
+def test_stats_summary_reads_counters(Session):
+    app = FastAPI()
+    app.include_router(emails_router.router)
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    with Session() as db:
+        for i in range(60):
+            db.add(Email(subject=f"M{i}", body="b", sender_id=2, recipient_id=1, is_read=i % 3 == 0))
+        db.commit()
+        user = db.get(User, 1)
+        db.expunge(user)
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_cookie] = lambda: user
+    client = TestClient(app)
+
+    first = client.get("/emails/stats/summary")
+    # Previously capped at the 50-row page the summary was computed from
+    assert first.json() == {"inbox_count": 60, "sent_count": 0, "unread_count": 40}
+    etag = first.headers["etag"]
+    assert client.get("/emails/stats/summary", headers={"If-None-Match": etag}).status_code == 304
+
+    with Session() as db:
+        db.get(Email, 2).is_read = True
+        db.commit()
+    changed = client.get("/emails/stats/summary", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.json()["unread_count"] == 39
+
+
+def test_ews_getfolder_reports_counters(Session, monkeypatch):
+    monkeypatch.setattr(ews, "SessionLocal", Session)
+    monkeypatch.setattr(
+        ews,
+        "authenticate_user",
+        lambda db, username, password: db.query(User).filter(User.username == username).first(),
+    )
+    with Session() as db:
+        for i in range(5):
+            db.add(Email(subject=f"M{i}", body="b", sender_id=2, recipient_id=1, is_read=i < 2))
+        db.add(Email(subject="Gone", body="b", sender_id=2, recipient_id=1, is_deleted=True))
+        db.commit()
+    app = FastAPI()
+    app.include_router(ews.router)
+    client = TestClient(app)
+    client.headers["Authorization"] = "Basic " + base64.b64encode(b"alice:secret").decode()
+
+    def get_folder(*folder_ids):
+        ids = "".join(f'<t:DistinguishedFolderId Id="{fid}"/>' for fid in folder_ids)
+        response = client.post(
+            "/EWS/Exchange.asmx",
+            content=(
+                '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+                f"<m:GetFolder><m:FolderIds>{ids}</m:FolderIds></m:GetFolder></soap:Body></soap:Envelope>"
+            ),
+        )
+        assert response.status_code == 200, response.text
+        return re.findall(r"<t:TotalCount>(\d+)</t:TotalCount>.*?<t:UnreadCount>(\d+)</t:UnreadCount>", response.text)
+
+    assert get_folder("inbox", "deleteditems", "sentitems") == [("5", "3"), ("1", "1"), ("0", "0")]
+
+    with Session() as db:
+        db.get(Email, 3).is_read = True
+        db.commit()
+    assert get_folder("inbox") == [("5", "2")]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory GAL prefix index shared by NSPI, EAS Search and EWS.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.database import GlobalAddressEntry
+from app.services import gal_index as gal_index_module
+from app.services.gal_index import GalIndexEntry, GalSearchIndex
+from app.services.gal_service import GalService
+
+
+def _entry(email, display_name, company=None, department=None, given=None, surname=None):
+    return GalIndexEntry(
+        id=None,
+        uuid=None,
+        user_id=None,
+        display_name=display_name,
+        given_name=given,
+        surname=surname,
+        email=email,
+        company=company,
+        department=department,
+        job_title=None,
+        office_location=None,
+        business_phone=None,
+        mobile_phone=None,
+    )
+
+
+def _index():
+    index = GalSearchIndex()
+    index.rebuild(
+        [
+            _entry("john.smith@example.com", "John Smith", "Example", "Sales"),
+            _entry("jane.smithers@example.com", "Jane Smithers", "Example", "Engineering"),
+            _entry("jose@example.com", "José Álvarez", "Example", "Sales"),
+            _entry("smitty@other.org", "Bob Jones", "Other"),
+        ]
+    )
+    return index
+
+
+def test_prefix_search_is_anchored_and_ranked():
+    index = _index()
+    names = [e.display_name for e in index.search("smi")]
+    # Name matches outrank the email-only match, ties break alphabetically
+    assert names == ["Jane Smithers", "John Smith", "Bob Jones"]
+    # Unanchored substrings no longer match
+    assert index.search("mith") == []
+
+
+def test_multi_term_query_requires_every_term():
+    index = _index()
+    assert [e.email for e in index.search("john sm")] == ["john.smith@example.com"]
+    assert [e.email for e in index.search("sales jo")] == [
+        "john.smith@example.com",
+        "jose@example.com",
+    ]
+
+
+def test_address_query_filters_on_domain():
+    index = _index()
+    assert [e.email for e in index.search("smi")][-1] == "smitty@other.org"
+    assert [e.email for e in index.search("smitty@oth")] == ["smitty@other.org"]
+    assert index.search("smitty@example") == []
+
+
+def test_domain_only_query():
+    index = _index()
+    example = ["jane.smithers@example.com", "john.smith@example.com", "jose@example.com"]
+    assert sorted(e.email for e in index.search("example.com")) == example
+    assert sorted(e.email for e in index.search("@example")) == example
+    assert [e.email for e in index.search("other.org")] == ["smitty@other.org"]
+    assert [e.email for e in index.search("@oth")] == ["smitty@other.org"]
+    assert [e.email for e in index.search("john.smith@example.com")] == ["john.smith@example.com"]
+
+
+def test_accent_insensitive_and_limit():
+    index = _index()
+    assert [e.email for e in index.search("alvarez")] == ["jose@example.com"]
+    assert len(index.search("example", limit=2)) == 2
+    assert [e.display_name for e in index.all(limit=2)] == ["Bob Jones", "Jane Smithers"]
+
+
+def test_incremental_upsert_and_remove():
+    index = _index()
+    index.upsert(_entry("john.smith@example.com", "Johnny Smith", "Example"))
+    assert [e.display_name for e in index.search("johnny")] == ["Johnny Smith"]
+    assert index.search("sales jo")[0].email == "jose@example.com"
+    index.remove("JOSE@example.com")
+    assert index.search("alvarez") == []
+    assert len(index) == 3
+
+
+def test_committed_changes_patch_shared_index(monkeypatch):
+    engine = create_engine("sqlite://")
+    GlobalAddressEntry.__table__.create(bind=engine)
+    Session = sessionmaker(bind=engine)
+    shared = GalSearchIndex(refresh_interval=3600)
+    monkeypatch.setattr(gal_index_module, "gal_index", shared)
+    monkeypatch.setattr("app.services.gal_service.gal_index", shared)
+
+    db = Session()
+    service = GalService(db)
+    service.upsert_entry(email="alice@example.com", display_name="Alice Archer")
+    db.commit()
+    assert [e.email for e in service.search("arch")] == ["alice@example.com"]
+
+    service.upsert_entry(email="bob@example.com", display_name="Bob Archer")
+    db.commit()
+    assert {e.email for e in service.search("archer")} == {"alice@example.com", "bob@example.com"}
+
+    service.upsert_entry(email="carol@example.com", display_name="Carol Archer")
+    db.rollback()
+    assert len(service.search("archer")) == 2
+
+    service.deactivate_entry(service.get_by_email("alice@example.com"))
+    db.commit()
+    assert [e.email for e in service.search("archer")] == ["bob@example.com"]
+    db.close()
+
+
+def test_refresh_rebuilds_when_another_process_also_changed_the_gal(monkeypatch):
+    engine = create_engine("sqlite://")
+    GlobalAddressEntry.__table__.create(bind=engine)
+    Session = sessionmaker(bind=engine)
+    shared = GalSearchIndex(refresh_interval=3600)
+    monkeypatch.setattr(gal_index_module, "gal_index", shared)
+    monkeypatch.setattr("app.services.gal_service.gal_index", shared)
+    rebuilds = []
+    rebuild = shared.rebuild
+    monkeypatch.setattr(shared, "rebuild", lambda entries: rebuilds.append(1) or rebuild(entries))
+
+    db = Session()
+    service = GalService(db)
+    service.upsert_entry(email="alice@example.com", display_name="Alice Archer")
+    db.commit()
+    shared.ensure_fresh(db)
+    assert len(rebuilds) == 1
+
+    # Only our own (already patched) changes: no rebuild
+    service.upsert_entry(email="bob@example.com", display_name="Bob Archer")
+    db.commit()
+    service.upsert_entry(email="alice@example.com", display_name="Alice Bowman")
+    db.commit()
+    shared._checked_at = 0.0
+    shared.ensure_fresh(db)
+    assert len(rebuilds) == 1
+
+    # Another process writes in the same interval as we do: its row is picked up
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO global_address_entries (uuid, email, display_name, is_active, created_at, updated_at) "
+                "VALUES ('c', 'carol@example.com', 'Carol Archer', 1, '2000-01-01', '2000-01-01')"
+            )
+        )
+    service.upsert_entry(email="dave@example.com", display_name="Dave Archer")
+    db.commit()
+    assert "carol@example.com" not in {e.email for e in shared.search("archer")}
+    shared._checked_at = 0.0
+    shared.ensure_fresh(db)
+    assert len(rebuilds) == 2
+    assert {e.email for e in shared.search("archer")} == {"bob@example.com", "carol@example.com", "dave@example.com"}
+    db.close()
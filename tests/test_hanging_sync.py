@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Tests for hanging Sync (Wait/HeartbeatInterval) and empty/partial Sync requests.
+"""
+
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import db_executor
+from app.auth import get_current_user_from_basic_auth
+from app.database import ActiveSyncDevice, ActiveSyncState, Base, Email, User, get_db
+from app.push_notifications import push_manager
+from app.routers import activesync
+from app.services import hanging_sync
+from app.wbxml_parser import parse_wbxml_sync_collections
+
+FOLDERS = {"1": "inbox", "3": "deleted", "4": "sent"}
+
+
+def _str(tag, value):
+    return bytes([tag | 0x40, 0x03]) + value.encode() + b"\x00\x01"
+
+
+def _sync_body(collections=(), wait=None, heartbeat=None, partial=False):
+    """WBXML <Sync> with (collection_id, sync_key) collections."""
+    body = b"\x03\x01j\x00\x45"
+    if collections:
+        body += b"\x5c"
+        for collection_id, sync_key in collections:
+            body += b"\x4f" + _str(0x0B, sync_key) + _str(0x12, collection_id) + b"\x13\x01"
+        body += b"\x01"
+    if wait is not None:
+        body += _str(0x24, str(wait))
+    if heartbeat is not None:
+        body += _str(0x29, str(heartbeat))
+    if partial:
+        body += b"\x26"
+    return body + b"\x01"
+
+
+@pytest.fixture
+def Session(tmp_path, monkeypatch):
+    monkeypatch.setattr(hanging_sync, "sync_request_cache", hanging_sync.SyncRequestCache())
+    engine = create_engine(f"sqlite:///{tmp_path / 'hang.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                Email(id=1, subject="Old", recipient_id=1),
+                ActiveSyncDevice(user_id=1, device_id="dev1", device_type="iPhone", policy_key="77", is_provisioned=1),
+                ActiveSyncState(user_id=1, device_id="dev1", collection_id="1", sync_key="5", last_synced_email_id=1),
+                ActiveSyncState(user_id=1, device_id="dev1", collection_id="4", sync_key="2", last_synced_email_id=0),
+            ]
+        )
+        db.commit()
+    return Session
+
+
+def test_parser_and_partial_requests_expand_from_the_cache(Session):
+    full = parse_wbxml_sync_collections(_sync_body([("1", "5"), ("4", "2")], heartbeat=600))
+    assert full["heartbeat_interval"] == 600 and not full["partial"]
+    assert [(c["collection_id"], c["sync_key"], c["get_changes"]) for c in full["collections"]] == [
+        ("1", "5", True),
+        ("4", "2", True),
+    ]
+
+    # Nothing cached yet: an empty request cannot be expanded
+    assert hanging_sync.resolve_request(1, "dev1", parse_wbxml_sync_collections(b"")) is None
+    assert hanging_sync.resolve_request(1, "dev1", full)["expanded"] is False
+
+    partial = hanging_sync.resolve_request(
+        1, "dev1", parse_wbxml_sync_collections(_sync_body([("4", "3")], wait=5, partial=True))
+    )
+    assert partial["expanded"] and partial["wait"] == 5 and partial["heartbeat_interval"] is None
+    assert [(c["collection_id"], c["sync_key"], bool(c.get("cached"))) for c in partial["collections"]] == [
+        ("1", "5", True),
+        ("4", "3", False),
+    ]
+    assert hanging_sync.heartbeat_seconds(partial) == (300, None)
+    assert hanging_sync.heartbeat_seconds({"heartbeat_interval": 30}) == (None, "60")
+    assert hanging_sync.heartbeat_seconds({"wait": 90}) == (None, "59")
+
+    # Over HTTP: a cache miss answers Status 13, an out-of-range heartbeat Status 14 with Limit
+    app = FastAPI()
+    app.include_router(activesync.router)
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    with Session() as db:
+        user = db.get(User, 1)
+        db.expunge(user)
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_basic_auth] = lambda: user
+    client = TestClient(app)
+    url = "/activesync/Microsoft-Server-ActiveSync?Cmd=Sync&DeviceId=dev2&DeviceType=iPhone"
+    with Session() as db:
+        db.add(ActiveSyncDevice(user_id=1, device_id="dev2", device_type="iPhone", policy_key="77", is_provisioned=1))
+        db.commit()
+    headers = {"X-MS-PolicyKey": "77", "MS-ASProtocolVersion": "14.1"}
+    miss = client.post(url, content=b"", headers=headers)
+    assert miss.status_code == 200 and miss.content.endswith(b"\x45\x4e\x0313\x00\x01\x01")
+    limit = client.post(url, content=_sync_body([("1", "5")], heartbeat=10), headers=headers)
+    assert limit.content.endswith(b"\x45\x4e\x0314\x00\x01\x65\x0360\x00\x01\x01")
+
+
+def test_changed_collections_uses_a_fixed_number_of_queries(Session):
+    with Session() as db:
+        statements = []
+        event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+        many = [{"collection_id": cid, "sync_key": key} for cid, key in (("1", "5"), ("3", "0"), ("4", "2"), ("9", "1"))]
+        # Inbox up to date, Deleted never synced, Sent empty, unknown folders ignored
+        assert hanging_sync.changed_collections(db, 1, "dev1", many, FOLDERS) == ["3"]
+        assert len(statements) == 2
+
+        db.add(Email(id=2, subject="New", recipient_id=1))
+        db.commit()
+        statements.clear()
+        assert hanging_sync.changed_collections(db, 1, "dev1", many[:1], FOLDERS) == ["1"]
+        assert len(statements) == 2
+
+        # A stale key only counts when the client sent it, not when it came from the cache
+        stale = [{"collection_id": "4", "sync_key": "1"}]
+        assert hanging_sync.changed_collections(db, 1, "dev1", stale, FOLDERS) == ["4"]
+        assert hanging_sync.changed_collections(db, 1, "dev1", [dict(stale[0], cached=True)], FOLDERS) == []
+
+        state = db.query(ActiveSyncState).filter_by(collection_id="4").one()
+        state.pending_sync_key = "3"
+        db.commit()
+        assert hanging_sync.changed_collections(db, 1, "dev1", [dict(stale[0], cached=True)], FOLDERS) == ["4"]
+
+
+def test_hang_releases_the_transaction_and_wakes_on_new_mail(Session):
+    collections = [{"collection_id": "1", "sync_key": "5"}]
+
+    async def scenario():
+        with Session() as db:
+            # Times out with nothing new
+            assert await hanging_sync.hang(db, 1, "dev1", collections, FOLDERS, 0.05) == ([], True)
+            assert not db.in_transaction()
+
+            async def deliver():
+                await asyncio.sleep(0.05)
+                # A wake-up without changes keeps waiting
+                await push_manager.notify_new_content(1, "1")
+                await asyncio.sleep(0.05)
+                with Session() as other:
+                    # Writable while the request hangs: nothing is locked
+                    other.add(Email(id=2, subject="New", recipient_id=1))
+                    other.commit()
+                await push_manager.notify_new_content(1, "1")
+
+            delivery = asyncio.create_task(deliver())
+            result = await hanging_sync.hang(db, 1, "dev1", collections, FOLDERS, 5)
+            await delivery
+            return result
+
+    assert asyncio.run(scenario()) == (["1"], True)
+    assert not push_manager._subscribers.get(1)
+
+
+def test_parked_sync_holds_no_pool_thread_and_answers_every_changed_collection(Session, monkeypatch):
+    # One pool thread: a parked request holding it would block everything else
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-worker", initializer=db_executor._initializer)
+    monkeypatch.setattr(db_executor, "db_executor", pool)
+    monkeypatch.setattr(hanging_sync, "SYNC_MAX_HEARTBEAT", 10)
+    app = FastAPI()
+    app.include_router(activesync.router)
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    with Session() as db:
+        user = db.get(User, 1)
+        db.expunge(user)
+        db.add(ActiveSyncDevice(user_id=1, device_id="dev2", device_type="iPhone", policy_key="77", is_provisioned=1))
+        db.commit()
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_basic_auth] = lambda: user
+    headers = {"X-MS-PolicyKey": "77", "MS-ASProtocolVersion": "14.1"}
+    url = "/activesync/Microsoft-Server-ActiveSync?Cmd=Sync&DeviceType=iPhone&DeviceId="
+    results = {}
+
+    with TestClient(app) as client:
+        def park():
+            body = _sync_body([("1", "5"), ("4", "2")], heartbeat=600)
+            results["parked"] = client.post(url + "dev1", content=body, headers=headers)
+            results["woken_at"] = time.monotonic()
+
+        parked = threading.Thread(target=park)
+        parked.start()
+        deadline = time.monotonic() + 5
+        while not push_manager._subscribers.get(1) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert push_manager._subscribers.get(1)
+
+        # Other requests still get the pool while dev1 is parked
+        other = client.post(url + "dev2", content=b"", headers=headers)
+        assert other.content.endswith(b"\x45\x4e\x0313\x00\x01\x01")
+        assert parked.is_alive()
+
+        # New mail in two collections, notified from another thread and loop
+        with Session() as db:
+            db.add_all([Email(id=2, subject="New", recipient_id=1), Email(id=3, subject="Sent", sender_id=1)])
+            db.commit()
+        notified_at = time.monotonic()
+        threading.Thread(target=asyncio.run, args=(push_manager.notify_new_content(1, "1"),)).start()
+        parked.join(5)
+        assert not parked.is_alive()
+
+    pool.shutdown()
+    assert results["woken_at"] - notified_at < 2
+    response = results["parked"]
+    assert response.status_code == 200 and response.content.startswith(b"\x03\x01j\x00")
+    # Both changed collections in one <Sync>
+    assert re.findall(rb"\x52\x03([0-9]+)\x00\x01", response.content) == [b"1", b"4"]
+    assert not push_manager._subscribers.get(1)
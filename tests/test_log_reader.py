@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Tests for the reverse-seek log reader behind the admin log viewers.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.log_reader import (
+    LogOffsetIndex,
+    get_offset_index,
+    iter_lines_reverse,
+    read_lines,
+    search_lines,
+    tail_lines,
+)
+
+BASE = datetime(2025, 10, 1, 12, 0, 0)
+
+
+def _write_log(path, count, start=0):
+    with open(path, "a", encoding="utf-8") as handle:
+        for i in range(start, start + count):
+            stamp = (BASE + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S")
+            handle.write(f"{stamp},000 - smtp - INFO - message {i} {'ERROR' if i % 10 == 0 else 'ok'}\n")
+
+
+def test_tail_reads_backward_across_blocks(tmp_path):
+    path = str(tmp_path / "smtp.log")
+    _write_log(path, 500)
+    tail = tail_lines(path, 3)
+    assert [line.split(" - ")[-1] for line in tail] == ["message 497 ok", "message 498 ok", "message 499 ok"]
+    # Tiny blocks force lines to straddle block boundaries
+    lines = [line.decode() for line in iter_lines_reverse(path, block_size=7)]
+    assert len(lines) == 500
+    assert lines[0].endswith("message 499 ok") and lines[-1].endswith("message 0 ERROR")
+    assert tail_lines(str(tmp_path / "smtp.log"), 1000)[0].endswith("message 0 ERROR")
+
+
+def test_time_window_uses_sparse_index(tmp_path):
+    path = str(tmp_path / "smtp.log")
+    _write_log(path, 1000)
+    index = LogOffsetIndex(path, stride=100)
+    start, end = index.window(BASE + timedelta(seconds=450), BASE + timedelta(seconds=460))
+    assert 0 < start < end < os.path.getsize(path)
+
+    lines = read_lines(path, 50, since=BASE + timedelta(seconds=450), until=BASE + timedelta(seconds=460))
+    assert len(lines) == 11
+    assert lines[0].endswith("message 450 ERROR") and lines[-1].endswith("message 460 ERROR")
+
+
+def test_index_extends_incrementally_and_resets_on_truncate(tmp_path):
+    path = str(tmp_path / "smtp.log")
+    _write_log(path, 300)
+    index = get_offset_index(path)
+    index.refresh()
+    assert index.line_count == 300
+    _write_log(path, 50, start=300)
+    index.refresh()
+    assert index.line_count == 350
+
+    with open(path, "w", encoding="utf-8"):
+        pass
+    _write_log(path, 400, start=5000)
+    index.refresh()
+    assert index.line_count == 400
+    assert read_lines(path, 5, until=BASE + timedelta(seconds=5100))[-1].endswith("message 5100 ERROR")
+
+
+def test_search_streams_newest_matches_first(tmp_path):
+    path = str(tmp_path / "smtp.log")
+    _write_log(path, 1000)
+    results = search_lines(path, "error", 3)
+    assert next(results).endswith("message 990 ERROR")
+    assert [line.split(" - ")[-1] for line in results] == ["message 980 ERROR", "message 970 ERROR"]
+    windowed = list(search_lines(path, "ERROR", 100, until=BASE + timedelta(seconds=25)))
+    assert [line.split(" - ")[-1] for line in windowed] == ["message 20 ERROR", "message 10 ERROR", "message 0 ERROR"]
+    assert list(search_lines(path, "missing", 10)) == []
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tests for the mailbox full-text search index and the endpoints served from it.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.auth import get_current_user_from_basic_auth, get_current_user_from_cookie
+from app.database import ActiveSyncDevice, Base, Email, User, get_db
+from app.message_store import deliver_to_mailboxes
+from app.routers import activesync, owa
+from app.services import mail_search
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", full_name="Alice Adams", hashed_password="x"),
+                User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+                User(id=3, username="carol", email="carol@example.com", hashed_password="x"),
+            ]
+        )
+        db.commit()
+    return Session
+
+
+def _ids(db, user_id, query, **filters):
+    return mail_search.search(db, user_id, query, **filters)["ids"]
+
+
+def test_index_follows_ingest_edits_and_deletes(Session):
+    with Session() as db:
+        shared = deliver_to_mailboxes(db, [1, 2], "Quarterly report", "Numbers for José", None, None, None, sender_id=3)
+        note = Email(subject="Lunch", body_html="<style>p{}</style><p>Bring the <b>reports</b> &amp; slides</p>", recipient_id=1)
+        db.add(note)
+        db.commit()
+
+        # Prefix terms, accents folded, HTML bodies indexed as text
+        assert _ids(db, 1, "repo") == [shared[0].id, note.id]
+        assert _ids(db, 1, "jose") == [shared[0].id]
+        assert _ids(db, 1, "slides") == [note.id]
+        assert _ids(db, 1, "style") == []
+        # Field prefixes, and each mailbox only sees its own rows
+        assert _ids(db, 1, "from:carol") == [shared[0].id]
+        assert _ids(db, 3, "to:alice") == [shared[0].id]
+        assert _ids(db, 2, "lunch") == []
+
+        note.subject = "Picnic"
+        db.commit()
+        assert _ids(db, 1, "lunch") == [] and _ids(db, 1, "picnic") == [note.id]
+
+        db.delete(shared[0])
+        db.commit()
+        assert _ids(db, 1, "quarterly") == [] and _ids(db, 2, "quarterly") == [shared[1].id]
+
+        # A rolled back insert leaves no index entry behind
+        db.add(Email(subject="Quarterly draft", body="x", recipient_id=1))
+        db.flush()
+        db.rollback()
+        assert _ids(db, 1, "quarterly") == []
+
+
+def test_ranking_filters_paging_and_backfill(Session):
+    now = datetime.utcnow()
+    with Session() as db:
+        for i in range(30):
+            db.add(
+                Email(
+                    subject=f"Status {i}",
+                    body="weekly budget numbers" if i % 2 else "nothing here",
+                    sender_id=2,
+                    recipient_id=1,
+                    is_deleted=i == 7,
+                    created_at=now - timedelta(days=i),
+                )
+            )
+        db.add(Email(subject="Budget review", body="see attached", sender_id=2, recipient_id=1, created_at=now - timedelta(days=60)))
+        db.commit()
+
+        page = mail_search.search(db, 1, "budget", limit=10)
+        # A subject hit outranks newer body-only hits
+        assert page["total"] == 16 and len(page["ids"]) == 10
+        assert db.get(Email, page["ids"][0]).subject == "Budget review"
+        rest = mail_search.search(db, 1, "budget", offset=10, limit=10)
+        assert len(rest["ids"]) == 6 and not set(page["ids"]) & set(rest["ids"])
+
+        assert mail_search.search(db, 1, "budget", folder="deleted")["total"] == 1
+        assert mail_search.search(db, 1, "budget", folder="inbox")["total"] == 15
+        recent = mail_search.search(db, 1, "budget", since=now - timedelta(days=10, hours=1))
+        assert recent["total"] == 5
+
+        # Mail stored before the index existed is picked up by the backfill
+        db.execute(text(f"DELETE FROM {mail_search.SEARCH_TABLE}"))
+        db.commit()
+        assert mail_search.search(db, 1, "budget")["total"] == 0
+    assert mail_search.backfill(Session.kw["bind"], batch_size=7) == 31
+    with Session() as db:
+        assert mail_search.search(db, 1, "budget", limit=10) == page
+    assert mail_search.backfill(Session.kw["bind"]) == 0
+
+
+def test_owa_and_activesync_search_endpoints(Session):
+    with Session() as db:
+        deliver_to_mailboxes(db, [1], "Invoice 42", "Payment due", None, None, None, sender_id=2)
+        deliver_to_mailboxes(db, [2], "Invoice 43", "Not yours", None, None, None, sender_id=3)
+        db.add(ActiveSyncDevice(user_id=1, device_id="dev1", device_type="iPhone", policy_key="77", is_provisioned=1))
+        db.commit()
+        user = db.get(User, 1)
+        db.expunge(user)
+
+    app = FastAPI()
+    app.include_router(owa.router)
+    app.include_router(activesync.router)
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_cookie] = lambda: user
+    app.dependency_overrides[get_current_user_from_basic_auth] = lambda: user
+    client = TestClient(app)
+
+    found = client.get("/owa/api/search", params={"q": "invo", "folder": "inbox"}).json()
+    assert found["total"] == 1
+    assert found["messages"][0]["subject"] == "Invoice 42" and found["messages"][0]["sender"] == "bob@example.com"
+    assert client.get("/owa/api/search", params={"q": "x", "folder": "junk"}).status_code == 400
+
+    body = (
+        "<Search><Store><Name>Mailbox</Name><Query><And><CollectionId>1</CollectionId>"
+        "<FreeText>invoice</FreeText></And></Query><Options><Range>0-9</Range></Options></Store></Search>"
+    )
+    response = client.post(
+        "/activesync/Microsoft-Server-ActiveSync?Cmd=Search&DeviceId=dev1&DeviceType=iPhone",
+        content=body,
+        headers={"X-MS-PolicyKey": "77", "MS-ASProtocolVersion": "14.1"},
+    )
+    assert response.status_code == 200
+    assert "<Subject>Invoice 42</Subject>" in response.text and "Invoice 43" not in response.text
+    assert "<Range>0-0</Range><Total>1</Total>" in response.text
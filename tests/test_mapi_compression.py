@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Tests for MAPI RPC buffer compression and ROP output budgeting.
+
+Covers:
+1. Plain LZ77 round trips (literals, short/long matches, nibble sharing)
+2. RPC_HEADER_EXT framing with compression and XorMagic
+3. RopQueryRows partial results under a small output budget
+4. RopBufferTooSmall when a single row cannot fit
+5. EcDoRpc requests framed with RPC_HEADER_EXT (compressed, chunked)
+"""
+
+import os
+import struct
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.mapi_compression import (
+    RHEF_COMPRESSED,
+    RHEF_LAST,
+    RHEF_XOR_MAGIC,
+    decode_rpc_buffer,
+    decode_rpc_request,
+    encode_rpc_buffer,
+    lz77_compress,
+    lz77_decompress,
+)
+from app.mapi_protocol import MapiPropertyTags, MapiRpcOpNum, MapiRpcProcessor, session_manager
+from app.mapi_rop import QueryRowsOrigin, RopId, RopProcessor
+from app.mapi_store import MapiMessage
+
+
+def _roundtrip(data: bytes) -> bytes:
+    return lz77_decompress(lz77_compress(data))
+
+
+def test_lz77_roundtrip_samples():
+    samples = [
+        b"",
+        b"a",
+        b"abc",
+        b"abcabcabcabc",
+        b"x" * 10,
+        b"x" * 30,
+        b"y" * 300,
+        b"z" * 70000,
+        os.urandom(2048),
+        b"".join(b"Subject %05d hello@example.com " % i for i in range(500)),
+    ]
+    for data in samples:
+        assert _roundtrip(data) == data
+
+
+def test_lz77_compresses_repetitive_rows():
+    data = b"".join(b"row %05d sender@example.com Quarterly report\x00" % i for i in range(600))
+    assert len(lz77_compress(data)) < len(data) // 3
+
+
+def test_rpc_header_ext_flags():
+    payload = b"IPM.Note\x00" * 200
+    framed = encode_rpc_buffer(payload, compress=True, obfuscate=True)
+    _version, flags, size, size_actual = struct.unpack_from("<HHHH", framed, 0)
+    assert flags == RHEF_LAST | RHEF_COMPRESSED | RHEF_XOR_MAGIC
+    assert size == len(framed) - 8
+    assert size_actual == len(payload)
+    assert decode_rpc_buffer(framed) == (payload, flags)
+
+
+def test_rpc_header_ext_skips_incompressible_payload():
+    payload = os.urandom(512)
+    framed = encode_rpc_buffer(payload, compress=True)
+    assert decode_rpc_buffer(framed) == (payload, RHEF_LAST)
+
+
+def _processor_with_table(row_count: int, subject_len: int = 40) -> RopProcessor:
+    processor = RopProcessor("user@example.com")
+    now = datetime(2025, 1, 1)
+    messages = [
+        MapiMessage(
+            message_id=str(i),
+            folder_id="inbox",
+            subject="",
+            sender_name="",
+            sender_email="",
+            recipient_name="",
+            recipient_email="",
+            body_text="",
+            body_html="",
+            creation_time=now,
+            last_modification_time=now,
+            message_size=0,
+            message_flags=0,
+            entry_id=b"",
+            properties={MapiPropertyTags.PR_SUBJECT: ("s%05d" % i).ljust(subject_len, "x")},
+        )
+        for i in range(row_count)
+    ]
+    processor.handle_manager.create_handle(
+        "contents_table",
+        {"messages": messages, "folder_name": "inbox", "columns": [MapiPropertyTags.PR_SUBJECT], "current_row": 0},
+    )
+    return processor
+
+
+def _query_rows_buffer(row_count: int) -> bytes:
+    rop = struct.pack("<BBBB", RopId.RopQueryRows, 0, 1, 0) + struct.pack("<H", row_count) + b"\x00" * 6
+    return struct.pack("<HHI", 8 + len(rop), 1, 0) + rop
+
+
+def _parse_query_rows(buffer: bytes):
+    rop_id, _handle, return_value = struct.unpack_from("<BBI", buffer, 8)
+    origin, rows = struct.unpack_from("<BH", buffer, 14)
+    return rop_id, return_value, origin, rows
+
+
+def test_query_rows_pages_within_budget():
+    processor = _processor_with_table(1000)
+    seen = 0
+    round_trips = 0
+    while True:
+        response = processor.process_rop_buffer(_query_rows_buffer(0xFFFF), max_size=4096)
+        assert len(response) <= 4096
+        rop_id, return_value, origin, rows = _parse_query_rows(response)
+        assert rop_id == RopId.RopQueryRows and return_value == 0
+        seen += rows
+        round_trips += 1
+        if origin == QueryRowsOrigin.BOOKMARK_END:
+            break
+        assert origin == QueryRowsOrigin.BOOKMARK_CURRENT and rows > 0
+    assert seen == 1000
+    assert round_trips > 1
+
+
+def test_query_rows_buffer_too_small():
+    processor = _processor_with_table(5, subject_len=200)
+    request = _query_rows_buffer(5)
+    response = processor.process_rop_buffer(request, max_size=64)
+    assert response[8] == RopId.RopBufferTooSmall
+    size_needed = struct.unpack_from("<H", response, 9)[0]
+    assert size_needed > 64
+    # The unexecuted request is returned verbatim and the cursor did not move
+    assert response[11:] == request[8:]
+    response = processor.process_rop_buffer(request, max_size=4096)
+    assert _parse_query_rows(response)[3] == 5
+
+
+def test_dropped_rop_leaves_no_side_effects():
+    processor = _processor_with_table(5)
+    rop = struct.pack("<BBBB", RopId.RopLogon, 0, 0, 1) + b"\x00" * 10
+    request = struct.pack("<HHI", 8 + len(rop), 1, 0) + rop
+    handles_before = dict(processor.handle_manager.handles)
+    response = processor.process_rop_buffer(request, max_size=32)
+    assert response[8] == RopId.RopBufferTooSmall
+    # The logon ran but its response was dropped: no handle was leaked
+    assert processor.logon_handle is None
+    assert processor.handle_manager.handles == handles_before
+    response = processor.process_rop_buffer(request, max_size=4096)
+    assert response[8] == RopId.RopLogon
+    assert processor.logon_handle == 2
+
+
+def _do_rpc(request: bytes) -> bytes:
+    processor = MapiRpcProcessor(db_session=None)
+    cookie = session_manager.create_session("/o=Test/cn=user", "user@example.com")
+    processor.rop_processors[cookie] = _processor_with_table(5)
+    response = processor.process_rpc(cookie, struct.pack("<II", 0, MapiRpcOpNum.EcDoRpc) + request)
+    session_manager.remove_session(cookie)
+    assert struct.unpack_from("<I", response, 0)[0] == 0
+    size = struct.unpack_from("<I", response, 8)[0]
+    return decode_rpc_buffer(response[12 : 12 + size])[0]
+
+
+def test_do_rpc_decodes_the_request_rpc_header_ext():
+    request = _query_rows_buffer(5)
+    expected = _do_rpc(request)
+    assert _parse_query_rows(expected)[3] == 5
+
+    compressed = lz77_compress(request)
+    framed = struct.pack("<HHHH", 0, RHEF_LAST | RHEF_COMPRESSED, len(compressed), len(request)) + compressed
+    assert decode_rpc_request(framed) == request
+    assert _do_rpc(framed) == expected
+
+    # Split over two headers, the first obfuscated; only the second is RHEF_LAST
+    head, tail = request[:6], request[6:]
+    chunked = encode_rpc_buffer(head, compress=False, obfuscate=True, last=False)
+    chunked += encode_rpc_buffer(tail, compress=False)
+    assert decode_rpc_request(chunked) == request
+    assert _do_rpc(chunked) == expected
+
+    # A Size past the end of the buffer is an error, not a guess
+    processor = MapiRpcProcessor(db_session=None)
+    cookie = session_manager.create_session("/o=Test/cn=user", "user@example.com")
+    processor.rop_processors[cookie] = _processor_with_table(5)
+    truncated = struct.pack("<II", 0, MapiRpcOpNum.EcDoRpc) + framed[:-4]
+    assert processor.process_rpc(cookie, truncated) == struct.pack("<I", 0x80040111)
+    session_manager.remove_session(cookie)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for the /metrics subsystem: histograms, per-request SQL counts, WBXML.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app import metrics as metrics_module
+from app.db_executor import run_in_db_thread
+from app.metrics import Histogram, MetricsMiddleware, request_sql_statements, set_command, wbxml_bytes
+from app.routers import metrics as metrics_router
+from app.wbxml_parser import parse_wbxml_sync_request
+
+
+def test_histogram_renders_cumulative_buckets_and_caps_series(monkeypatch):
+    histogram = Histogram("demo_seconds", "Demo", ("command",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "Sync")
+    histogram.observe(0.5, "Sync")
+    histogram.observe(5.0, "Sync")
+    lines = histogram.render()
+    assert 'demo_seconds_bucket{command="Sync",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{command="Sync",le="1"} 2' in lines
+    assert 'demo_seconds_bucket{command="Sync",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{command="Sync"} 3' in lines
+
+    monkeypatch.setattr(metrics_module, "METRICS_MAX_SERIES", 2)
+    for name in ("Ping", "A", "B", "C"):
+        histogram.observe(0.2, name)
+    assert histogram.snapshot("Ping") is not None
+    assert histogram.snapshot("A") is None and histogram.snapshot("other")[2] == 3
+
+
+def test_middleware_attributes_sql_from_db_threads_to_the_command(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'm.db'}")
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router.router)
+
+    def query(count):
+        with engine.connect() as conn:
+            for _ in range(count):
+                conn.execute(text("SELECT 1"))
+
+    @app.post("/Microsoft-Server-ActiveSync")
+    async def eas(request: Request):
+        await run_in_db_thread(query, 3)
+        return {}
+
+    @app.post("/EWS/Exchange.asmx")
+    async def ews():
+        set_command("FindItem")
+        await run_in_db_thread(query, 2)
+        return {}
+
+    before = request_sql_statements.snapshot("eas", "Sync")
+    client = TestClient(app)
+    client.post("/Microsoft-Server-ActiveSync?Cmd=Sync&User=a&DeviceId=d")
+    client.post("/EWS/Exchange.asmx")
+    after = request_sql_statements.snapshot("eas", "Sync")
+    assert after[1] - (before[1] if before else 0) == 3
+    assert request_sql_statements.snapshot("ews", "FindItem")[1] >= 2
+
+    body = client.get("/metrics").text
+    assert 'command_duration_seconds_bucket{protocol="eas",command="Sync",le="+Inf"}' in body
+    assert 'command_duration_seconds_count{protocol="ews",command="FindItem"}' in body
+    assert "# TYPE eas_ping_waiters gauge" in body
+
+
+def test_wbxml_decoders_record_payload_size():
+    body = b"\x03\x01j\x00\x45\x5c\x4f\x4b\x030\x00\x01\x52\x031\x00\x01\x01\x01\x01"
+    before = wbxml_bytes.snapshot("decode", "parse_wbxml_sync_request")
+    parse_wbxml_sync_request(body)
+    after = wbxml_bytes.snapshot("decode", "parse_wbxml_sync_request")
+    assert after[2] == (before[2] if before else 0) + 1
+    assert after[1] - (before[1] if before else 0) == len(body)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Tests for the versioned schema migration runner.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, inspect, text
+
+from app.migrations import MIGRATIONS, applied_versions, current_version, migrate_database
+
+
+def _legacy_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR, email VARCHAR, "
+                "hashed_password VARCHAR, full_name VARCHAR, is_active BOOLEAN, created_at DATETIME)"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO users (id, username, email, hashed_password, is_active) "
+                "VALUES (1, 'alice', 'alice@example.com', 'x', 1), (2, 'bob', 'bob@example.com', 'x', 1)"
+            )
+        )
+    return engine
+
+
+def test_legacy_database_is_upgraded_and_backfilled(tmp_path):
+    engine = _legacy_engine(tmp_path)
+    ran = migrate_database(engine, background=False)
+    assert ran == [m.version for m in MIGRATIONS if not m.background]
+    assert current_version(engine) == MIGRATIONS[-1].version
+
+    columns = {c["name"] for c in inspect(engine).get_columns("users")}
+    assert {"ntlm_hash", "admin", "uuid", "totp_secret"} <= columns
+    assert "body_html" in {c["name"] for c in inspect(engine).get_columns("emails")}
+    with engine.connect() as conn:
+        uuids = conn.execute(text("SELECT uuid FROM users")).scalars().all()
+        gal = conn.execute(text("SELECT email FROM global_address_entries ORDER BY email")).scalars().all()
+    assert len(set(uuids)) == 2 and None not in uuids
+    assert gal == ["alice@example.com", "bob@example.com"]
+
+
+def test_current_schema_only_checks_version(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    migrate_database(engine, background=False)
+    assert applied_versions(engine) == {m.version for m in MIGRATIONS}
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    assert migrate_database(engine, background=False) == []
+    assert all("schema_migrations" in sql for sql in statements)
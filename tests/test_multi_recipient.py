@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for multi-recipient messages: shared content and per-MX RCPT batching.
+"""
+
+import asyncio
+import os
+import sys
+from email.mime.text import MIMEText
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import email_delivery as delivery_module
+from app import message_store, smtp_server
+from app.database import Base, Email, MessageContent, User
+from app.email_queue import Base as QueueBase
+from app.email_queue import EmailQueue, EmailQueueStatus, QueuedEmail
+from app.services import message_list
+from app.smtp_client import smtp_client
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'mail.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    QueueBase.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                User(id=2, username="bob", email="Bob@example.com", hashed_password="x"),
+                User(id=3, username="carol", email="carol@example.com", hashed_password="x"),
+            ]
+        )
+        db.commit()
+    return Session
+
+
+def test_fan_out_stores_one_body_and_notifies_each_mailbox_once(Session, monkeypatch):
+    pushed, websocket, woken = [], [], []
+    monkeypatch.setattr(message_store, "trigger_ews_push", lambda **kw: pushed.append(kw["user_id"]))
+    monkeypatch.setattr(message_store, "schedule_notify_new_email", lambda user_id, folder_id: woken.append(user_id))
+    monkeypatch.setattr(message_store.manager, "notify_new_email", lambda user_id, data: websocket.append(user_id))
+
+    with Session() as db:
+        emails = message_store.deliver_to_mailboxes(
+            db, [1, 2, 3, 2], "Team update", "Plain body", "<p>Plain body</p>", "TUlNRQ==", "multipart/alternative", sender_id=1
+        )
+        single = message_store.deliver_to_mailboxes(db, [3], "Just you", "Solo", None, None, None, sender_id=1)
+        message_store.notify_new_mail(emails + single)
+
+        assert [email.recipient_id for email in emails] == [1, 2, 3]
+        assert db.query(MessageContent).count() == 1
+        assert {email._body for email in emails} == {None}
+        assert {email.body_html for email in emails} == {"<p>Plain body</p>"}
+        assert single[0].content_id is None and single[0].body == "Solo"
+
+        page = message_list.list_headers(db, 2, "inbox")["messages"]
+        assert page[0]["preview"] == "Plain body"
+
+        # Filters and column selects see the shared content as well
+        assert db.query(Email).filter(Email.body.like("Plain%")).count() == 3
+        assert db.query(Email.id).filter(Email.body_html.is_(None)).all() == [(single[0].id,)]
+        assert {body for (body,) in db.query(Email.body)} == {"Plain body", "Solo"}
+
+    # Ping wake-ups are scheduled even without a running event loop (SMTP threads)
+    assert sorted(pushed) == sorted(websocket) == sorted(woken) == [1, 2, 3]
+
+
+def test_smtp_session_delivers_every_rcpt_in_one_transaction(Session, monkeypatch):
+    notified = []
+    monkeypatch.setattr(smtp_server, "notify_new_mail", lambda emails, sender=None: notified.append(len(emails)))
+    handler = smtp_server.EmailHandler()
+    handler.db.close()
+    handler.db = Session()
+
+    msg = MIMEText("Hello all", "plain", "utf-8")
+    msg["From"] = "outside@remote.test"
+    msg["To"] = "alice@example.com, bob@example.com"
+    msg["Subject"] = "Fan-out"
+    reply = asyncio.run(
+        handler.process_email(
+            "c1",
+            ("192.0.2.1", 2525),
+            "outside@remote.test",
+            ["alice@example.com", "BOB@example.com", "nobody@example.com"],
+            msg.as_string(),
+        )
+    )
+
+    assert reply.startswith("250")
+    assert notified == [2]
+    with Session() as db:
+        rows = db.query(Email).order_by(Email.recipient_id).all()
+        assert [row.recipient_id for row in rows] == [1, 2]
+        assert {row.content_id for row in rows} == {db.query(MessageContent.id).scalar()}
+        assert all(row.body == "Hello all" and row.external_sender == "outside@remote.test" for row in rows)
+
+
+class FakeSMTP:
+    sessions = []
+
+    def __init__(self, host):
+        self.host = host
+
+    def sendmail(self, sender, recipients, text):
+        FakeSMTP.sessions.append((self.host, sender, list(recipients), text))
+        return {"gone@one.test": (550, b"No such user")}
+
+    def quit(self):
+        pass
+
+
+def test_outbound_recipients_share_one_session_per_mx(Session, monkeypatch):
+    queue = EmailQueue(Session)
+    monkeypatch.setattr(delivery_module, "email_queue", queue)
+    lookups = []
+
+    def delivery_info(address):
+        domain = address.split("@")[1]
+        lookups.append(domain)
+        return {"email": address, "domain": domain, "best_mx_server": f"mx.{domain}", "port": 25}
+
+    monkeypatch.setattr(delivery_module.mx_lookup, "get_delivery_info", delivery_info)
+    monkeypatch.setattr(smtp_client, "connect_to_server", lambda host, port: FakeSMTP(host))
+    FakeSMTP.sessions = []
+
+    service = delivery_module.EmailDeliveryService()
+    recipients = ["a@one.test", "b@one.test", "gone@one.test", "c@two.test"]
+    rfc_id = service.queue_message("alice@example.com", recipients, "Hi", "Shared body")
+    with Session() as db:
+        rows = db.query(QueuedEmail).all()
+        assert len(rows) == 4 and len({row.message_id for row in rows}) == 4
+        assert {row.body for row in rows} == {None}
+        assert {row.headers["Message-ID"] for row in rows} == {rfc_id}
+        asyncio.run(service._process_due_emails(db))
+
+    assert sorted(lookups) == ["one.test", "two.test"]
+    by_host = {host: (rcpts, text) for host, _, rcpts, text in FakeSMTP.sessions}
+    assert len(FakeSMTP.sessions) == 2
+    assert by_host["mx.one.test"][0] == ["a@one.test", "b@one.test", "gone@one.test"]
+    # The shared body was loaded back for the claimed rows
+    assert "U2hhcmVkIGJvZHk=" in by_host["mx.two.test"][1]
+    assert "To: a@one.test, b@one.test, gone@one.test, c@two.test" in by_host["mx.one.test"][1]
+    with Session() as db:
+        status = {row.recipient_email: row.status for row in db.query(QueuedEmail)}
+    assert status.pop("gone@one.test") == EmailQueueStatus.RETRY.value
+    assert set(status.values()) == {EmailQueueStatus.SENT.value}
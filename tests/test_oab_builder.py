@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Tests for versioned OAB generation and the static OAB download endpoints.
+"""
+
+import gzip
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import oab as oab_router
+from app.services.gal_index import GalIndexEntry
+from app.services.oab_builder import (
+    OAB_V4_VERSION,
+    OabGenerator,
+    OabStore,
+    changes_file_name,
+    encode_v4_int,
+    read_records,
+)
+
+
+def _entry(email, display_name, company=None):
+    return GalIndexEntry(
+        id=None,
+        uuid=None,
+        user_id=None,
+        display_name=display_name,
+        given_name=None,
+        surname=None,
+        email=email,
+        company=company,
+        department=None,
+        job_title=None,
+        office_location=None,
+        business_phone=None,
+        mobile_phone=None,
+    )
+
+
+ENTRIES = [
+    _entry("alice@example.com", "Alice Archer", "Example"),
+    _entry("bob@example.com", "Bob Baker"),
+]
+
+
+def _read(path):
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+def test_v4_integer_encoding():
+    assert encode_v4_int(0x7F) == b"\x7f"
+    assert encode_v4_int(0x80) == b"\x81\x80"
+    assert encode_v4_int(0x12345) == b"\x83\x45\x23\x01"
+
+
+def test_publish_is_versioned_by_content(tmp_path):
+    store = OabStore(root=str(tmp_path), keep_versions=3)
+    first = store.publish(ENTRIES)
+    assert first.sequence == 1
+    # Identical content does not advance the sequence
+    assert store.publish(list(ENTRIES)).sequence == 1
+
+    details = _read(first.files["details.oab"].path)
+    version, _serial, total = struct.unpack_from("<III", details, 0)
+    assert (version, total) == (OAB_V4_VERSION, 2)
+    records = read_records(details, _read(first.files["rdndex.oab"].path))
+    assert set(records) == {"alice@example.com", "bob@example.com"}
+    assert b"Alice Archer\x00" in records["alice@example.com"]
+    assert gzip.decompress(_read(first.files["details.oab"].gzip_path)) == details
+
+    second = store.publish([ENTRIES[0], _entry("carol@example.com", "Carol Cole")])
+    assert second.sequence == 2
+    patch = _read(second.files[changes_file_name(1)].path)
+    assert patch[:4] == b"OABP"
+    from_seq, to_seq, removed = struct.unpack_from("<III", patch, 4)
+    assert (from_seq, to_seq, removed) == (1, 2, 1)
+    assert b"bob@example.com" in patch and b"Carol Cole" in patch
+    assert b"Alice Archer" not in patch
+
+    # A fresh store (another process) sees the published version
+    assert OabStore(root=str(tmp_path)).current().sequence == 2
+
+
+
+def test_concurrent_publishers_never_replace_a_published_version(tmp_path):
+    root = str(tmp_path)
+    OabStore(root=root, keep_versions=10).publish(ENTRIES)
+    # Separate stores stand in for the services sharing the directory
+    contents = [[_entry(f"user{n}@example.com", f"User {n}")] for n in range(6)]
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        published = list(pool.map(lambda entries: OabStore(root=root, keep_versions=10).publish(entries), contents))
+    assert sorted(v.sequence for v in published) == [2, 3, 4, 5, 6, 7]
+    for version, entries in zip(published, contents):
+        records = read_records(_read(version.files["details.oab"].path), _read(version.files["rdndex.oab"].path))
+        assert set(records) == {entries[0].key}
+
+    # A directory left behind (e.g. by a crashed publisher) is skipped, not deleted
+    os.makedirs(os.path.join(root, "8"))
+    with open(os.path.join(root, "8", "in-use"), "w") as handle:
+        handle.write("x")
+    store = OabStore(root=root, keep_versions=10)
+    assert store.publish(ENTRIES).sequence == 9
+    assert os.path.exists(os.path.join(root, "8", "in-use"))
+
+    # The same content already written under the next sequence is adopted as is
+    latest = store.publish(contents[0])
+    with open(os.path.join(root, "current.json"), "w") as handle:
+        json.dump({"sequence": 9}, handle)
+    os.utime(os.path.join(root, "current.json"), (0, 0))
+    adopted = OabStore(root=root, keep_versions=10).publish(contents[0])
+    assert adopted.sequence == latest.sequence == 10 and adopted.created == latest.created
+
+
+def test_download_endpoints_support_validators_and_ranges(tmp_path, monkeypatch):
+    generator = OabGenerator(store=OabStore(root=str(tmp_path)))
+    generator.store.publish(ENTRIES)
+    monkeypatch.setattr(oab_router, "oab_generator", generator)
+    app = FastAPI()
+    app.include_router(oab_router.router)
+    client = TestClient(app)
+
+    manifest = client.get("/oab/oab.xml")
+    assert manifest.status_code == 200
+    assert b"<Sequence>1</Sequence>" in manifest.content
+    assert client.get("/oab/oab.xml", headers={"If-None-Match": manifest.headers["etag"]}).status_code == 304
+
+    assert b"<Name>1/details.oab</Name>" in manifest.content
+
+    details = _read(generator.store.current().files["details.oab"].path)
+    full = client.get("/oab/default-oab/1/details.oab", headers={"Accept-Encoding": "identity"})
+    assert full.status_code == 200 and full.content == details
+    assert "immutable" in full.headers["cache-control"]
+    assert client.get(
+        "/oab/default-oab/1/details.oab", headers={"If-None-Match": full.headers["etag"]}
+    ).status_code == 304
+
+    partial = client.get("/oab/default-oab/1/details.oab", headers={"Range": "bytes=4-11"})
+    assert partial.status_code == 206
+    assert partial.content == details[4:12]
+    assert partial.headers["content-range"] == f"bytes 4-11/{len(details)}"
+    assert client.get(
+        "/oab/default-oab/1/details.oab", headers={"Range": f"bytes={len(details)}-"}
+    ).status_code == 416
+
+    assert client.get("/oab/default-oab/1/changes-9.oab").status_code == 404
+    assert client.get("/oab/default-oab/1/passwd").status_code == 404
+    assert client.get("/oab/default-oab/passwd").status_code == 404
+
+    # A new sequence gets new URLs; the old one stays valid until pruned
+    generator.store.publish(ENTRIES + [_entry("carol@example.com", "Carol Cook")])
+    moved = client.get("/oab/default-oab/details.oab", follow_redirects=False)
+    assert moved.status_code == 307
+    assert moved.headers["location"] == "/oab/default-oab/2/details.oab"
+    assert client.get("/oab/default-oab/1/details.oab").content == details
+    assert client.get("/oab/default-oab/2/changes-1.oab").status_code == 200
+    assert client.get("/oab/default-oab/3/details.oab").status_code == 404
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for the OWA message list API: keyset pages and deltas since a token.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import RedirectResponse
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.auth import get_current_user_from_cookie
+from app.database import Base, Email, User, get_db
+from app.routers import owa
+from app.services import message_list
+
+BASE_TIME = datetime(2025, 1, 6, 9, 0)
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'owa.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+            ]
+        )
+        for i in range(1, 8):
+            # Pairs share created_at so pages have to break ties on id
+            stamp = BASE_TIME + timedelta(minutes=i // 2)
+            db.add(
+                Email(
+                    id=i,
+                    subject=f"Message {i}",
+                    body=f"Body of message {i}",
+                    sender_id=2,
+                    recipient_id=1,
+                    created_at=stamp,
+                    updated_at=stamp,
+                )
+            )
+        db.add(
+            Email(
+                id=20,
+                subject="Outgoing",
+                body="Hi",
+                sender_id=1,
+                external_recipient="x@remote.test",
+                created_at=BASE_TIME,
+                updated_at=BASE_TIME,
+            )
+        )
+        db.commit()
+    return Session
+
+
+def test_keyset_pages_cover_the_folder_once_without_bodies(Session):
+    with Session() as db:
+        seen, cursor = [], None
+        while True:
+            page = message_list.list_headers(db, 1, "inbox", limit=3, cursor=cursor)
+            seen.extend(row["id"] for row in page["messages"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        first = message_list.list_headers(db, 1, "inbox", limit=1)["messages"][0]
+        sent = message_list.list_headers(db, 1, "sent")["messages"]
+        inbox_cursor = message_list.list_headers(db, 1, "inbox", limit=1)["next_cursor"]
+        with pytest.raises(message_list.InvalidCursor):
+            message_list.list_headers(db, 1, "sent", cursor=inbox_cursor)
+
+    assert seen == [7, 6, 5, 4, 3, 2, 1]
+    assert first["sender"] == "bob@example.com" and first["preview"] == "Body of message 7"
+    assert "body" not in first and "body_html" not in first
+    assert [(row["id"], row["recipient"]) for row in sent] == [(20, "x@remote.test")]
+
+
+def test_changes_since_reports_upserts_removals_and_resets(Session, monkeypatch):
+    with Session() as db:
+        token = message_list.list_headers(db, 1, "inbox", limit=2)["changes_token"]
+        db.get(Email, 3).is_read = True
+        db.get(Email, 4).is_deleted = True
+        db.add(Email(id=8, subject="Fresh", body="New", sender_id=2, recipient_id=1))
+        db.commit()
+
+        delta = message_list.changes_since(db, 1, token)
+        assert delta["reset"] is False
+        assert sorted(row["id"] for row in delta["upserts"]) == [3, 8]
+        assert next(row for row in delta["upserts"] if row["id"] == 3)["is_read"] is True
+        assert delta["removed"] == [4]
+
+        deleted_token = message_list.list_headers(db, 1, "deleted")["changes_token"]
+        db.get(Email, 4).is_deleted = False
+        db.commit()
+        # Rows re-read inside the overlap window are repeated; the client ignores unknown ids
+        assert 4 in message_list.changes_since(db, 1, deleted_token)["removed"]
+
+        monkeypatch.setattr(message_list, "MAX_DELTA_ROWS", 1)
+        assert message_list.changes_since(db, 1, token)["reset"] is True
+
+
+def test_api_endpoints_page_and_reject_bad_requests(Session):
+    app = FastAPI()
+    app.include_router(owa.router)
+    state = {"user": None}
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    def override_user():
+        return state["user"] or RedirectResponse(url="/auth/login")
+
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_cookie] = override_user
+    client = TestClient(app)
+
+    assert client.get("/owa/api/messages").status_code == 401
+
+    with Session() as db:
+        state["user"] = db.get(User, 1)
+        db.expunge(state["user"])
+    page = client.get("/owa/api/messages", params={"folder": "inbox", "limit": 4}).json()
+    assert [row["id"] for row in page["messages"]] == [7, 6, 5, 4]
+    rest = client.get("/owa/api/messages", params={"folder": "inbox", "cursor": page["next_cursor"]}).json()
+    assert [row["id"] for row in rest["messages"]] == [3, 2, 1] and rest["next_cursor"] is None
+
+    changes = client.get("/owa/api/messages/changes", params={"since": page["changes_token"]}).json()
+    assert changes["upserts"] == [] and changes["removed"] == []
+    assert client.get("/owa/api/messages", params={"folder": "junk"}).status_code == 400
+    assert client.get("/owa/api/messages", params={"cursor": "not-a-cursor"}).status_code == 400
+
+    shell = client.get("/owa/inbox", params={"folder": "sent"})
+    assert shell.status_code == 200 and 'id="mailSpacer"' in shell.text
+    assert "Message 7" not in shell.text
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Tests for recurrence expansion and the free/busy interval index.
+"""
+
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, CalendarEvent, User
+from app.routers.ews import get_user_availability
+from app.services.calendar_service import CalendarService
+from app.services.freebusy import FreeBusyIndex, merge_busy, merged_free_busy
+from app.services.recurrence import Occurrence, RecurrenceSeries
+
+WEEKLY = {
+    "freq": "WEEKLY",
+    "byday": ["MO", "WE"],
+    "exdates": ["2025-01-08T09:00:00"],
+    "exceptions": [
+        {"original_start": "2025-01-13T09:00:00", "start": "2025-01-14T15:00:00", "end": "2025-01-14T16:00:00"},
+        {"original_start": "2025-01-15T09:00:00", "cancelled": True},
+    ],
+}
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cal.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+            ]
+        )
+        db.add(
+            CalendarEvent(
+                id=1,
+                owner_id=1,
+                subject="Standup",
+                start_time=datetime(2025, 1, 6, 9),
+                end_time=datetime(2025, 1, 6, 10),
+                is_recurring=True,
+                recurrence_pattern=json.dumps(WEEKLY),
+                meeting_status="busy",
+            )
+        )
+        db.commit()
+    return Session
+
+
+def test_weekly_expansion_with_exceptions():
+    series = RecurrenceSeries(datetime(2025, 1, 6, 9), datetime(2025, 1, 6, 10), WEEKLY)
+    starts = [o.start for o in series.occurrences(datetime(2025, 1, 6), datetime(2025, 1, 20))]
+    # 8th excluded, 13th moved to the 14th, 15th cancelled
+    assert starts == [datetime(2025, 1, 6, 9), datetime(2025, 1, 14, 15)]
+    # Far-future windows skip straight to the right period
+    assert len(series.occurrences(datetime(2030, 3, 4), datetime(2030, 3, 11))) == 2
+
+    monthly = RecurrenceSeries(datetime(2025, 1, 31, 9), datetime(2025, 1, 31, 10), "FREQ=MONTHLY;COUNT=3")
+    assert [o.start.month for o in monthly.occurrences(datetime(2025, 1, 1), datetime(2026, 1, 1))] == [1, 3, 5]
+    last_friday = RecurrenceSeries(datetime(2025, 1, 1, 9), datetime(2025, 1, 1, 10), {"freq": "MONTHLY", "byday": ["-1FR"]})
+    assert last_friday.occurrences(datetime(2025, 2, 1), datetime(2025, 3, 1))[0].start == datetime(2025, 2, 28, 9)
+    assert not monthly.has_occurrence(datetime(2025, 6, 1))
+
+
+def test_merge_and_merged_string():
+    merged = merge_busy(
+        [
+            Occurrence(datetime(2025, 1, 6, 9), datetime(2025, 1, 6, 11), "tentative"),
+            Occurrence(datetime(2025, 1, 6, 10), datetime(2025, 1, 6, 10, 30), "busy"),
+            Occurrence(datetime(2025, 1, 6, 12), datetime(2025, 1, 6, 13), "free"),
+        ]
+    )
+    assert [(o.start.strftime("%H:%M"), o.end.strftime("%H:%M"), o.status) for o in merged] == [
+        ("09:00", "10:00", "tentative"),
+        ("10:00", "10:30", "busy"),
+        ("10:30", "11:00", "tentative"),
+    ]
+    assert merged_free_busy(merged, datetime(2025, 1, 6, 8), datetime(2025, 1, 6, 12), 60) == "0120"
+
+
+def test_index_tracks_changes_incrementally(Session):
+    index = FreeBusyIndex()
+    week = (datetime(2025, 1, 13), datetime(2025, 1, 20))
+    with Session() as db:
+        busy = index.busy_intervals(db, [1, 2], *week)
+        assert [o.start for o in busy[1]] == [datetime(2025, 1, 14, 15)]
+        assert busy[2] == []
+
+    with Session() as db:
+        db.add(CalendarEvent(owner_id=2, subject="1:1", start_time=datetime(2025, 1, 13, 9), end_time=datetime(2025, 1, 13, 10), meeting_status="oof"))
+        standup = db.get(CalendarEvent, 1)
+        standup.recurrence_pattern = json.dumps({"freq": "DAILY", "count": 30})
+        db.commit()
+
+    with Session() as db:
+        busy = index.busy_intervals(db, [1, 2], *week)
+        assert len(busy[1]) == 7
+        assert [(o.start, o.status) for o in busy[2]] == [(datetime(2025, 1, 13, 9), "oof")]
+        db.delete(db.get(CalendarEvent, 1))
+        db.commit()
+        assert index.busy_intervals(db, [1], *week)[1] == []
+
+
+def test_date_range_and_ews_availability(Session):
+    with Session() as db:
+        events = CalendarService(db).get_events_by_date_range(1, datetime(2025, 1, 6), datetime(2025, 1, 20))
+        assert [e.start_time for e in events] == [datetime(2025, 1, 6, 9), datetime(2025, 1, 14, 15)]
+        assert {e.id for e in events} == {1}
+
+        body = get_user_availability(
+            db,
+            '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+            'xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages" '
+            'xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"><s:Body>'
+            "<m:GetUserAvailabilityRequest><t:TimeZone><t:Bias>-120</t:Bias></t:TimeZone>"
+            "<m:MailboxDataArray>"
+            "<t:MailboxData><t:Email><t:Address>Alice@example.com</t:Address></t:Email></t:MailboxData>"
+            "<t:MailboxData><t:Email><t:Address>nobody@example.com</t:Address></t:Email></t:MailboxData>"
+            "</m:MailboxDataArray><t:FreeBusyViewOptions><t:TimeWindow>"
+            "<t:StartTime>2025-01-06T00:00:00</t:StartTime><t:EndTime>2025-01-07T00:00:00</t:EndTime>"
+            "</t:TimeWindow><t:MergedFreeBusyIntervalInMinutes>60</t:MergedFreeBusyIntervalInMinutes>"
+            "<t:RequestedView>DetailedMerged</t:RequestedView></t:FreeBusyViewOptions>"
+            "</m:GetUserAvailabilityRequest></s:Body></s:Envelope>",
+        )
+    assert body.count("<m:FreeBusyResponse>") == 2
+    assert "ErrorMailRecipientNotFound" in body
+    # 09:00 UTC is 11:00 at UTC+2
+    assert "<t:StartTime>2025-01-06T11:00:00</t:StartTime>" in body
+    assert "<t:BusyType>Busy</t:BusyType>" in body
+    assert "<t:MergedFreeBusy>000000000002000000000000</t:MergedFreeBusy>" in body
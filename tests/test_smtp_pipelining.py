@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tests for SMTP PIPELINING (RFC 2920) and CHUNKING/BDAT (RFC 3030) in the inbound server.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import smtp_server
+from app.database import Base, Email, User
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'smtp.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(
+            [
+                User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+                User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+            ]
+        )
+        db.commit()
+    monkeypatch.setattr(smtp_server, "notify_new_mail", lambda emails, sender=None: None)
+    handler = smtp_server.EmailHandler()
+    handler.db.close()
+    handler.db = Session()
+    handler.Session = Session
+    return handler
+
+
+def _converse(handler, monkeypatch, script):
+    """Run ``script(reader, writer)`` against a live server; returns (result, server writes)."""
+    writes = []
+    original = asyncio.StreamWriter.write
+
+    def counting_write(self, data):
+        if self.get_extra_info("sockname")[1] == port:
+            writes.append(bytes(data))
+        return original(self, data)
+
+    monkeypatch.setattr(asyncio.StreamWriter, "write", counting_write)
+
+    async def run():
+        nonlocal port
+        server = await asyncio.start_server(handler.handle_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await reader.readline()
+            result = await script(reader, writer)
+            writer.close()
+            return result
+        finally:
+            server.close()
+
+    port = None
+    return asyncio.run(run()), writes
+
+
+async def _replies(reader, count):
+    lines = []
+    while len(lines) < count:
+        line = (await reader.readline()).decode().rstrip("\r\n")
+        if line[3:4] != "-":
+            lines.append(line)
+    return lines
+
+
+def test_pipelined_commands_are_answered_in_one_batch(handler, monkeypatch):
+    async def script(reader, writer):
+        writer.write(b"EHLO client\r\n")
+        ehlo = []
+        while not ehlo or ehlo[-1][3:4] != " ":
+            ehlo.append((await reader.readline()).decode().rstrip("\r\n"))
+        writer.write(
+            b"MAIL FROM:<list@remote.test>\r\nRCPT TO:<alice@example.com>\r\n"
+            b"RCPT TO:<Bob@Example.com>\r\nDATA\r\n"
+        )
+        group = await _replies(reader, 4)
+        writer.write(b"Subject: Digest\r\n\r\nline one\r\n..leading dot\r\n.\r\nQUIT\r\n")
+        return ehlo, group, await _replies(reader, 2)
+
+    (ehlo, group, done), writes = _converse(handler, monkeypatch, script)
+    assert "250-PIPELINING" in ehlo and "250-CHUNKING" in ehlo
+    assert group == ["250 OK", "250 OK", "250 OK", "354 End data with <CR><LF>.<CR><LF>"]
+    assert done == ["250 OK", "221 Goodbye"]
+    # Greeting, EHLO, the MAIL..DATA group, then the message reply with QUIT
+    assert len(writes) == 4 and writes[2].count(b"\r\n") == 4
+
+    with handler.Session() as db:
+        stored = db.query(Email).order_by(Email.recipient_id).all()
+        assert [email.recipient_id for email in stored] == [1, 2]
+        assert stored[0].subject == "Digest" and ".leading dot" in stored[0].body
+        assert "..leading" not in stored[0].body
+
+
+def test_bdat_chunks_are_binary_safe_and_always_consumed(handler, monkeypatch):
+    first = b"Subject: Chunked\r\n\r\nbefore\r\n.\r\n"
+    second = b"after \xc3\xa9\r\n"
+
+    async def script(reader, writer):
+        # A refused chunk is still read, so the next command parses cleanly
+        writer.write(b"BDAT 5 LAST\r\nxxxxxNOOP\r\n")
+        refused = await _replies(reader, 2)
+        writer.write(
+            b"MAIL FROM:<relay@remote.test>\r\nRCPT TO:<alice@example.com>\r\n"
+            + f"BDAT {len(first)}\r\n".encode() + first
+            + f"BDAT {len(second)} LAST\r\n".encode() + second
+            + b"MAIL FROM:<relay@remote.test>\r\nRCPT TO:<bob@example.com>\r\nBDAT 0 LAST\r\nQUIT\r\n"
+        )
+        return refused, await _replies(reader, 8)
+
+    (refused, replies), _ = _converse(handler, monkeypatch, script)
+    assert refused == ["503 Need MAIL FROM and RCPT TO before BDAT", "250 OK"]
+    assert replies == [
+        "250 OK",
+        "250 OK",
+        f"250 {len(first)} octets received",
+        "250 OK",
+        "250 OK",
+        "250 OK",
+        "250 OK",
+        "221 Goodbye",
+    ]
+    with handler.Session() as db:
+        email = db.query(Email).filter(Email.recipient_id == 1).one()
+        # The "." line inside a chunk is content, not a terminator
+        assert email.subject == "Chunked" and email.body == "before\r\n.\r\nafter é"
+        assert db.query(Email).filter(Email.recipient_id == 2).count() == 1
+
+
+def test_command_logging_is_sampled_debug_and_redacts_auth(monkeypatch, caplog):
+    monkeypatch.setattr(smtp_server, "SMTP_COMMAND_LOG_SAMPLE", 2)
+    with caplog.at_level(logging.INFO, logger=smtp_server.logger.name):
+        smtp_server._log_command("conn_1", "NOOP", "NOOP")
+    assert not caplog.records
+
+    with caplog.at_level(logging.DEBUG, logger=smtp_server.logger.name):
+        for command in ("NOOP", "RSET", "NOOP", "RSET", "NOOP", "RSET"):
+            smtp_server._log_command("conn_1", command, command)
+        for _ in range(2):
+            smtp_server._log_command("conn_1", "AUTH", "AUTH PLAIN c2VjcmV0")
+    assert len(caplog.records) == 4
+    assert all("c2VjcmV0" not in record.getMessage() for record in caplog.records)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for the EAS Sync replay cache: bounded LRU, commit-time staging and
+byte-identical answers to retried Sync requests.
+"""
+
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.auth import get_current_user_from_basic_auth
+from app.database import ActiveSyncDevice, ActiveSyncState, Base, Email, User, get_db
+from app.routers import activesync
+from app.services import sync_replay
+from app.services.sync_replay import SyncReplayCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SyncReplayCache()
+    monkeypatch.setattr(sync_replay, "sync_replay_cache", cache)
+    monkeypatch.setattr(activesync, "sync_replay_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'replay.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add(User(id=1, username="alice", email="alice@example.com", hashed_password="x"))
+        db.add_all(Email(id=i, subject=f"Message {i}", body="text", recipient_id=1) for i in range(1, 6))
+        db.add(ActiveSyncDevice(user_id=1, device_id="dev1", device_type="iPhone", policy_key="77", is_provisioned=1))
+        db.commit()
+    return Session
+
+
+def test_lru_is_bounded_by_entries_and_bytes():
+    cache = SyncReplayCache(max_entries=3, max_bytes=100, max_response=60)
+    for device in ("a", "b", "c"):
+        cache.store((1, device, "1", "k1"), "f", b"x" * 30)
+    assert cache.get((1, "a", "1", "k1"), "f") == b"x" * 30
+    # Bytes cap: 120 > 100 evicts the least recently used (b, since a was just read)
+    cache.store((1, "d", "1", "k1"), "f", b"y" * 30)
+    assert cache.get((1, "b", "1", "k1"), "f") is None
+    assert cache.stats()["entries"] == 3 and cache.stats()["bytes"] == 90
+    # Oversized responses are not kept; other options miss
+    cache.store((1, "e", "1", "k1"), "f", b"z" * 61)
+    assert cache.get((1, "e", "1", "k1"), "f") is None
+    assert cache.get((1, "a", "1", "k1"), "other") is None
+    # A new pending key replaces the collection's previous one
+    cache.store((1, "a", "1", "k2"), "f", b"n")
+    assert cache.get((1, "a", "1", "k1"), "f") is None
+    assert cache.get((1, "a", "1", "k2"), "f") == b"n"
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 4, 1)
+    assert stats["hit_ratio"] == pytest.approx(2 / 6)
+
+
+def test_entries_are_applied_only_when_the_session_commits(Session, cache):
+    key = (1, "dev1", "1", "k1")
+    with Session() as db:
+        db.get(User, 1).full_name = "Alice"
+        cache.stage(db, key, "f", b"batch")
+        assert cache.get(key, "f") is None
+        db.rollback()
+        db.commit()
+        assert cache.get(key, "f") is None
+
+        cache.stage(db, key, "f", b"batch")
+        db.commit()
+        assert cache.get(key, "f") == b"batch"
+
+        cache.stage_invalidate(db, 1, "dev1", "1")
+        assert cache.get(key, "f") == b"batch"
+        db.commit()
+        assert cache.get(key, "f") is None
+
+
+def test_retried_sync_replays_the_pending_batch_byte_for_byte(Session, cache, monkeypatch):
+    with Session() as db:
+        user = db.get(User, 1)
+        db.expunge(user)
+    app = FastAPI()
+    app.include_router(activesync.router)
+
+    def override_db():
+        with Session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user_from_basic_auth] = lambda: user
+    client = TestClient(app)
+    url = "/activesync/Microsoft-Server-ActiveSync?Cmd=Sync&DeviceId=dev1&DeviceType=iPhone"
+    headers = {"X-MS-PolicyKey": "77", "MS-ASProtocolVersion": "14.1"}
+
+    def sync(sync_key):
+        # <Sync><Collections><Collection><SyncKey/><CollectionId>1</CollectionId><GetChanges/>
+        body = b"\x03\x01j\x00\x45\x5c\x4f\x4b\x03" + sync_key.encode() + b"\x00\x01\x52\x031\x00\x01\x13\x01\x01\x01"
+        response = client.post(url, content=body, headers=headers)
+        return response.content, re.search(rb"\x4b\x03(.*?)\x00", response.content).group(1).decode()
+
+    _, first_key = sync("0")
+    batch, pending_key = sync(first_key)
+    assert b"Message 5" in batch and cache.stats()["entries"] == 1
+
+    builds = []
+    build = activesync.create_sync_response_wbxml
+    monkeypatch.setattr(activesync, "create_sync_response_wbxml", lambda *a, **k: builds.append(1) or build(*a, **k))
+    for _ in range(2):
+        assert sync(first_key) == (batch, pending_key)
+    assert not builds and cache.stats()["hits"] == 2
+
+    # Confirming the batch (the next key is committed) drops the entry
+    sync(pending_key)
+    assert cache.stats()["entries"] == 0
+    with Session() as db:
+        assert db.query(ActiveSyncState).one().sync_key == pending_key
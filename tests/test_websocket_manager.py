@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tests for per-connection WebSocket outboxes in ConnectionManager.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.websocket_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.fail:
+            raise ConnectionResetError("gone")
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.closed = True
+
+
+async def _settle(rounds=20):
+    for _ in range(rounds):
+        await asyncio.sleep(0)
+
+
+def test_slow_socket_does_not_delay_others():
+    async def scenario():
+        manager = ConnectionManager(queue_size=10, send_timeout=5, heartbeat_interval=0)
+        slow, fast = FakeWebSocket(delay=10), FakeWebSocket()
+        await manager.connect(slow, 1)
+        await manager.connect(fast, 1)
+        await manager.broadcast({"type": "system_message", "data": {"n": 1}})
+        await _settle()
+        assert [m["data"]["n"] for m in fast.sent] == [1]
+        assert slow.sent == []
+        manager.disconnect(slow, 1)
+        manager.disconnect(fast, 1)
+
+    asyncio.run(scenario())
+
+
+def test_bounded_outbox_drops_oldest_and_coalesces():
+    async def scenario():
+        manager = ConnectionManager(queue_size=3, send_timeout=5, heartbeat_interval=0)
+        ws = FakeWebSocket()
+        await manager.connect(ws, 7)
+        for n in range(5):
+            await manager.send_personal_message({"type": "system_message", "data": {"n": n}}, 7)
+        for _ in range(3):
+            manager.notify_email_update(7, {"email_id": 42, "action": "mark_as_read", "is_read": True})
+        await _settle()
+        received = [m["data"].get("n", m["data"].get("email_id")) for m in ws.sent]
+        # Queue of 3 keeps the newest messages; the three identical updates coalesce into one
+        assert received == [3, 4, 42]
+        stats = manager.get_stats()
+        assert stats["messages_dropped"] == 3
+        assert stats["queue_depth_total"] == 0 and stats["send_latency_ms_p50"] is not None
+        manager.disconnect(ws, 7)
+
+    asyncio.run(scenario())
+
+
+def test_failed_send_disconnects_and_threads_can_publish():
+    async def scenario():
+        manager = ConnectionManager(queue_size=10, send_timeout=5, heartbeat_interval=0)
+        dead, alive = FakeWebSocket(fail=True), FakeWebSocket()
+        await manager.connect(dead, 3)
+        await manager.connect(alive, 3)
+        # Sync code (e.g. a threadpool request handler) publishes without a running loop
+        worker = threading.Thread(target=manager.notify_new_email, args=(3, {"id": 1, "subject": "Hi"}))
+        worker.start()
+        worker.join()
+        await _settle()
+        assert [m["data"]["subject"] for m in alive.sent] == ["Hi"]
+        assert dead not in manager.all_connections
+        assert manager.active_connections[3] == [alive]
+        manager.disconnect(alive, 3)
+
+    asyncio.run(scenario())
+
+
+def test_heartbeat_closes_stalled_socket():
+    async def scenario():
+        manager = ConnectionManager(queue_size=10, send_timeout=0.01, heartbeat_interval=0.01)
+        stuck = FakeWebSocket(delay=0.005)
+        await manager.connect(stuck, 5)
+
+        async def never(text):
+            await asyncio.Event().wait()
+
+        stuck.send_text = never
+        manager.publish_to_user(5, {"type": "system_message"})
+        await asyncio.sleep(0.2)
+        assert stuck not in manager.all_connections
+        assert stuck.closed or manager.get_stats()["send_failures"] == 1
+
+    asyncio.run(scenario())